@@ -0,0 +1,423 @@
+"""
+Approximate nearest-neighbour search for large knowledge bases.
+An inverted-file (IVF) index: vectors are clustered with k-means and a query
+only scores the vectors in the clusters whose centroids are closest to it.
+"""
+
+import os
+import json
+import time
+import logging
+import threading
+from typing import Dict, List, Any, Optional, Tuple
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# ANN configuration
+ANN_NPROBE = int(os.getenv("ANN_NPROBE", "8"))
+ANN_KMEANS_ITERATIONS = int(os.getenv("ANN_KMEANS_ITERATIONS", "10"))
+ANN_TRAINING_SAMPLE = int(os.getenv("ANN_TRAINING_SAMPLE", "50000"))
+# Knowledge bases in "auto" search mode use the index from this many chunks on
+ANN_MIN_CHUNKS = int(os.getenv("ANN_MIN_CHUNKS", "50000"))
+
+
+def kmeans(vectors: np.ndarray, k: int, iterations: int = None, seed: int = 0) -> np.ndarray:
+    """
+    Spherical k-means on normalized vectors.
+    
+    Args:
+        vectors: Array of shape (n, dim), rows L2-normalized
+        k: Number of clusters
+        iterations: Number of Lloyd iterations
+        seed: Seed for the initial centroids
+    
+    Returns:
+        Normalized centroids of shape (k, dim)
+    """
+    iterations = iterations or ANN_KMEANS_ITERATIONS
+    rng = np.random.default_rng(seed)
+    k = min(k, len(vectors))
+    centroids = np.array(vectors[rng.choice(len(vectors), k, replace=False)], dtype=np.float32)
+    
+    for _ in range(iterations):
+        assignments = np.argmax(vectors @ centroids.T, axis=1)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, assignments, vectors)
+        counts = np.bincount(assignments, minlength=k)
+        
+        # Re-seed empty clusters with random vectors
+        empty = np.flatnonzero(counts == 0)
+        if empty.size:
+            sums[empty] = vectors[rng.choice(len(vectors), empty.size, replace=False)]
+        
+        norms = np.linalg.norm(sums, axis=1, keepdims=True)
+        norms[norms == 0] = 1.0
+        centroids = (sums / norms).astype(np.float32)
+    
+    return centroids
+
+
+class IVFIndex:
+    """
+    Inverted-file index over the rows of a VectorStore matrix.
+    
+    The index stores only row ids grouped by cluster, so vectors are not
+    duplicated; candidates are scored against the store's memory-mapped matrix.
+    
+    Files in the index directory:
+        ivf_centroids.f32 - (nlist, dim) float32 centroids
+        ivf_ids.i32       - row ids, grouped by cluster
+        ivf_offsets.i64   - (nlist + 1) start offsets of each cluster in ivf_ids
+        ivf_tail.i32      - (cluster, row id) pairs inserted since the last merge
+        ivf_meta.json     - nlist, dim and counts
+    """
+    
+    CENTROIDS_FILE = "ivf_centroids.f32"
+    IDS_FILE = "ivf_ids.i32"
+    OFFSETS_FILE = "ivf_offsets.i64"
+    TAIL_FILE = "ivf_tail.i32"
+    META_FILE = "ivf_meta.json"
+    
+    def __init__(self, path: str, nprobe: int = None):
+        """
+        Initialize the index.
+        
+        Args:
+            path: Directory holding the index files
+            nprobe: Number of clusters scanned per query
+        """
+        self.path = path
+        self.nprobe = nprobe or ANN_NPROBE
+        self.dim = 0
+        self.trained_count = 0
+        self.generation = 0
+        self.centroids: Optional[np.ndarray] = None
+        self.ids: Optional[np.ndarray] = None
+        self.offsets: Optional[np.ndarray] = None
+        self._tail_lists: List[np.ndarray] = []
+        self._tail_ids: List[np.ndarray] = []
+        self._lock = threading.RLock()
+    
+    @property
+    def nlist(self) -> int:
+        """Number of clusters."""
+        return 0 if self.centroids is None else len(self.centroids)
+    
+    @property
+    def count(self) -> int:
+        """Number of indexed rows."""
+        merged = 0 if self.ids is None else len(self.ids)
+        return merged + sum(len(ids) for ids in self._tail_ids)
+    
+    @property
+    def is_built(self) -> bool:
+        """Whether the index has been trained."""
+        return self.centroids is not None
+    
+    @property
+    def is_stale(self) -> bool:
+        """Whether the index has grown so much since training that it should be rebuilt."""
+        return self.is_built and self.count > 2 * max(self.trained_count, 1)
+    
+    @staticmethod
+    def default_nlist(count: int) -> int:
+        """
+        Choose the number of clusters for a corpus size.
+        
+        Args:
+            count: Number of vectors
+        
+        Returns:
+            About 4 * sqrt(count) clusters
+        """
+        return max(1, min(count, int(4 * np.sqrt(count))))
+    
+    def build(self, matrix: np.ndarray, nlist: int = None, sample: int = None, generation: int = 0) -> Dict[str, Any]:
+        """
+        Train the clusters and index every row of a matrix.
+        
+        Args:
+            matrix: Array of shape (n, dim), e.g. VectorStore.matrix
+            nlist: Number of clusters (defaults to default_nlist(n))
+            sample: Maximum number of rows used to train the clusters
+            generation: Generation of the matrix, to detect an index built for older row numbering
+        
+        Returns:
+            Build statistics
+        """
+        started = time.perf_counter()
+        count = len(matrix)
+        if count == 0:
+            raise ValueError("Cannot build an index over an empty matrix")
+        
+        nlist = nlist or self.default_nlist(count)
+        sample = sample or ANN_TRAINING_SAMPLE
+        rng = np.random.default_rng(0)
+        training = matrix if count <= sample else matrix[np.sort(rng.choice(count, sample, replace=False))]
+        centroids = kmeans(np.asarray(training, dtype=np.float32), nlist)
+        
+        lists = self._assign(matrix, centroids)
+        order = np.argsort(lists, kind="stable").astype(np.int32)
+        offsets = np.zeros(len(centroids) + 1, dtype=np.int64)
+        np.cumsum(np.bincount(lists, minlength=len(centroids)), out=offsets[1:])
+        
+        with self._lock:
+            self.dim = matrix.shape[1]
+            self.trained_count = count
+            self.generation = generation
+            self.centroids = centroids
+            self.ids = order
+            self.offsets = offsets
+            self._tail_lists = []
+            self._tail_ids = []
+            self.save()
+        
+        elapsed = time.perf_counter() - started
+        logger.info(f"Built IVF index at {self.path}: {count} vectors in {len(centroids)} lists in {elapsed:.2f}s")
+        return {"vectors": count, "nlist": len(centroids), "seconds": elapsed}
+    
+    def insert(self, row_ids: np.ndarray, vectors: np.ndarray) -> None:
+        """
+        Add rows to the index without retraining.
+        
+        New rows go to their nearest existing cluster and are appended to the
+        tail file; the tail is merged into the main arrays on merge().
+        
+        Args:
+            row_ids: Matrix row ids of the vectors
+            vectors: Array of shape (n, dim)
+        """
+        if not self.is_built:
+            raise RuntimeError("Index has not been built")
+        
+        row_ids = np.asarray(row_ids, dtype=np.int32)
+        lists = self._assign(vectors, self.centroids).astype(np.int32)
+        with self._lock:
+            with open(os.path.join(self.path, self.TAIL_FILE), 'ab') as f:
+                f.write(np.column_stack([lists, row_ids]).astype(np.int32).tobytes())
+            self._tail_lists.append(lists)
+            self._tail_ids.append(row_ids)
+            
+            if sum(len(ids) for ids in self._tail_ids) > max(1000, len(self.ids) // 10):
+                self.merge()
+    
+    def merge(self) -> None:
+        """
+        Fold the inserted tail into the main cluster arrays and persist them.
+        """
+        with self._lock:
+            if not self._tail_ids:
+                return
+            tail_lists = np.concatenate(self._tail_lists)
+            tail_ids = np.concatenate(self._tail_ids)
+            lists = np.concatenate([np.repeat(np.arange(self.nlist, dtype=np.int32), np.diff(self.offsets)), tail_lists])
+            ids = np.concatenate([np.asarray(self.ids), tail_ids])
+            order = np.argsort(lists, kind="stable")
+            
+            self.ids = ids[order]
+            self.offsets = np.zeros(self.nlist + 1, dtype=np.int64)
+            np.cumsum(np.bincount(lists, minlength=self.nlist), out=self.offsets[1:])
+            self._tail_lists = []
+            self._tail_ids = []
+            self.save()
+    
+    def search(
+        self,
+        matrix: np.ndarray,
+        query_vector: np.ndarray,
+        k: int,
+        nprobe: int = None,
+        exclude: np.ndarray = None
+    ) -> List[Tuple[int, float]]:
+        """
+        Find approximately the rows most similar to a query vector.
+        
+        Args:
+            matrix: The matrix the index was built over
+            query_vector: Normalized query embedding
+            k: Number of results
+            nprobe: Number of clusters to scan (defaults to the index setting)
+            exclude: Optional boolean mask of rows to skip (e.g. tombstones)
+        
+        Returns:
+            (row, score) pairs, best first
+        """
+        with self._lock:
+            centroids, ids, offsets = self.centroids, self.ids, self.offsets
+            tail_lists, tail_ids = list(self._tail_lists), list(self._tail_ids)
+        if centroids is None or k <= 0:
+            return []
+        
+        query_vector = query_vector.astype(np.float32, copy=False)
+        nprobe = min(nprobe or self.nprobe, len(centroids))
+        probes = np.argpartition(-(centroids @ query_vector), nprobe - 1)[:nprobe]
+        
+        parts = [ids[offsets[probe]:offsets[probe + 1]] for probe in probes]
+        for lists, row_ids in zip(tail_lists, tail_ids):
+            parts.append(row_ids[np.isin(lists, probes)])
+        # Sorted row ids keep reads from the memory-mapped matrix sequential
+        candidates = np.sort(np.concatenate(parts)) if parts else np.empty(0, dtype=np.int32)
+        if exclude is not None and candidates.size:
+            candidates = candidates[~exclude[candidates]]
+        if not candidates.size:
+            return []
+        
+        scores = matrix[candidates] @ query_vector
+        k = min(k, len(scores))
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        return [(int(candidates[i]), float(scores[i])) for i in top]
+    
+    def save(self) -> None:
+        """
+        Persist the centroids and merged cluster arrays.
+        """
+        with self._lock:
+            os.makedirs(self.path, exist_ok=True)
+            self._write(self.CENTROIDS_FILE, np.asarray(self.centroids, dtype=np.float32))
+            self._write(self.IDS_FILE, np.asarray(self.ids, dtype=np.int32))
+            self._write(self.OFFSETS_FILE, np.asarray(self.offsets, dtype=np.int64))
+            # Tail entries not yet merged are rewritten so the tail file matches memory
+            tail = np.column_stack([np.concatenate(self._tail_lists), np.concatenate(self._tail_ids)]) \
+                if self._tail_ids else np.empty((0, 2), dtype=np.int32)
+            self._write(self.TAIL_FILE, tail.astype(np.int32))
+            
+            meta_path = os.path.join(self.path, self.META_FILE)
+            with open(f"{meta_path}.tmp", 'w') as f:
+                json.dump({"dim": self.dim, "nlist": self.nlist, "trained_count": self.trained_count, "generation": self.generation, "merged_count": len(self.ids)}, f)
+            os.replace(f"{meta_path}.tmp", meta_path)
+    
+    def load(self) -> bool:
+        """
+        Load the index from disk, memory-mapping the large arrays.
+        
+        Returns:
+            True if an index was found, False otherwise
+        """
+        meta_path = os.path.join(self.path, self.META_FILE)
+        if not os.path.exists(meta_path):
+            return False
+        
+        with open(meta_path, 'r') as f:
+            meta = json.load(f)
+        
+        with self._lock:
+            self.dim = meta["dim"]
+            self.trained_count = meta["trained_count"]
+            self.generation = meta.get("generation", 0)
+            self.centroids = np.fromfile(os.path.join(self.path, self.CENTROIDS_FILE), dtype=np.float32).reshape(meta["nlist"], self.dim)
+            self.offsets = np.fromfile(os.path.join(self.path, self.OFFSETS_FILE), dtype=np.int64)
+            self.ids = self._map(self.IDS_FILE, np.int32, meta["merged_count"])
+            
+            tail = np.fromfile(os.path.join(self.path, self.TAIL_FILE), dtype=np.int32).reshape(-1, 2) \
+                if os.path.exists(os.path.join(self.path, self.TAIL_FILE)) else np.empty((0, 2), dtype=np.int32)
+            self._tail_lists = [tail[:, 0].copy()] if len(tail) else []
+            self._tail_ids = [tail[:, 1].copy()] if len(tail) else []
+        return True
+    
+    def clear(self) -> None:
+        """
+        Remove the index files.
+        """
+        with self._lock:
+            for filename in (self.CENTROIDS_FILE, self.IDS_FILE, self.OFFSETS_FILE, self.TAIL_FILE, self.META_FILE):
+                file_path = os.path.join(self.path, filename)
+                if os.path.exists(file_path):
+                    os.remove(file_path)
+            self.centroids = self.ids = self.offsets = None
+            self._tail_lists = []
+            self._tail_ids = []
+            self.trained_count = 0
+    
+    def _assign(self, vectors: np.ndarray, centroids: np.ndarray, batch: int = 65536) -> np.ndarray:
+        """Nearest centroid of each vector, computed in batches to bound memory."""
+        lists = np.empty(len(vectors), dtype=np.int64)
+        for start in range(0, len(vectors), batch):
+            block = np.asarray(vectors[start:start + batch], dtype=np.float32)
+            lists[start:start + batch] = np.argmax(block @ centroids.T, axis=1)
+        return lists
+    
+    def _write(self, filename: str, array: np.ndarray) -> None:
+        file_path = os.path.join(self.path, filename)
+        array.tofile(f"{file_path}.tmp")
+        os.replace(f"{file_path}.tmp", file_path)
+    
+    def _map(self, filename: str, dtype: Any, count: int) -> np.ndarray:
+        if count == 0:
+            return np.empty(0, dtype=dtype)
+        return np.memmap(os.path.join(self.path, filename), dtype=dtype, mode='r', shape=(count,))
+
+
+def exact_search(matrix: np.ndarray, query_vector: np.ndarray, k: int, exclude: np.ndarray = None) -> List[Tuple[int, float]]:
+    """
+    Brute-force top-k search, also the ground truth for recall evaluation.
+    
+    Args:
+        matrix: Array of shape (n, dim)
+        query_vector: Normalized query embedding
+        k: Number of results
+        exclude: Optional boolean mask of rows to skip (e.g. tombstones)
+    
+    Returns:
+        (row, score) pairs, best first
+    """
+    if not len(matrix) or k <= 0:
+        return []
+    
+    scores = matrix @ query_vector.astype(np.float32, copy=False)
+    if exclude is not None:
+        scores[exclude] = -np.inf
+    k = min(k, len(scores))
+    top = np.argpartition(-scores, k - 1)[:k]
+    top = top[np.argsort(-scores[top])]
+    return [(int(row), float(scores[row])) for row in top if scores[row] > -np.inf]
+
+
+def evaluate_recall(
+    index: IVFIndex,
+    matrix: np.ndarray,
+    queries: np.ndarray,
+    k: int = 10,
+    nprobes: List[int] = None
+) -> List[Dict[str, Any]]:
+    """
+    Measure recall@k and latency of the index against brute-force search.
+    
+    Args:
+        index: A built index over matrix
+        matrix: The indexed matrix
+        queries: Array of normalized query vectors
+        k: Number of results per query
+        nprobes: nprobe values to evaluate (defaults to the index setting)
+    
+    Returns:
+        One result per nprobe: recall, mean latencies in ms and speedup
+    """
+    exact_ms = 0.0
+    truth = []
+    for query in queries:
+        started = time.perf_counter()
+        truth.append({row for row, _ in exact_search(matrix, query, k)})
+        exact_ms += (time.perf_counter() - started) * 1000
+    
+    results = []
+    for nprobe in nprobes or [index.nprobe]:
+        found = 0
+        approx_ms = 0.0
+        for query, expected in zip(queries, truth):
+            started = time.perf_counter()
+            rows = {row for row, _ in index.search(matrix, query, k, nprobe=nprobe)}
+            approx_ms += (time.perf_counter() - started) * 1000
+            found += len(rows & expected)
+        
+        expected_total = sum(len(expected) for expected in truth)
+        results.append({
+            "nprobe": nprobe,
+            "recall": found / expected_total if expected_total else 1.0,
+            "exactMs": exact_ms / len(queries),
+            "approxMs": approx_ms / len(queries),
+            "speedup": exact_ms / approx_ms if approx_ms else 0.0
+        })
+    return results
@@ -0,0 +1,195 @@
+"""
+Cache of API key validation results.
+Keys are identified by a salted HMAC, so raw keys are never stored, and
+concurrent validations of the same key share a single upstream request.
+"""
+
+import os
+import hmac
+import time
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+from typing import Dict, Any, Callable, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Key validation cache configuration
+KEY_VALIDATION_TTL = float(os.getenv("KEY_VALIDATION_TTL", "3600"))
+KEY_VALIDATION_NEGATIVE_TTL = float(os.getenv("KEY_VALIDATION_NEGATIVE_TTL", "60"))
+KEY_VALIDATION_CACHE_SIZE = int(os.getenv("KEY_VALIDATION_CACHE_SIZE", "10000"))
+# Salt of the key fingerprints; a random per-process salt is used if unset
+# (set it when key-derived identities must match across workers, e.g. shared rate limits)
+API_KEY_HASH_SALT = os.getenv("API_KEY_HASH_SALT")
+
+_DEFAULT_SALT = API_KEY_HASH_SALT.encode("utf-8") if API_KEY_HASH_SALT else os.urandom(32)
+
+
+def key_fingerprint(api_key: str, salt: bytes = None) -> bytes:
+    """
+    Salted fingerprint of an API key, so the key itself never has to be stored.
+    
+    Args:
+        api_key: The API key
+        salt: HMAC salt (API_KEY_HASH_SALT or the process salt by default)
+    
+    Returns:
+        HMAC-SHA256 of the key
+    """
+    return hmac.new(salt or _DEFAULT_SALT, api_key.encode("utf-8"), hashlib.sha256).digest()
+
+
+class _Flight:
+    """A validation in progress that other callers can wait on."""
+    
+    def __init__(self):
+        self.done = threading.Event()
+        self.result: Optional[bool] = None
+
+
+class APIKeyValidationCache:
+    """
+    Bounded LRU of key validity with separate lifetimes for valid and invalid
+    keys. A validation that could not reach a verdict (e.g. a network error)
+    is not cached.
+    """
+    
+    def __init__(
+        self,
+        ttl: float = None,
+        negative_ttl: float = None,
+        max_entries: int = None,
+        salt: bytes = None,
+        clock: Callable[[], float] = None
+    ):
+        """
+        Initialize the cache.
+        
+        Args:
+            ttl: Seconds a valid key is trusted
+            negative_ttl: Seconds an invalid key is rejected without re-validation
+            max_entries: Maximum number of cached keys
+            salt: HMAC salt for key fingerprints (API_KEY_HASH_SALT or random by default)
+            clock: Time source, for tests
+        """
+        self.ttl = KEY_VALIDATION_TTL if ttl is None else ttl
+        self.negative_ttl = KEY_VALIDATION_NEGATIVE_TTL if negative_ttl is None else negative_ttl
+        self.max_entries = max_entries or KEY_VALIDATION_CACHE_SIZE
+        self._salt = salt or _DEFAULT_SALT
+        self.clock = clock or time.monotonic
+        self._entries: "OrderedDict[bytes, Tuple[bool, float]]" = OrderedDict()
+        self._flights: Dict[bytes, _Flight] = {}
+        self._lock = threading.Lock()
+        self._metrics = {"hits": 0, "misses": 0, "validations": 0, "coalesced": 0, "valid": 0, "invalid": 0, "inconclusive": 0}
+    
+    def fingerprint(self, api_key: str) -> bytes:
+        """
+        Salted fingerprint of a key.
+        
+        Args:
+            api_key: The API key
+        
+        Returns:
+            HMAC-SHA256 of the key
+        """
+        return key_fingerprint(api_key, self._salt)
+    
+    def get(self, api_key: str) -> Optional[bool]:
+        """
+        Look up a cached validation result.
+        
+        Args:
+            api_key: The API key
+        
+        Returns:
+            True or False if a fresh result is cached, None otherwise
+        """
+        fingerprint = self.fingerprint(api_key)
+        with self._lock:
+            return self._get(fingerprint)
+    
+    def _get(self, fingerprint: bytes) -> Optional[bool]:
+        """Look up a fresh entry (caller holds the lock)."""
+        entry = self._entries.get(fingerprint)
+        if entry is None:
+            return None
+        if self.clock() >= entry[1]:
+            del self._entries[fingerprint]
+            return None
+        self._entries.move_to_end(fingerprint)
+        return entry[0]
+    
+    def put(self, api_key: str, valid: bool) -> None:
+        """
+        Record the validity of a key (e.g. learned from a chat call).
+        
+        Args:
+            api_key: The API key
+            valid: Whether the key is valid
+        """
+        self._put(self.fingerprint(api_key), valid)
+    
+    def _put(self, fingerprint: bytes, valid: bool) -> None:
+        expires = self.clock() + (self.ttl if valid else self.negative_ttl)
+        with self._lock:
+            self._entries[fingerprint] = (valid, expires)
+            self._entries.move_to_end(fingerprint)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+    
+    def validate(self, api_key: str, check: Callable[[str], Optional[bool]]) -> Optional[bool]:
+        """
+        Get a key's validity, calling check() at most once at a time per key.
+        
+        Args:
+            api_key: The API key
+            check: Validates a key upstream; returns None if no verdict was reached
+        
+        Returns:
+            True if valid, False if invalid, None if validation was inconclusive
+        """
+        fingerprint = self.fingerprint(api_key)
+        with self._lock:
+            cached = self._get(fingerprint)
+            if cached is not None:
+                self._metrics["hits"] += 1
+                return cached
+            self._metrics["misses"] += 1
+            flight = self._flights.get(fingerprint)
+            leader = flight is None
+            if leader:
+                flight = self._flights[fingerprint] = _Flight()
+            else:
+                self._metrics["coalesced"] += 1
+        
+        if not leader:
+            flight.done.wait()
+            return flight.result
+        
+        try:
+            flight.result = check(api_key)
+        finally:
+            # Cache before retiring the flight so that no caller starts a second validation
+            if flight.result is not None:
+                self._put(fingerprint, flight.result)
+            with self._lock:
+                self._flights.pop(fingerprint, None)
+                self._metrics["validations"] += 1
+                self._metrics[{True: "valid", False: "invalid"}.get(flight.result, "inconclusive")] += 1
+            flight.done.set()
+        return flight.result
+    
+    def get_metrics(self) -> Dict[str, Any]:
+        """
+        Get cache metrics.
+        
+        Returns:
+            Counters plus hit rate and the number of cached keys
+        """
+        with self._lock:
+            metrics = dict(self._metrics)
+            metrics["entries"] = len(self._entries)
+        lookups = metrics["hits"] + metrics["misses"]
+        metrics["hitRate"] = metrics["hits"] / lookups if lookups else 0.0
+        return metrics
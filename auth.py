@@ -3,10 +3,12 @@
 import os
 import logging
 import firebase_admin
-from firebase_admin import credentials, auth
+from firebase_admin import credentials
 from fastapi import Depends, HTTPException, status
 from fastapi.security import OAuth2PasswordBearer
 
+from token_verifier import token_verifier, TokenVerificationError, ExpiredTokenError
+
 logger = logging.getLogger(__name__)
 
 # --- Firebase Initialization ---
@@ -24,6 +26,9 @@ if SERVICE_ACCOUNT_KEY_PATH:
         cred = credentials.Certificate(SERVICE_ACCOUNT_KEY_PATH)
         firebase_app = firebase_admin.initialize_app(cred)
         logger.info("Firebase Admin SDK initialized successfully.")
+        # ID tokens are verified locally against the project's cached signing keys
+        if not token_verifier.project_id:
+            token_verifier.project_id = firebase_app.project_id
     except Exception as e:
         logger.error(f"Failed to initialize Firebase Admin SDK: {e}")
         # Allow app to start, but authentication will fail
@@ -46,19 +51,19 @@ def get_current_user(token: str = Depends(oauth2_scheme)) -> dict:
         )
         
     try:
-        # Verify the ID token while checking if the token is revoked.
-        decoded_token = auth.verify_id_token(token, app=firebase_app)
+        # Verify the ID token locally (cached signing keys and decoded tokens, no network per request).
+        decoded_token = token_verifier.verify(token)
         # The decoded_token contains user information like uid, email, etc.
-        logger.info(f"Successfully verified token for user_id: {decoded_token.get('uid')}")
+        logger.debug(f"Successfully verified token for user_id: {decoded_token.get('uid')}")
         return decoded_token # Contains uid, email, name, picture etc.
-    except auth.ExpiredIdTokenError:
+    except ExpiredTokenError:
         logger.warning("Expired Firebase ID token received.")
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Token expired",
             headers={"WWW-Authenticate": "Bearer"},
         )
-    except auth.InvalidIdTokenError as e:
+    except TokenVerificationError as e:
         logger.warning(f"Invalid Firebase ID token received: {e}")
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
@@ -0,0 +1,627 @@
+#!/usr/bin/env python3
+"""
+Benchmarks for backend data structures and services.
+
+Usage:
+    python benchmarks.py messages --count 100000
+    python benchmarks.py retrieval --sizes 1000 10000 100000
+    python benchmarks.py ann --count 300000 --nprobe 4 8 16 32
+    python benchmarks.py reindex --docs 10000
+    python benchmarks.py hybrid --copies 200
+    python benchmarks.py embedding --docs 5000 --workers 1 4
+    python benchmarks.py bots --bots 1000 --turns 200
+    python benchmarks.py convlog --turns 1000
+    python benchmarks.py router --bots 10000 --fanout 100
+    python benchmarks.py ratelimit --keys 100000
+    python benchmarks.py keypool --heavy 64 --light 8
+"""
+
+import os
+import sys
+import json
+import time
+import argparse
+import tempfile
+import statistics
+import tracemalloc
+from datetime import datetime
+from typing import Any, Callable, Dict, List, Tuple
+
+
+def measure_memory(build: Callable[[], Any]) -> Tuple[Any, int]:
+    """
+    Measure the memory retained by the object graph returned from build().
+    
+    Args:
+        build: Function that builds and returns the object to measure
+    
+    Returns:
+        The built object and the number of bytes it retains
+    """
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    result = build()
+    after = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return result, after - before
+
+
+def print_table(headers: List[str], rows: List[List[Any]]) -> None:
+    """Print rows as an aligned text table."""
+    widths = [max(len(str(value)) for value in column) for column in zip(headers, *rows)]
+    print("  ".join(str(header).ljust(width) for header, width in zip(headers, widths)))
+    print("  ".join("-" * width for width in widths))
+    for row in rows:
+        print("  ".join(str(value).ljust(width) for value, width in zip(row, widths)))
+
+
+def bundled_file(name: str) -> str:
+    """Path of a file shipped next to this script, independent of the working directory."""
+    return os.path.join(os.path.dirname(os.path.abspath(__file__)), name)
+
+
+# --- Conversation messages ---
+
+class LegacyMessage:
+    """The previous Message layout: per-instance __dict__, datetime and role string."""
+    
+    def __init__(self, role: str, content: str, timestamp: datetime = None):
+        self.role = role
+        self.content = content
+        self.timestamp = timestamp or datetime.now()
+    
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> 'LegacyMessage':
+        timestamp = datetime.fromisoformat(data["timestamp"]) if "timestamp" in data else None
+        return cls(role=data["role"], content=data["content"], timestamp=timestamp)
+
+
+def bench_messages(args: argparse.Namespace) -> None:
+    """Bytes per retained message for the legacy, slotted and columnar representations."""
+    from conversation import Message, MessageColumns
+    
+    roles = ["user", "assistant"]
+    payload = json.dumps([
+        {
+            "role": roles[i % 2],
+            "content": f"message {i} " + "x" * (i % 64),
+            "timestamp": datetime.fromtimestamp(1700000000 + i).isoformat()
+        }
+        for i in range(args.count)
+    ])
+    
+    # Content strings are the same size in every representation; measure them once
+    content_bytes = measure_memory(lambda: [data["content"] for data in json.loads(payload)])[1] - \
+        measure_memory(lambda: [None for _ in json.loads(payload)])[1]
+    
+    # Parse JSON inside the measured region so role strings are fresh objects, as when loading history
+    builders = [
+        ("legacy (dict, datetime, str role)", lambda: [LegacyMessage.from_dict(d) for d in json.loads(payload)]),
+        ("Message (slots, epoch, Role)", lambda: [Message.from_dict(d) for d in json.loads(payload)]),
+        ("MessageColumns (arrays)", lambda: MessageColumns(Message.from_dict(d) for d in json.loads(payload))),
+    ]
+    
+    rows = []
+    baseline = None
+    for name, build in builders:
+        result, retained = measure_memory(build)
+        per_message = retained / args.count
+        overhead = (retained - content_bytes) / args.count
+        baseline = baseline or per_message
+        rows.append([name, f"{per_message:.1f}", f"{overhead:.1f}", f"{baseline / per_message:.2f}x"])
+        del result
+    
+    print(f"Retained memory for {args.count} messages (content strings: {content_bytes / args.count:.1f} B/msg)\n")
+    print_table(["representation", "bytes/msg", "overhead/msg", "vs legacy"], rows)
+
+
+# --- Knowledge retrieval ---
+
+def bench_retrieval(args: argparse.Namespace) -> None:
+    """Top-k query latency against memory-mapped vector stores of increasing size."""
+    import numpy as np
+    from embeddings import get_embedder
+    from knowledge_retrieval import VectorStore
+    
+    embedder = get_embedder()
+    rng = np.random.default_rng(0)
+    queries = [embedder.embed_query(f"how do I file quarterly taxes {i}") for i in range(args.queries)]
+    
+    rows = []
+    with tempfile.TemporaryDirectory() as tmp:
+        for size in args.sizes:
+            store = VectorStore(f"{tmp}/{size}")
+            store.reset(embedder.dim, embedder.name)
+            for start in range(0, size, 10000):
+                n = min(10000, size - start)
+                vectors = rng.standard_normal((n, embedder.dim), dtype=np.float32)
+                vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+                store.append(vectors, [{"source_id": "bench", "position": start + i, "text": ""} for i in range(n)])
+            store.search(queries[0], args.k)  # map the file
+            
+            timings = []
+            for query in queries:
+                started = time.perf_counter()
+                store.search(query, args.k)
+                timings.append((time.perf_counter() - started) * 1000)
+            timings.sort()
+            p95 = timings[int(len(timings) * 0.95) - 1]
+            rows.append([size, f"{statistics.median(timings):.3f}", f"{p95:.3f}", f"{size * embedder.dim * 4 / 1e6:.1f}"])
+    
+    print(f"Top-{args.k} brute-force search, dim={embedder.dim}, {args.queries} queries\n")
+    print_table(["chunks", "p50 ms", "p95 ms", "matrix MB"], rows)
+
+
+def bench_ann(args: argparse.Namespace) -> None:
+    """Recall@k and latency of the IVF index against brute-force search."""
+    import numpy as np
+    from ann_index import IVFIndex, evaluate_recall
+    
+    # Clustered synthetic embeddings: real chunk embeddings are far from uniform
+    rng = np.random.default_rng(0)
+    topics = rng.standard_normal((max(1, args.count // 500), args.dim), dtype=np.float32)
+    matrix = topics[rng.integers(0, len(topics), args.count)] + 0.6 * rng.standard_normal((args.count, args.dim), dtype=np.float32)
+    matrix /= np.linalg.norm(matrix, axis=1, keepdims=True)
+    queries = matrix[rng.choice(args.count, args.queries, replace=False)] + 0.1 * rng.standard_normal((args.queries, args.dim), dtype=np.float32)
+    queries /= np.linalg.norm(queries, axis=1, keepdims=True)
+    
+    with tempfile.TemporaryDirectory() as tmp:
+        index = IVFIndex(tmp)
+        stats = index.build(matrix)
+        print(f"Built IVF index: {args.count} vectors, dim={args.dim}, nlist={stats['nlist']} in {stats['seconds']:.2f}s\n")
+        results = evaluate_recall(index, matrix, queries, k=args.k, nprobes=args.nprobe)
+    
+    print_table(
+        ["nprobe", f"recall@{args.k}", "exact ms", "ivf ms", "speedup"],
+        [[r["nprobe"], f"{r['recall']:.3f}", f"{r['exactMs']:.2f}", f"{r['approxMs']:.2f}", f"{r['speedup']:.1f}x"] for r in results]
+    )
+
+
+def bench_reindex(args: argparse.Namespace) -> None:
+    """Full ingestion vs. incremental re-indexing after a single edited document."""
+    import os
+    from embedding_cache import EmbeddingPipeline
+    from knowledge_base import KnowledgeBase
+    from knowledge_retrieval import KnowledgeRetriever
+    
+    with open(bundled_file("Knowledge Base: Accountant Bot.md"), 'r', encoding='utf-8') as f:
+        sections = f.read().split("\n## ")
+    
+    with tempfile.TemporaryDirectory() as tmp:
+        knowledge_base = KnowledgeBase("bench", "", vector_db_path=os.path.join(tmp, "vector_db"), embedding_model="hashing-384", search_mode="exact")
+        for i in range(args.docs):
+            path = os.path.join(tmp, f"doc{i}.md")
+            with open(path, 'w', encoding='utf-8') as f:
+                f.write(f"# Document {i}\n\n## {sections[i % len(sections)]}\n\nReference number {i}.")
+            knowledge_base.add_source("file", path)
+        
+        # Compact explicitly below instead of in the background
+        retriever = KnowledgeRetriever(pipeline=EmbeddingPipeline(use_cache=False), compaction_threshold=1.0)
+        rows = []
+        full = retriever.ingest(knowledge_base)
+        rows.append(["full ingest", full["chunks_indexed"], f"{full['seconds']:.2f}"])
+        
+        with open(os.path.join(tmp, "doc0.md"), 'a', encoding='utf-8') as f:
+            f.write("\n\nAn edited paragraph.")
+        edited = retriever.ingest(knowledge_base)
+        rows.append(["after one edit", edited["chunks_indexed"], f"{edited['seconds']:.2f}"])
+        
+        knowledge_base.sources = knowledge_base.sources[:len(knowledge_base.sources) * 3 // 4]
+        removed = retriever.ingest(knowledge_base)
+        rows.append([f"after removing {removed['removed']} sources", removed["chunks_indexed"], f"{removed['seconds']:.2f}"])
+        
+        compacted = retriever.compact(knowledge_base)
+        rows.append([f"compaction ({compacted['removed']} rows)", 0, f"{compacted['seconds']:.2f}"])
+    
+    print(f"Indexing {args.docs} documents\n")
+    print_table(["operation", "chunks indexed", "seconds"], rows)
+
+
+def bench_hybrid(args: argparse.Namespace) -> None:
+    """Query throughput of lexical, vector and hybrid ranking on the bundled knowledge bases, scaled up."""
+    import os
+    import glob
+    from embedding_cache import EmbeddingPipeline
+    from knowledge_base import KnowledgeBase
+    from knowledge_retrieval import KnowledgeRetriever
+    
+    queries = [
+        "What is Form W-9 used for?",
+        "difference between cash and accrual accounting",
+        "how to write an engaging Instagram caption",
+        "account code 4010 depreciation schedule",
+        "best time to post on LinkedIn",
+        "reconcile bank statement discrepancies",
+    ]
+    
+    paths = glob.glob(bundled_file("Knowledge Base: *.md"))
+    if not paths:
+        raise FileNotFoundError(f"No 'Knowledge Base: *.md' files next to {__file__}")
+    
+    with tempfile.TemporaryDirectory() as tmp:
+        knowledge_base = KnowledgeBase("bench", "", vector_db_path=os.path.join(tmp, "vector_db"), embedding_model="hashing-384", search_mode="exact")
+        for path in paths:
+            with open(path, 'r', encoding='utf-8') as f:
+                text = f.read()
+            for copy in range(args.copies):
+                # Distinct account codes per copy keep the vocabulary growing like a real corpus
+                copy_path = os.path.join(tmp, f"{copy}-{os.path.basename(path)}")
+                with open(copy_path, 'w', encoding='utf-8') as f:
+                    f.write(text.replace("\n\n", f"\n\nAccount code {4000 + copy}.\n\n", 3))
+                knowledge_base.add_source("file", copy_path)
+        
+        retriever = KnowledgeRetriever(pipeline=EmbeddingPipeline(use_cache=False))
+        stats = retriever.ingest(knowledge_base)
+        lexical_index = retriever.get_lexical_index(knowledge_base)
+        print(f"{stats['chunks']} chunks, {len(lexical_index.term_ids)} terms, {int(lexical_index.offsets[-1])} postings\n")
+        
+        rows = []
+        for mode in ("lexical", "vector", "hybrid"):
+            retriever.query(knowledge_base, queries[0], k=args.k, mode=mode)
+            started = time.perf_counter()
+            for i in range(args.queries):
+                retriever.query(knowledge_base, queries[i % len(queries)], k=args.k, mode=mode)
+            elapsed = time.perf_counter() - started
+            rows.append([mode, f"{args.queries / elapsed:.0f}", f"{elapsed / args.queries * 1000:.2f}"])
+    
+    print_table(["mode", "queries/s", "ms/query"], rows)
+
+
+def bench_embedding(args: argparse.Namespace) -> None:
+    """Ingestion throughput with a cold and a warm embedding cache."""
+    import os
+    from embedding_cache import EmbeddingCache, EmbeddingPipeline
+    from embeddings import get_embedder
+    from knowledge_base import KnowledgeBase
+    from knowledge_retrieval import KnowledgeRetriever
+    
+    path = bundled_file("Knowledge Base: Accountant Bot.md")
+    with open(path, 'r', encoding='utf-8') as f:
+        paragraphs = [p for p in f.read().split("\n\n") if p.strip()]
+    if not paragraphs:
+        raise ValueError(f"{path} has no paragraphs to index")
+    
+    rows = []
+    with tempfile.TemporaryDirectory() as tmp:
+        for i in range(args.docs):
+            with open(os.path.join(tmp, f"doc{i}.md"), 'w', encoding='utf-8') as f:
+                f.write(f"# Document {i}\n\n" + "\n\n".join(paragraphs[(i + j) % len(paragraphs)] for j in range(6)) + f"\n\nReference {i}.")
+        
+        for workers in args.workers:
+            cache = EmbeddingCache(os.path.join(tmp, f"cache-{workers}.db"))
+            pipeline = EmbeddingPipeline(cache=cache, batch_size=args.batch_size, max_workers=workers)
+            retriever = KnowledgeRetriever(pipeline=pipeline)
+            for run, label in enumerate(("cold cache", "warm cache (new knowledge base)")):
+                knowledge_base = KnowledgeBase("bench", "", vector_db_path=os.path.join(tmp, f"kb-{workers}-{run}"), embedding_model=args.model)
+                for i in range(args.docs):
+                    knowledge_base.add_source("file", os.path.join(tmp, f"doc{i}.md"))
+                stats = retriever.ingest(knowledge_base)
+                if not stats["chunks_indexed"]:
+                    raise RuntimeError(f"Ingestion indexed no chunks from {args.docs} documents")
+                rows.append([workers, label, stats["chunks_indexed"], stats["cache_hits"], f"{stats['chunks_per_second']:.0f}"])
+            pipeline.shutdown()
+            cache.close()
+    
+    print(f"Ingesting {args.docs} documents with {get_embedder(args.model).name}, batch size {args.batch_size}\n")
+    print_table(["workers", "run", "chunks", "cache hits", "chunks/s"], rows)
+
+
+class _StubLLM:
+    """LLM service stand-in that answers instantly."""
+    
+    def chat_completion(self, messages: List[Dict[str, str]], **kwargs: Any) -> Dict[str, Any]:
+        return {"choices": [{"message": {"role": "assistant", "content": "ok"}}]}
+    
+    def extract_assistant_message(self, response: Dict[str, Any]) -> str:
+        return response["choices"][0]["message"]["content"]
+
+
+def bench_bots(args: argparse.Namespace) -> None:
+    """Bot lookups and per-turn bot file reads with and without the registry."""
+    import os
+    from unittest import mock
+    from bot import Bot
+    from bot_service import BotService
+    
+    with tempfile.TemporaryDirectory() as tmp:
+        service = BotService(data_dir=tmp, llm_service=_StubLLM())
+        bots = [service.create_bot({"name": f"bot {i}", "parent_id": None if i < 10 else f"parent-{i % 10}"}) for i in range(args.bots)]
+        bot_ids = [bot.id for bot in bots]
+        
+        def legacy_get_bot(bot_id: str) -> Bot:
+            return Bot.load(os.path.join(service.bots_dir, f"{bot_id}.json"))
+        
+        rows = []
+        for name, lookup in (("disk (Bot.load)", legacy_get_bot), ("registry", service.get_bot)):
+            started = time.perf_counter()
+            for i in range(args.turns * 10):
+                lookup(bot_ids[i % len(bot_ids)])
+            rows.append([f"get_bot, {name}", f"{(time.perf_counter() - started) / (args.turns * 10) * 1e6:.1f} us"])
+        
+        started = time.perf_counter()
+        Bot.list_bots(service.bots_dir)
+        rows.append(["list_bots, disk", f"{(time.perf_counter() - started) * 1000:.2f} ms"])
+        started = time.perf_counter()
+        service.list_bots()
+        rows.append(["list_bots, registry", f"{(time.perf_counter() - started) * 1000:.2f} ms"])
+        
+        # Count bot file reads during chat turns
+        loads = []
+        original_load = Bot.load.__func__
+        with mock.patch.object(Bot, "load", classmethod(lambda cls, path: loads.append(path) or original_load(cls, path))):
+            for i in range(args.turns):
+                service.send_message(f"conversation-{i % 20}", bot_ids[i % len(bot_ids)], "hello")
+        rows.append(["bot file reads per turn", f"{len(loads) / args.turns:.2f}"])
+        
+        # Effective (inherited) bot resolution at the bottom of a deep chain
+        parent_id = None
+        for depth in range(args.depth):
+            parent_id = service.create_bot({"name": f"level {depth}", "parent_id": parent_id, "system_prompt": f"Level {depth}."}).id
+        for name in ("first resolution", "cached"):
+            started = time.perf_counter()
+            service.get_effective_bot(parent_id)
+            rows.append([f"get_effective_bot depth {args.depth}, {name}", f"{(time.perf_counter() - started) * 1e6:.1f} us"])
+    
+    print(f"{args.bots} bots, {args.turns} chat turns\n")
+    print_table(["measurement", "value"], rows)
+
+
+def bench_convlog(args: argparse.Namespace) -> None:
+    """Per-turn write and read cost of whole-file conversation saves vs. the append-only log."""
+    import os
+    from conversation import Conversation
+    from conversation_store import JSONLConversationStore, CONVERSATION_RECENT_MESSAGES
+    
+    checkpoints = {args.turns // 10, args.turns // 2, args.turns}
+    rows = []
+    with tempfile.TemporaryDirectory() as tmp:
+        store = JSONLConversationStore(os.path.join(tmp, "log"))
+        legacy = Conversation(user_id="bench")
+        logged = Conversation(user_id="bench")
+        store.save_conversation(logged)
+        
+        legacy_seconds = log_seconds = 0.0
+        legacy_bytes = log_bytes = 0
+        for turn in range(1, args.turns + 1):
+            content = f"turn {turn} " + "lorem ipsum dolor sit amet " * 8
+            legacy.add_message("user", content)
+            legacy.add_message("assistant", content)
+            started = time.perf_counter()
+            legacy_bytes += os.path.getsize(legacy.save(os.path.join(tmp, "legacy")))
+            legacy_seconds += time.perf_counter() - started
+            
+            messages = [logged.add_message("user", content), logged.add_message("assistant", content)]
+            before = store.get_metrics()["bytesAppended"]
+            started = time.perf_counter()
+            store.append_messages(logged.id, messages, logged.updated_at)
+            log_seconds += time.perf_counter() - started
+            log_bytes += store.get_metrics()["bytesAppended"] - before
+            
+            if turn in checkpoints:
+                # Reading the conversation for the next turn: replaying the whole log
+                # vs. the cached header plus the end of the log
+                started = time.perf_counter()
+                store.load_conversation(logged.id)
+                replay_ms = (time.perf_counter() - started) * 1000
+                started = time.perf_counter()
+                store.load_recent(logged.id, CONVERSATION_RECENT_MESSAGES)
+                recent_ms = (time.perf_counter() - started) * 1000
+                rows.append([turn, f"{legacy_seconds / turn * 1000:.3f} ms", f"{legacy_bytes / turn / 1024:.1f} KB",
+                             f"{log_seconds / turn * 1000:.3f} ms", f"{log_bytes / turn / 1024:.1f} KB",
+                             f"{replay_ms:.2f} ms", f"{recent_ms:.2f} ms"])
+        
+    print(f"{args.turns} turns (two messages each); recent reads load the last {CONVERSATION_RECENT_MESSAGES} messages\n")
+    print_table(["turns", "save: time/turn", "save: bytes/turn", "log: time/turn", "log: bytes/turn", "read: replay", "read: recent"], rows)
+
+
+def bench_router(args: argparse.Namespace) -> None:
+    """Focus-keyword routing latency over a large bot hierarchy."""
+    import random
+    from bot_service import BotService
+    
+    rng = random.Random(0)
+    vocabulary = [f"topic{i}" for i in range(args.bots)]
+    with tempfile.TemporaryDirectory() as tmp:
+        service = BotService(data_dir=tmp, llm_service=_StubLLM())
+        parents = [service.create_bot({"name": f"parent {i}"}).id for i in range(max(1, args.bots // args.fanout))]
+        keywords = {}
+        for i in range(args.bots - len(parents)):
+            parent_id = parents[i % len(parents)]
+            bot_keywords = rng.sample(vocabulary, 4) + [f"{rng.choice(vocabulary)} {rng.choice(vocabulary)}"]
+            bot = service.create_bot({"name": f"child {i}", "parent_id": parent_id, "focus_keywords": bot_keywords})
+            keywords[bot.id] = (parent_id, bot_keywords)
+        
+        started = time.perf_counter()
+        service.router.route(parents[0], "warm up")
+        build_ms = (time.perf_counter() - started) * 1000
+        
+        # Siblings owning each keyword; a message whose keyword several siblings own is ambiguous
+        owners = {}
+        for bot_id, (parent_id, bot_keywords) in keywords.items():
+            for keyword in bot_keywords:
+                for token in keyword.split():
+                    owners.setdefault((parent_id, token), set()).add(bot_id)
+        
+        bot_ids = list(keywords)
+        filler_words = [f"filler{i}" for i in range(1000)]
+        queries = []
+        for _ in range(args.queries):
+            bot_id = rng.choice(bot_ids)
+            parent_id, bot_keywords = keywords[bot_id]
+            keyword = rng.choice(bot_keywords)
+            # Filler words are never keywords, so they cannot pull the message towards a sibling
+            filler = " ".join(rng.sample(filler_words, 3))
+            ambiguous = len(keyword.split()) == 1 and len(owners[(parent_id, keyword)]) > 1
+            queries.append((parent_id, f"question about {keyword} and {filler}", bot_id, ambiguous))
+        
+        started = time.perf_counter()
+        routed = [service.router.route(parent_id, message) for parent_id, message, _, _ in queries]
+        route_us = (time.perf_counter() - started) / len(queries) * 1e6
+        unambiguous = [(route, bot_id) for route, (_, _, bot_id, ambiguous) in zip(routed, queries) if not ambiguous]
+        correct = sum(route is not None and route.bot_id == bot_id for route, bot_id in unambiguous)
+        
+        service.update_bot(bot_ids[0], {"focus_keywords": ["changed"]})
+        started = time.perf_counter()
+        service.router.route(parents[0], "changed")
+        rebuild_ms = (time.perf_counter() - started) * 1000
+    
+    print(f"{args.bots} bots, {len(parents)} parents, {args.queries} messages\n")
+    print_table(["measurement", "value"], [
+        ["initial index build", f"{build_ms:.1f} ms"],
+        ["route, per message", f"{route_us:.1f} us"],
+        ["routed to the expected bot", f"{correct / max(len(unambiguous), 1):.1%} of {len(unambiguous)} unambiguous messages"],
+        ["route after one bot update", f"{rebuild_ms:.2f} ms"],
+    ])
+
+
+def bench_ratelimit(args: argparse.Namespace) -> None:
+    """Cost of one in-memory rate limit check vs. the number of tracked keys."""
+    from rate_limiter import InMemoryRateLimiter, RateLimitPolicy, api_key_identity
+    
+    limiter = InMemoryRateLimiter(enabled=True)
+    policy = RateLimitPolicy(per_minute=60, burst=10, daily_quota=1000)
+    keys = [api_key_identity(f"hf_key_{i}") for i in range(args.keys)]
+    
+    rows = []
+    for name, batch in (("first check per key", keys), ("repeat checks", keys)):
+        started = time.perf_counter()
+        allowed = sum(limiter.check(key, policy).allowed for key in batch)
+        elapsed = time.perf_counter() - started
+        rows.append([name, f"{elapsed / len(batch) * 1e6:.2f} us", f"{allowed / len(batch):.0%}"])
+    
+    started = time.perf_counter()
+    for _ in range(len(keys)):
+        api_key_identity("hf_key_0")
+    rows.append(["hash API key", f"{(time.perf_counter() - started) / len(keys) * 1e6:.2f} us", "-"])
+    
+    print(f"{args.keys} keys\n")
+    print_table(["operation", "time per call", "allowed"], rows)
+
+
+def bench_keypool(args: argparse.Namespace) -> None:
+    """Latency of light users while one key floods the user API, with and without per-key limits."""
+    import threading
+    from key_sessions import KeySessionPool
+    
+    class _StubSession:
+        def post(self, *a, **kw):
+            time.sleep(args.upstream_ms / 1000)
+        
+        def close(self):
+            pass
+    
+    def run(per_key_limit: int) -> Dict[str, List[float]]:
+        pool = KeySessionPool(per_key_limit=per_key_limit, max_in_flight=args.capacity, queue_timeout=60, session_factory=lambda key: _StubSession())
+        latencies: Dict[str, List[float]] = {"heavy": [], "light": []}
+        
+        def call(kind: str, api_key: str) -> None:
+            started = time.perf_counter()
+            with pool.session(api_key) as session:
+                session.post()
+            latencies[kind].append(time.perf_counter() - started)
+        
+        threads = [threading.Thread(target=call, args=("heavy", "hf_heavy")) for _ in range(args.heavy)]
+        for thread in threads:
+            thread.start()
+        time.sleep(0.01)
+        light = [threading.Thread(target=call, args=("light", f"hf_light_{i}")) for i in range(args.light)]
+        for thread in light:
+            thread.start()
+        for thread in threads + light:
+            thread.join()
+        return latencies
+    
+    rows = []
+    for name, per_key_limit in (("round-robin, no per-key limit", args.capacity), (f"fair, {args.per_key} per key", args.per_key)):
+        latencies = run(per_key_limit)
+        rows.append([
+            name,
+            f"{statistics.median(latencies['light']) * 1000:.0f} ms",
+            f"{max(latencies['light']) * 1000:.0f} ms",
+            f"{max(latencies['heavy']) * 1000:.0f} ms"
+        ])
+    
+    print(f"{args.heavy} requests on one key, {args.light} light keys, capacity {args.capacity}, upstream {args.upstream_ms:g} ms\n")
+    print_table(["scheduling", "light p50", "light max", "heavy max"], rows)
+
+
+BENCHMARKS: Dict[str, Callable[[argparse.Namespace], None]] = {
+    "messages": bench_messages,
+    "retrieval": bench_retrieval,
+    "ann": bench_ann,
+    "reindex": bench_reindex,
+    "hybrid": bench_hybrid,
+    "embedding": bench_embedding,
+    "bots": bench_bots,
+    "convlog": bench_convlog,
+    "router": bench_router,
+    "ratelimit": bench_ratelimit,
+    "keypool": bench_keypool,
+}
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Run backend benchmarks")
+    subparsers = parser.add_subparsers(dest="benchmark", required=True)
+    
+    messages_parser = subparsers.add_parser("messages", help="Memory per conversation message")
+    messages_parser.add_argument("--count", type=int, default=100000, help="Number of messages")
+    
+    retrieval_parser = subparsers.add_parser("retrieval", help="Knowledge retrieval query latency vs. corpus size")
+    retrieval_parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 10000, 100000], help="Corpus sizes in chunks")
+    retrieval_parser.add_argument("--queries", type=int, default=200, help="Queries per corpus size")
+    retrieval_parser.add_argument("-k", type=int, default=4, help="Results per query")
+    
+    ann_parser = subparsers.add_parser("ann", help="Approximate search recall and latency")
+    ann_parser.add_argument("--count", type=int, default=300000, help="Number of vectors")
+    ann_parser.add_argument("--dim", type=int, default=384, help="Vector dimension")
+    ann_parser.add_argument("--queries", type=int, default=100, help="Number of queries")
+    ann_parser.add_argument("--nprobe", type=int, nargs="+", default=[4, 8, 16, 32], help="Clusters scanned per query")
+    ann_parser.add_argument("-k", type=int, default=10, help="Results per query")
+    
+    reindex_parser = subparsers.add_parser("reindex", help="Incremental knowledge base re-indexing")
+    reindex_parser.add_argument("--docs", type=int, default=10000, help="Number of documents")
+    
+    hybrid_parser = subparsers.add_parser("hybrid", help="Lexical, vector and hybrid query throughput")
+    hybrid_parser.add_argument("--copies", type=int, default=200, help="Copies of each bundled knowledge base")
+    hybrid_parser.add_argument("--queries", type=int, default=300, help="Queries per mode")
+    hybrid_parser.add_argument("-k", type=int, default=4, help="Results per query")
+    
+    embedding_parser = subparsers.add_parser("embedding", help="Batched, cached embedding throughput")
+    embedding_parser.add_argument("--docs", type=int, default=5000, help="Number of documents")
+    embedding_parser.add_argument("--workers", type=int, nargs="+", default=[1, 4], help="Worker pool sizes")
+    embedding_parser.add_argument("--batch-size", type=int, default=64, help="Texts per embedder call")
+    embedding_parser.add_argument("--model", default="hashing-384", help="Embedding model")
+    
+    bots_parser = subparsers.add_parser("bots", help="Bot lookups and per-turn disk reads")
+    bots_parser.add_argument("--bots", type=int, default=1000, help="Number of bots")
+    bots_parser.add_argument("--turns", type=int, default=200, help="Number of chat turns")
+    bots_parser.add_argument("--depth", type=int, default=10, help="Depth of the inheritance chain")
+    
+    convlog_parser = subparsers.add_parser("convlog", help="Conversation write and read cost per turn")
+    convlog_parser.add_argument("--turns", type=int, default=1000, help="Number of chat turns")
+    
+    router_parser = subparsers.add_parser("router", help="Focus-keyword routing latency")
+    router_parser.add_argument("--bots", type=int, default=10000, help="Number of bots")
+    router_parser.add_argument("--fanout", type=int, default=100, help="Children per parent")
+    router_parser.add_argument("--queries", type=int, default=10000, help="Number of routed messages")
+    
+    ratelimit_parser = subparsers.add_parser("ratelimit", help="Rate limit check cost")
+    ratelimit_parser.add_argument("--keys", type=int, default=100000, help="Number of rate-limited keys")
+    
+    keypool_parser = subparsers.add_parser("keypool", help="Fairness of user API key scheduling")
+    keypool_parser.add_argument("--heavy", type=int, default=64, help="Concurrent requests on the heavy key")
+    keypool_parser.add_argument("--light", type=int, default=8, help="Number of light keys with one request each")
+    keypool_parser.add_argument("--capacity", type=int, default=8, help="Maximum requests in flight")
+    keypool_parser.add_argument("--per-key", type=int, default=2, help="Maximum requests in flight per key")
+    keypool_parser.add_argument("--upstream-ms", type=float, default=50, help="Simulated upstream latency")
+    
+    args = parser.parse_args()
+    started = time.perf_counter()
+    BENCHMARKS[args.benchmark](args)
+    print(f"\nCompleted in {time.perf_counter() - started:.2f}s")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,288 @@
+"""
+Lexical BM25 index over knowledge base chunks.
+Complements vector search for exact terms (account codes, form names) that
+embeddings handle poorly.
+"""
+
+import os
+import json
+import math
+import time
+import logging
+import threading
+from collections import Counter
+from typing import Dict, List, Any, Optional, Tuple
+
+import numpy as np
+
+from embeddings import tokenize
+
+logger = logging.getLogger(__name__)
+
+# BM25 parameters
+BM25_K1 = float(os.getenv("BM25_K1", "1.2"))
+BM25_B = float(os.getenv("BM25_B", "0.75"))
+
+
+class BM25Index:
+    """
+    Inverted index with BM25 scoring over the rows of a VectorStore.
+    
+    Postings are stored as flat arrays grouped by term (row ids as uint32,
+    term frequencies as uint16) and memory-mapped on load. Rows added after
+    the last build go to an append-only delta log that is folded in on the
+    next build.
+    
+    Files in the index directory:
+        bm25_terms.txt    - vocabulary, one term per line, in term id order
+        bm25_offsets.i64  - (vocab + 1) start offsets of each term's postings
+        bm25_rows.u32     - posting row ids, grouped by term
+        bm25_tfs.u16      - posting term frequencies
+        bm25_lengths.u32  - token count of every indexed row
+        bm25_delta.jsonl  - rows added since the last build
+        bm25_meta.json    - counts and the store generation the index was built for
+    """
+    
+    TERMS_FILE = "bm25_terms.txt"
+    OFFSETS_FILE = "bm25_offsets.i64"
+    ROWS_FILE = "bm25_rows.u32"
+    TFS_FILE = "bm25_tfs.u16"
+    LENGTHS_FILE = "bm25_lengths.u32"
+    DELTA_FILE = "bm25_delta.jsonl"
+    META_FILE = "bm25_meta.json"
+    
+    def __init__(self, path: str, k1: float = None, b: float = None):
+        """
+        Initialize the index.
+        
+        Args:
+            path: Directory holding the index files
+            k1: BM25 term frequency saturation
+            b: BM25 length normalization
+        """
+        self.path = path
+        self.k1 = BM25_K1 if k1 is None else k1
+        self.b = BM25_B if b is None else b
+        self.generation = 0
+        self.term_ids: Dict[str, int] = {}
+        self.offsets = np.zeros(1, dtype=np.int64)
+        self.rows = np.empty(0, dtype=np.uint32)
+        self.tfs = np.empty(0, dtype=np.uint16)
+        self.lengths = np.empty(0, dtype=np.uint32)
+        self.total_length = 0
+        self.built = False
+        self._delta: Dict[str, List[Tuple[int, int]]] = {}
+        self._lock = threading.RLock()
+    
+    @property
+    def doc_count(self) -> int:
+        """Number of indexed rows."""
+        return int(np.count_nonzero(self.lengths))
+    
+    def build(self, texts: List[str], generation: int = 0) -> Dict[str, Any]:
+        """
+        Index texts from scratch; text i is row i.
+        
+        Args:
+            texts: Chunk texts in row order
+            generation: Generation of the store the rows belong to
+        
+        Returns:
+            Build statistics
+        """
+        started = time.perf_counter()
+        postings: Dict[str, List[Tuple[int, int]]] = {}
+        lengths = np.zeros(len(texts), dtype=np.uint32)
+        for row, text in enumerate(texts):
+            tokens = tokenize(text)
+            lengths[row] = len(tokens)
+            for term, tf in Counter(tokens).items():
+                postings.setdefault(term, []).append((row, tf))
+        
+        terms = sorted(postings)
+        offsets = np.zeros(len(terms) + 1, dtype=np.int64)
+        np.cumsum([len(postings[term]) for term in terms], out=offsets[1:])
+        rows = np.empty(offsets[-1], dtype=np.uint32)
+        tfs = np.empty(offsets[-1], dtype=np.uint16)
+        for term_id, term in enumerate(terms):
+            entries = np.array(postings[term], dtype=np.int64)
+            rows[offsets[term_id]:offsets[term_id + 1]] = entries[:, 0]
+            tfs[offsets[term_id]:offsets[term_id + 1]] = np.minimum(entries[:, 1], 65535)
+        
+        with self._lock:
+            self.term_ids = {term: term_id for term_id, term in enumerate(terms)}
+            self.offsets, self.rows, self.tfs, self.lengths = offsets, rows, tfs, lengths
+            self.total_length = int(lengths.sum())
+            self.generation = generation
+            self.built = True
+            self._delta = {}
+            self._save(terms)
+        
+        elapsed = time.perf_counter() - started
+        logger.info(f"Built BM25 index at {self.path}: {len(texts)} rows, {len(terms)} terms in {elapsed:.2f}s")
+        return {"rows": len(texts), "terms": len(terms), "postings": int(offsets[-1]), "seconds": elapsed}
+    
+    def add(self, first_row: int, texts: List[str]) -> None:
+        """
+        Index rows appended to the store since the last build.
+        
+        Args:
+            first_row: Row id of the first text
+            texts: Chunk texts of consecutive rows
+        """
+        with self._lock:
+            records = []
+            lengths = np.zeros(first_row + len(texts), dtype=np.uint32)
+            kept = min(len(self.lengths), first_row)
+            lengths[:kept] = self.lengths[:kept]
+            for row, text in enumerate(texts, start=first_row):
+                tokens = tokenize(text)
+                counts = Counter(tokens)
+                lengths[row] = len(tokens)
+                self.total_length += len(tokens)
+                for term, tf in counts.items():
+                    self._delta.setdefault(term, []).append((row, tf))
+                records.append({"row": row, "length": len(tokens), "terms": counts})
+            self.lengths = lengths
+            
+            with open(os.path.join(self.path, self.DELTA_FILE), 'a', encoding='utf-8') as f:
+                for record in records:
+                    f.write(json.dumps(record) + "\n")
+    
+    def scores(self, query: str, size: int) -> np.ndarray:
+        """
+        BM25 score of every row for a query.
+        
+        Args:
+            query: The query text
+            size: Number of rows in the store (length of the result)
+        
+        Returns:
+            Float32 array of scores, zero for rows without query terms
+        """
+        with self._lock:
+            term_ids, offsets, rows, tfs, lengths = self.term_ids, self.offsets, self.rows, self.tfs, self.lengths
+            delta = self._delta
+            doc_count = max(self.doc_count, 1)
+            avg_length = self.total_length / doc_count or 1.0
+        
+        scores = np.zeros(size, dtype=np.float32)
+        for term in set(tokenize(query)):
+            parts = []
+            term_id = term_ids.get(term)
+            if term_id is not None:
+                parts.append((rows[offsets[term_id]:offsets[term_id + 1]], tfs[offsets[term_id]:offsets[term_id + 1]]))
+            if term in delta:
+                entries = np.array(delta[term], dtype=np.int64)
+                parts.append((entries[:, 0], entries[:, 1]))
+            if not parts:
+                continue
+            
+            df = sum(len(part[0]) for part in parts)
+            idf = math.log(1 + (doc_count - df + 0.5) / (df + 0.5))
+            for term_rows, term_tfs in parts:
+                term_rows = term_rows.astype(np.int64)
+                keep = term_rows < size
+                term_rows = term_rows[keep]
+                tf = term_tfs[keep].astype(np.float32)
+                norm = self.k1 * (1 - self.b + self.b * lengths[term_rows] / avg_length)
+                scores[term_rows] += idf * tf * (self.k1 + 1) / (tf + norm)
+        return scores
+    
+    def search(self, query: str, size: int, k: int, exclude: np.ndarray = None) -> List[Tuple[int, float]]:
+        """
+        Find the rows with the highest BM25 scores.
+        
+        Args:
+            query: The query text
+            size: Number of rows in the store
+            k: Number of results
+            exclude: Optional boolean mask of rows to skip (e.g. tombstones)
+        
+        Returns:
+            (row, score) pairs with positive scores, best first
+        """
+        scores = self.scores(query, size)
+        if exclude is not None:
+            scores[exclude] = 0.0
+        k = min(k, size)
+        if k <= 0:
+            return []
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        return [(int(row), float(scores[row])) for row in top if scores[row] > 0]
+    
+    def load(self) -> bool:
+        """
+        Load the index from disk, memory-mapping the postings.
+        
+        Returns:
+            True if an index was found, False otherwise
+        """
+        meta_path = os.path.join(self.path, self.META_FILE)
+        if not os.path.exists(meta_path):
+            return False
+        
+        with open(meta_path, 'r') as f:
+            meta = json.load(f)
+        with open(os.path.join(self.path, self.TERMS_FILE), 'r', encoding='utf-8') as f:
+            terms = f.read().split("\n") if meta["terms"] else []
+        
+        with self._lock:
+            self.generation = meta.get("generation", 0)
+            self.term_ids = {term: term_id for term_id, term in enumerate(terms)}
+            self.offsets = np.fromfile(os.path.join(self.path, self.OFFSETS_FILE), dtype=np.int64)
+            self.rows = self._map(self.ROWS_FILE, np.uint32, meta["postings"])
+            self.tfs = self._map(self.TFS_FILE, np.uint16, meta["postings"])
+            self.lengths = np.fromfile(os.path.join(self.path, self.LENGTHS_FILE), dtype=np.uint32)
+            self.total_length = int(self.lengths.sum())
+            self.built = True
+            self._delta = {}
+            
+            delta_path = os.path.join(self.path, self.DELTA_FILE)
+            if os.path.exists(delta_path):
+                with open(delta_path, 'r', encoding='utf-8') as f:
+                    for line in f:
+                        record = json.loads(line)
+                        row = record["row"]
+                        if row >= len(self.lengths):
+                            self.lengths = np.concatenate([self.lengths, np.zeros(row + 1 - len(self.lengths), dtype=np.uint32)])
+                        self.lengths[row] = record["length"]
+                        self.total_length += record["length"]
+                        for term, tf in record["terms"].items():
+                            self._delta.setdefault(term, []).append((row, tf))
+        return True
+    
+    def clear(self) -> None:
+        """
+        Remove the index files.
+        """
+        with self._lock:
+            for filename in (self.TERMS_FILE, self.OFFSETS_FILE, self.ROWS_FILE, self.TFS_FILE,
+                             self.LENGTHS_FILE, self.DELTA_FILE, self.META_FILE):
+                file_path = os.path.join(self.path, filename)
+                if os.path.exists(file_path):
+                    os.remove(file_path)
+            self.__init__(self.path, self.k1, self.b)
+    
+    def _save(self, terms: List[str]) -> None:
+        os.makedirs(self.path, exist_ok=True)
+        with open(os.path.join(self.path, f"{self.TERMS_FILE}.tmp"), 'w', encoding='utf-8') as f:
+            f.write("\n".join(terms))
+        os.replace(os.path.join(self.path, f"{self.TERMS_FILE}.tmp"), os.path.join(self.path, self.TERMS_FILE))
+        for filename, array in ((self.OFFSETS_FILE, self.offsets), (self.ROWS_FILE, self.rows),
+                                (self.TFS_FILE, self.tfs), (self.LENGTHS_FILE, self.lengths)):
+            file_path = os.path.join(self.path, filename)
+            array.tofile(f"{file_path}.tmp")
+            os.replace(f"{file_path}.tmp", file_path)
+        open(os.path.join(self.path, self.DELTA_FILE), 'w').close()
+        
+        meta_path = os.path.join(self.path, self.META_FILE)
+        with open(f"{meta_path}.tmp", 'w') as f:
+            json.dump({"terms": len(terms), "postings": int(self.offsets[-1]), "generation": self.generation}, f)
+        os.replace(f"{meta_path}.tmp", meta_path)
+    
+    def _map(self, filename: str, dtype: Any, count: int) -> np.ndarray:
+        if count == 0:
+            return np.empty(0, dtype=dtype)
+        return np.memmap(os.path.join(self.path, filename), dtype=dtype, mode='r', shape=(count,))
@@ -12,6 +12,9 @@ from typing import Dict, List, Optional, Any
 
 logger = logging.getLogger(__name__)
 
+DEFAULT_SYSTEM_PROMPT = "You are a helpful assistant."
+DEFAULT_MODEL_CONFIG = {"model": "gemini-1.5-flash", "temperature": 0.7, "max_tokens": 1024}
+
 class Bot:
     """
     Represents a chatbot with specific persona and configuration.
@@ -21,11 +24,12 @@ class Bot:
         self,
         name: str,
         description: str = "",
-        system_prompt: str = "You are a helpful assistant.",
+        system_prompt: str = None,
         focus_keywords: List[str] = None,
         icon: str = None,
         parent_id: str = None,
         model_config: Dict[str, Any] = None,
+        knowledge_base_ids: List[str] = None,
         id: str = None,
         created_at: float = None,
         updated_at: float = None
@@ -36,22 +40,25 @@ class Bot:
         Args:
             name: The name of the bot
             description: A description of the bot
-            system_prompt: System prompt for the bot
+            system_prompt: System prompt for the bot (child bots add it to their parent's)
             focus_keywords: Keywords that the bot focuses on
             icon: Icon for the bot
             parent_id: ID of the parent bot (if this is a child bot)
-            model_config: Configuration for the model
+            model_config: Configuration for the model (child bots override their parent's per key)
+            knowledge_base_ids: IDs of the knowledge bases the bot answers from
             id: Unique identifier for the bot (generated if not provided)
             created_at: Timestamp when the bot was created
             updated_at: Timestamp when the bot was last updated
         """
         self.name = name
         self.description = description
-        self.system_prompt = system_prompt
+        # Child bots start empty so that they inherit from their parent
+        self.system_prompt = system_prompt if system_prompt is not None else ("" if parent_id else DEFAULT_SYSTEM_PROMPT)
         self.focus_keywords = focus_keywords or []
         self.icon = icon
         self.parent_id = parent_id
-        self.model_config = model_config or {"model": "gemini-1.5-flash", "temperature": 0.7, "max_tokens": 1024}
+        self.model_config = model_config or ({} if parent_id else dict(DEFAULT_MODEL_CONFIG))
+        self.knowledge_base_ids = knowledge_base_ids or []
         self.id = id or str(uuid.uuid4())
         self.created_at = created_at or time.time()
         self.updated_at = updated_at or time.time()
@@ -72,10 +79,51 @@ class Bot:
             "icon": self.icon,
             "parent_id": self.parent_id,
             "model_config": self.model_config,
+            "knowledge_base_ids": self.knowledge_base_ids,
             "created_at": self.created_at,
             "updated_at": self.updated_at
         }
     
+    def inherit(self, parent: Optional['Bot']) -> 'Bot':
+        """
+        Flatten this bot onto its parent's effective configuration.
+        
+        The system prompts are joined (parent first), focus keywords and
+        knowledge bases are combined, and model config keys set on this bot
+        override the parent's.
+        
+        Args:
+            parent: The parent's effective bot (None for top-level bots)
+        
+        Returns:
+            A new Bot with this bot's identity and the merged configuration
+        """
+        if parent is None:
+            system_prompt = self.system_prompt or DEFAULT_SYSTEM_PROMPT
+            focus_keywords = list(self.focus_keywords)
+            knowledge_base_ids = list(self.knowledge_base_ids)
+            model_config = {**DEFAULT_MODEL_CONFIG, **self.model_config}
+        else:
+            prompts = [prompt for prompt in (parent.system_prompt, self.system_prompt) if prompt]
+            system_prompt = "\n\n".join(prompts)
+            focus_keywords = list(dict.fromkeys(parent.focus_keywords + self.focus_keywords))
+            knowledge_base_ids = list(dict.fromkeys(parent.knowledge_base_ids + self.knowledge_base_ids))
+            model_config = {**parent.model_config, **self.model_config}
+        
+        return Bot(
+            name=self.name,
+            description=self.description,
+            system_prompt=system_prompt,
+            focus_keywords=focus_keywords,
+            icon=self.icon or (parent.icon if parent else None),
+            parent_id=self.parent_id,
+            model_config=model_config,
+            knowledge_base_ids=knowledge_base_ids,
+            id=self.id,
+            created_at=self.created_at,
+            updated_at=self.updated_at
+        )
+    
     @classmethod
     def from_dict(cls, data: Dict[str, Any]) -> 'Bot':
         """
@@ -87,14 +135,25 @@ class Bot:
         Returns:
             Bot instance
         """
+        system_prompt = data.get("system_prompt")
+        model_config = data.get("model_config")
+        if data.get("parent_id"):
+            # Child bots used to be saved with the top-level defaults, which would
+            # override their parent's; a value equal to a default counts as unset
+            if system_prompt == DEFAULT_SYSTEM_PROMPT:
+                system_prompt = ""
+            if model_config == DEFAULT_MODEL_CONFIG:
+                model_config = {}
+        
         return cls(
             name=data.get("name"),
             description=data.get("description"),
-            system_prompt=data.get("system_prompt"),
+            system_prompt=system_prompt,
             focus_keywords=data.get("focus_keywords"),
             icon=data.get("icon"),
             parent_id=data.get("parent_id"),
-            model_config=data.get("model_config"),
+            model_config=model_config,
+            knowledge_base_ids=data.get("knowledge_base_ids"),
             id=data.get("id"),
             created_at=data.get("created_at"),
             updated_at=data.get("updated_at")
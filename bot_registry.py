@@ -0,0 +1,331 @@
+"""
+Bot registry for the child bot system.
+Keeps every bot in memory, indexed by ID and by parent ID, and picks up
+changes to the bots directory by mtime polling.
+"""
+
+import os
+import time
+import logging
+import threading
+from typing import Callable, Dict, List, Optional, Set, Tuple
+
+from bot import Bot
+
+logger = logging.getLogger(__name__)
+
+# How often (seconds) the bots directory is re-scanned for changes made by other processes
+BOT_REGISTRY_POLL_INTERVAL = float(os.getenv("BOT_REGISTRY_POLL_INTERVAL", "2.0"))
+
+
+class BotRegistry:
+    """
+    In-memory registry of bots backed by a directory of JSON files.
+    
+    Bots are loaded once; afterwards the directory is re-scanned at most once
+    per poll interval and only files whose mtime or size changed are re-read.
+    Scans triggered by lookups run on a background thread, and the directory
+    is read without holding the registry lock, so lookups never wait on disk.
+    Writes made through this process update the registry directly.
+    
+    Returned Bot objects are shared: callers that modify one must save it
+    and call put() (BotService does both).
+    
+    Effective (inherited) bots are flattened once and cached; a change to any
+    bot drops the cached result for it and all of its descendants.
+    """
+    
+    def __init__(self, bots_dir: str, poll_interval: float = None):
+        """
+        Initialize the bot registry.
+        
+        Args:
+            bots_dir: Directory containing bot JSON files
+            poll_interval: Minimum seconds between directory scans
+        """
+        self.bots_dir = bots_dir
+        self.poll_interval = BOT_REGISTRY_POLL_INTERVAL if poll_interval is None else poll_interval
+        self._bots: Dict[str, Bot] = {}
+        self._children: Dict[Optional[str], Set[str]] = {}
+        # Parent each bot was indexed under (Bot objects are shared and may be edited before put())
+        self._parent_ids: Dict[str, Optional[str]] = {}
+        self._file_stats: Dict[str, Tuple[int, int]] = {}
+        self._effective: Dict[str, Bot] = {}
+        self._listeners: List[Callable[[str], None]] = []
+        self._lock = threading.RLock()
+        self._loaded = False
+        self._last_scan = 0.0
+        self._refreshing = False
+        self._version = 0
+        self.disk_reads = 0
+    
+    @property
+    def version(self) -> int:
+        """Monotonic counter incremented whenever any bot changes."""
+        self._maybe_refresh()
+        return self._version
+    
+    def get(self, bot_id: str) -> Optional[Bot]:
+        """
+        Get a bot by ID.
+        
+        Args:
+            bot_id: ID of the bot
+        
+        Returns:
+            The bot or None if not found
+        """
+        self._maybe_refresh()
+        return self._bots.get(bot_id)
+    
+    def children(self, parent_id: Optional[str]) -> List[Bot]:
+        """
+        Get the direct children of a bot.
+        
+        Args:
+            parent_id: ID of the parent bot (None for top-level bots)
+        
+        Returns:
+            List of child bots
+        """
+        self._maybe_refresh()
+        with self._lock:
+            return [self._bots[bot_id] for bot_id in self._children.get(parent_id, ())]
+    
+    def list(self) -> List[Bot]:
+        """
+        List all bots.
+        
+        Returns:
+            List of bots
+        """
+        self._maybe_refresh()
+        with self._lock:
+            return list(self._bots.values())
+    
+    def effective(self, bot_id: str) -> Optional[Bot]:
+        """
+        Get a bot with its configuration flattened up the parent chain.
+        
+        Args:
+            bot_id: ID of the bot
+        
+        Returns:
+            The effective bot (see Bot.inherit) or None if not found
+        """
+        self._maybe_refresh()
+        effective = self._effective.get(bot_id)
+        if effective is not None:
+            return effective
+        
+        with self._lock:
+            # Collect the uncached part of the chain, stopping at cycles and missing parents
+            chain = []
+            seen = set()
+            current = bot_id
+            while current is not None and current not in seen and current not in self._effective:
+                bot = self._bots.get(current)
+                if bot is None:
+                    if current != bot_id:
+                        logger.warning(f"Parent bot not found: {current}")
+                    break
+                chain.append(bot)
+                seen.add(current)
+                current = bot.parent_id
+            if not chain:
+                return None
+            if current in seen:
+                logger.warning(f"Bot hierarchy cycle at: {current}")
+            
+            parent = self._effective.get(current) if current not in seen else None
+            for bot in reversed(chain):
+                parent = bot.inherit(parent)
+                self._effective[bot.id] = parent
+            return parent
+    
+    def descendants(self, bot_id: str) -> List[str]:
+        """
+        Get the IDs of all descendants of a bot.
+        
+        Args:
+            bot_id: ID of the bot
+        
+        Returns:
+            Descendant IDs, breadth first
+        """
+        with self._lock:
+            result = []
+            queue = list(self._children.get(bot_id, ()))
+            seen = set()
+            while queue:
+                child_id = queue.pop(0)
+                if child_id in seen:
+                    continue
+                seen.add(child_id)
+                result.append(child_id)
+                queue.extend(self._children.get(child_id, ()))
+            return result
+    
+    def add_listener(self, listener: Callable[[str], None]) -> None:
+        """
+        Register a callback invoked with the ID of every bot that is added,
+        changed or removed. Listeners run under the registry lock and must be quick.
+        
+        Args:
+            listener: The callback
+        """
+        with self._lock:
+            self._listeners.append(listener)
+    
+    def put(self, bot: Bot) -> None:
+        """
+        Register a bot that was just saved to the bots directory.
+        
+        Args:
+            bot: The saved bot
+        """
+        self._maybe_refresh()
+        with self._lock:
+            self._index(bot)
+            try:
+                stat = os.stat(os.path.join(self.bots_dir, f"{bot.id}.json"))
+                self._file_stats[bot.id] = (stat.st_mtime_ns, stat.st_size)
+            except OSError:
+                self._file_stats.pop(bot.id, None)
+            self._version += 1
+    
+    def remove(self, bot_id: str) -> None:
+        """
+        Unregister a bot that was deleted from the bots directory.
+        
+        Args:
+            bot_id: ID of the deleted bot
+        """
+        with self._lock:
+            self._unindex(bot_id)
+            self._file_stats.pop(bot_id, None)
+            self._version += 1
+    
+    def refresh(self, force: bool = False) -> bool:
+        """
+        Re-scan the bots directory and reload changed files.
+        
+        Args:
+            force: Scan even if the poll interval has not elapsed
+        
+        Returns:
+            True if any bot changed, False otherwise
+        """
+        with self._lock:
+            now = time.monotonic()
+            if not force and self._loaded and now - self._last_scan < self.poll_interval:
+                return False
+            self._last_scan = now
+            known = dict(self._file_stats)
+        
+        # Scan and read changed files without the lock
+        try:
+            entries = list(os.scandir(self.bots_dir))
+        except FileNotFoundError:
+            entries = []
+        except OSError as e:
+            logger.error(f"Error scanning bots directory {self.bots_dir}: {e}")
+            return False
+        
+        file_stats: Dict[str, Tuple[int, int]] = {}
+        loaded: Dict[str, Optional[Bot]] = {}
+        for entry in entries:
+            try:
+                if not entry.name.endswith('.json') or not entry.is_file():
+                    continue
+                stat = entry.stat()
+            except OSError:
+                # Deleted since the scan
+                continue
+            bot_id = os.path.splitext(entry.name)[0]
+            file_stats[bot_id] = (stat.st_mtime_ns, stat.st_size)
+            if known.get(bot_id) == file_stats[bot_id]:
+                continue
+            
+            try:
+                loaded[bot_id] = Bot.load(entry.path)
+                self.disk_reads += 1
+            except Exception as e:
+                # Remember the file anyway so that it is not retried until it changes
+                logger.error(f"Error loading bot from {entry.path}: {e}")
+                loaded[bot_id] = None
+        
+        with self._lock:
+            self._loaded = True
+            changed = False
+            for bot_id, bot in loaded.items():
+                # Skip bots that put(), remove() or another scan changed meanwhile
+                if self._file_stats.get(bot_id) != known.get(bot_id):
+                    continue
+                self._file_stats[bot_id] = file_stats[bot_id]
+                if bot is not None:
+                    self._index(bot)
+                    changed = True
+                
+            for bot_id, file_stat in known.items():
+                if bot_id not in file_stats and self._file_stats.get(bot_id) == file_stat:
+                    self._unindex(bot_id)
+                    del self._file_stats[bot_id]
+                    changed = True
+            
+            if changed:
+                self._version += 1
+                logger.info(f"Bot registry loaded {len(self._bots)} bots (version {self._version})")
+            return changed
+    
+    def _maybe_refresh(self) -> None:
+        """
+        Load on first access; afterwards, once the poll interval has elapsed,
+        re-scan on a background thread and keep serving the current bots.
+        """
+        if not self._loaded:
+            self.refresh()
+            return
+        if time.monotonic() - self._last_scan < self.poll_interval:
+            return
+        
+        with self._lock:
+            if self._refreshing:
+                return
+            self._refreshing = True
+        
+        def run():
+            try:
+                self.refresh()
+            except Exception as e:
+                logger.error(f"Error refreshing bot registry: {e}")
+            finally:
+                self._refreshing = False
+        
+        threading.Thread(target=run, name="bot-registry-refresh", daemon=True).start()
+    
+    def _invalidate(self, bot_id: str) -> None:
+        """Drop the cached effective bots of a bot and its descendants."""
+        self._effective.pop(bot_id, None)
+        for descendant_id in self.descendants(bot_id):
+            self._effective.pop(descendant_id, None)
+    
+    def _index(self, bot: Bot) -> None:
+        """Add or replace a bot in the indexes."""
+        self._unindex(bot.id)
+        self._bots[bot.id] = bot
+        self._parent_ids[bot.id] = bot.parent_id
+        self._children.setdefault(bot.parent_id, set()).add(bot.id)
+    
+    def _unindex(self, bot_id: str) -> None:
+        """Remove a bot from the indexes."""
+        self._invalidate(bot_id)
+        for listener in self._listeners:
+            listener(bot_id)
+        if self._bots.pop(bot_id, None) is not None:
+            parent_id = self._parent_ids.pop(bot_id)
+            siblings = self._children.get(parent_id)
+            if siblings is not None:
+                siblings.discard(bot_id)
+                if not siblings:
+                    del self._children[parent_id]
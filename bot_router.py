@@ -0,0 +1,243 @@
+"""
+Message router for the child bot system.
+Picks the child bot of a parent whose focus keywords (and, optionally,
+description) best match a message.
+"""
+
+import os
+import time
+import logging
+import threading
+from typing import Dict, List, Any, Optional, Set, Tuple
+
+import numpy as np
+
+from bot_registry import BotRegistry
+from embeddings import Embedder, get_embedder, tokenize
+
+logger = logging.getLogger(__name__)
+
+# Description similarity is optional: embedding each message costs far more than the keyword match
+BOT_ROUTER_EMBEDDINGS = os.getenv("BOT_ROUTER_EMBEDDINGS", "false").lower() in ("1", "true", "yes")
+BOT_ROUTER_MODEL = os.getenv("BOT_ROUTER_MODEL", "all-MiniLM-L6-v2")
+# Minimum description similarity for a route when no keyword matches
+BOT_ROUTER_MIN_SIMILARITY = float(os.getenv("BOT_ROUTER_MIN_SIMILARITY", "0.35"))
+# Weight of description similarity added to the keyword score
+BOT_ROUTER_SIMILARITY_WEIGHT = float(os.getenv("BOT_ROUTER_SIMILARITY_WEIGHT", "1.0"))
+
+
+class Route:
+    """
+    A routing decision.
+    """
+    
+    def __init__(self, bot_id: str, score: float, matched_keywords: List[str], similarity: Optional[float] = None):
+        """
+        Initialize a route.
+        
+        Args:
+            bot_id: ID of the chosen bot
+            score: Combined routing score
+            matched_keywords: Focus keywords of the bot found in the message
+            similarity: Description similarity, if embeddings are enabled
+        """
+        self.bot_id = bot_id
+        self.score = score
+        self.matched_keywords = matched_keywords
+        self.similarity = similarity
+    
+    def to_dict(self) -> Dict[str, Any]:
+        """
+        Convert the route to a dictionary.
+        
+        Returns:
+            Dictionary representation of the route
+        """
+        return {
+            "botId": self.bot_id,
+            "score": self.score,
+            "matchedKeywords": self.matched_keywords,
+            "similarity": self.similarity
+        }
+
+
+class _SiblingIndex:
+    """Keyword index (and optional description matrix) over the children of one parent."""
+    
+    def __init__(self):
+        # First token -> [(keyword tokens, bot id, keyword)]
+        self.keywords: Dict[str, List[Tuple[Tuple[str, ...], str, str]]] = {}
+        self.bot_ids: List[str] = []
+        self.vectors: Optional[np.ndarray] = None
+
+
+class BotRouter:
+    """
+    Routes messages to child bots by focus keywords.
+    
+    Each parent has a precompiled index of its children's keywords (their own,
+    not inherited ones, so that siblings are told apart), keyed by first token
+    so multi-word keywords match as phrases. Routing tokenizes the message once
+    and scores each child by the number of keyword tokens it matched.
+    
+    The router listens to the bot registry and rebuilds only the sibling
+    indexes of bots that changed, on the next route.
+    """
+    
+    def __init__(
+        self,
+        registry: BotRegistry,
+        use_embeddings: bool = None,
+        embedder: Embedder = None,
+        min_similarity: float = None,
+        similarity_weight: float = None
+    ):
+        """
+        Initialize the router.
+        
+        Args:
+            registry: Registry of the bots to route between
+            use_embeddings: Also score description similarity (defaults to BOT_ROUTER_EMBEDDINGS)
+            embedder: Embedder for descriptions and messages (BOT_ROUTER_MODEL by default)
+            min_similarity: Minimum similarity for a description-only route
+            similarity_weight: Weight of description similarity in the combined score
+        """
+        self.registry = registry
+        self.use_embeddings = BOT_ROUTER_EMBEDDINGS if use_embeddings is None else use_embeddings
+        self._embedder = embedder
+        self.min_similarity = BOT_ROUTER_MIN_SIMILARITY if min_similarity is None else min_similarity
+        self.similarity_weight = BOT_ROUTER_SIMILARITY_WEIGHT if similarity_weight is None else similarity_weight
+        self._indexes: Dict[Optional[str], _SiblingIndex] = {}
+        self._parents: Dict[str, Optional[str]] = {}
+        self._dirty: Set[str] = set()
+        self._built = False
+        self._lock = threading.RLock()
+        # Guards only _dirty; registry listeners run under the registry lock and must not wait on _lock
+        self._dirty_lock = threading.Lock()
+        self._metrics = {"routes": 0, "routed": 0, "unrouted": 0, "rebuilds": 0, "routeSeconds": 0.0}
+        registry.add_listener(self._on_bot_changed)
+    
+    @property
+    def embedder(self) -> Embedder:
+        """The description embedder, created on first use."""
+        if self._embedder is None:
+            self._embedder = get_embedder(BOT_ROUTER_MODEL)
+        return self._embedder
+    
+    def _on_bot_changed(self, bot_id: str) -> None:
+        with self._dirty_lock:
+            self._dirty.add(bot_id)
+    
+    def route(self, parent_id: Optional[str], message: str) -> Optional[Route]:
+        """
+        Pick the child bot of a parent that best matches a message.
+        
+        Args:
+            parent_id: ID of the parent bot (None for top-level bots)
+            message: The user's message
+        
+        Returns:
+            The best route, or None if no child matched
+        """
+        started = time.perf_counter()
+        index = self._sibling_index(parent_id)
+        
+        scores: Dict[str, float] = {}
+        matched: Dict[str, List[str]] = {}
+        if index is not None and index.keywords:
+            tokens = tokenize(message)
+            for position, token in enumerate(tokens):
+                for keyword_tokens, bot_id, keyword in index.keywords.get(token, ()):
+                    end = position + len(keyword_tokens)
+                    if len(keyword_tokens) > 1 and tuple(tokens[position:end]) != keyword_tokens:
+                        continue
+                    bot_matched = matched.setdefault(bot_id, [])
+                    if keyword not in bot_matched:
+                        bot_matched.append(keyword)
+                        scores[bot_id] = scores.get(bot_id, 0.0) + len(keyword_tokens)
+        
+        similarities = None
+        if index is not None and index.vectors is not None and len(index.bot_ids):
+            similarities = index.vectors @ self.embedder.embed_query(message)
+            for bot_id, similarity in zip(index.bot_ids, similarities):
+                if bot_id in scores or similarity >= self.min_similarity:
+                    scores[bot_id] = scores.get(bot_id, 0.0) + self.similarity_weight * float(similarity)
+        
+        route = None
+        if scores:
+            # Highest score wins; ties go to the bot with more matched keywords, then the lowest ID
+            bot_id = min(scores, key=lambda candidate: (-scores[candidate], -len(matched.get(candidate, ())), candidate))
+            similarity = None
+            if similarities is not None and bot_id in index.bot_ids:
+                similarity = float(similarities[index.bot_ids.index(bot_id)])
+            route = Route(bot_id, scores[bot_id], matched.get(bot_id, []), similarity)
+        
+        with self._lock:
+            self._metrics["routes"] += 1
+            self._metrics["routed" if route else "unrouted"] += 1
+            self._metrics["routeSeconds"] += time.perf_counter() - started
+        return route
+    
+    def _sibling_index(self, parent_id: Optional[str]) -> Optional[_SiblingIndex]:
+        """Get the index of a parent's children, applying pending bot changes first."""
+        self.registry.version  # picks up changes made by other processes
+        if self._built and not self._dirty:
+            return self._indexes.get(parent_id)
+        
+        with self._lock:
+            with self._dirty_lock:
+                dirty, self._dirty = self._dirty, set()
+            if not self._built:
+                self._parents = {bot.id: bot.parent_id for bot in self.registry.list()}
+                stale = set(self._parents.values())
+                self._indexes.clear()
+                self._built = True
+            else:
+                stale = set()
+                for bot_id in dirty:
+                    if bot_id in self._parents:
+                        stale.add(self._parents.pop(bot_id))
+                    bot = self.registry.get(bot_id)
+                    if bot is not None:
+                        self._parents[bot.id] = bot.parent_id
+                        stale.add(bot.parent_id)
+            
+            for stale_parent_id in stale:
+                self._rebuild(stale_parent_id)
+            return self._indexes.get(parent_id)
+    
+    def _rebuild(self, parent_id: Optional[str]) -> None:
+        """Compile the sibling index of one parent."""
+        children = sorted(self.registry.children(parent_id), key=lambda bot: bot.id)
+        if not children:
+            self._indexes.pop(parent_id, None)
+            return
+        
+        index = _SiblingIndex()
+        for bot in children:
+            for keyword in bot.focus_keywords:
+                keyword_tokens = tuple(tokenize(keyword))
+                if keyword_tokens:
+                    index.keywords.setdefault(keyword_tokens[0], []).append((keyword_tokens, bot.id, keyword))
+        
+        if self.use_embeddings:
+            described = [bot for bot in children if bot.description]
+            if described:
+                index.bot_ids = [bot.id for bot in described]
+                index.vectors = self.embedder.embed([bot.description for bot in described])
+        
+        self._indexes[parent_id] = index
+        self._metrics["rebuilds"] += 1
+    
+    def get_metrics(self) -> Dict[str, Any]:
+        """
+        Get routing metrics.
+        
+        Returns:
+            Counters plus mean routing latency in microseconds
+        """
+        with self._lock:
+            metrics = dict(self._metrics)
+        seconds = metrics.pop("routeSeconds")
+        metrics["meanRouteMicroseconds"] = seconds / metrics["routes"] * 1e6 if metrics["routes"] else 0.0
+        return metrics
@@ -4,12 +4,23 @@ Bot service for the child bot system.
 
 import os
 import json
+import asyncio
 import logging
-from typing import Dict, List, Any, Optional
+import threading
+from collections import OrderedDict
+from typing import Dict, List, Any, Optional, Tuple
 
-from src.models.bot import Bot
-from src.models.conversation import Conversation
-from src.services.llm_service import LLMService
+from bot import Bot
+from bot_registry import BotRegistry
+from bot_router import BotRouter
+from conversation import Conversation, Message
+from conversation_store import JSONLConversationStore, CONVERSATION_RECENT_MESSAGES, is_valid_conversation_id
+from context_builder import ContextBuilder, context_builder as default_context_builder
+from conversation_summarizer import ConversationSummarizer, conversation_summarizer as default_summarizer
+from knowledge_base import KnowledgeBase
+from knowledge_retrieval import KnowledgeRetriever, knowledge_retriever as default_retriever
+from llm_client import LLMClient, LLMClientError, LLMTimeoutError, LegacyLLMClient, create_llm_client, run_sync
+from llm_service import LLMService
 
 # Configure logging
 logging.basicConfig(
@@ -18,23 +29,50 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+# Per-bot conversation log stores kept open (least recently used are dropped)
+BOT_CONVERSATION_STORES = int(os.getenv("BOT_CONVERSATION_STORES", "128"))
+
 class BotService:
     """
     Service for managing and interacting with bots.
     """
     
-    def __init__(self, data_dir: str = None, llm_service: LLMService = None):
+    def __init__(
+        self,
+        data_dir: str = None,
+        llm_service: LLMService = None,
+        context_builder: ContextBuilder = None,
+        summarizer: ConversationSummarizer = None,
+        retriever: KnowledgeRetriever = None,
+        llm_client: LLMClient = None
+    ):
         """
         Initialize the bot service.
         
         Args:
             data_dir: Directory for storing bot data
             llm_service: LLM service for generating responses
+            context_builder: Builder for token-budgeted LLM context windows
+            summarizer: Background summarizer for long conversations
+            retriever: Retrieval engine for the bots' knowledge bases
+            llm_client: Async LLM client for bot replies (wraps llm_service if only that is given)
         """
         self.data_dir = data_dir or os.environ.get("BOT_DATA_DIR", "data")
         self.bots_dir = os.path.join(self.data_dir, "bots")
         self.conversations_dir = os.path.join(self.data_dir, "conversations")
+        self.knowledge_bases_dir = os.path.join(self.data_dir, "knowledge_bases")
         self.llm_service = llm_service or LLMService()
+        self.llm_client = llm_client or (LegacyLLMClient(llm_service) if llm_service else create_llm_client())
+        self.context_builder = context_builder or default_context_builder
+        self.summarizer = summarizer or default_summarizer
+        self.retriever = retriever or default_retriever
+        self.registry = BotRegistry(self.bots_dir)
+        self.router = BotRouter(self.registry)
+        # Append-only conversation logs, one store per bot directory (LRU)
+        self._conversation_stores: "OrderedDict[str, JSONLConversationStore]" = OrderedDict()
+        self._stores_lock = threading.Lock()
+        # Parsed knowledge bases by ID, with the (mtime, size) of the file they were read from
+        self._knowledge_bases: Dict[str, Tuple[Tuple[int, int], KnowledgeBase]] = {}
         
         # Create directories if they don't exist
         os.makedirs(self.bots_dir, exist_ok=True)
@@ -53,14 +91,16 @@ class BotService:
         bot = Bot(
             name=bot_data.get("name", "Unnamed Bot"),
             description=bot_data.get("description", ""),
-            system_prompt=bot_data.get("system_prompt", "You are a helpful assistant."),
+            system_prompt=bot_data.get("system_prompt"),
             focus_keywords=bot_data.get("focus_keywords", []),
             icon=bot_data.get("icon"),
             parent_id=bot_data.get("parent_id"),
-            model_config=bot_data.get("model_config")
+            model_config=bot_data.get("model_config"),
+            knowledge_base_ids=bot_data.get("knowledge_base_ids")
         )
         
         bot.save(self.bots_dir)
+        self.registry.put(bot)
         logger.info(f"Created bot: {bot.id} - {bot.name}")
         
         return bot
@@ -75,17 +115,30 @@ class BotService:
         Returns:
             The bot or None if not found
         """
-        file_path = os.path.join(self.bots_dir, f"{bot_id}.json")
+        bot = self.registry.get(bot_id)
         
-        if not os.path.exists(file_path):
+        if not bot:
             logger.warning(f"Bot not found: {bot_id}")
-            return None
         
-        try:
-            return Bot.load(file_path)
-        except Exception as e:
-            logger.exception(f"Error loading bot: {bot_id}")
-            return None
+        return bot
+    
+    def get_effective_bot(self, bot_id: str) -> Optional[Bot]:
+        """
+        Get a bot with its prompt, focus keywords, knowledge bases and model
+        config merged with those of its ancestors.
+        
+        Args:
+            bot_id: ID of the bot
+        
+        Returns:
+            The effective bot or None if not found
+        """
+        bot = self.registry.effective(bot_id)
+        
+        if not bot:
+            logger.warning(f"Bot not found: {bot_id}")
+        
+        return bot
     
     def update_bot(self, bot_id: str, bot_data: Dict[str, Any]) -> Optional[Bot]:
         """
@@ -103,6 +156,11 @@ class BotService:
         if not bot:
             return None
         
+        parent_id = bot_data.get("parent_id", bot.parent_id)
+        if parent_id == bot_id or parent_id in self.registry.descendants(bot_id):
+            logger.warning(f"Rejected parent {parent_id} for bot {bot_id}: it would create a cycle")
+            return None
+        
         # Update bot fields
         if "name" in bot_data:
             bot.name = bot_data["name"]
@@ -116,8 +174,12 @@ class BotService:
             bot.icon = bot_data["icon"]
         if "model_config" in bot_data:
             bot.model_config = bot_data["model_config"]
+        bot.parent_id = parent_id
+        if "knowledge_base_ids" in bot_data:
+            bot.knowledge_base_ids = bot_data["knowledge_base_ids"]
         
         bot.save(self.bots_dir)
+        self.registry.put(bot)
         logger.info(f"Updated bot: {bot.id} - {bot.name}")
         
         return bot
@@ -140,6 +202,7 @@ class BotService:
         
         try:
             os.remove(file_path)
+            self.registry.remove(bot_id)
             logger.info(f"Deleted bot: {bot_id}")
             return True
         except Exception as e:
@@ -153,7 +216,44 @@ class BotService:
         Returns:
             List of bots
         """
-        return Bot.list_bots(self.bots_dir)
+        return self.registry.list()
+    
+    def get_child_bots(self, parent_id: str) -> List[Bot]:
+        """
+        List the direct children of a bot.
+        
+        Args:
+            parent_id: ID of the parent bot
+        
+        Returns:
+            List of child bots
+        """
+        return self.registry.children(parent_id)
+    
+    def route_message(self, parent_id: str, message: str) -> Optional[Bot]:
+        """
+        Pick the bot under a parent that should answer a message.
+        
+        Routing descends the hierarchy while a child matches, so the most
+        specific matching descendant is returned.
+        
+        Args:
+            parent_id: ID of the parent bot
+            message: The user's message
+        
+        Returns:
+            The chosen bot with its inherited configuration, or None if no child matched
+        """
+        bot_id = None
+        seen = {parent_id}
+        route = self.router.route(parent_id, message)
+        while route is not None and route.bot_id not in seen:
+            bot_id = route.bot_id
+            seen.add(bot_id)
+            logger.debug(f"Routed message to bot {bot_id} (score {route.score:.2f}, keywords {route.matched_keywords})")
+            route = self.router.route(bot_id, message)
+        
+        return self.get_effective_bot(bot_id) if bot_id else None
     
     def create_conversation(self, bot_id: str, user_id: str = "anonymous") -> Optional[Conversation]:
         """
@@ -166,21 +266,32 @@ class BotService:
         Returns:
             The created conversation or None if the bot doesn't exist
         """
-        bot = self.get_bot(bot_id)
+        bot = self.get_effective_bot(bot_id)
         
         if not bot:
             return None
         
+        return self._new_conversation(bot, user_id)
+    
+    def _new_conversation(self, bot: Bot, user_id: str) -> Conversation:
+        """
+        Create and save a new conversation with a bot.
+        
+        Args:
+            bot: The bot to converse with
+            user_id: ID of the user
+        
+        Returns:
+            The created conversation
+        """
+        bot_id = bot.id
         conversation = Conversation(
             bot_id=bot_id,
             user_id=user_id,
             metadata={"system_prompt": bot.system_prompt}
         )
         
-        conversation_dir = os.path.join(self.conversations_dir, bot_id)
-        os.makedirs(conversation_dir, exist_ok=True)
-        
-        conversation.save(conversation_dir)
+        self.conversation_store(bot_id).save_conversation(conversation)
         logger.info(f"Created conversation: {conversation.id} for bot: {bot_id}")
         
         return conversation
@@ -196,19 +307,61 @@ class BotService:
         Returns:
             The conversation or None if not found
         """
-        conversation_dir = os.path.join(self.conversations_dir, bot_id)
-        file_path = os.path.join(conversation_dir, f"{conversation_id}.json")
+        if not is_valid_conversation_id(conversation_id) or self.registry.get(bot_id) is None:
+            logger.warning(f"Conversation not found: {conversation_id!r}")
+            return None
         
-        if not os.path.exists(file_path):
+        try:
+            conversation = self.conversation_store(bot_id).load_conversation(conversation_id)
+        except Exception as e:
+            logger.exception(f"Error loading conversation: {conversation_id}")
+            return None
+        
+        if conversation is None:
             logger.warning(f"Conversation not found: {conversation_id}")
+        return conversation
+    
+    def _load_recent(self, conversation_id: str, bot_id: str) -> Optional[Conversation]:
+        """
+        Load the part of a conversation a turn needs: its summary and the
+        messages the summary does not cover (the latest ones only when
+        conversations are not summarized).
+        
+        Args:
+            conversation_id: ID of the conversation
+            bot_id: ID of the bot
+        
+        Returns:
+            The conversation or None if not found
+        """
+        if not is_valid_conversation_id(conversation_id):
             return None
         
+        limit = None if self.summarizer.enabled else CONVERSATION_RECENT_MESSAGES
         try:
-            return Conversation.load(file_path)
+            return self.conversation_store(bot_id).load_recent(conversation_id, limit)
         except Exception as e:
             logger.exception(f"Error loading conversation: {conversation_id}")
             return None
     
+    def get_recent_messages(self, conversation_id: str, bot_id: str, limit: int = 20) -> List[Dict[str, Any]]:
+        """
+        Get the last messages of a conversation, reading only the end of its log.
+        
+        Args:
+            conversation_id: ID of the conversation
+            bot_id: ID of the bot
+            limit: Maximum number of messages
+        
+        Returns:
+            Up to `limit` of the most recent messages, oldest first
+        """
+        if not is_valid_conversation_id(conversation_id) or self.registry.get(bot_id) is None:
+            return []
+        
+        messages = self.conversation_store(bot_id).load_tail(conversation_id, limit)
+        return [message.to_dict() for message in messages]
+    
     def list_conversations(self, bot_id: str, user_id: str = None) -> List[Conversation]:
         """
         List conversations for a bot.
@@ -220,8 +373,115 @@ class BotService:
         Returns:
             List of conversations
         """
-        conversation_dir = os.path.join(self.conversations_dir, bot_id)
-        return Conversation.list_conversations(conversation_dir, bot_id, user_id)
+        if self.registry.get(bot_id) is None:
+            return []
+        
+        return self.conversation_store(bot_id).list_conversations(bot_id, user_id)
+    
+    def conversation_store(self, bot_id: str) -> JSONLConversationStore:
+        """
+        Get the conversation log store of a bot.
+        
+        Args:
+            bot_id: ID of the bot
+        
+        Returns:
+            The store for the bot's conversations directory
+        
+        Raises:
+            ValueError: If the bot does not exist
+        """
+        with self._stores_lock:
+            store = self._conversation_stores.get(bot_id)
+            if store is not None:
+                self._conversation_stores.move_to_end(bot_id)
+                return store
+        
+        # Only bots in the registry get a directory, so arbitrary IDs never reach the file system
+        if self.registry.get(bot_id) is None:
+            raise ValueError(f"Bot not found: {bot_id}")
+        
+        with self._stores_lock:
+            store = self._conversation_stores.get(bot_id)
+            if store is None:
+                store = JSONLConversationStore(os.path.join(self.conversations_dir, bot_id))
+                self._conversation_stores[bot_id] = store
+                while len(self._conversation_stores) > BOT_CONVERSATION_STORES:
+                    self._conversation_stores.popitem(last=False)
+            self._conversation_stores.move_to_end(bot_id)
+            return store
+    
+    def get_knowledge_base(self, knowledge_base_id: str) -> Optional[KnowledgeBase]:
+        """
+        Get a knowledge base by ID.
+        
+        The parsed knowledge base is kept in memory and only read again when
+        its file changes, so answering a turn costs one stat per knowledge base.
+        
+        Args:
+            knowledge_base_id: ID of the knowledge base to get
+        
+        Returns:
+            The knowledge base or None if not found
+        """
+        file_path = os.path.join(self.knowledge_bases_dir, f"{knowledge_base_id}.json")
+        
+        try:
+            stat = os.stat(file_path)
+        except OSError:
+            self._knowledge_bases.pop(knowledge_base_id, None)
+            logger.warning(f"Knowledge base not found: {knowledge_base_id}")
+            return None
+        
+        signature = (stat.st_mtime_ns, stat.st_size)
+        cached = self._knowledge_bases.get(knowledge_base_id)
+        if cached and cached[0] == signature:
+            return cached[1]
+        
+        try:
+            knowledge_base = KnowledgeBase.load(file_path)
+        except Exception as e:
+            logger.exception(f"Error loading knowledge base: {knowledge_base_id}")
+            return None
+        self._knowledge_bases[knowledge_base_id] = (signature, knowledge_base)
+        return knowledge_base
+    
+    def ingest_knowledge_base(self, knowledge_base_id: str, full: bool = False) -> Dict[str, Any]:
+        """
+        Bring the vector index of a knowledge base up to date with its sources.
+        
+        Args:
+            knowledge_base_id: ID of the knowledge base to ingest
+            full: Rebuild the index from scratch instead of only re-indexing changed sources
+        
+        Returns:
+            Ingestion statistics
+        """
+        knowledge_base = self.get_knowledge_base(knowledge_base_id)
+        if not knowledge_base:
+            return {"error": f"Knowledge base not found: {knowledge_base_id}"}
+        return self.retriever.ingest(knowledge_base, full=full)
+    
+    def _knowledge_context(self, bot: Bot, message: str) -> str:
+        """
+        Retrieve knowledge base excerpts relevant to a message.
+        
+        Args:
+            bot: The bot being asked
+            message: The user's message
+        
+        Returns:
+            Prompt section with the excerpts, or an empty string
+        """
+        if not bot.knowledge_base_ids:
+            return ""
+        
+        knowledge_bases = [kb for kb in map(self.get_knowledge_base, bot.knowledge_base_ids) if kb]
+        try:
+            return self.retriever.build_context(knowledge_bases, message)
+        except Exception as e:
+            logger.exception(f"Error retrieving knowledge for bot: {bot.id}")
+            return ""
     
     def send_message(
         self,
@@ -242,53 +502,150 @@ class BotService:
         Returns:
             Response from the bot
         """
-        # Get the conversation or create a new one if it doesn't exist
-        conversation = self.get_conversation(conversation_id, bot_id)
-        if not conversation:
-            conversation = self.create_conversation(bot_id, user_id)
-            if not conversation:
-                return {"error": f"Bot not found: {bot_id}"}
+        return run_sync(self.send_message_async(conversation_id, bot_id, message, user_id))
+    
+    async def send_message_async(
+        self,
+        conversation_id: str,
+        bot_id: str,
+        message: str,
+        user_id: str = "anonymous",
+        timeout: float = None
+    ) -> Dict[str, Any]:
+        """
+        Send a message to a bot and get a response without blocking the event loop.
         
-        # Get the bot
-        bot = self.get_bot(bot_id)
-        if not bot:
-            return {"error": f"Bot not found: {bot_id}"}
+        Many conversations can be served concurrently on one loop; the LLM
+        client's concurrency limit bounds the calls in flight.
         
-        # Add the user message to the conversation
-        conversation.add_message("user", message)
+        Args:
+            conversation_id: ID of the conversation
+            bot_id: ID of the bot
+            message: Message to send
+            user_id: ID of the user
+            timeout: Seconds allowed for the LLM call (the client's default if None)
         
-        # Get the conversation context for the LLM
-        context = conversation.get_context_for_llm()
+        Returns:
+            Response from the bot
+        """
+        loop = asyncio.get_running_loop()
+        # Loading the conversation and building the context touch disk, so run them on a worker thread
+        turn = await loop.run_in_executor(None, self._prepare_turn, conversation_id, bot_id, message, user_id)
+        if "error" in turn:
+            return turn
+        bot, conversation, user_message, context = turn["bot"], turn["conversation"], turn["user_message"], turn["context"]
         
         # Get the bot's response from the LLM
-        llm_response = self.llm_service.chat_completion(
-            messages=context,
-            model=bot.model_config.get("model", "vicuna-13b"),
-            temperature=bot.model_config.get("temperature", 0.7),
-            max_tokens=bot.model_config.get("max_tokens", 1024)
-        )
-        
-        # Extract the assistant's message
-        assistant_message = self.llm_service.extract_assistant_message(llm_response)
-        
-        if assistant_message:
-            # Add the assistant's message to the conversation
-            conversation.add_message("assistant", assistant_message)
-            
-            # Save the conversation
-            conversation_dir = os.path.join(self.conversations_dir, bot_id)
-            conversation.save(conversation_dir)
-            
+        try:
+            completion = await self.llm_client.complete(
+                context.messages,
+                model=turn["model"],
+                temperature=bot.model_config.get("temperature", 0.7),
+                max_tokens=turn["max_tokens"],
+                timeout=timeout
+            )
+        except LLMTimeoutError as e:
             return {
                 "conversation_id": conversation.id,
                 "bot_id": bot.id,
-                "message": assistant_message
+                "error": "LLM request timed out",
+                "details": str(e)
             }
-        else:
+        except LLMClientError as e:
             return {
                 "conversation_id": conversation.id,
                 "bot_id": bot.id,
                 "error": "Failed to get response from LLM",
-                "details": llm_response
+                "details": e.details if e.details is not None else str(e)
             }
-
+        
+        assistant_message = completion.text
+        await loop.run_in_executor(None, self._finish_turn, conversation, bot_id, user_message, assistant_message)
+        return {
+            "conversation_id": conversation.id,
+            "bot_id": bot.id,
+            "message": assistant_message
+        }
+    
+    def _prepare_turn(self, conversation_id: str, bot_id: str, message: str, user_id: str) -> Dict[str, Any]:
+        """
+        Record the user's message and build the LLM context for a turn.
+        
+        Args:
+            conversation_id: ID of the conversation
+            bot_id: ID of the bot
+            message: Message to send
+            user_id: ID of the user
+        
+        Returns:
+            The bot, conversation, user message, context, model and max_tokens, or an error
+        """
+        # Get the bot with its inherited configuration
+        bot = self.get_effective_bot(bot_id)
+        if not bot:
+            return {"error": f"Bot not found: {bot_id}"}
+        
+        # Get the conversation or create a new one if it doesn't exist
+        conversation = self._load_recent(conversation_id, bot_id)
+        if not conversation:
+            conversation = self._new_conversation(bot, user_id)
+        
+        # Add the user message to the conversation
+        user_message = conversation.add_message("user", message)
+        
+        # Build a token-budgeted context window for the LLM
+        model = bot.model_config.get("model", "vicuna-13b")
+        max_tokens = bot.model_config.get("max_tokens", 1024)
+        # The effective prompt is resolved per message, so ancestor edits apply to ongoing conversations
+        system_prompt = bot.system_prompt
+        knowledge = self._knowledge_context(bot, message)
+        context = self.context_builder.build(
+            conversation,
+            system_prompt=f"{system_prompt}\n\n{knowledge}" if knowledge else system_prompt,
+            model=model,
+            max_tokens=max_tokens
+        )
+        self.summarizer.record_turn(conversation, context, system_prompt)
+        return {
+            "bot": bot,
+            "conversation": conversation,
+            "user_message": user_message,
+            "context": context,
+            "model": model,
+            "max_tokens": max_tokens
+        }
+        
+    def _finish_turn(self, conversation: Conversation, bot_id: str, user_message: Message, assistant_message: str) -> Message:
+        """
+        Record the bot's reply and persist the turn.
+        
+        Args:
+            conversation: The conversation
+            bot_id: ID of the bot
+            user_message: The user's message, as added to the conversation
+            assistant_message: The bot's reply
+        
+        Returns:
+            The reply, as added to the conversation
+        """
+        # Add the assistant's message to the conversation
+        reply = conversation.add_message("assistant", assistant_message)
+            
+        # Append only this turn to the conversation log
+        self.conversation_store(bot_id).append_messages(conversation.id, [user_message, reply], conversation.updated_at)
+            
+        # Compact older turns in the background once the conversation grows long
+        self.summarizer.maybe_schedule(conversation, on_complete=lambda c: self._save_summary(c, bot_id))
+        return reply
+    
+    def _save_summary(self, conversation: Conversation, bot_id: str) -> None:
+        """
+        Append a background summary to a conversation's log.
+        
+        Args:
+            conversation: The conversation the summary was computed for
+            bot_id: ID of the bot
+        """
+        self.conversation_store(bot_id).save_summary(
+            conversation.id, conversation.summary, conversation.summary_upto, conversation.summarized_tokens
+        )
@@ -0,0 +1,218 @@
+"""
+Token-budgeted context window builder for multi-turn chats.
+"""
+
+import os
+import logging
+from typing import Dict, List, Any, Optional
+
+logger = logging.getLogger(__name__)
+
+# Upper bound on prompt tokens sent upstream, even for models with larger windows
+CONTEXT_MAX_TOKENS = int(os.getenv("CONTEXT_MAX_TOKENS", "4096"))
+
+# Approximate tokenizer: ~4 characters per token for English text, plus role framing per message
+CHARS_PER_TOKEN = 4
+MESSAGE_OVERHEAD_TOKENS = 4
+
+# Introduces the rolling summary of older turns within the system prompt
+SUMMARY_HEADER = "Summary of the earlier conversation:"
+
+# Context window sizes (prompt + completion) of the models we serve
+DEFAULT_CONTEXT_WINDOW = 2048
+MODEL_CONTEXT_WINDOWS = {
+    "vicuna-13b": 2048,
+    "vicuna-7b": 2048,
+    "gemini-1.5-flash": 1048576,
+    "gemini-1.5-flash-001": 1048576,
+    "gemini-1.5-pro-001": 2097152,
+    "microsoft/DialoGPT-large": 1024,
+    "microsoft/DialoGPT-medium": 1024,
+    "facebook/blenderbot-400M-distill": 128,
+    "google/flan-t5-base": 512,
+    "google/flan-t5-small": 512,
+    "gpt2": 1024,
+}
+
+
+def estimate_tokens(text: str) -> int:
+    """
+    Estimate the number of tokens in a text without running a tokenizer.
+    
+    Args:
+        text: The text to measure
+    
+    Returns:
+        Approximate token count
+    """
+    return (len(text) + CHARS_PER_TOKEN - 1) // CHARS_PER_TOKEN
+
+
+def message_tokens(content: str) -> int:
+    """
+    Estimate the tokens a chat message occupies, including role framing.
+    
+    Args:
+        content: The content of the message
+    
+    Returns:
+        Approximate token count
+    """
+    return MESSAGE_OVERHEAD_TOKENS + estimate_tokens(content)
+
+
+class ContextWindow:
+    """
+    The messages selected for one LLM call.
+    """
+    
+    def __init__(
+        self,
+        system: Optional[Dict[str, str]],
+        history: List[Dict[str, str]],
+        token_count: int,
+        dropped: int,
+        summarized: int = 0
+    ):
+        """
+        Initialize a context window.
+        
+        Args:
+            system: The system message (including any rolling summary), if any
+            history: Conversation messages included, oldest first (ends with the latest message)
+            token_count: Estimated prompt tokens of the window
+            dropped: Number of unsummarized older messages left out to fit the budget
+            summarized: Number of older messages represented by the rolling summary
+        """
+        self.system = system
+        self.history = history
+        self.token_count = token_count
+        self.dropped = dropped
+        self.summarized = summarized
+    
+    @property
+    def system_prompt(self) -> str:
+        """
+        The system prompt text, including any rolling summary.
+        """
+        return self.system["content"] if self.system else ""
+    
+    @property
+    def messages(self) -> List[Dict[str, str]]:
+        """
+        The window as a chat-completion message list.
+        """
+        return ([self.system] if self.system else []) + self.history
+    
+    def to_dict(self) -> Dict[str, Any]:
+        """
+        Convert the window to a dictionary.
+        
+        Returns:
+            Dictionary representation of the window
+        """
+        return {
+            "messages": self.messages,
+            "tokenCount": self.token_count,
+            "dropped": self.dropped,
+            "summarized": self.summarized
+        }
+
+
+class ContextBuilder:
+    """
+    Assembles system prompt + conversation history under a per-model token budget.
+    
+    Relies on the conversation's incrementally maintained per-message token
+    counts, so building a window only touches the messages that are kept.
+    If the conversation has a rolling summary, it is appended to the system
+    prompt and only the messages after it are considered, so the cost is
+    O(summary + recent turns). Older turns that still do not fit are dropped.
+    """
+    
+    def __init__(self, max_context_tokens: int = None, context_windows: Dict[str, int] = None):
+        """
+        Initialize the context builder.
+        
+        Args:
+            max_context_tokens: Upper bound on prompt tokens regardless of model
+            context_windows: Context window sizes by model name
+        """
+        self.max_context_tokens = max_context_tokens or CONTEXT_MAX_TOKENS
+        self.context_windows = context_windows or MODEL_CONTEXT_WINDOWS
+    
+    def budget_for(self, model: Optional[str], max_tokens: int = 0) -> int:
+        """
+        Get the prompt token budget for a model.
+        
+        Args:
+            model: Name of the model
+            max_tokens: Tokens reserved for the completion
+        
+        Returns:
+            Maximum prompt tokens
+        """
+        window = self.context_windows.get(model, DEFAULT_CONTEXT_WINDOW)
+        return max(0, min(self.max_context_tokens, window - max_tokens))
+    
+    def build(
+        self,
+        conversation: Any,
+        system_prompt: Optional[str] = None,
+        model: Optional[str] = None,
+        max_tokens: int = 0
+    ) -> ContextWindow:
+        """
+        Build the context window for the next LLM call.
+        
+        Args:
+            conversation: The conversation, ending with the message to answer
+            system_prompt: System prompt to prepend
+            model: Name of the model the window is for
+            max_tokens: Tokens reserved for the completion
+        
+        Returns:
+            The context window
+        """
+        budget = self.budget_for(model, max_tokens)
+        
+        summary = getattr(conversation, "summary", None)
+        summarized = conversation.summary_upto if summary else 0
+        # Index of the first unsummarized message among those in memory
+        offset = getattr(conversation, "message_offset", 0)
+        floor = max(0, summarized - offset)
+        if summary:
+            system_prompt = f"{system_prompt}\n\n{SUMMARY_HEADER}\n{summary}" if system_prompt else f"{SUMMARY_HEADER}\n{summary}"
+        
+        system = {"role": "system", "content": system_prompt} if system_prompt else None
+        used = message_tokens(system_prompt) if system_prompt else 0
+        
+        messages = conversation.messages
+        counts = conversation.message_token_counts
+        start = len(messages)
+        
+        # Walk backwards from the newest message while the budget allows
+        while start > floor and used + counts[start - 1] <= budget:
+            used += counts[start - 1]
+            start -= 1
+        
+        history = [{"role": str(message.role), "content": message.content} for message in messages[start:]]
+        
+        if start == len(messages) and len(messages) > floor:
+            # Even the latest message alone is over budget: keep its beginning
+            latest = messages[-1]
+            allowed_chars = max(0, budget - used - MESSAGE_OVERHEAD_TOKENS) * CHARS_PER_TOKEN
+            history = [{"role": str(latest.role), "content": latest.content[:allowed_chars]}]
+            used += message_tokens(history[0]["content"])
+            start -= 1
+        
+        # Unsummarized messages a tail-only load left out were dropped too
+        dropped = start - floor + max(0, offset - summarized)
+        if dropped:
+            logger.debug(f"Context for conversation {conversation.id} dropped {dropped} older messages to fit {budget} tokens")
+        
+        return ContextWindow(system=system, history=history, token_count=used, dropped=dropped, summarized=summarized)
+
+
+# Shared context builder
+context_builder = ContextBuilder()
@@ -2,27 +2,98 @@
 Conversation model for the chatbot backend.
 """
 
+import os
+import json
+import time
 import uuid
-from typing import Dict, List, Any, Optional
+import logging
+import threading
+from array import array
+from enum import Enum
+from collections import OrderedDict
+from typing import Dict, List, Any, Optional, Iterable, Iterator, Union
 from datetime import datetime
 
+from context_builder import message_tokens
+
+logger = logging.getLogger(__name__)
+
+# Maximum number of conversations kept resident in memory by the ConversationManager
+CONVERSATION_CACHE_SIZE = int(os.getenv("CONVERSATION_CACHE_SIZE", "1000"))
+
+# Store resident message histories in array-backed columns instead of lists of objects
+CONVERSATION_COLUMNAR = os.getenv("CONVERSATION_COLUMNAR", "false").lower() in ("1", "true", "yes")
+
+class Role(str, Enum):
+    """
+    Roles of message senders. Messages reference these shared members instead
+    of holding their own copy of the role string.
+    """
+    
+    SYSTEM = "system"
+    USER = "user"
+    ASSISTANT = "assistant"
+    
+    def __str__(self) -> str:
+        return self.value
+
+
+# Fixed role lookup table used to store roles as one-byte codes
+_ROLE_TABLE: List[Role] = list(Role)
+_ROLE_CODES: Dict[Role, int] = {role: code for code, role in enumerate(_ROLE_TABLE)}
+
+
+def _to_epoch(timestamp: Union[datetime, float, int, str, None]) -> float:
+    """
+    Normalize a timestamp to seconds since the epoch.
+    
+    Args:
+        timestamp: A datetime, epoch seconds, ISO 8601 string, or None for now
+    
+    Returns:
+        Epoch seconds
+    """
+    if timestamp is None:
+        return time.time()
+    if isinstance(timestamp, datetime):
+        return timestamp.timestamp()
+    if isinstance(timestamp, str):
+        return datetime.fromisoformat(timestamp).timestamp()
+    return float(timestamp)
+
+
 class Message:
     """
     Represents a message in a conversation.
+    
+    Uses __slots__, a shared role object and an epoch-seconds float instead of
+    a datetime to keep per-message memory small.
     """
     
-    def __init__(self, role: str, content: str, timestamp: Optional[datetime] = None):
+    __slots__ = ("role", "content", "ts")
+    
+    def __init__(self, role: str, content: str, timestamp: Union[datetime, float, None] = None):
         """
         Initialize a message.
         
         Args:
             role: The role of the message sender (user or assistant)
             content: The content of the message
-            timestamp: The timestamp of the message
+            timestamp: The timestamp of the message, as a datetime or epoch seconds
+        
+        Raises:
+            ValueError: If the role is not a Role
         """
-        self.role = role
+        self.role = Role(role)
         self.content = content
-        self.timestamp = timestamp or datetime.now()
+        self.ts = _to_epoch(timestamp)
+    
+    @property
+    def timestamp(self) -> datetime:
+        """
+        The timestamp of the message as a local datetime.
+        """
+        return datetime.fromtimestamp(self.ts)
     
     def to_dict(self) -> Dict[str, Any]:
         """
@@ -32,7 +103,7 @@ class Message:
             Dictionary representation of the message
         """
         return {
-            "role": self.role,
+            "role": str(self.role),
             "content": self.content,
             "timestamp": self.timestamp.isoformat()
         }
@@ -48,12 +119,94 @@ class Message:
         Returns:
             Message object
         """
-        timestamp = datetime.fromisoformat(data["timestamp"]) if "timestamp" in data else None
         return cls(
             role=data["role"],
             content=data["content"],
-            timestamp=timestamp
+            timestamp=data.get("timestamp")
         )
+    
+    def __repr__(self) -> str:
+        return f"Message(role={str(self.role)!r}, content={self.content[:30]!r}, ts={self.ts})"
+
+
+class MessageColumns:
+    """
+    Array-backed message history for a conversation.
+    
+    Stores roles as one byte each and timestamps as packed doubles, keeping only
+    the content strings as Python objects. Messages are materialized on access,
+    so it behaves like a read-only list of Message objects with append/extend.
+    """
+    
+    __slots__ = ("_roles", "_timestamps", "_contents")
+    
+    def __init__(self, messages: Iterable[Message] = ()):
+        """
+        Initialize the columns.
+        
+        Args:
+            messages: Initial messages
+        """
+        self._roles = array('B')
+        self._timestamps = array('d')
+        self._contents: List[str] = []
+        self.extend(messages)
+    
+    def append(self, message: Message) -> None:
+        """
+        Append a message.
+        
+        Args:
+            message: The message to append
+        """
+        self._roles.append(_ROLE_CODES[message.role])
+        self._timestamps.append(message.ts)
+        self._contents.append(message.content)
+    
+    def extend(self, messages: Iterable[Message]) -> None:
+        """
+        Append several messages.
+        
+        Args:
+            messages: The messages to append
+        """
+        for message in messages:
+            self.append(message)
+    
+    def pop(self, index: int = -1) -> Message:
+        """
+        Remove and return a message.
+        
+        Args:
+            index: Position of the message (the last one by default)
+        
+        Returns:
+            The removed message
+        """
+        message = self[index]
+        self._roles.pop(index)
+        self._timestamps.pop(index)
+        self._contents.pop(index)
+        return message
+    
+    def _message_at(self, index: int) -> Message:
+        return Message(_ROLE_TABLE[self._roles[index]], self._contents[index], self._timestamps[index])
+    
+    def __len__(self) -> int:
+        return len(self._contents)
+    
+    def __getitem__(self, index: Union[int, slice]) -> Union[Message, List[Message]]:
+        if isinstance(index, slice):
+            return [self._message_at(i) for i in range(*index.indices(len(self)))]
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError("message index out of range")
+        return self._message_at(index)
+    
+    def __iter__(self) -> Iterator[Message]:
+        for i in range(len(self)):
+            yield self._message_at(i)
 
 
 class Conversation:
@@ -61,38 +214,215 @@ class Conversation:
     Represents a conversation between a user and the chatbot.
     """
     
-    def __init__(self, id: Optional[str] = None, user_id: Optional[str] = None):
+    def __init__(
+        self,
+        id: Optional[str] = None,
+        user_id: Optional[str] = None,
+        bot_id: Optional[str] = None,
+        metadata: Optional[Dict[str, Any]] = None,
+        columnar: Optional[bool] = None
+    ):
         """
         Initialize a conversation.
         
         Args:
             id: The ID of the conversation
             user_id: The ID of the user
+            bot_id: The ID of the bot the conversation is with, if any
+            metadata: Additional conversation data (e.g. the bot's system prompt)
+            columnar: Keep messages in array-backed columns (defaults to CONVERSATION_COLUMNAR)
         """
         self.id = id or str(uuid.uuid4())
         self.user_id = user_id
-        self.messages: List[Message] = []
+        self.bot_id = bot_id
+        self.metadata: Dict[str, Any] = metadata or {}
+        self.columnar = CONVERSATION_COLUMNAR if columnar is None else columnar
+        self._messages: Optional[List[Message]] = None
+        self._token_counts = array('I')
+        self._token_total = 0
+        self._set_history([])
+        # Number of earliest messages left out of `messages` (a load of the recent tail only);
+        # summary_upto and summarized_tokens always count from the first message
+        self.message_offset = 0
+        self._store = None
         self.created_at = datetime.now()
         self.updated_at = self.created_at
         self.questionnaire: Optional[Dict[str, Any]] = None
         self.original_message: Optional[str] = None
+        # (summary text, number of leading messages it covers, tokens of those messages),
+        # replaced as a whole so readers never see a half-applied summary
+        self._summary_state = (None, 0, 0)
+    
+    @property
+    def messages(self) -> List[Message]:
+        """
+        The message history, loaded from the backing store on first access.
+        """
+        if self._messages is None:
+            self._set_history(self._store.load_messages(self.id) if self._store else [])
+        return self._messages
+    
+    @messages.setter
+    def messages(self, messages: List[Message]) -> None:
+        self._set_history(messages)
+    
+    def _set_history(self, messages: Iterable[Message]) -> None:
+        """Replace the in-memory history and recount its tokens."""
+        self._messages = MessageColumns(messages) if self.columnar else list(messages)
+        self._token_counts = array('I', (message_tokens(message.content) for message in self._messages))
+        self._token_total = sum(self._token_counts)
+    
+    @property
+    def message_token_counts(self) -> "array[int]":
+        """
+        Estimated tokens of each message, maintained incrementally as messages are added.
+        """
+        self.messages
+        return self._token_counts
     
-    def add_message(self, role: str, content: str) -> Message:
+    @property
+    def token_count(self) -> int:
+        """
+        Estimated tokens of the whole message history.
+        """
+        self.messages
+        return self._token_total
+    
+    @property
+    def message_count(self) -> int:
+        """
+        Number of messages in the conversation, including any left out of `messages`.
+        """
+        return self.message_offset + len(self.messages)
+    
+    @property
+    def messages_loaded(self) -> bool:
+        """
+        Whether the message history is resident in memory.
+        """
+        return self._messages is not None
+    
+    def bind_store(self, store: Any, lazy: bool = False) -> None:
+        """
+        Attach a conversation store that new messages are appended to.
+        
+        Args:
+            store: The ConversationStore backing this conversation
+            lazy: Drop the in-memory history and load it from the store on demand
+        """
+        self._store = store
+        if lazy:
+            self._messages = None
+    
+    @property
+    def summary(self) -> Optional[str]:
+        """
+        Rolling summary of the oldest messages, if one has been computed.
+        """
+        return self._summary_state[0]
+    
+    @property
+    def summary_upto(self) -> int:
+        """
+        Number of leading messages covered by the summary.
+        """
+        return self._summary_state[1]
+    
+    @property
+    def summarized_tokens(self) -> int:
+        """
+        Estimated tokens of the messages covered by the summary.
+        """
+        return self._summary_state[2]
+    
+    @property
+    def unsummarized_tokens(self) -> int:
+        """
+        Estimated tokens of the messages not covered by the summary.
+        """
+        if self.message_offset:
+            return sum(self.message_token_counts[max(0, self.summary_upto - self.message_offset):])
+        return self.token_count - self.summarized_tokens
+    
+    def apply_summary(self, summary: str, upto: int, summarized_tokens: Optional[int] = None) -> None:
+        """
+        Replace the rolling summary.
+        
+        Args:
+            summary: Summary of the first `upto` messages
+            upto: Number of leading messages the summary covers
+            summarized_tokens: Tokens of the covered messages (computed if omitted)
+        """
+        if summarized_tokens is None:
+            offset = self.message_offset
+            if upto >= self.summary_upto >= offset:
+                # Extend the current count, so messages left out of `messages` are not needed
+                summarized_tokens = self.summarized_tokens + sum(self.message_token_counts[self.summary_upto - offset:upto - offset])
+            else:
+                summarized_tokens = sum(self.message_token_counts[:upto])
+        self._summary_state = (summary, upto, summarized_tokens)
+    
+    def add_message(self, role: str, content: str, persist: bool = True) -> Message:
         """
         Add a message to the conversation.
         
         Args:
             role: The role of the message sender (user or assistant)
             content: The content of the message
+            persist: Append it to the bound store now; otherwise persist_messages() or
+                discard_message() must follow
             
         Returns:
             The added message
         """
         message = Message(role=role, content=content)
-        self.messages.append(message)
+        # Appending does not require the history to be loaded
+        if self._messages is not None:
+            self._messages.append(message)
+            tokens = message_tokens(content)
+            self._token_counts.append(tokens)
+            self._token_total += tokens
         self.updated_at = datetime.now()
+        if persist:
+            self.persist_messages([message])
         return message
     
+    def persist_messages(self, messages: List[Message]) -> None:
+        """
+        Append messages added with persist=False to the bound store, if any.
+        
+        Args:
+            messages: The messages, in order
+        """
+        if self._store:
+            self._store.append_messages(self.id, messages, self.updated_at)
+    
+    def discard_message(self, message: Message) -> None:
+        """
+        Remove a message added with persist=False from the in-memory history,
+        e.g. a user turn whose reply could not be generated.
+        
+        Args:
+            message: The message returned by add_message
+        """
+        if self._messages is None:
+            return
+        # Messages added meanwhile by concurrent turns stay in place
+        for index in range(len(self._messages) - 1, -1, -1):
+            candidate = self._messages[index]
+            if candidate.ts == message.ts and candidate.content == message.content and candidate.role == message.role:
+                self._messages.pop(index)
+                self._token_total -= self._token_counts.pop(index)
+                return
+    
+    def persist_metadata(self) -> None:
+        """
+        Write the conversation's metadata (e.g. questionnaire state) through to
+        the bound store, if any, so it survives a restart.
+        """
+        if self._store:
+            self._store.save_conversation(self)
+    
     def start_questionnaire(self, template_id: str, original_message: str) -> None:
         """
         Start a questionnaire for prompt enhancement.
@@ -108,6 +438,7 @@ class Conversation:
             "complete": False
         }
         self.original_message = original_message
+        self.persist_metadata()
     
     def complete_questionnaire(self) -> None:
         """
@@ -115,23 +446,49 @@ class Conversation:
         """
         if self.questionnaire:
             self.questionnaire["complete"] = True
+            self.persist_metadata()
     
-    def to_dict(self) -> Dict[str, Any]:
+    def get_context_for_llm(self) -> List[Dict[str, str]]:
+        """
+        Get the full conversation as a chat-completion message list.
+        Use a ContextBuilder to get a token-budgeted window instead.
+        
+        Returns:
+            List of messages, starting with the system prompt if one is set
+        """
+        context = []
+        system_prompt = self.metadata.get("system_prompt")
+        if system_prompt:
+            context.append({"role": "system", "content": system_prompt})
+        context.extend({"role": str(message.role), "content": message.content} for message in self.messages)
+        return context
+    
+    def to_dict(self, include_messages: bool = True) -> Dict[str, Any]:
         """
         Convert the conversation to a dictionary.
         
+        Args:
+            include_messages: Whether to include the message history
+        
         Returns:
             Dictionary representation of the conversation
         """
-        return {
+        data = {
             "id": self.id,
             "userId": self.user_id,
-            "messages": [message.to_dict() for message in self.messages],
+            "botId": self.bot_id,
+            "metadata": self.metadata,
             "createdAt": self.created_at.isoformat(),
             "updatedAt": self.updated_at.isoformat(),
             "questionnaire": self.questionnaire,
-            "originalMessage": self.original_message
+            "originalMessage": self.original_message,
+            "summary": self.summary,
+            "summaryUpto": self.summary_upto,
+            "summaryTokens": self.summarized_tokens
         }
+        if include_messages:
+            data["messages"] = [message.to_dict() for message in self.messages]
+        return data
     
     @classmethod
     def from_dict(cls, data: Dict[str, Any]) -> 'Conversation':
@@ -146,7 +503,9 @@ class Conversation:
         """
         conversation = cls(
             id=data.get("id"),
-            user_id=data.get("userId")
+            user_id=data.get("userId"),
+            bot_id=data.get("botId"),
+            metadata=data.get("metadata")
         )
         
         conversation.messages = [Message.from_dict(message_data) for message_data in data.get("messages", [])]
@@ -154,20 +513,133 @@ class Conversation:
         conversation.updated_at = datetime.fromisoformat(data["updatedAt"]) if "updatedAt" in data else datetime.now()
         conversation.questionnaire = data.get("questionnaire")
         conversation.original_message = data.get("originalMessage")
+        if data.get("summary"):
+            conversation.apply_summary(data["summary"], data.get("summaryUpto", 0), data.get("summaryTokens"))
         
         return conversation
+    
+    def save(self, directory: str) -> str:
+        """
+        Save the conversation to a JSON file.
+        
+        Args:
+            directory: Directory to save the conversation in
+        
+        Returns:
+            Path to the saved file
+        """
+        os.makedirs(directory, exist_ok=True)
+        file_path = os.path.join(directory, f"{self.id}.json")
+        
+        with open(file_path, 'w') as f:
+            json.dump(self.to_dict(), f, indent=2)
+        
+        return file_path
+    
+    @classmethod
+    def load(cls, file_path: str) -> 'Conversation':
+        """
+        Load a conversation from a JSON file.
+        
+        Args:
+            file_path: Path to the JSON file
+        
+        Returns:
+            Conversation object
+        """
+        with open(file_path, 'r') as f:
+            data = json.load(f)
+        
+        return cls.from_dict(data)
+    
+    @classmethod
+    def list_conversations(cls, directory: str, bot_id: Optional[str] = None, user_id: Optional[str] = None) -> List['Conversation']:
+        """
+        List the conversations saved in a directory.
+        
+        Args:
+            directory: Directory containing conversation JSON files
+            bot_id: Optional bot ID to filter by
+            user_id: Optional user ID to filter by
+        
+        Returns:
+            List of conversations
+        """
+        conversations = []
+        
+        if not os.path.exists(directory):
+            return conversations
+        
+        for filename in os.listdir(directory):
+            if filename.endswith('.json'):
+                file_path = os.path.join(directory, filename)
+                try:
+                    conversation = cls.load(file_path)
+                except Exception as e:
+                    logger.error(f"Error loading conversation from {file_path}: {e}")
+                    continue
+                if bot_id and conversation.bot_id and conversation.bot_id != bot_id:
+                    continue
+                if user_id and conversation.user_id != user_id:
+                    continue
+                conversations.append(conversation)
+        
+        return conversations
 
 
 class ConversationManager:
     """
     Manages conversations for the chatbot.
+    
+    Conversations are persisted in a ConversationStore. The most recently used
+    conversations stay resident in memory (LRU); others are reloaded from the
+    store on demand with their message history loaded lazily.
     """
     
-    def __init__(self):
+    def __init__(self, store: Any = None, max_resident: int = None):
         """
         Initialize the conversation manager.
+        
+        Args:
+            store: ConversationStore to persist conversations in (configured default, created on first use, if omitted)
+            max_resident: Maximum number of conversations kept in memory
+        """
+        self._store = store
+        self.max_resident = max_resident or CONVERSATION_CACHE_SIZE
+        self.conversations: "OrderedDict[str, Conversation]" = OrderedDict()
+        self._lock = threading.RLock()
+    
+    @property
+    def store(self) -> Any:
         """
-        self.conversations: Dict[str, Conversation] = {}
+        Get the conversation store. The configured default is created on first
+        use rather than at import, since conversation_store imports this module.
+        """
+        if self._store is None:
+            with self._lock:
+                if self._store is None:
+                    from conversation_store import create_conversation_store
+                    self._store = create_conversation_store()
+        return self._store
+    
+    def _make_resident(self, conversation: Conversation) -> Conversation:
+        """
+        Insert a conversation into the resident set, evicting the least recently used.
+        
+        Args:
+            conversation: The conversation to keep in memory
+        
+        Returns:
+            The conversation
+        """
+        with self._lock:
+            self.conversations[conversation.id] = conversation
+            self.conversations.move_to_end(conversation.id)
+            while len(self.conversations) > self.max_resident:
+                _, evicted = self.conversations.popitem(last=False)
+                # Messages are written through on add, so only metadata needs flushing
+                self.store.save_conversation(evicted)
+        return conversation
     
     def get_conversation(self, conversation_id: str) -> Optional[Conversation]:
         """
@@ -179,7 +651,18 @@ class ConversationManager:
         Returns:
             The conversation or None if not found
         """
-        return self.conversations.get(conversation_id)
+        with self._lock:
+            conversation = self.conversations.get(conversation_id)
+            if conversation is not None:
+                self.conversations.move_to_end(conversation_id)
+                return conversation
+        
+        conversation = self.store.load_conversation(conversation_id)
+        if conversation is None:
+            return None
+        
+        conversation.bind_store(self.store, lazy=True)
+        return self._make_resident(conversation)
     
     def get_or_create_conversation(self, user_id: Optional[str] = None, conversation_id: Optional[str] = None) -> Conversation:
         """
@@ -192,12 +675,25 @@ class ConversationManager:
         Returns:
             The conversation
         """
-        if conversation_id and conversation_id in self.conversations:
-            return self.conversations[conversation_id]
+        if conversation_id:
+            conversation = self.get_conversation(conversation_id)
+            if conversation is not None:
+                return conversation
         
         conversation = Conversation(id=conversation_id, user_id=user_id)
-        self.conversations[conversation.id] = conversation
-        return conversation
+        self.store.save_conversation(conversation)
+        conversation.bind_store(self.store)
+        return self._make_resident(conversation)
+    
+    def save_conversation(self, conversation: Conversation) -> None:
+        """
+        Persist conversation metadata (questionnaire state, original message).
+        Messages are persisted as they are added.
+        
+        Args:
+            conversation: The conversation to save
+        """
+        self.store.save_conversation(conversation)
     
     def get_user_conversations(self, user_id: str) -> List[Conversation]:
         """
@@ -209,7 +705,12 @@ class ConversationManager:
         Returns:
             List of conversations
         """
-        return [conversation for conversation in self.conversations.values() if conversation.user_id == user_id]
+        conversations = []
+        for conversation_id in self.store.list_conversation_ids(user_id):
+            conversation = self.get_conversation(conversation_id)
+            if conversation is not None:
+                conversations.append(conversation)
+        return conversations
     
     def delete_conversation(self, conversation_id: str) -> bool:
         """
@@ -221,10 +722,9 @@ class ConversationManager:
         Returns:
             True if the conversation was deleted, False otherwise
         """
-        if conversation_id in self.conversations:
-            del self.conversations[conversation_id]
-            return True
-        return False
+        with self._lock:
+            self.conversations.pop(conversation_id, None)
+        return self.store.delete_conversation(conversation_id)
 
 
 # Initialize the conversation manager
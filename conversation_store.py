@@ -0,0 +1,836 @@
+"""
+Persistent storage backends for conversations.
+"""
+
+import os
+import re
+import copy
+import json
+import sqlite3
+import logging
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from typing import Dict, List, Any, Optional, Tuple
+
+from conversation import Conversation, Message
+
+logger = logging.getLogger(__name__)
+
+# Storage configuration
+CONVERSATION_STORE = os.getenv("CONVERSATION_STORE", "sqlite").lower()
+CONVERSATION_DB_PATH = os.getenv("CONVERSATION_DB_PATH", os.path.join("data", "conversations.db"))
+CONVERSATION_LOG_DIR = os.getenv("CONVERSATION_LOG_DIR", os.path.join("data", "conversations"))
+# Rewrite a conversation log once this many superseded metadata/summary records accumulate
+CONVERSATION_LOG_COMPACT_RECORDS = int(os.getenv("CONVERSATION_LOG_COMPACT_RECORDS", "32"))
+# Conversation headers (metadata, summary and message count) kept in memory, so a
+# turn reads only the end of its log
+CONVERSATION_LOG_CACHED_HEADERS = int(os.getenv("CONVERSATION_LOG_CACHED_HEADERS", "10000"))
+# Latest messages loaded for a turn of a conversation without a rolling summary
+CONVERSATION_RECENT_MESSAGES = int(os.getenv("CONVERSATION_RECENT_MESSAGES", "200"))
+
+# Bytes read per step when scanning a log backwards for its last messages
+_TAIL_BLOCK_SIZE = 64 * 1024
+
+# Conversation IDs double as file names, so they are restricted to a safe alphabet
+_CONVERSATION_ID = re.compile(r"[A-Za-z0-9_-]{1,64}")
+
+
+def is_valid_conversation_id(conversation_id: Any) -> bool:
+    """
+    Check that a conversation ID is safe to use, e.g. as a file name.
+    
+    Args:
+        conversation_id: The ID to check (typically supplied by a client)
+    
+    Returns:
+        True if the ID is 1-64 letters, digits, underscores or hyphens
+    """
+    return isinstance(conversation_id, str) and _CONVERSATION_ID.fullmatch(conversation_id) is not None
+
+
+class ConversationStore:
+    """
+    Interface for conversation storage backends.
+    
+    Conversation metadata is upserted, while messages are only ever appended.
+    Message history is loaded separately from metadata so that it can be
+    fetched lazily.
+    """
+    
+    def save_conversation(self, conversation: Conversation) -> None:
+        """
+        Insert or update the metadata of a conversation.
+        
+        Args:
+            conversation: The conversation to save
+        """
+        raise NotImplementedError
+    
+    def append_messages(self, conversation_id: str, messages: List[Message], updated_at: datetime) -> None:
+        """
+        Append messages to a conversation.
+        
+        Args:
+            conversation_id: The ID of the conversation
+            messages: The new messages, in order
+            updated_at: The new update time of the conversation
+        """
+        raise NotImplementedError
+    
+    def load_conversation(self, conversation_id: str) -> Optional[Conversation]:
+        """
+        Load the metadata of a conversation, without its messages.
+        
+        Args:
+            conversation_id: The ID of the conversation
+        
+        Returns:
+            The conversation or None if not found
+        """
+        raise NotImplementedError
+    
+    def load_messages(self, conversation_id: str) -> List[Message]:
+        """
+        Load the full message history of a conversation.
+        
+        Args:
+            conversation_id: The ID of the conversation
+        
+        Returns:
+            List of messages, oldest first
+        """
+        raise NotImplementedError
+    
+    def list_conversation_ids(self, user_id: str) -> List[str]:
+        """
+        List the IDs of all conversations of a user.
+        
+        Args:
+            user_id: The ID of the user
+        
+        Returns:
+            Conversation IDs, oldest first
+        """
+        raise NotImplementedError
+    
+    def delete_conversation(self, conversation_id: str) -> bool:
+        """
+        Delete a conversation and its messages.
+        
+        Args:
+            conversation_id: The ID of the conversation
+        
+        Returns:
+            True if the conversation was deleted, False otherwise
+        """
+        raise NotImplementedError
+
+
+class InMemoryConversationStore(ConversationStore):
+    """
+    Process-local store. History is lost on restart; intended for tests and development.
+    """
+    
+    def __init__(self):
+        """
+        Initialize the in-memory store.
+        """
+        self._conversations: Dict[str, Dict[str, Any]] = {}
+        self._messages: Dict[str, List[Message]] = {}
+        self._user_index: Dict[str, List[str]] = {}
+        self._lock = threading.Lock()
+    
+    def save_conversation(self, conversation: Conversation) -> None:
+        data = conversation.to_dict(include_messages=False)
+        with self._lock:
+            if conversation.id not in self._conversations:
+                self._messages[conversation.id] = []
+                self._user_index.setdefault(conversation.user_id, []).append(conversation.id)
+            self._conversations[conversation.id] = data
+    
+    def append_messages(self, conversation_id: str, messages: List[Message], updated_at: datetime) -> None:
+        with self._lock:
+            self._messages.setdefault(conversation_id, []).extend(messages)
+            if conversation_id in self._conversations:
+                self._conversations[conversation_id]["updatedAt"] = updated_at.isoformat()
+    
+    def load_conversation(self, conversation_id: str) -> Optional[Conversation]:
+        with self._lock:
+            data = self._conversations.get(conversation_id)
+        return Conversation.from_dict(data) if data else None
+    
+    def load_messages(self, conversation_id: str) -> List[Message]:
+        with self._lock:
+            return list(self._messages.get(conversation_id, []))
+    
+    def list_conversation_ids(self, user_id: str) -> List[str]:
+        with self._lock:
+            return list(self._user_index.get(user_id, []))
+    
+    def delete_conversation(self, conversation_id: str) -> bool:
+        with self._lock:
+            data = self._conversations.pop(conversation_id, None)
+            if data is None:
+                return False
+            self._messages.pop(conversation_id, None)
+            user_ids = self._user_index.get(data.get("userId"), [])
+            if conversation_id in user_ids:
+                user_ids.remove(conversation_id)
+            return True
+
+
+class SQLiteConversationStore(ConversationStore):
+    """
+    SQLite-backed store. Messages are stored one row each and only ever inserted,
+    so a turn costs a single small write regardless of history length.
+    """
+    
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS conversations (
+            id TEXT PRIMARY KEY,
+            user_id TEXT,
+            bot_id TEXT,
+            metadata TEXT,
+            created_at REAL NOT NULL,
+            updated_at REAL NOT NULL,
+            questionnaire TEXT,
+            original_message TEXT,
+            summary TEXT,
+            summary_upto INTEGER NOT NULL DEFAULT 0,
+            summary_tokens INTEGER NOT NULL DEFAULT 0
+        );
+        CREATE INDEX IF NOT EXISTS idx_conversations_user ON conversations (user_id, created_at);
+        CREATE TABLE IF NOT EXISTS messages (
+            id INTEGER PRIMARY KEY,
+            conversation_id TEXT NOT NULL,
+            role TEXT NOT NULL,
+            content TEXT NOT NULL,
+            timestamp REAL NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS idx_messages_conversation ON messages (conversation_id, id);
+    """
+    
+    def __init__(self, db_path: str = None):
+        """
+        Initialize the SQLite store. The database is opened on first use.
+        
+        Args:
+            db_path: Path to the SQLite database file
+        """
+        self.db_path = db_path or CONVERSATION_DB_PATH
+        self._connection: Optional[sqlite3.Connection] = None
+        self._lock = threading.RLock()
+    
+    def _connect(self) -> sqlite3.Connection:
+        """Open the database and create the schema if needed."""
+        if self._connection is None:
+            directory = os.path.dirname(self.db_path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            connection = sqlite3.connect(self.db_path, check_same_thread=False)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            connection.executescript(self.SCHEMA)
+            self._migrate(connection)
+            self._connection = connection
+            logger.info(f"Conversation store opened: {self.db_path}")
+        return self._connection
+    
+    def _migrate(self, connection: sqlite3.Connection) -> None:
+        """Add columns introduced after a database was created."""
+        columns = {row[1] for row in connection.execute("PRAGMA table_info(conversations)")}
+        with connection:
+            if "summary" not in columns:
+                connection.execute("ALTER TABLE conversations ADD COLUMN summary TEXT")
+                connection.execute("ALTER TABLE conversations ADD COLUMN summary_upto INTEGER NOT NULL DEFAULT 0")
+                connection.execute("ALTER TABLE conversations ADD COLUMN summary_tokens INTEGER NOT NULL DEFAULT 0")
+            if "bot_id" not in columns:
+                connection.execute("ALTER TABLE conversations ADD COLUMN bot_id TEXT")
+                connection.execute("ALTER TABLE conversations ADD COLUMN metadata TEXT")
+    
+    def save_conversation(self, conversation: Conversation) -> None:
+        questionnaire = json.dumps(conversation.questionnaire) if conversation.questionnaire is not None else None
+        metadata = json.dumps(conversation.metadata) if conversation.metadata else None
+        with self._lock:
+            connection = self._connect()
+            with connection:
+                connection.execute(
+                    """
+                    INSERT INTO conversations (
+                        id, user_id, bot_id, metadata, created_at, updated_at, questionnaire, original_message,
+                        summary, summary_upto, summary_tokens
+                    )
+                    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+                    ON CONFLICT(id) DO UPDATE SET
+                        user_id = excluded.user_id,
+                        bot_id = excluded.bot_id,
+                        metadata = excluded.metadata,
+                        updated_at = excluded.updated_at,
+                        questionnaire = excluded.questionnaire,
+                        original_message = excluded.original_message,
+                        summary = excluded.summary,
+                        summary_upto = excluded.summary_upto,
+                        summary_tokens = excluded.summary_tokens
+                    """,
+                    (
+                        conversation.id,
+                        conversation.user_id,
+                        conversation.bot_id,
+                        metadata,
+                        conversation.created_at.timestamp(),
+                        conversation.updated_at.timestamp(),
+                        questionnaire,
+                        conversation.original_message,
+                        conversation.summary,
+                        conversation.summary_upto,
+                        conversation.summarized_tokens
+                    )
+                )
+    
+    def append_messages(self, conversation_id: str, messages: List[Message], updated_at: datetime) -> None:
+        rows = [
+            (conversation_id, str(message.role), message.content, message.ts)
+            for message in messages
+        ]
+        with self._lock:
+            connection = self._connect()
+            with connection:
+                connection.executemany(
+                    "INSERT INTO messages (conversation_id, role, content, timestamp) VALUES (?, ?, ?, ?)",
+                    rows
+                )
+                connection.execute(
+                    "UPDATE conversations SET updated_at = ? WHERE id = ?",
+                    (updated_at.timestamp(), conversation_id)
+                )
+    
+    def load_conversation(self, conversation_id: str) -> Optional[Conversation]:
+        with self._lock:
+            row = self._connect().execute(
+                """
+                SELECT id, user_id, bot_id, metadata, created_at, updated_at, questionnaire, original_message,
+                       summary, summary_upto, summary_tokens
+                FROM conversations WHERE id = ?
+                """,
+                (conversation_id,)
+            ).fetchone()
+        
+        if not row:
+            return None
+        
+        conversation = Conversation(id=row[0], user_id=row[1], bot_id=row[2], metadata=json.loads(row[3]) if row[3] else None)
+        conversation.created_at = datetime.fromtimestamp(row[4])
+        conversation.updated_at = datetime.fromtimestamp(row[5])
+        conversation.questionnaire = json.loads(row[6]) if row[6] is not None else None
+        conversation.original_message = row[7]
+        if row[8]:
+            conversation.apply_summary(row[8], row[9], row[10])
+        return conversation
+    
+    def load_messages(self, conversation_id: str) -> List[Message]:
+        with self._lock:
+            rows = self._connect().execute(
+                "SELECT role, content, timestamp FROM messages WHERE conversation_id = ? ORDER BY id",
+                (conversation_id,)
+            ).fetchall()
+        return [Message(role=role, content=content, timestamp=timestamp) for role, content, timestamp in rows]
+    
+    def list_conversation_ids(self, user_id: str) -> List[str]:
+        with self._lock:
+            rows = self._connect().execute(
+                "SELECT id FROM conversations WHERE user_id = ? ORDER BY created_at",
+                (user_id,)
+            ).fetchall()
+        return [row[0] for row in rows]
+    
+    def delete_conversation(self, conversation_id: str) -> bool:
+        with self._lock:
+            connection = self._connect()
+            with connection:
+                deleted = connection.execute("DELETE FROM conversations WHERE id = ?", (conversation_id,)).rowcount
+                connection.execute("DELETE FROM messages WHERE conversation_id = ?", (conversation_id,))
+        return deleted > 0
+    
+    def close(self) -> None:
+        """Close the database connection."""
+        with self._lock:
+            if self._connection is not None:
+                self._connection.close()
+                self._connection = None
+
+
+class JSONLConversationStore(ConversationStore):
+    """
+    Append-only store with one JSON Lines log per conversation in a directory.
+    
+    Each line of <id>.jsonl is one record:
+        {"type": "meta", ...}     - conversation metadata (the latest one wins)
+        {"type": "message", ...}  - one message, in order
+        {"type": "summary", ...}  - rolling summary (the latest one wins)
+    
+    A turn appends only its new message lines, so write cost does not grow
+    with history length. Superseded meta and summary records are dropped by
+    compaction, which atomically rewrites a log on a background thread once
+    enough accumulate. A torn last line left by a crash mid-append is
+    skipped on load.
+    
+    The latest metadata, summary and message count of each conversation are
+    kept in memory after its log was first replayed, so load_recent() reads
+    only the messages the summary does not cover from the end of the log.
+    
+    Whole-file JSON conversations (Conversation.save) found in the directory
+    are converted to logs on first load.
+    """
+    
+    LOG_SUFFIX = ".jsonl"
+    LEGACY_SUFFIX = ".json"
+    
+    def __init__(self, directory: str = None, compact_records: int = None):
+        """
+        Initialize the log store.
+        
+        Args:
+            directory: Directory holding the conversation logs
+            compact_records: Superseded records that trigger a compaction
+        """
+        self.directory = directory or CONVERSATION_LOG_DIR
+        self.compact_records = compact_records or CONVERSATION_LOG_COMPACT_RECORDS
+        self._superseded: Dict[str, int] = {}
+        # id -> [metadata as in a meta record, message count, log size]; a log
+        # whose size differs (written by another process) is replayed again
+        self._headers: "OrderedDict[str, list]" = OrderedDict()
+        self._compacting = set()
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._lock = threading.RLock()
+        self._metrics = {"appends": 0, "bytesAppended": 0, "compactions": 0, "fullReads": 0, "tailReads": 0}
+        os.makedirs(self.directory, exist_ok=True)
+    
+    def _path(self, conversation_id: str, suffix: str = LOG_SUFFIX) -> str:
+        if not is_valid_conversation_id(conversation_id):
+            raise ValueError(f"Invalid conversation ID: {conversation_id!r}")
+        return os.path.join(self.directory, f"{conversation_id}{suffix}")
+    
+    def _inside(self, path: str) -> bool:
+        """Whether a path resolves (following symlinks) to a file inside the store directory."""
+        directory = os.path.realpath(self.directory)
+        return os.path.commonpath([directory, os.path.realpath(path)]) == directory
+    
+    @staticmethod
+    def _meta_record(conversation: Conversation) -> Dict[str, Any]:
+        return {"type": "meta", **conversation.to_dict(include_messages=False)}
+    
+    @staticmethod
+    def _message_record(message: Message) -> Dict[str, Any]:
+        return {"type": "message", "role": str(message.role), "content": message.content, "ts": message.ts}
+    
+    @staticmethod
+    def _summary_record(summary: str, upto: int, summary_tokens: int) -> Dict[str, Any]:
+        return {"type": "summary", "summary": summary, "upto": upto, "tokens": summary_tokens}
+    
+    def _append(self, conversation_id: str, records: List[Dict[str, Any]]) -> None:
+        """Append records to a conversation log."""
+        data = "".join(json.dumps(record, ensure_ascii=False) + "\n" for record in records)
+        with self._lock:
+            with open(self._path(conversation_id), 'a', encoding='utf-8') as f:
+                f.write(data)
+                size = f.tell()
+            header = self._headers.get(conversation_id)
+            if header is not None:
+                header[2] = size
+            self._metrics["appends"] += 1
+            self._metrics["bytesAppended"] += len(data)
+    
+    def _supersede(self, conversation_id: str) -> None:
+        """Count a superseded record and schedule a compaction when enough accumulate."""
+        with self._lock:
+            superseded = self._superseded.get(conversation_id, 0) + 1
+            self._superseded[conversation_id] = superseded
+            if superseded < self.compact_records or conversation_id in self._compacting:
+                return
+            self._compacting.add(conversation_id)
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="log-compaction")
+        self._executor.submit(self._compact_in_background, conversation_id)
+    
+    def _compact_in_background(self, conversation_id: str) -> None:
+        try:
+            self.compact(conversation_id)
+        except Exception as e:
+            logger.error(f"Error compacting conversation log {conversation_id}: {e}")
+        finally:
+            with self._lock:
+                self._compacting.discard(conversation_id)
+    
+    def _log_size(self, conversation_id: str) -> Optional[int]:
+        try:
+            return os.path.getsize(self._path(conversation_id))
+        except OSError:
+            return None
+    
+    def _set_header(self, conversation_id: str, meta: Dict[str, Any], count: int) -> None:
+        """Cache a conversation's header as of its log's current size (caller holds the lock)."""
+        self._headers[conversation_id] = [meta, count, os.path.getsize(self._path(conversation_id))]
+        self._headers.move_to_end(conversation_id)
+        while len(self._headers) > CONVERSATION_LOG_CACHED_HEADERS:
+            self._headers.popitem(last=False)
+    
+    def save_conversation(self, conversation: Conversation) -> None:
+        with self._lock:
+            exists = os.path.exists(self._path(conversation.id))
+            record = self._meta_record(conversation)
+            self._append(conversation.id, [record])
+            if not exists:
+                self._set_header(conversation.id, record, 0)
+                return
+            header = self._headers.get(conversation.id)
+            if header is not None:
+                header[0] = record
+            self._supersede(conversation.id)
+    
+    def append_messages(self, conversation_id: str, messages: List[Message], updated_at: datetime) -> None:
+        # updatedAt is recovered from the last message timestamp on load
+        with self._lock:
+            self._append(conversation_id, [self._message_record(message) for message in messages])
+            header = self._headers.get(conversation_id)
+            if header is not None:
+                header[0] = {**header[0], "updatedAt": updated_at.isoformat()}
+                header[1] += len(messages)
+    
+    def save_summary(self, conversation_id: str, summary: str, upto: int, summary_tokens: int) -> None:
+        """
+        Record a new rolling summary of a conversation.
+        
+        Args:
+            conversation_id: The ID of the conversation
+            summary: Summary of the first `upto` messages
+            upto: Number of leading messages the summary covers
+            summary_tokens: Tokens of the covered messages
+        """
+        with self._lock:
+            if not os.path.exists(self._path(conversation_id)):
+                return
+            self._append(conversation_id, [self._summary_record(summary, upto, summary_tokens)])
+            header = self._headers.get(conversation_id)
+            if header is not None:
+                header[0] = {**header[0], "summary": summary, "summaryUpto": upto, "summaryTokens": summary_tokens}
+            self._supersede(conversation_id)
+    
+    def _read(self, conversation_id: str) -> Optional[Conversation]:
+        """Replay a conversation log (converting a legacy JSON file if needed)."""
+        path = self._path(conversation_id)
+        if not os.path.exists(path):
+            legacy_path = self._path(conversation_id, self.LEGACY_SUFFIX)
+            if not os.path.exists(legacy_path):
+                return None
+            if not self._inside(legacy_path):
+                logger.warning(f"Not converting conversation {conversation_id}: {legacy_path} is outside {self.directory}")
+                return None
+            conversation = Conversation.load(legacy_path)
+            # Keyed by the file name it was found under, whatever ID the file holds
+            conversation.id = conversation_id
+            self._write(conversation_id, conversation)
+            os.remove(legacy_path)
+            logger.info(f"Converted conversation {conversation_id} to an append-only log")
+            self._set_header(conversation_id, self._meta_record(conversation), len(conversation.messages))
+            return conversation
+        
+        conversation, superseded, unreadable = self._replay(path)
+        self._metrics["fullReads"] += 1
+        if conversation is None:
+            return None
+        self._superseded[conversation_id] = superseded
+        if unreadable:
+            # Rewrite so that the next append does not land on a torn line
+            self._write(conversation_id, conversation)
+        self._set_header(conversation_id, self._meta_record(conversation), len(conversation.messages))
+        return conversation
+    
+    def _replay(self, path: str, end: Optional[int] = None) -> Tuple[Optional[Conversation], int, int]:
+        """
+        Replay a conversation log.
+        
+        Args:
+            path: Path of the log
+            end: Replay only the first `end` bytes
+        
+        Returns:
+            The conversation (None without metadata), and the numbers of superseded and unreadable records
+        """
+        conversation = None
+        messages = []
+        summary = None
+        superseded = 0
+        unreadable = 0
+        with open(path, 'rb') as f:
+            for line in (f if end is None else f.read(end).splitlines()):
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    logger.warning(f"Skipping unreadable record in conversation log {path}")
+                    unreadable += 1
+                    continue
+                kind = record.pop("type", None)
+                if kind == "message":
+                    messages.append(Message(role=record["role"], content=record["content"], timestamp=record["ts"]))
+                elif kind == "meta":
+                    superseded += conversation is not None
+                    conversation = Conversation.from_dict(record)
+                    if record.get("summary"):
+                        superseded += summary is not None
+                        summary = (record["summary"], record.get("summaryUpto", 0), record.get("summaryTokens"))
+                elif kind == "summary":
+                    superseded += summary is not None
+                    summary = (record["summary"], record["upto"], record["tokens"])
+        
+        if conversation is None:
+            logger.warning(f"Conversation log without metadata: {path}")
+            return None, superseded, unreadable
+        conversation.messages = messages
+        if messages:
+            conversation.updated_at = max(conversation.updated_at, messages[-1].timestamp)
+        if summary:
+            conversation.apply_summary(*summary)
+        return conversation, superseded, unreadable
+    
+    def _write(self, conversation_id: str, conversation: Conversation, appended: bytes = b"") -> None:
+        """Atomically replace a conversation's log with its minimal form, followed by `appended` raw records."""
+        records = [self._meta_record(conversation)]
+        records.extend(self._message_record(message) for message in conversation.messages)
+        if conversation.summary:
+            records.append(self._summary_record(conversation.summary, conversation.summary_upto, conversation.summarized_tokens))
+        
+        path = self._path(conversation_id)
+        with open(f"{path}.tmp", 'w', encoding='utf-8') as f:
+            for record in records:
+                f.write(json.dumps(record, ensure_ascii=False) + "\n")
+        if appended:
+            with open(f"{path}.tmp", 'ab') as f:
+                f.write(appended)
+        os.replace(f"{path}.tmp", path)
+        self._superseded[conversation_id] = 0
+    
+    def load_conversation(self, conversation_id: str) -> Optional[Conversation]:
+        """
+        Load a conversation. The log is replayed in one pass, so the message
+        history is included.
+        
+        Args:
+            conversation_id: The ID of the conversation
+        
+        Returns:
+            The conversation or None if not found
+        """
+        with self._lock:
+            return self._read(conversation_id)
+    
+    def load_messages(self, conversation_id: str) -> List[Message]:
+        conversation = self.load_conversation(conversation_id)
+        return list(conversation.messages) if conversation else []
+    
+    def load_recent(self, conversation_id: str, limit: Optional[int] = None) -> Optional[Conversation]:
+        """
+        Load a conversation with only the messages its summary does not cover.
+        Once a log has been replayed, this reads only the end of it.
+        
+        Args:
+            conversation_id: The ID of the conversation
+            limit: Load at most this many of the latest messages
+        
+        Returns:
+            The conversation, whose message_offset counts the messages left out, or None if not found
+        """
+        with self._lock:
+            header = self._headers.get(conversation_id)
+            if header is not None and self._log_size(conversation_id) != header[2]:
+                header = None
+            if header is None:
+                conversation = self._read(conversation_id)
+                if conversation is None:
+                    return None
+                meta, count = self._meta_record(conversation), len(conversation.messages)
+                messages = list(conversation.messages)
+            else:
+                self._headers.move_to_end(conversation_id)
+                meta, count, _ = header
+                messages = None
+            
+            keep = count - (meta.get("summaryUpto", 0) if meta.get("summary") else 0)
+            if limit is not None:
+                keep = min(keep, limit)
+            keep = max(0, keep)
+            if messages is None:
+                messages = self.load_tail(conversation_id, keep) if keep else []
+                self._metrics["tailReads"] += 1
+            else:
+                messages = messages[len(messages) - keep:]
+            meta = copy.deepcopy(meta)
+        
+        conversation = Conversation.from_dict(meta)
+        conversation.messages = messages
+        conversation.message_offset = count - len(messages)
+        return conversation
+    
+    def load_tail(self, conversation_id: str, limit: int) -> List[Message]:
+        """
+        Load the last messages of a conversation without reading the whole log.
+        
+        Args:
+            conversation_id: The ID of the conversation
+            limit: Maximum number of messages
+        
+        Returns:
+            Up to `limit` of the most recent messages, oldest first
+        """
+        with self._lock:
+            if not os.path.exists(self._path(conversation_id)):
+                return self.load_messages(conversation_id)[-limit:] if limit > 0 else []
+            
+            messages = []
+            with open(self._path(conversation_id), 'rb') as f:
+                position = f.seek(0, os.SEEK_END)
+                remainder = b""
+                while position > 0 and len(messages) < limit:
+                    step = min(_TAIL_BLOCK_SIZE, position)
+                    position -= step
+                    f.seek(position)
+                    lines = (f.read(step) + remainder).split(b"\n")
+                    # The first piece may be a partial line unless the start of the file was reached
+                    remainder = lines.pop(0) if position > 0 else b""
+                    for line in reversed(lines):
+                        if len(messages) >= limit:
+                            break
+                        if not line.startswith(b'{"type": "message"'):
+                            continue
+                        try:
+                            record = json.loads(line)
+                        except ValueError:
+                            continue
+                        messages.append(Message(role=record["role"], content=record["content"], timestamp=record["ts"]))
+        messages.reverse()
+        return messages
+    
+    def compact(self, conversation_id: str) -> bool:
+        """
+        Rewrite a conversation log without superseded records. The log is
+        replayed without holding the store lock, so turns can append to it
+        meanwhile; their records are carried over into the rewritten log.
+        
+        Args:
+            conversation_id: The ID of the conversation
+        
+        Returns:
+            True if the log was rewritten, False if it was not found or changed meanwhile
+        """
+        path = self._path(conversation_id)
+        with self._lock:
+            if not os.path.exists(path):
+                # Converts a legacy JSON conversation, if there is one
+                return self._read(conversation_id) is not None
+            replayed = os.stat(path)
+        
+        conversation, _, _ = self._replay(path, replayed.st_size)
+        if conversation is None:
+            return False
+        
+        with self._lock:
+            try:
+                current = os.stat(path)
+            except FileNotFoundError:
+                return False
+            if current.st_ino != replayed.st_ino or current.st_size < replayed.st_size:
+                # Deleted and recreated, or already rewritten
+                return False
+            with open(path, 'rb') as f:
+                f.seek(replayed.st_size)
+                appended = f.read()
+            self._write(conversation_id, conversation, appended)
+            header = self._headers.get(conversation_id)
+            if header is not None:
+                header[2] = os.path.getsize(path)
+            self._metrics["compactions"] += 1
+        logger.info(f"Compacted conversation log {conversation_id}")
+        return True
+    
+    def list_conversations(self, bot_id: Optional[str] = None, user_id: Optional[str] = None) -> List[Conversation]:
+        """
+        Load all conversations in the directory.
+        
+        Args:
+            bot_id: Optional bot ID to filter by
+            user_id: Optional user ID to filter by
+        
+        Returns:
+            List of conversations
+        """
+        conversations = []
+        for conversation_id in self._conversation_ids():
+            try:
+                conversation = self.load_conversation(conversation_id)
+            except Exception as e:
+                logger.error(f"Error loading conversation {conversation_id}: {e}")
+                continue
+            if conversation is None:
+                continue
+            if bot_id and conversation.bot_id and conversation.bot_id != bot_id:
+                continue
+            if user_id and conversation.user_id != user_id:
+                continue
+            conversations.append(conversation)
+        return conversations
+    
+    def list_conversation_ids(self, user_id: str) -> List[str]:
+        return [conversation.id for conversation in sorted(
+            self.list_conversations(user_id=user_id), key=lambda conversation: conversation.created_at
+        )]
+    
+    def _conversation_ids(self) -> List[str]:
+        ids = set()
+        for filename in os.listdir(self.directory):
+            for suffix in (self.LOG_SUFFIX, self.LEGACY_SUFFIX):
+                if filename.endswith(suffix) and is_valid_conversation_id(filename[:-len(suffix)]):
+                    ids.add(filename[:-len(suffix)])
+        return sorted(ids)
+    
+    def delete_conversation(self, conversation_id: str) -> bool:
+        deleted = False
+        with self._lock:
+            for suffix in (self.LOG_SUFFIX, self.LEGACY_SUFFIX):
+                path = self._path(conversation_id, suffix)
+                if os.path.exists(path) and self._inside(path):
+                    os.remove(path)
+                    deleted = True
+            self._superseded.pop(conversation_id, None)
+            self._headers.pop(conversation_id, None)
+        return deleted
+    
+    def get_metrics(self) -> Dict[str, Any]:
+        """
+        Get log metrics.
+        
+        Returns:
+            Appends, bytes appended, compactions, and full and tail reads so far
+        """
+        with self._lock:
+            return dict(self._metrics)
+
+
+def create_conversation_store(kind: str = None) -> ConversationStore:
+    """
+    Create the configured conversation store.
+    
+    Args:
+        kind: Store type ('sqlite', 'jsonl' or 'memory'), defaults to CONVERSATION_STORE
+    
+    Returns:
+        A conversation store
+    """
+    kind = (kind or CONVERSATION_STORE).lower()
+    if kind == "sqlite":
+        return SQLiteConversationStore()
+    if kind == "jsonl":
+        return JSONLConversationStore()
+    if kind == "memory":
+        return InMemoryConversationStore()
+    raise ValueError(f"Unsupported CONVERSATION_STORE: {kind}. Choose 'sqlite', 'jsonl' or 'memory'.")
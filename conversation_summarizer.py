@@ -0,0 +1,264 @@
+"""
+Background rolling summarization of long conversations.
+"""
+
+import os
+import re
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Any, Callable, Optional
+
+from context_builder import estimate_tokens, message_tokens, CHARS_PER_TOKEN
+
+logger = logging.getLogger(__name__)
+
+# Summarization is opt-in
+SUMMARY_ENABLED = os.getenv("SUMMARY_ENABLED", "false").lower() in ("1", "true", "yes")
+# Summarize once the unsummarized part of a conversation exceeds this many tokens
+SUMMARY_TRIGGER_TOKENS = int(os.getenv("SUMMARY_TRIGGER_TOKENS", "3000"))
+# Number of most recent messages that are always kept verbatim
+SUMMARY_KEEP_RECENT = int(os.getenv("SUMMARY_KEEP_RECENT", "8"))
+# Target size of the rolling summary
+SUMMARY_MAX_TOKENS = int(os.getenv("SUMMARY_MAX_TOKENS", "400"))
+SUMMARY_WORKERS = int(os.getenv("SUMMARY_WORKERS", "2"))
+
+# Summarizer signature: (previous summary or None, messages to fold in, max tokens) -> new summary
+SummarizeFn = Callable[[Optional[str], List[Dict[str, str]], int], str]
+
+_SENTENCE_END = re.compile(r'(?<=[.!?])\s')
+
+
+def extractive_summary(previous: Optional[str], messages: List[Dict[str, str]], max_tokens: int) -> str:
+    """
+    Summarize messages by keeping the first sentence of each, without an LLM call.
+    
+    Args:
+        previous: The previous rolling summary
+        messages: Messages to fold into the summary, oldest first
+        max_tokens: Maximum size of the summary
+    
+    Returns:
+        The new summary; the oldest lines are dropped when it grows too long
+    """
+    lines = previous.split("\n") if previous else []
+    for message in messages:
+        first_sentence = _SENTENCE_END.split(message["content"].strip(), 1)[0][:240]
+        if first_sentence:
+            speaker = "Assistant" if message["role"] == "assistant" else "User"
+            lines.append(f"- {speaker}: {first_sentence}")
+    
+    # Keep the most recent lines that fit
+    kept = []
+    budget = max_tokens * CHARS_PER_TOKEN
+    for line in reversed(lines):
+        budget -= len(line) + 1
+        if budget < 0:
+            break
+        kept.append(line)
+    return "\n".join(reversed(kept))
+
+
+def llm_summarizer(llm_service: Any, model: str = "vicuna-13b") -> SummarizeFn:
+    """
+    Create a summarizer that asks an LLM to update the rolling summary.
+    
+    Args:
+        llm_service: LLMService used for the completion
+        model: Model to summarize with
+    
+    Returns:
+        A summarize function, falling back to extractive summaries on errors
+    """
+    def summarize(previous: Optional[str], messages: List[Dict[str, str]], max_tokens: int) -> str:
+        transcript = "\n".join(f"{message['role']}: {message['content']}" for message in messages)
+        prompt = (
+            f"Current summary:\n{previous or '(none)'}\n\n"
+            f"New conversation turns:\n{transcript}\n\n"
+            f"Update the summary to include the new turns. Keep facts, figures, decisions and open "
+            f"questions. Reply with the summary only, in at most {max_tokens} tokens."
+        )
+        response = llm_service.chat_completion(
+            messages=[
+                {"role": "system", "content": "You maintain concise running summaries of conversations."},
+                {"role": "user", "content": prompt}
+            ],
+            model=model,
+            temperature=0.2,
+            max_tokens=max_tokens
+        )
+        summary = llm_service.extract_assistant_message(response)
+        if not summary or "error" in response:
+            return extractive_summary(previous, messages, max_tokens)
+        return summary.strip()
+    
+    return summarize
+
+
+class ConversationSummarizer:
+    """
+    Compacts older messages of long conversations into a stored rolling summary.
+    
+    Checks are O(1) on the request path (they compare the conversation's
+    running token counts with the trigger); the messages to fold in are
+    copied when a job is scheduled, and the summary itself is computed on a
+    worker pool and applied to the conversation when done.
+    """
+    
+    def __init__(
+        self,
+        summarize_fn: SummarizeFn = None,
+        enabled: bool = None,
+        trigger_tokens: int = None,
+        keep_recent: int = None,
+        max_summary_tokens: int = None,
+        max_workers: int = None
+    ):
+        """
+        Initialize the summarizer.
+        
+        Args:
+            summarize_fn: Function producing the new summary (extractive by default)
+            enabled: Whether summarization runs at all (defaults to SUMMARY_ENABLED)
+            trigger_tokens: Unsummarized tokens that trigger a summary
+            keep_recent: Number of recent messages never folded into the summary
+            max_summary_tokens: Target size of the summary
+            max_workers: Size of the worker pool
+        """
+        self.summarize_fn = summarize_fn or extractive_summary
+        self.enabled = SUMMARY_ENABLED if enabled is None else enabled
+        self.trigger_tokens = trigger_tokens or SUMMARY_TRIGGER_TOKENS
+        self.keep_recent = SUMMARY_KEEP_RECENT if keep_recent is None else keep_recent
+        self.max_summary_tokens = max_summary_tokens or SUMMARY_MAX_TOKENS
+        self.max_workers = max_workers or SUMMARY_WORKERS
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._in_flight = set()
+        self._lock = threading.Lock()
+        self._metrics = {
+            "summaries": 0,
+            "failures": 0,
+            "messagesSummarized": 0,
+            "turns": 0,
+            "historyTokens": 0,
+            "sentTokens": 0
+        }
+    
+    def maybe_schedule(self, conversation: Any, on_complete: Callable[[Any], None] = None) -> bool:
+        """
+        Schedule a background summary if the conversation has grown past the trigger.
+        
+        Args:
+            conversation: The conversation to check
+            on_complete: Called with the conversation after a summary is applied (e.g. to persist it)
+        
+        Returns:
+            True if a summary job was scheduled
+        """
+        if not self.enabled or conversation.unsummarized_tokens < self.trigger_tokens:
+            return False
+        
+        upto = conversation.message_count - self.keep_recent
+        # Messages between the summary and a tail-only load are not in memory to summarize
+        if upto <= conversation.summary_upto or conversation.message_offset > conversation.summary_upto:
+            return False
+        
+        with self._lock:
+            if conversation.id in self._in_flight:
+                return False
+            self._in_flight.add(conversation.id)
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="summarizer")
+        
+        # Snapshot on the calling thread, as request threads keep appending to the history;
+        # the in-flight entry keeps the summary from changing until the job is done
+        previous, start = conversation.summary, conversation.summary_upto
+        offset = conversation.message_offset
+        messages = [
+            {"role": str(message.role), "content": message.content}
+            for message in conversation.messages[start - offset:upto - offset]
+        ]
+        summarized_tokens = conversation.summarized_tokens + sum(conversation.message_token_counts[start - offset:upto - offset])
+        
+        self._executor.submit(self._summarize, conversation, previous, messages, upto, summarized_tokens, on_complete)
+        return True
+    
+    def _summarize(
+        self,
+        conversation: Any,
+        previous: Optional[str],
+        messages: List[Dict[str, str]],
+        upto: int,
+        summarized_tokens: int,
+        on_complete: Optional[Callable[[Any], None]]
+    ) -> None:
+        """Compute and apply a new rolling summary from a message snapshot (runs on the worker pool)."""
+        try:
+            summary = self.summarize_fn(previous, messages, self.max_summary_tokens)
+            conversation.apply_summary(summary, upto, summarized_tokens)
+            
+            with self._lock:
+                self._metrics["summaries"] += 1
+                self._metrics["messagesSummarized"] += len(messages)
+            logger.info(f"Summarized {len(messages)} messages of conversation {conversation.id} ({estimate_tokens(summary)} summary tokens)")
+            
+            if on_complete:
+                on_complete(conversation)
+        except Exception as e:
+            with self._lock:
+                self._metrics["failures"] += 1
+            logger.error(f"Error summarizing conversation {conversation.id}: {e}")
+        finally:
+            with self._lock:
+                self._in_flight.discard(conversation.id)
+    
+    def record_turn(self, conversation: Any, context: Any, system_prompt: Optional[str] = None) -> int:
+        """
+        Record how many prompt tokens a context window saved versus sending the full history.
+        
+        Args:
+            conversation: The conversation the window was built from
+            context: The ContextWindow that was sent
+            system_prompt: The system prompt without any summary
+        
+        Returns:
+            Tokens saved on this turn
+        """
+        # Counted from the summary, as a tail-only load does not hold the earliest messages
+        history_tokens = conversation.summarized_tokens + conversation.unsummarized_tokens + (message_tokens(system_prompt) if system_prompt else 0)
+        saved = max(0, history_tokens - context.token_count)
+        with self._lock:
+            self._metrics["turns"] += 1
+            self._metrics["historyTokens"] += history_tokens
+            self._metrics["sentTokens"] += history_tokens - saved
+        return saved
+    
+    def get_metrics(self) -> Dict[str, Any]:
+        """
+        Get summarization metrics.
+        
+        Returns:
+            Counters plus average tokens saved per turn
+        """
+        with self._lock:
+            metrics = dict(self._metrics)
+            metrics["inFlight"] = len(self._in_flight)
+        saved = metrics["historyTokens"] - metrics["sentTokens"]
+        metrics["tokensSaved"] = saved
+        metrics["tokensSavedPerTurn"] = saved / metrics["turns"] if metrics["turns"] else 0.0
+        return metrics
+    
+    def shutdown(self, wait: bool = True) -> None:
+        """
+        Stop the worker pool.
+        
+        Args:
+            wait: Wait for running summaries to finish
+        """
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor:
+            executor.shutdown(wait=wait)
+
+
+# Shared summarizer (disabled unless SUMMARY_ENABLED is set)
+conversation_summarizer = ConversationSummarizer()
@@ -0,0 +1,278 @@
+"""
+Content-addressed embedding cache and batched embedding pipeline.
+Identical chunks (across knowledge bases and re-ingestions) are embedded once.
+"""
+
+import os
+import time
+import sqlite3
+import hashlib
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Any, Optional
+
+import numpy as np
+
+from embeddings import Embedder
+
+logger = logging.getLogger(__name__)
+
+# Embedding cache configuration
+EMBEDDING_CACHE_ENABLED = os.getenv("EMBEDDING_CACHE_ENABLED", "true").lower() in ("1", "true", "yes")
+EMBEDDING_CACHE_PATH = os.getenv("EMBEDDING_CACHE_PATH", "data/embedding_cache.db")
+EMBEDDING_BATCH_SIZE = int(os.getenv("EMBEDDING_BATCH_SIZE", "64"))
+EMBEDDING_WORKERS = int(os.getenv("EMBEDDING_WORKERS", "4"))
+
+# SQLite limits the number of bound parameters per statement
+_LOOKUP_CHUNK = 500
+
+
+def embedding_key(model_name: str, text: str) -> bytes:
+    """
+    Content address of an embedding.
+    
+    Args:
+        model_name: Name of the embedder
+        text: The embedded text
+    
+    Returns:
+        SHA-256 digest of the model name and text
+    """
+    return hashlib.sha256(f"{model_name}\0{text}".encode("utf-8")).digest()
+
+
+class EmbeddingCache:
+    """
+    SQLite table of float32 embeddings keyed by embedding_key().
+    """
+    
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS embeddings (
+            key BLOB PRIMARY KEY,
+            model TEXT NOT NULL,
+            dim INTEGER NOT NULL,
+            vector BLOB NOT NULL
+        ) WITHOUT ROWID;
+    """
+    
+    def __init__(self, db_path: str = None):
+        """
+        Initialize the cache. The database is opened on first use.
+        
+        Args:
+            db_path: Path to the SQLite database file
+        """
+        self.db_path = db_path or EMBEDDING_CACHE_PATH
+        self._connection: Optional[sqlite3.Connection] = None
+        self._lock = threading.RLock()
+    
+    def _connect(self) -> sqlite3.Connection:
+        """Open the database and create the schema if needed."""
+        if self._connection is None:
+            directory = os.path.dirname(self.db_path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            connection = sqlite3.connect(self.db_path, check_same_thread=False)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            connection.executescript(self.SCHEMA)
+            self._connection = connection
+            logger.info(f"Embedding cache opened: {self.db_path}")
+        return self._connection
+    
+    def get_many(self, keys: List[bytes], dim: int) -> Dict[bytes, np.ndarray]:
+        """
+        Look up cached embeddings.
+        
+        Args:
+            keys: Embedding keys
+            dim: Expected dimension (entries of another dimension are ignored)
+        
+        Returns:
+            Embeddings found, by key
+        """
+        found = {}
+        with self._lock:
+            connection = self._connect()
+            for start in range(0, len(keys), _LOOKUP_CHUNK):
+                chunk = keys[start:start + _LOOKUP_CHUNK]
+                placeholders = ",".join("?" * len(chunk))
+                rows = connection.execute(
+                    f"SELECT key, vector FROM embeddings WHERE dim = ? AND key IN ({placeholders})",
+                    [dim, *chunk]
+                )
+                for key, vector in rows:
+                    found[key] = np.frombuffer(vector, dtype=np.float32)
+        return found
+    
+    def put_many(self, model_name: str, items: Dict[bytes, np.ndarray]) -> None:
+        """
+        Store embeddings.
+        
+        Args:
+            model_name: Name of the embedder
+            items: Embeddings by key
+        """
+        if not items:
+            return
+        with self._lock:
+            connection = self._connect()
+            with connection:
+                connection.executemany(
+                    "INSERT OR REPLACE INTO embeddings (key, model, dim, vector) VALUES (?, ?, ?, ?)",
+                    [
+                        (key, model_name, len(vector), np.ascontiguousarray(vector, dtype=np.float32).tobytes())
+                        for key, vector in items.items()
+                    ]
+                )
+    
+    def count(self) -> int:
+        """
+        Count cached embeddings.
+        
+        Returns:
+            Number of entries
+        """
+        with self._lock:
+            return self._connect().execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+    
+    def close(self) -> None:
+        """
+        Close the database connection.
+        """
+        with self._lock:
+            if self._connection is not None:
+                self._connection.close()
+                self._connection = None
+
+
+class EmbeddingPipeline:
+    """
+    Embeds texts in fixed-size batches on a worker pool, through the cache.
+    
+    Texts are de-duplicated per call, looked up in the cache in bulk, and
+    only the misses are sent to the embedder.
+    """
+    
+    def __init__(
+        self,
+        cache: Optional[EmbeddingCache] = None,
+        batch_size: int = None,
+        max_workers: int = None,
+        use_cache: bool = None
+    ):
+        """
+        Initialize the pipeline.
+        
+        Args:
+            cache: Embedding cache (a shared one at EMBEDDING_CACHE_PATH by default)
+            batch_size: Number of texts per embedder call
+            max_workers: Size of the worker pool
+            use_cache: Whether to use the cache (defaults to EMBEDDING_CACHE_ENABLED)
+        """
+        self.use_cache = EMBEDDING_CACHE_ENABLED if use_cache is None else use_cache
+        self.cache = (cache or EmbeddingCache()) if self.use_cache else None
+        self.batch_size = batch_size or EMBEDDING_BATCH_SIZE
+        self.max_workers = max_workers or EMBEDDING_WORKERS
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._lock = threading.Lock()
+        self._metrics = {
+            "chunks": 0,
+            "cacheHits": 0,
+            "duplicates": 0,
+            "embedded": 0,
+            "batches": 0,
+            "embedSeconds": 0.0,
+            "totalSeconds": 0.0
+        }
+    
+    def embed(self, embedder: Embedder, texts: List[str], stats: Dict[str, Any] = None) -> np.ndarray:
+        """
+        Embed texts, reusing cached embeddings.
+        
+        Args:
+            embedder: The embedder to use for cache misses
+            texts: The texts to embed
+            stats: Optional per-call counters; its "cache_hits" is increased by the texts served from cache
+        
+        Returns:
+            Array of shape (len(texts), embedder.dim), dtype float32
+        """
+        started = time.perf_counter()
+        vectors = np.empty((len(texts), embedder.dim), dtype=np.float32)
+        if not texts:
+            return vectors
+        
+        # Group positions by content address
+        positions: Dict[bytes, List[int]] = {}
+        for i, text in enumerate(texts):
+            positions.setdefault(embedding_key(embedder.name, text), []).append(i)
+        keys = list(positions)
+        
+        cached = self.cache.get_many(keys, embedder.dim) if self.cache else {}
+        for key, vector in cached.items():
+            vectors[positions[key]] = vector
+        
+        missing = [key for key in keys if key not in cached]
+        missing_positions = sum(len(positions[key]) for key in missing)
+        embed_seconds = 0.0
+        if missing:
+            batches = [missing[i:i + self.batch_size] for i in range(0, len(missing), self.batch_size)]
+            embed_started = time.perf_counter()
+            results = self._pool().map(
+                lambda batch: embedder.embed([texts[positions[key][0]] for key in batch]),
+                batches
+            )
+            computed = {}
+            for batch, batch_vectors in zip(batches, results):
+                for key, vector in zip(batch, batch_vectors):
+                    vectors[positions[key]] = vector
+                    computed[key] = vector
+            embed_seconds = time.perf_counter() - embed_started
+            if self.cache:
+                self.cache.put_many(embedder.name, computed)
+        
+        if stats is not None:
+            stats["cache_hits"] = stats.get("cache_hits", 0) + len(texts) - missing_positions
+        with self._lock:
+            self._metrics["chunks"] += len(texts)
+            self._metrics["cacheHits"] += len(cached)
+            self._metrics["duplicates"] += len(texts) - len(keys)
+            self._metrics["embedded"] += len(missing)
+            self._metrics["batches"] += (len(missing) + self.batch_size - 1) // self.batch_size
+            self._metrics["embedSeconds"] += embed_seconds
+            self._metrics["totalSeconds"] += time.perf_counter() - started
+        return vectors
+    
+    def _pool(self) -> ThreadPoolExecutor:
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="embedder")
+            return self._executor
+    
+    def get_metrics(self) -> Dict[str, Any]:
+        """
+        Get pipeline metrics.
+        
+        Returns:
+            Counters plus cache hit rate and chunks/sec throughput
+        """
+        with self._lock:
+            metrics = dict(self._metrics)
+        metrics["cacheHitRate"] = metrics["cacheHits"] / metrics["chunks"] if metrics["chunks"] else 0.0
+        metrics["chunksPerSecond"] = metrics["chunks"] / metrics["totalSeconds"] if metrics["totalSeconds"] else 0.0
+        metrics["embeddedPerSecond"] = metrics["embedded"] / metrics["embedSeconds"] if metrics["embedSeconds"] else 0.0
+        return metrics
+    
+    def shutdown(self, wait: bool = True) -> None:
+        """
+        Stop the worker pool.
+        
+        Args:
+            wait: Wait for running batches to finish
+        """
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor:
+            executor.shutdown(wait=wait)
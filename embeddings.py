@@ -0,0 +1,170 @@
+"""
+Local text embedders for knowledge base retrieval.
+"""
+
+import re
+import zlib
+import logging
+from typing import List
+
+import numpy as np
+
+# Try to import sentence-transformers (optional)
+try:
+    from sentence_transformers import SentenceTransformer
+    SENTENCE_TRANSFORMERS_AVAILABLE = True
+except ImportError:
+    SENTENCE_TRANSFORMERS_AVAILABLE = False
+    SentenceTransformer = None
+
+logger = logging.getLogger(__name__)
+
+HASHING_EMBEDDER_DIM = 384
+
+_TOKEN_PATTERN = re.compile(r"[a-z0-9]+(?:['.-][a-z0-9]+)*")
+
+
+def tokenize(text: str) -> List[str]:
+    """
+    Split text into lowercase word tokens.
+    
+    Args:
+        text: The text to tokenize
+    
+    Returns:
+        List of tokens
+    """
+    return _TOKEN_PATTERN.findall(text.lower())
+
+
+class Embedder:
+    """
+    Interface for text embedders. Embeddings are L2-normalized float32 rows,
+    so cosine similarity is a dot product.
+    """
+    
+    name = "embedder"
+    dim = 0
+    # Whether similarity reflects meaning; lexical embedders match wording only
+    semantic = False
+    
+    def embed(self, texts: List[str]) -> np.ndarray:
+        """
+        Embed a batch of texts.
+        
+        Args:
+            texts: The texts to embed
+        
+        Returns:
+            Array of shape (len(texts), dim), dtype float32
+        """
+        raise NotImplementedError
+    
+    def embed_query(self, text: str) -> np.ndarray:
+        """
+        Embed a single query.
+        
+        Args:
+            text: The query text
+        
+        Returns:
+            Vector of shape (dim,), dtype float32
+        """
+        return self.embed([text])[0]
+
+
+class HashingEmbedder(Embedder):
+    """
+    Dependency-free embedder using signed feature hashing of word unigrams and bigrams.
+    
+    Deterministic across processes (crc32, not Python's salted hash), so vectors
+    can be persisted. Captures lexical overlap rather than deep semantics.
+    """
+    
+    def __init__(self, dim: int = HASHING_EMBEDDER_DIM):
+        """
+        Initialize the hashing embedder.
+        
+        Args:
+            dim: Dimension of the embeddings
+        """
+        self.dim = dim
+        self.name = f"hashing-{dim}"
+    
+    def _features(self, text: str) -> List[str]:
+        tokens = tokenize(text)
+        return tokens + [f"{a} {b}" for a, b in zip(tokens, tokens[1:])]
+    
+    def embed(self, texts: List[str]) -> np.ndarray:
+        vectors = np.zeros((len(texts), self.dim), dtype=np.float32)
+        for row, text in enumerate(texts):
+            hashes = np.fromiter((zlib.crc32(feature.encode("utf-8")) for feature in self._features(text)), dtype=np.uint32)
+            if not hashes.size:
+                continue
+            signs = np.where(hashes & 0x80000000, -1.0, 1.0).astype(np.float32)
+            np.add.at(vectors[row], hashes % self.dim, signs)
+        
+        # Sublinear term frequency, then L2 normalization
+        np.copyto(vectors, np.sign(vectors) * np.log1p(np.abs(vectors)))
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        norms[norms == 0] = 1.0
+        return vectors / norms
+
+
+class SentenceTransformerEmbedder(Embedder):
+    """
+    Embedder backed by a local sentence-transformers model.
+    """
+    
+    semantic = True
+    
+    def __init__(self, model_name: str):
+        """
+        Initialize the sentence-transformers embedder.
+        
+        Args:
+            model_name: Name or path of the model (e.g. all-MiniLM-L6-v2)
+        """
+        if not SENTENCE_TRANSFORMERS_AVAILABLE:
+            raise RuntimeError("sentence-transformers not available. Install with: pip install sentence-transformers")
+        self.model = SentenceTransformer(model_name)
+        self.dim = self.model.get_sentence_embedding_dimension()
+        self.name = model_name
+    
+    def embed(self, texts: List[str]) -> np.ndarray:
+        vectors = self.model.encode(texts, convert_to_numpy=True, normalize_embeddings=True)
+        return vectors.astype(np.float32, copy=False)
+
+
+_embedders = {}
+
+
+def get_embedder(model_name: str = None) -> Embedder:
+    """
+    Get a (shared) embedder for a model name.
+    
+    Names starting with 'hashing' select the HashingEmbedder. Other names load a
+    sentence-transformers model if the package is installed, falling back to
+    the HashingEmbedder otherwise.
+    
+    Args:
+        model_name: Name of the embedding model
+    
+    Returns:
+        An embedder
+    """
+    model_name = model_name or f"hashing-{HASHING_EMBEDDER_DIM}"
+    if model_name in _embedders:
+        return _embedders[model_name]
+    
+    if model_name.startswith("hashing"):
+        suffix = model_name.partition("-")[2]
+        embedder = HashingEmbedder(int(suffix) if suffix.isdigit() else HASHING_EMBEDDER_DIM)
+    elif SENTENCE_TRANSFORMERS_AVAILABLE:
+        embedder = SentenceTransformerEmbedder(model_name)
+    else:
+        logger.warning(f"sentence-transformers not installed; using hashing embedder instead of {model_name}")
+        embedder = HashingEmbedder()
+    
+    _embedders[model_name] = embedder
+    return embedder
@@ -5,9 +5,14 @@ This service uses the free Hugging Face Inference API.
 
 import os
 import json
+import time
 import logging
+import threading
 import requests
-from typing import Dict, List, Any, AsyncGenerator, Optional
+from concurrent.futures import Future, ThreadPoolExecutor, FIRST_COMPLETED, wait
+from typing import Dict, List, Any, AsyncGenerator, Callable, Optional, Tuple
+
+from services import BackendStats
 
 logger = logging.getLogger(__name__)
 
@@ -15,6 +20,207 @@ logger = logging.getLogger(__name__)
 HUGGING_FACE_API_KEY = os.getenv("HUGGING_FACE_API_KEY")
 HUGGING_FACE_API_URL = "https://api-inference.huggingface.co/models"
 DEFAULT_MODEL = "microsoft/DialoGPT-large"  # A free conversational model
+# Tokens generated per reply; callers reserve the same amount of the context window
+HF_MAX_NEW_TOKENS = int(os.getenv("HF_MAX_NEW_TOKENS", "200"))
+
+# Hedged requests: a duplicate goes to the secondary once the primary is slower than usual
+HF_HEDGING = os.getenv("HF_HEDGING", "false").lower() == "true"
+HF_HEDGE_PERCENTILE = float(os.getenv("HF_HEDGE_PERCENTILE", "0.95"))
+HF_HEDGE_MIN_DELAY = float(os.getenv("HF_HEDGE_MIN_DELAY", "0.5"))
+HF_HEDGE_MIN_SAMPLES = int(os.getenv("HF_HEDGE_MIN_SAMPLES", "20"))
+# Secondary endpoint and model; default to a duplicate of the primary request
+HF_HEDGE_API_URL = os.getenv("HF_HEDGE_API_URL", HUGGING_FACE_API_URL)
+HF_HEDGE_MODEL = os.getenv("HF_HEDGE_MODEL")
+# Hedges allowed per request on average, and how many may accumulate
+HF_HEDGE_BUDGET = float(os.getenv("HF_HEDGE_BUDGET", "0.1"))
+HF_HEDGE_BURST = float(os.getenv("HF_HEDGE_BURST", "5"))
+HF_HEDGE_WORKERS = int(os.getenv("HF_HEDGE_WORKERS", "32"))
+
+
+class HuggingFaceError(RuntimeError):
+    """Raised when a generation request fails or no API key is configured."""
+    pass
+
+def format_conversation(system_instruction: str, message: str, history: List[Dict[str, str]] = None) -> str:
+    """
+    Format a conversation as a plain-text prompt for conversational models.
+    
+    Args:
+        system_instruction: System prompt or instruction
+        message: Latest user message
+        history: Earlier conversation turns as role/content dicts, oldest first
+    
+    Returns:
+        Prompt text ending with the AI turn marker
+    """
+    lines = [system_instruction]
+    for turn in history or []:
+        speaker = "AI" if turn["role"] == "assistant" else "User"
+        lines.append(f"{speaker}: {turn['content']}")
+    lines.append(f"User: {message}")
+    lines.append("AI:")
+    return "\n".join(lines)
+
+class RequestHedger:
+    """
+    Runs a blocking call and, if it is slower than a percentile of recent
+    latency, races a duplicate against it and returns the first success.
+    A call fails by raising.
+    
+    Extra load is bounded by a token bucket: each request earns `budget`
+    hedge tokens up to `burst`, and each hedge spends one. A blocking HTTP
+    call cannot be interrupted, so the losing call is abandoned (or never
+    started if it is still queued) and its result discarded.
+    
+    Latency and the hedge delay count from when the primary starts running,
+    not from when it was queued. A primary still queued after the delay is
+    not hedged: the pool is saturated and a hedge would only queue behind it.
+    """
+    
+    def __init__(
+        self,
+        enabled: bool = None,
+        percentile: float = None,
+        min_delay: float = None,
+        min_samples: int = None,
+        budget: float = None,
+        burst: float = None,
+        max_workers: int = None
+    ):
+        """
+        Initialize the hedger.
+        
+        Args:
+            enabled: Whether to hedge at all
+            percentile: Latency percentile of the primary after which to hedge
+            min_delay: Minimum seconds before hedging
+            min_samples: Latency samples needed before hedging
+            budget: Hedges earned per request
+            burst: Maximum accumulated hedges
+            max_workers: Threads running primary and hedge calls
+        """
+        self.enabled = HF_HEDGING if enabled is None else enabled
+        self.percentile = percentile or HF_HEDGE_PERCENTILE
+        self.min_delay = HF_HEDGE_MIN_DELAY if min_delay is None else min_delay
+        self.min_samples = HF_HEDGE_MIN_SAMPLES if min_samples is None else min_samples
+        self.budget = HF_HEDGE_BUDGET if budget is None else budget
+        self.burst = HF_HEDGE_BURST if burst is None else burst
+        self.stats = BackendStats()
+        self._executor = ThreadPoolExecutor(max_workers=max_workers or HF_HEDGE_WORKERS, thread_name_prefix="hf-hedge")
+        self._tokens = self.burst
+        self._lock = threading.Lock()
+        self._metrics = {"requests": 0, "hedged": 0, "hedgeWins": 0, "budgetExhausted": 0, "saturated": 0}
+    
+    def hedge_delay(self) -> Optional[float]:
+        """
+        Seconds to wait for the primary before hedging.
+        
+        Returns:
+            The delay, or None until enough latency samples exist
+        """
+        latency = self.stats.percentile(self.percentile, self.min_samples)
+        return None if latency is None else max(latency, self.min_delay)
+    
+    def run(self, primary: Callable[[], str], secondary: Callable[[], str]) -> str:
+        """
+        Run a call, hedging it with a duplicate if it is slow.
+        
+        Args:
+            primary: The call to make
+            secondary: The duplicate to race against a slow primary
+        
+        Returns:
+            The first successful result
+        
+        Raises:
+            Exception: The primary's error if neither call succeeded
+        """
+        with self._lock:
+            self._metrics["requests"] += 1
+            self._tokens = min(self.burst, self._tokens + self.budget)
+        
+        delay = self.hedge_delay()
+        first, started = self._submit(primary, record=True)
+        if delay is None or not self.enabled:
+            return first.result()
+        
+        done, _ = wait([first], timeout=delay)
+        if done:
+            return first.result()
+        if not started:
+            with self._lock:
+                self._metrics["saturated"] += 1
+            return first.result()
+        # Give a primary that waited in the queue its full delay from when it started
+        remaining = started[0] + delay - time.monotonic()
+        if remaining > 0:
+            done, _ = wait([first], timeout=remaining)
+            if done:
+                return first.result()
+        
+        with self._lock:
+            allowed = self._tokens >= 1
+            if allowed:
+                self._tokens -= 1
+                self._metrics["hedged"] += 1
+            else:
+                self._metrics["budgetExhausted"] += 1
+        if not allowed:
+            return first.result()
+        
+        hedge, _ = self._submit(secondary, record=False)
+        pending = {first, hedge}
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in (hedge, first):
+                if future in done and future.exception() is None:
+                    if future is hedge:
+                        with self._lock:
+                            self._metrics["hedgeWins"] += 1
+                    for loser in pending:
+                        loser.cancel()
+                    return future.result()
+        # Both failed; report the primary's error
+        return first.result()
+    
+    def _submit(self, call: Callable[[], str], record: bool) -> Tuple[Future, List[float]]:
+        """
+        Run a call on the executor, recording the primary's latency from when it starts running.
+        
+        Returns:
+            The future, and a list that holds the call's start time once a thread picked it up
+        """
+        started: List[float] = []
+        
+        def timed() -> str:
+            started.append(time.monotonic())
+            try:
+                result = call()
+            except Exception:
+                if record:
+                    self.stats.record(None)
+                raise
+            if record:
+                self.stats.record(time.monotonic() - started[0])
+            return result
+        
+        return self._executor.submit(timed), started
+    
+    def get_metrics(self) -> Dict[str, Any]:
+        """
+        Get hedging metrics.
+        
+        Returns:
+            Counters, hedge rate and win rate, and the current hedge delay
+        """
+        with self._lock:
+            metrics = dict(self._metrics)
+        metrics["enabled"] = self.enabled
+        metrics["hedgeRate"] = metrics["hedged"] / metrics["requests"] if metrics["requests"] else 0.0
+        metrics["winRate"] = metrics["hedgeWins"] / metrics["hedged"] if metrics["hedged"] else 0.0
+        metrics["hedgeDelay"] = self.hedge_delay()
+        return metrics
+
 
 class HuggingFaceService:
     """Handles interactions with the Hugging Face Inference API."""
@@ -31,7 +237,8 @@ class HuggingFaceService:
             "Content-Type": "application/json"
         }
     
-    def generate_response(self, system_instruction: str, message: str, model: str = None) -> str:
+    def generate_response(self, system_instruction: str, message: str, model: str = None,
+                          history: List[Dict[str, str]] = None) -> str:
         """
         Generate a response using Hugging Face models.
         
@@ -39,31 +246,56 @@ class HuggingFaceService:
             system_instruction: System prompt or instruction
             message: User message
             model: Specific model to use (optional)
+            history: Earlier conversation turns as role/content dicts, oldest first (optional)
             
         Returns:
             Generated response text
+        
+        Raises:
+            HuggingFaceError: If no API key is configured or the request failed
         """
         if not self.api_key:
-            return "Hugging Face API key not configured. Please set HUGGING_FACE_API_KEY environment variable."
+            raise HuggingFaceError("Hugging Face API key not configured. Please set HUGGING_FACE_API_KEY environment variable.")
         
         model = model or self.default_model
         
         # Format the input for conversational models
-        inputs = f"{system_instruction}\nUser: {message}\nAI:"
+        inputs = format_conversation(system_instruction, message, history)
         
         payload = {
             "inputs": inputs,
             "parameters": {
-                "max_new_tokens": 200,
+                "max_new_tokens": HF_MAX_NEW_TOKENS,
                 "temperature": 0.7,
                 "top_p": 0.9,
                 "return_full_text": False
             }
         }
         
+        if not hedger.enabled:
+            return self._post(f"{HUGGING_FACE_API_URL}/{model}", payload)
+        return hedger.run(
+            lambda: self._post(f"{HUGGING_FACE_API_URL}/{model}", payload),
+            lambda: self._post(f"{HF_HEDGE_API_URL}/{HF_HEDGE_MODEL or model}", payload)
+        )
+    
+    def _post(self, url: str, payload: Dict[str, Any]) -> str:
+        """
+        Send a generation request.
+        
+        Args:
+            url: Model endpoint
+            payload: Request body
+        
+        Returns:
+            Generated text
+        
+        Raises:
+            HuggingFaceError: If the request failed
+        """
         try:
             response = requests.post(
-                f"{HUGGING_FACE_API_URL}/{model}",
+                url,
                 headers=self.headers,
                 json=payload,
                 timeout=30
@@ -78,11 +310,11 @@ class HuggingFaceService:
             else:
                 error_msg = f"Error {response.status_code}: {response.text}"
                 logger.error(error_msg)
-                return f"Error generating response: {error_msg}"
+                raise HuggingFaceError(f"Error generating response: {error_msg}")
                 
-        except Exception as e:
+        except requests.RequestException as e:
             logger.error(f"Error during Hugging Face API call: {e}")
-            return f"Error generating response: {str(e)}"
+            raise HuggingFaceError(f"Error generating response: {str(e)}")
     
     def list_available_models(self) -> List[str]:
         """
@@ -144,5 +376,8 @@ class HuggingFaceService:
             logger.error(f"Error during Hugging Face API call: {e}")
             return f"Error: {str(e)}"
 
+# Shared hedger, so latency history spans service instances
+hedger = RequestHedger()
+
 # For backwards compatibility
 AIService = HuggingFaceService
\ No newline at end of file
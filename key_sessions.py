@@ -0,0 +1,217 @@
+"""
+Pooled HTTP sessions and fair concurrency limits for user-provided API keys.
+Each key gets its own keep-alive session and at most a few requests in
+flight; when the shared upstream capacity is exhausted, waiting requests are
+admitted round-robin across keys so one heavy user cannot starve the others.
+"""
+
+import os
+import time
+import logging
+import threading
+from collections import OrderedDict, deque
+from contextlib import contextmanager
+from typing import Dict, Any, Callable, Deque, Iterator
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from rate_limiter import api_key_identity
+
+logger = logging.getLogger(__name__)
+
+# Key session pool configuration
+USER_API_MAX_KEYS = int(os.getenv("USER_API_MAX_KEYS", "256"))
+USER_API_KEY_CONCURRENCY = int(os.getenv("USER_API_KEY_CONCURRENCY", "4"))
+USER_API_MAX_IN_FLIGHT = int(os.getenv("USER_API_MAX_IN_FLIGHT", "32"))
+USER_API_QUEUE_TIMEOUT = float(os.getenv("USER_API_QUEUE_TIMEOUT", "30"))
+
+
+class KeyQueueTimeoutError(Exception):
+    """Raised when a request waits too long for a free slot."""
+    pass
+
+
+class _Waiter:
+    """A request waiting for a slot."""
+    
+    def __init__(self):
+        self.granted = False
+
+
+class _KeySlot:
+    """Session and counters of one API key."""
+    
+    def __init__(self, session: Any):
+        self.session = session
+        self.in_flight = 0
+        self.waiters: Deque[_Waiter] = deque()
+
+
+class KeySessionPool:
+    """
+    LRU of per-key sessions with a per-key and a global concurrency limit.
+    Keys with requests in flight or queued are never evicted.
+    """
+    
+    def __init__(
+        self,
+        max_keys: int = None,
+        per_key_limit: int = None,
+        max_in_flight: int = None,
+        queue_timeout: float = None,
+        session_factory: Callable[[str], Any] = None
+    ):
+        """
+        Initialize the pool.
+        
+        Args:
+            max_keys: Maximum number of idle key sessions kept open
+            per_key_limit: Maximum concurrent requests per key
+            max_in_flight: Maximum concurrent requests across all keys
+            queue_timeout: Seconds a request may wait for a slot
+            session_factory: Builds the session of a key (pooled requests.Session by default)
+        """
+        self.max_keys = max_keys or USER_API_MAX_KEYS
+        self.per_key_limit = per_key_limit or USER_API_KEY_CONCURRENCY
+        self.max_in_flight = max_in_flight or USER_API_MAX_IN_FLIGHT
+        self.queue_timeout = USER_API_QUEUE_TIMEOUT if queue_timeout is None else queue_timeout
+        self.session_factory = session_factory or self._create_session
+        self._slots: "OrderedDict[str, _KeySlot]" = OrderedDict()
+        # Keys with queued requests, in the order they are served
+        self._rotation: Deque[str] = deque()
+        self._in_flight = 0
+        self._cond = threading.Condition()
+        self._metrics = {"requests": 0, "queued": 0, "timeouts": 0, "sessionsCreated": 0, "evictions": 0, "queueWaitSeconds": 0.0}
+    
+    def _create_session(self, api_key: str) -> requests.Session:
+        """Keep-alive session authenticated with the key."""
+        session = requests.Session()
+        session.headers.update({
+            "Authorization": f"Bearer {api_key}",
+            "Content-Type": "application/json"
+        })
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.per_key_limit)
+        session.mount("https://", adapter)
+        session.mount("http://", adapter)
+        return session
+    
+    @contextmanager
+    def session(self, api_key: str) -> Iterator[Any]:
+        """
+        Hold a request slot for a key.
+        
+        Args:
+            api_key: The user's API key
+        
+        Yields:
+            The key's session
+        
+        Raises:
+            KeyQueueTimeoutError: If no slot became free within the queue timeout
+        """
+        identity = api_key_identity(api_key)
+        slot = self._acquire(identity, api_key)
+        try:
+            yield slot.session
+        finally:
+            self._release(identity, slot)
+    
+    def _acquire(self, identity: str, api_key: str) -> _KeySlot:
+        started = time.monotonic()
+        with self._cond:
+            slot = self._slots.get(identity)
+            if slot is None:
+                slot = self._slots[identity] = _KeySlot(self.session_factory(api_key))
+                self._metrics["sessionsCreated"] += 1
+            self._slots.move_to_end(identity)
+            self._metrics["requests"] += 1
+            
+            waiter = _Waiter()
+            slot.waiters.append(waiter)
+            self._evict()
+            if len(slot.waiters) == 1:
+                self._rotation.append(identity)
+            self._dispatch()
+            if not waiter.granted:
+                self._metrics["queued"] += 1
+                deadline = started + self.queue_timeout
+                while not waiter.granted:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        slot.waiters.remove(waiter)
+                        if not slot.waiters:
+                            self._rotation.remove(identity)
+                        self._metrics["timeouts"] += 1
+                        raise KeyQueueTimeoutError(f"No request slot free within {self.queue_timeout:g}s")
+                    self._cond.wait(remaining)
+            self._metrics["queueWaitSeconds"] += time.monotonic() - started
+            return slot
+    
+    def _release(self, identity: str, slot: _KeySlot) -> None:
+        with self._cond:
+            slot.in_flight -= 1
+            self._in_flight -= 1
+            self._dispatch()
+            self._evict()
+    
+    def _dispatch(self) -> None:
+        """Grant free slots round-robin across keys with queued requests (caller holds the lock)."""
+        granted = False
+        skipped = 0
+        while self._rotation and self._in_flight < self.max_in_flight and skipped < len(self._rotation):
+            identity = self._rotation.popleft()
+            slot = self._slots[identity]
+            if slot.in_flight >= self.per_key_limit:
+                # At its own limit; keep its place for the next release
+                self._rotation.append(identity)
+                skipped += 1
+                continue
+            slot.waiters.popleft().granted = True
+            slot.in_flight += 1
+            self._in_flight += 1
+            granted = True
+            skipped = 0
+            if slot.waiters:
+                self._rotation.append(identity)
+        if granted:
+            self._cond.notify_all()
+    
+    def _evict(self) -> None:
+        """Close the least recently used idle sessions beyond max_keys (caller holds the lock)."""
+        if len(self._slots) <= self.max_keys:
+            return
+        for identity in list(self._slots):
+            if len(self._slots) <= self.max_keys:
+                break
+            slot = self._slots[identity]
+            if slot.in_flight or slot.waiters:
+                continue
+            del self._slots[identity]
+            self._metrics["evictions"] += 1
+            try:
+                slot.session.close()
+            except Exception as e:
+                logger.warning(f"Error closing key session: {e}")
+    
+    def close(self) -> None:
+        """Close all idle sessions."""
+        with self._cond:
+            max_keys, self.max_keys = self.max_keys, 0
+            self._evict()
+            self.max_keys = max_keys
+    
+    def get_metrics(self) -> Dict[str, Any]:
+        """
+        Get pool metrics.
+        
+        Returns:
+            Counters and in-flight/queued totals (nothing that identifies a key)
+        """
+        with self._cond:
+            metrics = dict(self._metrics)
+            metrics["keys"] = len(self._slots)
+            metrics["inFlight"] = self._in_flight
+            metrics["waiting"] = sum(len(slot.waiters) for slot in self._slots.values())
+            metrics["busyKeys"] = sum(1 for slot in self._slots.values() if slot.in_flight or slot.waiters)
+        return metrics
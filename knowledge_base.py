@@ -22,7 +22,8 @@ class KnowledgeBase:
         updated_at: float = None,
         sources: List[Dict[str, Any]] = None,
         embedding_model: str = "all-MiniLM-L6-v2",
-        vector_db_path: str = None
+        vector_db_path: str = None,
+        search_mode: str = "auto"
     ):
         """
         Initialize a new KnowledgeBase instance.
@@ -36,6 +37,7 @@ class KnowledgeBase:
             sources: List of sources (files, URLs, etc.) in the knowledge base
             embedding_model: Name of the embedding model to use
             vector_db_path: Path to the vector database file
+            search_mode: Vector search mode: "exact", "approximate" or "auto" (approximate for large bases)
         """
         self.name = name
         self.description = description
@@ -45,6 +47,7 @@ class KnowledgeBase:
         self.sources = sources or []
         self.embedding_model = embedding_model
         self.vector_db_path = vector_db_path or f"knowledge_bases/{self.id}/vector_db"
+        self.search_mode = search_mode
     
     def to_dict(self) -> Dict[str, Any]:
         """
@@ -61,7 +64,8 @@ class KnowledgeBase:
             "updated_at": self.updated_at,
             "sources": self.sources,
             "embedding_model": self.embedding_model,
-            "vector_db_path": self.vector_db_path
+            "vector_db_path": self.vector_db_path,
+            "search_mode": self.search_mode
         }
     
     @classmethod
@@ -83,7 +87,8 @@ class KnowledgeBase:
             updated_at=data.get("updated_at"),
             sources=data.get("sources"),
             embedding_model=data.get("embedding_model"),
-            vector_db_path=data.get("vector_db_path")
+            vector_db_path=data.get("vector_db_path"),
+            search_mode=data.get("search_mode", "auto")
         )
     
     def save(self, directory: str) -> str:
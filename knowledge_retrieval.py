@@ -0,0 +1,976 @@
+"""
+Ingestion and retrieval engine for knowledge bases.
+Chunks knowledge base sources, embeds them and answers top-k similarity queries
+over a memory-mapped float32 vector matrix stored at the knowledge base's vector_db_path.
+"""
+
+import os
+import re
+import json
+import time
+import hashlib
+import logging
+import threading
+from typing import Dict, List, Any, Optional, Tuple
+
+import numpy as np
+
+from ann_index import IVFIndex, ANN_MIN_CHUNKS, exact_search
+from bm25_index import BM25Index
+from embedding_cache import EmbeddingPipeline
+from embeddings import Embedder, get_embedder
+from knowledge_base import KnowledgeBase
+
+logger = logging.getLogger(__name__)
+
+# Retrieval configuration
+RETRIEVAL_CHUNK_SIZE = int(os.getenv("RETRIEVAL_CHUNK_SIZE", "1000"))
+RETRIEVAL_TOP_K = int(os.getenv("RETRIEVAL_TOP_K", "4"))
+RETRIEVAL_MIN_SCORE = float(os.getenv("RETRIEVAL_MIN_SCORE", "0.1"))
+RETRIEVAL_CONTEXT_CHARS = int(os.getenv("RETRIEVAL_CONTEXT_CHARS", "3000"))
+# Ranking used for prompt context: "hybrid", "vector" or "lexical"
+RETRIEVAL_MODE = os.getenv("RETRIEVAL_MODE", "hybrid")
+# Weight of the vector score in hybrid ranking (the rest goes to BM25)
+HYBRID_ALPHA = float(os.getenv("HYBRID_ALPHA", "0.5"))
+# Candidates fetched from each ranker per requested hybrid result
+HYBRID_CANDIDATES = int(os.getenv("HYBRID_CANDIDATES", "5"))
+# Chunks collected across sources before they are embedded and appended together
+INGEST_WINDOW = int(os.getenv("INGEST_WINDOW", "4096"))
+# Compact a vector store once this fraction of its rows is tombstoned
+COMPACTION_THRESHOLD = float(os.getenv("COMPACTION_THRESHOLD", "0.2"))
+
+_HEADING = re.compile(r'^(#{1,6})\s+(.*)$')
+
+
+def chunk_markdown(text: str, max_chars: int = None) -> List[str]:
+    """
+    Split a markdown document into chunks along headings and paragraphs.
+    
+    Each chunk is prefixed with its heading path so it stays meaningful on its own.
+    
+    Args:
+        text: The markdown text
+        max_chars: Maximum characters per chunk (excluding the heading prefix)
+    
+    Returns:
+        List of chunk texts
+    """
+    max_chars = max_chars or RETRIEVAL_CHUNK_SIZE
+    chunks = []
+    headings: List[str] = []
+    paragraphs: List[str] = []
+    
+    def flush():
+        prefix = " > ".join(headings)
+        current = ""
+        for paragraph in paragraphs:
+            # Hard-split paragraphs that are longer than a chunk on their own
+            pieces = [paragraph[i:i + max_chars] for i in range(0, len(paragraph), max_chars)] or [""]
+            for piece in pieces:
+                if current and len(current) + len(piece) + 2 > max_chars:
+                    chunks.append(f"{prefix}\n{current}" if prefix else current)
+                    current = ""
+                current = f"{current}\n\n{piece}" if current else piece
+        if current.strip():
+            chunks.append(f"{prefix}\n{current}" if prefix else current)
+        paragraphs.clear()
+    
+    block: List[str] = []
+    for line in text.splitlines():
+        heading = _HEADING.match(line)
+        if heading:
+            if block:
+                paragraphs.append("\n".join(block).strip())
+                block = []
+            flush()
+            level = len(heading.group(1))
+            del headings[level - 1:]
+            headings.append(heading.group(2).strip())
+        elif not line.strip():
+            if block:
+                paragraphs.append("\n".join(block).strip())
+                block = []
+        else:
+            block.append(line)
+    
+    if block:
+        paragraphs.append("\n".join(block).strip())
+    flush()
+    
+    return chunks
+
+
+def load_source_text(source: Dict[str, Any]) -> str:
+    """
+    Read the text of a knowledge base source.
+    
+    Args:
+        source: Source entry (type file, url or text)
+    
+    Returns:
+        The source text
+    """
+    source_type = source.get("type")
+    if source_type == "file":
+        with open(source["path"], 'r', encoding='utf-8') as f:
+            return f.read()
+    if source_type == "text":
+        return source.get("metadata", {}).get("text", source.get("path", ""))
+    if source_type == "url":
+        import requests
+        response = requests.get(source["path"], timeout=30)
+        response.raise_for_status()
+        return response.text
+    raise ValueError(f"Unsupported source type: {source_type}")
+
+
+class VectorStore:
+    """
+    Chunk embeddings in a memory-mapped float32 matrix, plus per-chunk metadata.
+    
+    Rows are only ever appended; deleted rows are tombstoned and physically
+    removed by compact(), which bumps the store's generation.
+    
+    Files in the store directory:
+        vectors.f32  - row-major float32 matrix, one row per chunk
+        chunks.jsonl - one JSON record per row (source id, text)
+        deleted.u8   - one tombstone byte per row
+        meta.json    - dimension, row count, generation and embedder name
+    """
+    
+    VECTORS_FILE = "vectors.f32"
+    CHUNKS_FILE = "chunks.jsonl"
+    DELETED_FILE = "deleted.u8"
+    META_FILE = "meta.json"
+    
+    def __init__(self, path: str):
+        """
+        Initialize the vector store.
+        
+        Args:
+            path: Directory holding the store files
+        """
+        self.path = path
+        self.dim = 0
+        self.generation = 0
+        self.embedder_name: Optional[str] = None
+        self.chunks: List[Dict[str, Any]] = []
+        self.deleted = np.zeros(0, dtype=bool)
+        self.deleted_count = 0
+        self._matrix: Optional[np.ndarray] = None
+        self._lock = threading.RLock()
+    
+    @property
+    def count(self) -> int:
+        """Number of stored rows, including tombstoned ones."""
+        return len(self.chunks)
+    
+    @property
+    def live_count(self) -> int:
+        """Number of rows that are not tombstoned."""
+        return self.count - self.deleted_count
+    
+    @property
+    def matrix(self) -> np.ndarray:
+        """The (count, dim) embedding matrix, memory-mapped read-only."""
+        with self._lock:
+            if self._matrix is None:
+                if self.count == 0:
+                    self._matrix = np.empty((0, self.dim), dtype=np.float32)
+                else:
+                    self._matrix = np.memmap(
+                        os.path.join(self.path, self.VECTORS_FILE),
+                        dtype=np.float32,
+                        mode='r',
+                        shape=(self.count, self.dim)
+                    )
+            return self._matrix
+    
+    def snapshot(self) -> Tuple[np.ndarray, List[Dict[str, Any]], Optional[np.ndarray], int]:
+        """
+        Get a consistent view of the store for one query.
+        
+        Returns:
+            The matrix, chunk records, tombstone mask (None if nothing is deleted) and generation
+        """
+        with self._lock:
+            deleted = self.deleted if self.deleted_count else None
+            return self.matrix, self.chunks, deleted, self.generation
+    
+    def load(self) -> bool:
+        """
+        Load the store from disk.
+        
+        Returns:
+            True if a store was found, False otherwise
+        """
+        meta_path = os.path.join(self.path, self.META_FILE)
+        if not os.path.exists(meta_path):
+            return False
+        
+        with self._lock:
+            with open(meta_path, 'r') as f:
+                meta = json.load(f)
+            self.dim = meta["dim"]
+            self.generation = meta.get("generation", 0)
+            self.embedder_name = meta.get("embedder")
+            
+            chunks = []
+            with open(os.path.join(self.path, self.CHUNKS_FILE), 'r', encoding='utf-8') as f:
+                for line in f:
+                    if len(chunks) == meta["count"]:
+                        break
+                    chunks.append(json.loads(line))
+            self.chunks = chunks
+            
+            deleted = np.zeros(len(chunks), dtype=bool)
+            deleted_path = os.path.join(self.path, self.DELETED_FILE)
+            if os.path.exists(deleted_path):
+                marks = np.fromfile(deleted_path, dtype=np.uint8)[:len(chunks)]
+                deleted[:len(marks)] = marks.astype(bool)
+            self.deleted = deleted
+            self.deleted_count = int(deleted.sum())
+            self._matrix = None
+        return True
+    
+    def reset(self, dim: int, embedder_name: str) -> None:
+        """
+        Remove all vectors and start an empty store.
+        
+        Args:
+            dim: Dimension of the vectors
+            embedder_name: Name of the embedder producing the vectors
+        """
+        with self._lock:
+            os.makedirs(self.path, exist_ok=True)
+            self.dim = dim
+            self.generation += 1
+            self.embedder_name = embedder_name
+            self.chunks = []
+            self.deleted = np.zeros(0, dtype=bool)
+            self.deleted_count = 0
+            self._matrix = None
+            for filename in (self.VECTORS_FILE, self.CHUNKS_FILE, self.DELETED_FILE):
+                open(os.path.join(self.path, filename), 'wb').close()
+            self._write_meta()
+    
+    def append(self, vectors: np.ndarray, chunks: List[Dict[str, Any]]) -> None:
+        """
+        Append vectors and their chunk records.
+        
+        Args:
+            vectors: Array of shape (n, dim)
+            chunks: One metadata record per vector
+        """
+        if len(vectors) != len(chunks):
+            raise ValueError("Each vector needs exactly one chunk record")
+        
+        with self._lock:
+            with open(os.path.join(self.path, self.VECTORS_FILE), 'ab') as f:
+                f.write(np.ascontiguousarray(vectors, dtype=np.float32).tobytes())
+            with open(os.path.join(self.path, self.CHUNKS_FILE), 'a', encoding='utf-8') as f:
+                for chunk in chunks:
+                    f.write(json.dumps(chunk) + "\n")
+            with open(os.path.join(self.path, self.DELETED_FILE), 'ab') as f:
+                f.write(bytes(len(chunks)))
+            # Copy-on-append so snapshots handed to readers never change
+            self.chunks = self.chunks + list(chunks)
+            self.deleted = np.concatenate([self.deleted, np.zeros(len(chunks), dtype=bool)])
+            self._matrix = None
+            # meta.json is written last: its count is what readers trust
+            self._write_meta()
+    
+    def delete(self, start: int, end: int) -> int:
+        """
+        Tombstone a range of rows.
+        
+        Args:
+            start: First row to delete
+            end: Row after the last row to delete
+        
+        Returns:
+            Number of rows newly tombstoned
+        """
+        with self._lock:
+            newly = int(end - start - self.deleted[start:end].sum())
+            deleted = self.deleted.copy()
+            deleted[start:end] = True
+            self.deleted = deleted
+            self.deleted_count += newly
+            with open(os.path.join(self.path, self.DELETED_FILE), 'r+b') as f:
+                f.seek(start)
+                f.write(b"\x01" * (end - start))
+        return newly
+    
+    def compact(self) -> np.ndarray:
+        """
+        Rewrite the store without its tombstoned rows.
+        
+        Returns:
+            Array of length count + 1 mapping each old row offset to its new offset
+            (the number of live rows before it), for remapping row ranges
+        """
+        with self._lock:
+            live = ~self.deleted[:self.count]
+            new_offsets = np.zeros(self.count + 1, dtype=np.int64)
+            np.cumsum(live, out=new_offsets[1:])
+            if not self.deleted_count:
+                return new_offsets
+            
+            rows = np.flatnonzero(live)
+            matrix = self.matrix
+            vectors_path = os.path.join(self.path, self.VECTORS_FILE)
+            with open(f"{vectors_path}.tmp", 'wb') as f:
+                for start in range(0, len(rows), 65536):
+                    f.write(np.ascontiguousarray(matrix[rows[start:start + 65536]]).tobytes())
+            chunks = [self.chunks[row] for row in rows]
+            chunks_path = os.path.join(self.path, self.CHUNKS_FILE)
+            with open(f"{chunks_path}.tmp", 'w', encoding='utf-8') as f:
+                for chunk in chunks:
+                    f.write(json.dumps(chunk) + "\n")
+            
+            # Files mapped by in-flight queries stay valid after the rename
+            os.replace(f"{vectors_path}.tmp", vectors_path)
+            os.replace(f"{chunks_path}.tmp", chunks_path)
+            with open(os.path.join(self.path, self.DELETED_FILE), 'wb') as f:
+                f.write(bytes(len(chunks)))
+            
+            self.chunks = chunks
+            self.deleted = np.zeros(len(chunks), dtype=bool)
+            self.deleted_count = 0
+            self.generation += 1
+            self._matrix = None
+            self._write_meta()
+            return new_offsets
+    
+    def search(self, query_vector: np.ndarray, k: int) -> List[Tuple[int, float]]:
+        """
+        Find the live rows most similar to a query vector.
+        
+        Args:
+            query_vector: Normalized query embedding
+            k: Number of results
+        
+        Returns:
+            (row, score) pairs, best first
+        """
+        matrix, _, deleted, _ = self.snapshot()
+        return exact_search(matrix, query_vector, k, exclude=deleted)
+    
+    def _write_meta(self) -> None:
+        meta_path = os.path.join(self.path, self.META_FILE)
+        with open(f"{meta_path}.tmp", 'w') as f:
+            json.dump({"dim": self.dim, "count": self.count, "generation": self.generation, "embedder": self.embedder_name}, f)
+        os.replace(f"{meta_path}.tmp", meta_path)
+
+
+class IngestionManifest:
+    """
+    Records what has been indexed for each source of a knowledge base.
+    
+    Each source entry holds the content hash, a cheap change signature
+    (mtime and size for files) and the range of store rows holding its chunks.
+    """
+    
+    FILE = "manifest.json"
+    
+    def __init__(self, path: str):
+        """
+        Initialize the manifest.
+        
+        Args:
+            path: Directory holding the manifest (the vector store directory)
+        """
+        self.path = path
+        self.sources: Dict[str, Dict[str, Any]] = {}
+        self.chunk_size = 0
+        self.embedder_name: Optional[str] = None
+        self.rows = 0
+        self.generation = 0
+    
+    def load(self) -> bool:
+        """
+        Load the manifest from disk.
+        
+        Returns:
+            True if a manifest was found, False otherwise
+        """
+        file_path = os.path.join(self.path, self.FILE)
+        if not os.path.exists(file_path):
+            return False
+        
+        with open(file_path, 'r') as f:
+            data = json.load(f)
+        self.sources = data.get("sources", {})
+        self.chunk_size = data.get("chunk_size", 0)
+        self.embedder_name = data.get("embedder")
+        self.rows = data.get("rows", 0)
+        self.generation = data.get("generation", 0)
+        return True
+    
+    def save(self) -> None:
+        """
+        Save the manifest atomically.
+        """
+        os.makedirs(self.path, exist_ok=True)
+        file_path = os.path.join(self.path, self.FILE)
+        with open(f"{file_path}.tmp", 'w') as f:
+            json.dump({
+                "chunk_size": self.chunk_size,
+                "embedder": self.embedder_name,
+                "rows": self.rows,
+                "generation": self.generation,
+                "sources": self.sources
+            }, f)
+        os.replace(f"{file_path}.tmp", file_path)
+    
+    def reset(self, chunk_size: int, embedder_name: str) -> None:
+        """
+        Forget all indexed sources.
+        
+        Args:
+            chunk_size: Chunk size the new index uses
+            embedder_name: Embedder the new index uses
+        """
+        self.sources = {}
+        self.chunk_size = chunk_size
+        self.embedder_name = embedder_name
+        self.rows = 0
+    
+    def matches(self, store: VectorStore, chunk_size: int, embedder_name: str) -> bool:
+        """
+        Whether the manifest describes a store built with the given settings.
+        
+        Args:
+            store: The vector store
+            chunk_size: Current chunk size
+            embedder_name: Current embedder name
+        
+        Returns:
+            True if incremental indexing can continue from this manifest
+        """
+        return (
+            self.chunk_size == chunk_size
+            and self.embedder_name == embedder_name == store.embedder_name
+            and self.rows == store.count
+            and self.generation == store.generation
+        )
+
+
+def source_signature(source: Dict[str, Any]) -> Optional[str]:
+    """
+    Cheap change signature of a source, checked before hashing its content.
+    
+    Args:
+        source: Source entry
+    
+    Returns:
+        "mtime_ns:size" for files, None when there is no cheap signature
+    """
+    if source.get("type") != "file":
+        return None
+    try:
+        stat = os.stat(source["path"])
+    except OSError:
+        return None
+    return f"{stat.st_mtime_ns}:{stat.st_size}"
+
+
+class KnowledgeRetriever:
+    """
+    Ingests knowledge base sources into vector stores and answers top-k queries.
+    
+    Ingestion is incremental: only new or changed sources (by content hash)
+    are chunked and embedded, and the rows of changed or removed sources are
+    tombstoned. Once tombstones exceed COMPACTION_THRESHOLD of a store, it is
+    compacted on a background thread.
+    """
+    
+    def __init__(
+        self,
+        chunk_size: int = None,
+        pipeline: EmbeddingPipeline = None,
+        compaction_threshold: float = None
+    ):
+        """
+        Initialize the retriever.
+        
+        Args:
+            chunk_size: Maximum characters per chunk
+            pipeline: Batched, cached embedding pipeline used for ingestion
+            compaction_threshold: Fraction of tombstoned rows that triggers compaction
+        """
+        self.chunk_size = chunk_size or RETRIEVAL_CHUNK_SIZE
+        self.pipeline = pipeline or EmbeddingPipeline()
+        self.compaction_threshold = compaction_threshold or COMPACTION_THRESHOLD
+        self._stores: Dict[str, VectorStore] = {}
+        self._indexes: Dict[str, IVFIndex] = {}
+        self._lexical_indexes: Dict[str, BM25Index] = {}
+        self._write_locks: Dict[str, threading.Lock] = {}
+        self._compacting = set()
+        self._lock = threading.Lock()
+    
+    def get_store(self, knowledge_base: KnowledgeBase) -> VectorStore:
+        """
+        Get the (cached) vector store of a knowledge base.
+        
+        Args:
+            knowledge_base: The knowledge base
+        
+        Returns:
+            Its vector store, loaded from disk if present
+        """
+        with self._lock:
+            store = self._stores.get(knowledge_base.vector_db_path)
+            if store is None:
+                store = VectorStore(knowledge_base.vector_db_path)
+                store.load()
+                self._stores[knowledge_base.vector_db_path] = store
+            return store
+    
+    def get_index(self, knowledge_base: KnowledgeBase) -> IVFIndex:
+        """
+        Get the (cached) approximate index of a knowledge base.
+        
+        Args:
+            knowledge_base: The knowledge base
+        
+        Returns:
+            Its IVF index, loaded from disk if present (it may not be built)
+        """
+        with self._lock:
+            index = self._indexes.get(knowledge_base.vector_db_path)
+            if index is None:
+                index = IVFIndex(knowledge_base.vector_db_path)
+                index.load()
+                self._indexes[knowledge_base.vector_db_path] = index
+            return index
+    
+    def get_lexical_index(self, knowledge_base: KnowledgeBase) -> BM25Index:
+        """
+        Get the (cached) BM25 index of a knowledge base.
+        
+        Args:
+            knowledge_base: The knowledge base
+        
+        Returns:
+            Its BM25 index, loaded from disk if present (it may not be built)
+        """
+        with self._lock:
+            index = self._lexical_indexes.get(knowledge_base.vector_db_path)
+            if index is None:
+                index = BM25Index(knowledge_base.vector_db_path)
+                index.load()
+                self._lexical_indexes[knowledge_base.vector_db_path] = index
+            return index
+    
+    def _write_lock(self, knowledge_base: KnowledgeBase) -> threading.Lock:
+        """Lock serializing ingestion and compaction of one knowledge base."""
+        with self._lock:
+            return self._write_locks.setdefault(knowledge_base.vector_db_path, threading.Lock())
+    
+    def uses_ann(self, knowledge_base: KnowledgeBase, count: int) -> bool:
+        """
+        Whether a knowledge base is searched with the approximate index.
+        
+        Args:
+            knowledge_base: The knowledge base
+            count: Number of indexed chunks
+        
+        Returns:
+            True for "approximate" mode, or "auto" mode at ANN_MIN_CHUNKS chunks or more
+        """
+        mode = getattr(knowledge_base, "search_mode", "auto")
+        if mode == "approximate":
+            return True
+        return mode == "auto" and count >= ANN_MIN_CHUNKS
+    
+    def get_embedder(self, knowledge_base: KnowledgeBase) -> Embedder:
+        """
+        Get the embedder configured for a knowledge base.
+        
+        Args:
+            knowledge_base: The knowledge base
+        
+        Returns:
+            The embedder
+        """
+        return get_embedder(knowledge_base.embedding_model)
+    
+    def ingest(self, knowledge_base: KnowledgeBase, full: bool = False) -> Dict[str, Any]:
+        """
+        Bring the index of a knowledge base up to date with its sources.
+        
+        Args:
+            knowledge_base: The knowledge base to ingest
+            full: Rebuild the index from scratch instead of incrementally
+        
+        Returns:
+            Ingestion statistics
+        """
+        started = time.perf_counter()
+        embedder = self.get_embedder(knowledge_base)
+        stats = {"added": 0, "updated": 0, "removed": 0, "unchanged": 0, "failed": 0, "chunks_indexed": 0, "cache_hits": 0}
+        
+        with self._write_lock(knowledge_base):
+            store = self.get_store(knowledge_base)
+            index = self.get_index(knowledge_base)
+            manifest = IngestionManifest(knowledge_base.vector_db_path)
+            manifest.load()
+            
+            lexical_index = self.get_lexical_index(knowledge_base)
+            if full or not manifest.matches(store, self.chunk_size, embedder.name):
+                store.reset(embedder.dim, embedder.name)
+                index.clear()
+                lexical_index.clear()
+                manifest.reset(self.chunk_size, embedder.name)
+                stats["full"] = True
+            rows_before = store.count
+            
+            pending = []
+            pending_chunks = 0
+            current_ids = set()
+            for source in knowledge_base.sources:
+                source_id = source.get("id")
+                current_ids.add(source_id)
+                entry = manifest.sources.get(source_id)
+                signature = source_signature(source)
+                if entry and signature and entry.get("signature") == signature:
+                    stats["unchanged"] += 1
+                    continue
+                
+                try:
+                    text = load_source_text(source)
+                except Exception as e:
+                    logger.error(f"Error loading source {source_id} of knowledge base {knowledge_base.id}: {e}")
+                    stats["failed"] += 1
+                    continue
+                
+                digest = hashlib.sha256(text.encode("utf-8")).hexdigest()
+                if entry and entry["hash"] == digest:
+                    entry["signature"] = signature
+                    stats["unchanged"] += 1
+                    continue
+                
+                if entry:
+                    store.delete(entry["start"], entry["end"])
+                stats["updated" if entry else "added"] += 1
+                
+                records = [
+                    {"source_id": source_id, "position": position, "text": chunk}
+                    for position, chunk in enumerate(chunk_markdown(text, self.chunk_size))
+                ]
+                pending.append((source_id, {"hash": digest, "signature": signature}, records))
+                pending_chunks += len(records)
+                if pending_chunks >= INGEST_WINDOW:
+                    self._flush(store, index, embedder, manifest, pending, stats)
+                    pending, pending_chunks = [], 0
+            
+            self._flush(store, index, embedder, manifest, pending, stats)
+            
+            for source_id in set(manifest.sources) - current_ids:
+                entry = manifest.sources.pop(source_id)
+                store.delete(entry["start"], entry["end"])
+                stats["removed"] += 1
+            
+            if self.uses_ann(knowledge_base, store.live_count) and store.count:
+                if not index.is_built or index.is_stale or index.generation != store.generation:
+                    index.build(store.matrix, generation=store.generation)
+            elif index.is_built:
+                index.clear()
+            
+            # New rows go to the BM25 delta log; a stale or missing index is rebuilt
+            if lexical_index.built and lexical_index.generation == store.generation and len(lexical_index.lengths) == rows_before:
+                if store.count > rows_before:
+                    lexical_index.add(rows_before, [chunk["text"] for chunk in store.chunks[rows_before:]])
+            else:
+                lexical_index.build([chunk["text"] for chunk in store.chunks], generation=store.generation)
+            
+            manifest.rows = store.count
+            manifest.generation = store.generation
+            manifest.save()
+        
+        if store.count and store.deleted_count / store.count > self.compaction_threshold:
+            self.schedule_compaction(knowledge_base)
+        
+        elapsed = time.perf_counter() - started
+        logger.info(f"Ingested knowledge base {knowledge_base.id}: {stats['chunks_indexed']} chunks indexed "
+                    f"({stats['cache_hits']} from cache) in {elapsed:.2f}s")
+        stats.update({
+            "knowledge_base_id": knowledge_base.id,
+            "sources": len(knowledge_base.sources),
+            "chunks": store.live_count,
+            "ann": index.is_built,
+            "seconds": elapsed,
+            "chunks_per_second": stats["chunks_indexed"] / elapsed if elapsed else 0.0
+        })
+        return stats
+    
+    def _flush(
+        self,
+        store: VectorStore,
+        index: IVFIndex,
+        embedder: Embedder,
+        manifest: IngestionManifest,
+        pending: List[Tuple[str, Dict[str, Any], List[Dict[str, Any]]]],
+        stats: Dict[str, Any]
+    ) -> None:
+        """Embed the pending sources' chunks together and append them to the store and a built index."""
+        records = [record for _, _, source_records in pending for record in source_records]
+        if not records:
+            return
+        
+        vectors = self.pipeline.embed(embedder, [record["text"] for record in records], stats)
+        first_row = store.count
+        store.append(vectors, records)
+        if index.is_built and index.generation == store.generation:
+            index.insert(np.arange(first_row, first_row + len(records)), vectors)
+        
+        start = first_row
+        for source_id, entry, source_records in pending:
+            entry.update({"start": start, "end": start + len(source_records)})
+            manifest.sources[source_id] = entry
+            start += len(source_records)
+        stats["chunks_indexed"] += len(records)
+    
+    def schedule_compaction(self, knowledge_base: KnowledgeBase) -> bool:
+        """
+        Compact a knowledge base's store on a background thread.
+        
+        Args:
+            knowledge_base: The knowledge base to compact
+        
+        Returns:
+            True if a compaction was started, False if one is already running
+        """
+        with self._lock:
+            if knowledge_base.vector_db_path in self._compacting:
+                return False
+            self._compacting.add(knowledge_base.vector_db_path)
+        
+        def run():
+            try:
+                self.compact(knowledge_base)
+            except Exception as e:
+                logger.error(f"Error compacting knowledge base {knowledge_base.id}: {e}")
+            finally:
+                with self._lock:
+                    self._compacting.discard(knowledge_base.vector_db_path)
+        
+        threading.Thread(target=run, name=f"compact-{knowledge_base.id}", daemon=True).start()
+        return True
+    
+    def compact(self, knowledge_base: KnowledgeBase) -> Dict[str, Any]:
+        """
+        Remove tombstoned rows from a knowledge base's store and remap the manifest.
+        
+        Args:
+            knowledge_base: The knowledge base to compact
+        
+        Returns:
+            Compaction statistics
+        """
+        started = time.perf_counter()
+        with self._write_lock(knowledge_base):
+            store = self.get_store(knowledge_base)
+            removed = store.deleted_count
+            if not removed:
+                return {"removed": 0, "seconds": 0.0}
+            
+            manifest = IngestionManifest(knowledge_base.vector_db_path)
+            manifest.load()
+            new_offsets = store.compact()
+            for entry in manifest.sources.values():
+                entry["start"] = int(new_offsets[entry["start"]])
+                entry["end"] = int(new_offsets[entry["end"]])
+            manifest.rows = store.count
+            manifest.generation = store.generation
+            manifest.save()
+            
+            # Row numbers changed; until the rebuild, queries fall back to exact search
+            index = self.get_index(knowledge_base)
+            if index.is_built:
+                index.build(store.matrix, generation=store.generation)
+            self.get_lexical_index(knowledge_base).build([chunk["text"] for chunk in store.chunks], generation=store.generation)
+        
+        elapsed = time.perf_counter() - started
+        logger.info(f"Compacted knowledge base {knowledge_base.id}: removed {removed} rows in {elapsed:.2f}s")
+        return {"removed": removed, "seconds": elapsed}
+    
+    def search(self, knowledge_base: KnowledgeBase, query: str, k: int = None, min_score: float = None) -> List[Dict[str, Any]]:
+        """
+        Find the chunks most similar to a query.
+        
+        Args:
+            knowledge_base: The knowledge base to search
+            query: The query text
+            k: Number of results
+            min_score: Minimum cosine similarity of returned chunks
+        
+        Returns:
+            Scored chunks (score, text, source_id, chunk_index, row), best first;
+            chunk_index is the chunk's position within its source, row its store row
+        """
+        store = self.get_store(knowledge_base)
+        if store.live_count == 0:
+            return []
+        
+        embedder = self.get_embedder(knowledge_base)
+        if store.embedder_name != embedder.name:
+            logger.warning(f"Knowledge base {knowledge_base.id} was indexed with {store.embedder_name}, not {embedder.name}; re-ingest it")
+            return []
+        
+        min_score = RETRIEVAL_MIN_SCORE if min_score is None else min_score
+        k = k or RETRIEVAL_TOP_K
+        query_vector = embedder.embed_query(query)
+        matrix, chunks, deleted, generation = store.snapshot()
+        index = self.get_index(knowledge_base)
+        if index.is_built and index.generation == generation and self.uses_ann(knowledge_base, len(chunks)):
+            matches = index.search(matrix, query_vector, k, exclude=deleted)
+        else:
+            matches = exact_search(matrix, query_vector, k, exclude=deleted)
+        
+        results = []
+        for row, score in matches:
+            if score < min_score:
+                break
+            chunk = chunks[row]
+            results.append({
+                "score": score,
+                "text": chunk["text"],
+                "source_id": chunk.get("source_id"),
+                "chunk_index": chunk.get("position"),
+                "row": row
+            })
+        return results
+    
+    def query(
+        self,
+        knowledge_base: KnowledgeBase,
+        query: str,
+        k: int = None,
+        mode: str = None,
+        alpha: float = None,
+        min_score: float = None
+    ) -> List[Dict[str, Any]]:
+        """
+        Rank chunks by vector similarity, BM25 or a weighted combination of both.
+        
+        In hybrid mode, candidates come from both rankers; each candidate gets
+        its exact cosine similarity and its BM25 score normalized by the best
+        BM25 score, and the two are blended with weight alpha on the vector score.
+        
+        Args:
+            knowledge_base: The knowledge base to search
+            query: The query text
+            k: Number of results
+            mode: "hybrid", "vector" or "lexical" (defaults to RETRIEVAL_MODE)
+            alpha: Weight of the vector score in hybrid mode
+            min_score: Minimum cosine similarity of chunks without any query term
+        
+        Returns:
+            Scored chunks (score, vector_score, lexical_score, text, source_id, chunk_index, row), best first
+        """
+        mode = mode or RETRIEVAL_MODE
+        if mode == "vector":
+            return self.search(knowledge_base, query, k, min_score)
+        
+        k = k or RETRIEVAL_TOP_K
+        alpha = HYBRID_ALPHA if alpha is None else alpha
+        min_score = RETRIEVAL_MIN_SCORE if min_score is None else min_score
+        store = self.get_store(knowledge_base)
+        matrix, chunks, deleted, generation = store.snapshot()
+        lexical_index = self.get_lexical_index(knowledge_base)
+        if not chunks:
+            return []
+        if not lexical_index.built or lexical_index.generation != generation:
+            logger.warning(f"BM25 index of knowledge base {knowledge_base.id} is missing or stale; using vector search")
+            return self.search(knowledge_base, query, k, min_score)
+        
+        lexical_scores = lexical_index.scores(query, len(chunks))
+        if deleted is not None:
+            lexical_scores[deleted] = 0.0
+        
+        candidates = k if mode == "lexical" else k * HYBRID_CANDIDATES
+        candidates = min(candidates, len(chunks))
+        rows = np.argpartition(-lexical_scores, candidates - 1)[:candidates]
+        rows = rows[lexical_scores[rows] > 0]
+        
+        embedder = self.get_embedder(knowledge_base)
+        query_vector = None
+        if mode == "hybrid" and store.embedder_name == embedder.name:
+            query_vector = embedder.embed_query(query)
+            index = self.get_index(knowledge_base)
+            if index.is_built and index.generation == generation and self.uses_ann(knowledge_base, len(chunks)):
+                matches = index.search(matrix, query_vector, candidates, exclude=deleted)
+            else:
+                matches = exact_search(matrix, query_vector, candidates, exclude=deleted)
+            rows = np.union1d(rows, np.array([row for row, _ in matches], dtype=np.int64))
+        if not len(rows):
+            return []
+        
+        lexical = lexical_scores[rows]
+        best_lexical = float(lexical.max())
+        lexical_normalized = lexical / best_lexical if best_lexical > 0 else lexical
+        if query_vector is not None:
+            vector = np.asarray(matrix[rows]) @ query_vector
+            combined = alpha * np.maximum(vector, 0.0) + (1 - alpha) * lexical_normalized
+        else:
+            vector = np.zeros(len(rows), dtype=np.float32)
+            combined = lexical_normalized
+        
+        results = []
+        for i in np.argsort(-combined):
+            if lexical[i] <= 0 and vector[i] < min_score:
+                continue
+            chunk = chunks[rows[i]]
+            results.append({
+                "score": float(combined[i]),
+                "vector_score": float(vector[i]),
+                "lexical_score": float(lexical[i]),
+                "text": chunk["text"],
+                "source_id": chunk.get("source_id"),
+                "chunk_index": chunk.get("position"),
+                "row": int(rows[i])
+            })
+            if len(results) == k:
+                break
+        return results
+    
+    def build_context(self, knowledge_bases: List[KnowledgeBase], query: str, k: int = None, max_chars: int = None) -> str:
+        """
+        Build a prompt section with the chunks most relevant to a query.
+        
+        Args:
+            knowledge_bases: Knowledge bases to search
+            query: The user's message
+            k: Number of chunks to include
+            max_chars: Maximum characters of the section
+        
+        Returns:
+            Text to append to a system prompt, or an empty string if nothing relevant was found
+        """
+        k = k or RETRIEVAL_TOP_K
+        max_chars = max_chars or RETRIEVAL_CONTEXT_CHARS
+        
+        results = []
+        for knowledge_base in knowledge_bases:
+            results.extend(self.query(knowledge_base, query, k))
+        results.sort(key=lambda result: result["score"], reverse=True)
+        
+        sections = []
+        remaining = max_chars
+        for result in results[:k]:
+            if remaining <= 0:
+                break
+            text = result["text"][:remaining]
+            sections.append(text)
+            remaining -= len(text)
+        
+        if not sections:
+            return ""
+        return "Use the following knowledge base excerpts when relevant:\n\n" + "\n\n---\n\n".join(sections)
+
+
+# Shared retriever
+knowledge_retriever = KnowledgeRetriever()
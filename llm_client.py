@@ -0,0 +1,615 @@
+"""
+Async-first LLM clients with a sync shim.
+Every backend exposes the same interface - complete(), stream() and
+list_models() - with per-call timeouts, cancellation and a concurrency limit,
+so callers can run many conversations concurrently on one event loop.
+Synchronous callers use the *_sync methods, which run on a shared
+background event loop.
+"""
+
+import os
+import time
+import asyncio
+import logging
+import threading
+import weakref
+from concurrent.futures import Future, ThreadPoolExecutor
+from contextlib import aclosing, asynccontextmanager
+from contextvars import ContextVar
+from typing import Dict, List, Any, AsyncGenerator, AsyncIterator, Callable, Coroutine, Optional, Tuple, TypeVar
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from model_catalog import model_stats
+from openai_compatible import OpenAICompatibleClient
+
+logger = logging.getLogger(__name__)
+
+# LLM client configuration
+# Backend of the default client: "api" (LLM API server), "huggingface" or "vicuna"
+LLM_BACKEND = os.getenv("LLM_BACKEND", "api").lower()
+LLM_API_URL = os.getenv("LLM_API_URL", "http://localhost:3001/api")
+LLM_API_KEY = os.getenv("LLM_API_KEY", "test-api-key")
+LLM_TIMEOUT = float(os.getenv("LLM_TIMEOUT", "60"))
+LLM_CONNECT_TIMEOUT = float(os.getenv("LLM_CONNECT_TIMEOUT", "5"))
+LLM_MAX_CONCURRENCY = int(os.getenv("LLM_MAX_CONCURRENCY", "16"))
+
+T = TypeVar("T")
+
+
+class _Slot:
+    """
+    A held concurrency slot. Blocking work started while holding it takes
+    its own hold, so the slot is freed only once that work has finished,
+    even if the caller stopped waiting (timeout or cancellation).
+    """
+    
+    def __init__(self, free: Callable[[], None]):
+        self._free = free
+        self._holds = 1
+    
+    def hold(self) -> None:
+        self._holds += 1
+    
+    def release(self) -> None:
+        """Drop a hold (on the slot's event loop)."""
+        self._holds -= 1
+        if self._holds == 0:
+            self._free()
+    
+    def release_when_done(self, future: Future, loop: asyncio.AbstractEventLoop) -> None:
+        """Hold the slot until a worker thread's future completes."""
+        self.hold()
+        
+        def done(_: Future) -> None:
+            try:
+                loop.call_soon_threadsafe(self.release)
+            except RuntimeError:
+                # The loop is closed, so nothing else can use the slot
+                self.release()
+        
+        future.add_done_callback(done)
+
+
+# Slot held by the call running in the current task
+_current_slot: ContextVar[Optional[_Slot]] = ContextVar("llm_client_slot", default=None)
+
+
+class LLMClientError(Exception):
+    """Raised when an LLM backend fails to produce a completion."""
+    
+    def __init__(self, message: str, details: Any = None):
+        super().__init__(message)
+        self.details = details
+
+
+class LLMTimeoutError(LLMClientError):
+    """Raised when an LLM call exceeds its timeout."""
+    pass
+
+
+class Completion:
+    """A finished completion."""
+    
+    def __init__(self, text: str, model: str = None, raw: Dict[str, Any] = None):
+        """
+        Initialize the completion.
+        
+        Args:
+            text: Assistant message
+            model: Model that produced it
+            raw: Backend response, if the backend returns one
+        """
+        self.text = text
+        self.model = model
+        self.raw = raw
+    
+    def to_response(self) -> Dict[str, Any]:
+        """Chat completion response in the LLM API format."""
+        if self.raw is not None:
+            return self.raw
+        return {"model": self.model, "choices": [{"index": 0, "message": {"role": "assistant", "content": self.text}}]}
+
+
+class _LoopThread:
+    """A background event loop that runs coroutines for synchronous callers."""
+    
+    def __init__(self):
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._thread: Optional[threading.Thread] = None
+        self._lock = threading.Lock()
+    
+    def _ensure(self) -> asyncio.AbstractEventLoop:
+        with self._lock:
+            if self._loop is None:
+                self._loop = asyncio.new_event_loop()
+                self._thread = threading.Thread(target=self._loop.run_forever, name="llm-client-loop", daemon=True)
+                self._thread.start()
+            return self._loop
+    
+    def run(self, coroutine: Coroutine[Any, Any, T]) -> T:
+        """Run a coroutine to completion from a synchronous caller."""
+        loop = self._ensure()
+        if threading.current_thread() is self._thread:
+            coroutine.close()
+            raise RuntimeError("Synchronous LLM call made from the LLM client event loop; await the async method instead")
+        future = asyncio.run_coroutine_threadsafe(coroutine, loop)
+        try:
+            return future.result()
+        except BaseException:
+            # The caller gave up (e.g. KeyboardInterrupt); stop the work too
+            future.cancel()
+            raise
+
+
+_loop_thread = _LoopThread()
+
+
+def run_sync(coroutine: Coroutine[Any, Any, T]) -> T:
+    """
+    Run a coroutine on the shared background event loop and wait for it.
+    
+    Args:
+        coroutine: Coroutine to run
+    
+    Returns:
+        The coroutine's result
+    """
+    return _loop_thread.run(coroutine)
+
+
+async def _next(iterator: AsyncIterator[T]) -> Tuple[bool, Optional[T]]:
+    """Next item of an async iterator, as (False, None) once it is exhausted."""
+    try:
+        return True, await iterator.__anext__()
+    except StopAsyncIteration:
+        return False, None
+
+
+def split_messages(messages: List[Dict[str, str]]) -> Tuple[str, List[Dict[str, str]], str]:
+    """
+    Split chat messages into a system instruction, earlier turns and the last user message.
+    
+    Args:
+        messages: Role/content messages
+    
+    Returns:
+        System instruction, history and final message
+    """
+    system = "\n\n".join(m["content"] for m in messages if m["role"] == "system")
+    turns = [m for m in messages if m["role"] != "system"]
+    if turns and turns[-1]["role"] == "user":
+        return system, turns[:-1], turns[-1]["content"]
+    return system, turns, ""
+
+
+class LLMClient:
+    """
+    Base class of async LLM clients.
+    
+    Subclasses implement _complete() and, if the backend can stream,
+    _stream(); the base class adds timeouts, the concurrency limit and metrics.
+    """
+    
+    name = "llm"
+    
+    def __init__(self, timeout: float = None, max_concurrency: int = None):
+        """
+        Initialize the client.
+        
+        Args:
+            timeout: Default seconds allowed per call
+            max_concurrency: Maximum concurrent calls per event loop
+        """
+        self.timeout = timeout or LLM_TIMEOUT
+        self.max_concurrency = max_concurrency or LLM_MAX_CONCURRENCY
+        # asyncio semaphores belong to one event loop
+        self._semaphores: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, asyncio.Semaphore]" = weakref.WeakKeyDictionary()
+        self._metrics = {"requests": 0, "errors": 0, "timeouts": 0, "cancelled": 0, "inFlight": 0, "waiting": 0, "seconds": 0.0}
+        self._lock = threading.Lock()
+    
+    async def _complete(self, messages: List[Dict[str, str]], model: str, temperature: float, max_tokens: int, **options: Any) -> Completion:
+        raise NotImplementedError
+    
+    async def _stream(self, messages: List[Dict[str, str]], model: str, temperature: float, max_tokens: int, **options: Any) -> AsyncGenerator[str, None]:
+        # Backends without streaming deliver the whole completion as one chunk
+        completion = await self._complete(messages, model, temperature, max_tokens, **options)
+        yield completion.text
+    
+    async def _list_models(self) -> List[Dict[str, Any]]:
+        return []
+    
+    def _count(self, key: str, delta: float = 1) -> None:
+        with self._lock:
+            self._metrics[key] += delta
+    
+    @asynccontextmanager
+    async def _slot(self, timeout: float = None) -> AsyncIterator[None]:
+        """
+        Hold one of the concurrency slots and record backend errors. Blocking
+        work started in the slot keeps it until it finishes (see _BlockingClient).
+        """
+        loop = asyncio.get_running_loop()
+        semaphore = self._semaphores.get(loop)
+        if semaphore is None:
+            semaphore = self._semaphores[loop] = asyncio.Semaphore(self.max_concurrency)
+        self._count("waiting")
+        try:
+            await asyncio.wait_for(semaphore.acquire(), timeout)
+        except asyncio.TimeoutError:
+            raise LLMTimeoutError(f"{self.name} call timed out waiting for a free slot")
+        finally:
+            self._count("waiting", -1)
+        started = time.monotonic()
+        self._count("requests")
+        self._count("inFlight")
+        
+        def free() -> None:
+            self._count("inFlight", -1)
+            self._count("seconds", time.monotonic() - started)
+            semaphore.release()
+        
+        slot = _Slot(free)
+        token = _current_slot.set(slot)
+        try:
+            yield
+        except LLMTimeoutError:
+            raise
+        except Exception:
+            self._count("errors")
+            raise
+        finally:
+            _current_slot.reset(token)
+            slot.release()
+    
+    async def complete(
+        self,
+        messages: List[Dict[str, str]],
+        model: str = None,
+        temperature: float = 0.7,
+        max_tokens: int = 1024,
+        timeout: float = None,
+        **options: Any
+    ) -> Completion:
+        """
+        Generate a completion.
+        
+        Args:
+            messages: Role/content messages
+            model: Model to use (the backend's default if None)
+            temperature: Sampling temperature
+            max_tokens: Maximum tokens to generate
+            timeout: Seconds allowed, including time waiting for a slot
+            **options: Backend-specific options
+        
+        Returns:
+            The completion
+        
+        Raises:
+            LLMTimeoutError: If the call timed out
+            LLMClientError: If the backend failed
+        """
+        started = None
+        
+        async def call() -> Completion:
+            nonlocal started
+            async with self._slot():
+                started = time.monotonic()
+                try:
+                    completion = await self._complete(messages, model, temperature, max_tokens, **options)
+                except LLMTimeoutError:
+                    raise
+                except LLMClientError:
+                    model_stats.record(self.name, model, None)
+                    raise
+                model_stats.record(self.name, completion.model or model, time.monotonic() - started)
+                return completion
+        
+        timeout = timeout or self.timeout
+        try:
+            return await asyncio.wait_for(call(), timeout)
+        except (asyncio.TimeoutError, LLMTimeoutError) as e:
+            self._count("timeouts")
+            if started is not None:
+                # Time spent waiting for a slot is not the model's fault
+                model_stats.record(self.name, model, None)
+            if isinstance(e, LLMTimeoutError):
+                raise
+            raise LLMTimeoutError(f"{self.name} call timed out after {timeout:g}s")
+        except asyncio.CancelledError:
+            self._count("cancelled")
+            raise
+    
+    async def stream(
+        self,
+        messages: List[Dict[str, str]],
+        model: str = None,
+        temperature: float = 0.7,
+        max_tokens: int = 1024,
+        timeout: float = None,
+        **options: Any
+    ) -> AsyncGenerator[str, None]:
+        """
+        Stream a completion.
+        
+        Args:
+            messages: Role/content messages
+            model: Model to use (the backend's default if None)
+            temperature: Sampling temperature
+            max_tokens: Maximum tokens to generate
+            timeout: Seconds the backend may take in total, including time waiting for a slot
+            **options: Backend-specific options
+        
+        Yields:
+            Text chunks as they are generated
+        
+        Raises:
+            LLMTimeoutError: If the stream timed out
+            LLMClientError: If the backend failed
+        """
+        timeout = timeout or self.timeout
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + timeout
+        try:
+            async with self._slot(timeout):
+                chunks = self._stream(messages, model, temperature, max_tokens, **options)
+                try:
+                    while True:
+                        # The deadline bounds time spent in the backend, not in the consumer
+                        try:
+                            more, chunk = await asyncio.wait_for(_next(chunks), max(deadline - loop.time(), 0))
+                        except asyncio.TimeoutError:
+                            raise LLMTimeoutError(f"{self.name} stream timed out after {timeout:g}s")
+                        if not more:
+                            break
+                        yield chunk
+                finally:
+                    await chunks.aclose()
+        except LLMTimeoutError:
+            self._count("timeouts")
+            raise
+        except asyncio.CancelledError:
+            self._count("cancelled")
+            raise
+    
+    async def list_models(self, timeout: float = None) -> List[Dict[str, Any]]:
+        """
+        List the models the backend serves.
+        
+        Args:
+            timeout: Seconds allowed
+        
+        Returns:
+            Model descriptions
+        """
+        try:
+            return await asyncio.wait_for(self._list_models(), timeout or self.timeout)
+        except asyncio.TimeoutError:
+            raise LLMTimeoutError(f"{self.name} model listing timed out")
+    
+    def complete_sync(self, messages: List[Dict[str, str]], **kwargs: Any) -> Completion:
+        """Blocking complete() for synchronous callers."""
+        return run_sync(self.complete(messages, **kwargs))
+    
+    def list_models_sync(self, **kwargs: Any) -> List[Dict[str, Any]]:
+        """Blocking list_models() for synchronous callers."""
+        return run_sync(self.list_models(**kwargs))
+    
+    def get_metrics(self) -> Dict[str, Any]:
+        """
+        Get client metrics.
+        
+        Returns:
+            Call counters and in-flight/waiting gauges
+        """
+        with self._lock:
+            metrics = dict(self._metrics)
+        metrics["backend"] = self.name
+        metrics["maxConcurrency"] = self.max_concurrency
+        return metrics
+
+
+class _BlockingClient(LLMClient):
+    """
+    Client for backends reached with blocking calls, run on worker threads.
+    
+    A timed out or cancelled call stops waiting at once, but a blocking call
+    cannot be interrupted: its thread keeps the concurrency slot until it
+    finishes, and the pool has only max_concurrency threads, so the limit
+    bounds the requests actually in flight.
+    """
+    
+    def __init__(self, **kwargs: Any):
+        super().__init__(**kwargs)
+        self._executor = ThreadPoolExecutor(max_workers=self.max_concurrency, thread_name_prefix=f"llm-{self.name}")
+    
+    async def _run(self, function: Callable[..., T], *args: Any) -> T:
+        loop = asyncio.get_running_loop()
+        future = self._executor.submit(function, *args)
+        slot = _current_slot.get()
+        if slot is not None:
+            slot.release_when_done(future, loop)
+        return await asyncio.wrap_future(future)
+
+
+class LLMAPIClient(_BlockingClient):
+    """Client for the LLM API server (POST /chat, GET /models)."""
+    
+    name = "api"
+    
+    def __init__(self, api_url: str = None, api_key: str = None, **kwargs: Any):
+        """
+        Initialize the client.
+        
+        Args:
+            api_url: URL of the LLM API server
+            api_key: API key for authentication
+            **kwargs: timeout and max_concurrency
+        """
+        super().__init__(**kwargs)
+        self.api_url = (api_url or LLM_API_URL).rstrip("/")
+        self.api_key = api_key or LLM_API_KEY
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.max_concurrency)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+    
+    def _post_chat(self, messages: List[Dict[str, str]], model: str, temperature: float, max_tokens: int, force_cloud: bool) -> Dict[str, Any]:
+        data = {
+            "messages": messages,
+            "options": {
+                "model": model or "vicuna-13b",
+                "temperature": temperature,
+                "maxTokens": max_tokens,
+                "forceCloud": force_cloud
+            }
+        }
+        try:
+            response = self.session.post(
+                f"{self.api_url}/chat",
+                headers={"Content-Type": "application/json", "X-API-Key": self.api_key},
+                json=data,
+                timeout=(LLM_CONNECT_TIMEOUT, self.timeout)
+            )
+        except requests.Timeout as e:
+            raise LLMTimeoutError(f"LLM API timed out: {e}")
+        except requests.RequestException as e:
+            raise LLMClientError("Service error", str(e))
+        if response.status_code != 200:
+            logger.error(f"Error from LLM API: {response.status_code} - {response.text}")
+            raise LLMClientError(f"API error: {response.status_code}", response.text)
+        return response.json()
+    
+    async def _complete(self, messages: List[Dict[str, str]], model: str, temperature: float, max_tokens: int, force_cloud: bool = False, **options: Any) -> Completion:
+        raw = await self._run(self._post_chat, messages, model, temperature, max_tokens, force_cloud)
+        try:
+            text = raw["choices"][0]["message"]["content"]
+        except (KeyError, IndexError, TypeError):
+            raise LLMClientError("Malformed LLM API response", raw)
+        return Completion(text, raw.get("model", model), raw)
+    
+    def _get_models(self) -> List[Dict[str, Any]]:
+        try:
+            response = self.session.get(f"{self.api_url}/models", headers={"X-API-Key": self.api_key}, timeout=(LLM_CONNECT_TIMEOUT, self.timeout))
+        except requests.RequestException as e:
+            raise LLMClientError("Service error", str(e))
+        if response.status_code != 200:
+            logger.error(f"Error getting models: {response.status_code} - {response.text}")
+            raise LLMClientError(f"API error: {response.status_code}", response.text)
+        return response.json().get("data", [])
+    
+    async def _list_models(self) -> List[Dict[str, Any]]:
+        return await self._run(self._get_models)
+
+
+class HuggingFaceLLMClient(_BlockingClient):
+    """Client for the Hugging Face Inference API."""
+    
+    name = "huggingface"
+    
+    def __init__(self, service: Any = None, **kwargs: Any):
+        """
+        Initialize the client.
+        
+        Args:
+            service: HuggingFaceService to use (a new one by default)
+            **kwargs: timeout and max_concurrency
+        """
+        super().__init__(**kwargs)
+        if service is None:
+            from huggingface_service import HuggingFaceService
+            service = HuggingFaceService()
+        self.service = service
+    
+    async def _complete(self, messages: List[Dict[str, str]], model: str, temperature: float, max_tokens: int, **options: Any) -> Completion:
+        from huggingface_service import HuggingFaceError
+        system, history, message = split_messages(messages)
+        try:
+            text = await self._run(lambda: self.service.generate_response(system, message, model=model, history=history))
+        except HuggingFaceError as e:
+            raise LLMClientError("Hugging Face error", str(e))
+        return Completion(text, model or self.service.default_model)
+    
+    async def _list_models(self) -> List[Dict[str, Any]]:
+        return [{"id": model} for model in self.service.list_available_models()]
+
+
+class VicunaLLMClient(LLMClient):
+    """Client for Vicuna on an OpenAI-compatible local model server, with true streaming."""
+    
+    name = "vicuna"
+    
+    def __init__(self, client: OpenAICompatibleClient = None, **kwargs: Any):
+        """
+        Initialize the client.
+        
+        Args:
+            client: Streaming client of the model server (VICUNA_API_URL by default)
+            **kwargs: timeout and max_concurrency
+        """
+        super().__init__(**kwargs)
+        self.client = client or OpenAICompatibleClient()
+    
+    async def _stream(self, messages: List[Dict[str, str]], model: str, temperature: float, max_tokens: int, **options: Any) -> AsyncGenerator[str, None]:
+        chunks = self.client.stream_messages(messages, model=model, temperature=temperature, max_tokens=max_tokens)
+        try:
+            async for chunk in chunks:
+                yield chunk
+        except LLMClientError:
+            raise
+        except Exception as e:
+            raise LLMClientError("Vicuna error", str(e))
+        finally:
+            await chunks.aclose()
+    
+    async def _complete(self, messages: List[Dict[str, str]], model: str, temperature: float, max_tokens: int, **options: Any) -> Completion:
+        async with aclosing(self._stream(messages, model, temperature, max_tokens)) as chunks:
+            text = "".join([chunk async for chunk in chunks])
+        return Completion(text, model or self.client.model)
+    
+    async def _list_models(self) -> List[Dict[str, Any]]:
+        try:
+            return await asyncio.get_running_loop().run_in_executor(None, self.client.list_models)
+        except requests.RequestException as e:
+            raise LLMClientError("Vicuna error", str(e))
+
+
+class LegacyLLMClient(_BlockingClient):
+    """Adapts an object with LLMService's chat_completion/extract_assistant_message methods."""
+    
+    name = "legacy"
+    
+    def __init__(self, service: Any, **kwargs: Any):
+        super().__init__(**kwargs)
+        self.service = service
+    
+    async def _complete(self, messages: List[Dict[str, str]], model: str, temperature: float, max_tokens: int, **options: Any) -> Completion:
+        raw = await self._run(lambda: self.service.chat_completion(messages=messages, model=model, temperature=temperature, max_tokens=max_tokens))
+        if "error" in raw:
+            raise LLMClientError(str(raw["error"]), raw.get("details"))
+        text = self.service.extract_assistant_message(raw)
+        if not text:
+            raise LLMClientError("Empty LLM response", raw)
+        return Completion(text, model, raw)
+
+
+def create_llm_client(backend: str = None, **kwargs: Any) -> LLMClient:
+    """
+    Create an LLM client.
+    
+    Args:
+        backend: "api", "huggingface" or "vicuna" (LLM_BACKEND by default)
+        **kwargs: Client options
+    
+    Returns:
+        The client
+    """
+    backend = (backend or LLM_BACKEND).lower()
+    if backend == "huggingface":
+        return HuggingFaceLLMClient(**kwargs)
+    if backend == "vicuna":
+        return VicunaLLMClient(**kwargs)
+    if backend != "api":
+        raise ValueError(f"Unsupported LLM_BACKEND: {backend}. Choose 'api', 'huggingface' or 'vicuna'.")
+    return LLMAPIClient(**kwargs)
@@ -3,11 +3,11 @@ LLM service for the child bot system.
 """
 
 import os
-import requests
-import json
 import logging
 from typing import Dict, List, Any, Optional
 
+from llm_client import LLMAPIClient, LLMClientError
+
 # Configure logging
 logging.basicConfig(
     level=logging.INFO,
@@ -18,18 +18,22 @@ logger = logging.getLogger(__name__)
 class LLMService:
     """
     Service for interacting with language models.
+    
+    A blocking shim over the async LLMAPIClient, for synchronous callers.
     """
     
-    def __init__(self, api_url: str = None, api_key: str = None):
+    def __init__(self, api_url: str = None, api_key: str = None, client: LLMAPIClient = None):
         """
         Initialize the LLM service.
         
         Args:
             api_url: URL of the LLM API server
             api_key: API key for authentication
+            client: Async client to wrap (a new one for api_url by default)
         """
         self.api_url = api_url or os.environ.get("LLM_API_URL", "http://localhost:3001/api")
         self.api_key = api_key or os.environ.get("LLM_API_KEY", "test-api-key")
+        self.client = client or LLMAPIClient(self.api_url, self.api_key)
     
     def chat_completion(
         self,
@@ -53,41 +57,20 @@ class LLMService:
             Response from the LLM API
         """
         try:
-            headers = {
-                "Content-Type": "application/json",
-                "X-API-Key": self.api_key
-            }
-            
-            data = {
-                "messages": messages,
-                "options": {
-                    "model": model,
-                    "temperature": temperature,
-                    "maxTokens": max_tokens,
-                    "forceCloud": force_cloud
-                }
-            }
-            
-            response = requests.post(
-                f"{self.api_url}/chat",
-                headers=headers,
-                json=data
+            completion = self.client.complete_sync(
+                messages,
+                model=model,
+                temperature=temperature,
+                max_tokens=max_tokens,
+                force_cloud=force_cloud
             )
+            return completion.to_response()
             
-            if response.status_code == 200:
-                return response.json()
-            else:
-                logger.error(f"Error from LLM API: {response.status_code} - {response.text}")
-                return {
-                    "error": f"API error: {response.status_code}",
-                    "details": response.text
-                }
-        
-        except Exception as e:
-            logger.exception("Error calling LLM API")
+        except LLMClientError as e:
+            logger.error(f"Error calling LLM API: {e}")
             return {
-                "error": "Service error",
-                "details": str(e)
+                "error": str(e),
+                "details": e.details
             }
     
     def get_available_models(self) -> List[Dict[str, Any]]:
@@ -98,23 +81,10 @@ class LLMService:
             List of available models
         """
         try:
-            headers = {
-                "X-API-Key": self.api_key
-            }
-            
-            response = requests.get(
-                f"{self.api_url}/models",
-                headers=headers
-            )
+            return self.client.list_models_sync()
             
-            if response.status_code == 200:
-                return response.json().get("data", [])
-            else:
-                logger.error(f"Error getting models: {response.status_code} - {response.text}")
-                return []
-        
-        except Exception as e:
-            logger.exception("Error getting models")
+        except LLMClientError as e:
+            logger.error(f"Error getting models: {e}")
             return []
     
     def extract_assistant_message(self, response: Dict[str, Any]) -> Optional[str]:
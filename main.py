@@ -1,6 +1,8 @@
 from flask import Flask, jsonify, send_from_directory, request, Response
 from flask_cors import CORS
+from werkzeug.middleware.proxy_fix import ProxyFix
 import os
+import hmac
 import logging
 import sys
 import argparse
@@ -20,6 +22,17 @@ logger = logging.getLogger(__name__)
 # Import blueprints and services
 from agent_routes import agent_bp
 import personas
+from context_builder import context_builder
+from huggingface_service import HuggingFaceService, DEFAULT_MODEL, HF_MAX_NEW_TOKENS, hedger as hf_hedger
+from conversation import conversation_manager
+from conversation_store import is_valid_conversation_id
+from conversation_summarizer import conversation_summarizer
+from knowledge_retrieval import knowledge_retriever
+from model_catalog import model_catalog, MODEL_CATALOG_MAX_AGE
+from prompt_manager import prompt_manager
+from rate_limiter import rate_limiter, chat_rate_limit, api_key_identity
+from semantic_cache import semantic_cache
+from token_verifier import token_verifier, TokenVerificationError
 from services import AIService
 from user_api_service import UserAPIService
 
@@ -27,13 +40,55 @@ from user_api_service import UserAPIService
 app = Flask(__name__)
 CORS(app)  # Enable CORS for all routes
 
+# Reverse proxies in front of the app (1 on Railway/Render); their X-Forwarded-For
+# entries are trusted for the client address, so only count proxies that set it
+PROXY_FIX_HOPS = int(os.getenv("PROXY_FIX_HOPS", "0"))
+if PROXY_FIX_HOPS:
+    app.wsgi_app = ProxyFix(app.wsgi_app, x_for=PROXY_FIX_HOPS, x_proto=PROXY_FIX_HOPS)
+
+# /api/metrics is only served to callers sending METRICS_TOKEN in X-Metrics-Token,
+# or verified users listed in METRICS_ADMIN_UIDS (comma-separated); otherwise it is off
+METRICS_TOKEN = os.getenv("METRICS_TOKEN", "")
+METRICS_ADMIN_UIDS = {uid.strip() for uid in os.getenv("METRICS_ADMIN_UIDS", "").split(",") if uid.strip()}
+
 # Initialize AI services
 ai_service = AIService()
 user_api_service = UserAPIService()
 
+# Reload edited templates on a background thread, so requests never scan the directory
+prompt_manager.registry.start_watching()
+
 # Register blueprints
 app.register_blueprint(agent_bp, url_prefix='/api')
 
+def verified_user_id():
+    """User ID from a valid Firebase ID token in the Authorization header, else None"""
+    authorization = request.headers.get("Authorization", "")
+    if authorization.startswith("Bearer ") and token_verifier.project_id:
+        try:
+            return token_verifier.verify(authorization[len("Bearer "):])["uid"]
+        except TokenVerificationError:
+            pass
+    return None
+
+def rate_limit_key(user_id) -> str:
+    """Rate limit key of a caller: its verified user ID, else the client address"""
+    if user_id:
+        return "user:" + user_id
+    return "ip:" + (request.remote_addr or "unknown")
+
+def metrics_allowed() -> bool:
+    """Whether the caller may read internal metrics"""
+    token = request.headers.get("X-Metrics-Token", "")
+    if METRICS_TOKEN and hmac.compare_digest(token.encode("utf-8"), METRICS_TOKEN.encode("utf-8")):
+        return True
+    return bool(METRICS_ADMIN_UIDS) and verified_user_id() in METRICS_ADMIN_UIDS
+
+def rate_limited(limit):
+    """429 response for a rejected rate limit check"""
+    error = "Daily quota exceeded" if limit.reason == "quota" else "Rate limit exceeded"
+    return jsonify({"error": error, "retryAfter": limit.retry_after}), 429, limit.headers()
+
 # Default route
 @app.route('/')
 def index():
@@ -62,36 +117,33 @@ def list_personas():
 @app.route('/api/templates', methods=['GET'])
 def list_templates():
     """List available templates"""
+    registry = prompt_manager.registry
     templates = [
         {
-            "id": "blog-post",
-            "name": "Blog Post",
-            "description": "Generate a well-structured blog post"
-        },
-        {
-            "id": "social-media",
-            "name": "Social Media Post",
-            "description": "Create engaging social media content"
-        },
-        {
-            "id": "email",
-            "name": "Email",
-            "description": "Write professional emails"
-        },
-        {
-            "id": "code-explanation",
-            "name": "Code Explanation",
-            "description": "Explain code concepts and snippets"
+            "id": template["id"],
+            "name": template.get("name", template["id"]),
+            "description": template.get("description", ""),
+            "icon": template.get("icon")
         }
+        for template in registry.list()
     ]
-    return jsonify(templates)
+    
+    response = jsonify(templates)
+    response.set_etag(registry.etag)
+    response.headers["Cache-Control"] = "public, no-cache"
+    response.headers["X-Templates-Version"] = str(registry.version)
+    return response.make_conditional(request)
 
 # Models endpoint
 @app.route('/api/models', methods=['GET'])
 def list_models():
-    """List available models"""
-    models = user_api_service.list_available_models()
-    return jsonify(models)
+    """List available models with their observed latency and availability"""
+    catalog = model_catalog.get()
+    response = jsonify(catalog.models)
+    response.set_etag(catalog.etag)
+    response.headers["Cache-Control"] = f"public, max-age={MODEL_CATALOG_MAX_AGE}"
+    response.headers["X-Models-Version"] = str(catalog.version)
+    return response.make_conditional(request)
 
 # Chat endpoint with user-provided API key
 @app.route('/api/chat-with-key', methods=['POST'])
@@ -114,6 +166,12 @@ def chat_with_key():
         if not api_key:
             return jsonify({"error": "API key is required"}), 400
         
+        # Reject over-limit callers before spending the key's upstream quota
+        limit_key = api_key_identity(api_key)
+        limit = rate_limiter.check(limit_key, chat_rate_limit)
+        if not limit.allowed:
+            return rate_limited(limit)
+        
         # Get system instruction for the persona
         system_instruction = personas.get_system_instruction(persona_id)
         
@@ -125,7 +183,11 @@ def chat_with_key():
             model=model
         )
         
-        return jsonify({"response": response})
+        # Hold the key back while the provider is rejecting it
+        if response.startswith("Rate limit exceeded"):
+            rate_limiter.penalize(limit_key, chat_rate_limit)
+        
+        return jsonify({"response": response}), 200, limit.headers()
         
     except Exception as e:
         logger.error(f"Error in chat-with-key endpoint: {e}")
@@ -143,26 +205,73 @@ def chat():
         
         message = data.get("message")
         persona_id = data.get("personaId", "synapse")
+        conversation_id = data.get("conversationId")
         
         if not message:
             return jsonify({"error": "Message is required"}), 400
         
+        if conversation_id and not is_valid_conversation_id(conversation_id):
+            return jsonify({"error": "Invalid conversation ID"}), 400
+        
+        # Verify the ID token once per request
+        user_id = verified_user_id()
+        # The caller's key ("user:<uid>" or "ip:<address>") also owns the conversations it starts
+        caller = rate_limit_key(user_id)
+        limit = rate_limiter.check(caller, chat_rate_limit)
+        if not limit.allowed:
+            return rate_limited(limit)
+        
         # Get system instruction for the persona
         system_instruction = personas.get_system_instruction(persona_id)
         
+        # Conversation IDs come from the client, so only the caller's own conversations are continued
+        conversation = conversation_manager.get_conversation(conversation_id) if conversation_id else None
+        if conversation is not None and conversation.user_id != caller:
+            return jsonify({"error": "Conversation not found"}), 404
+        if conversation is None:
+            conversation = conversation_manager.get_or_create_conversation(user_id=caller, conversation_id=conversation_id)
+        
+        # Select as much history as fits the model's context budget. The user turn is only
+        # persisted together with the reply, so a failed generation leaves no trace
+        user_message = conversation.add_message("user", message, persist=False)
+        context = context_builder.build(conversation, system_prompt=system_instruction, model=DEFAULT_MODEL, max_tokens=HF_MAX_NEW_TOKENS)
+        conversation_summarizer.record_turn(conversation, context, system_instruction)
+        
+        # Opening messages don't depend on earlier turns, so paraphrases can share a cached answer;
+        # answers are only reused for the verified user they were generated for
+        cacheable = len(context.history) == 1 and user_id is not None and semantic_cache.is_enabled_for(persona_id)
+        cached = semantic_cache.lookup(persona_id, system_instruction, message, user_id) if cacheable else None
+        audit = cached is not None and semantic_cache.should_audit()
+        
         # Generate response using the AI service
         def generate():
             try:
-                import asyncio
-                # For simplicity in this Flask app, we'll use the sync version
-                from huggingface_service import HuggingFaceService
-                hf_service = HuggingFaceService()
-                response = hf_service.generate_response(system_instruction, message)
+                if cached and not audit:
+                    response = cached.response
+                else:
+                    # For simplicity in this Flask app, we'll use the sync version
+                    hf_service = HuggingFaceService()
+                    # Raises on failure, so only real answers are audited, cached and recorded.
+                    # The last turn is the message as the context builder fitted it (cut if over budget)
+                    response = hf_service.generate_response(context.system_prompt, context.history[-1]["content"], history=context.history[:-1])
+                    if cached:
+                        semantic_cache.record_audit(cached, response)
+                    if cacheable:
+                        semantic_cache.store(persona_id, system_instruction, message, response, user_id)
+                reply = conversation.add_message("assistant", response, persist=False)
+                conversation.persist_messages([user_message, reply])
+                conversation_summarizer.maybe_schedule(conversation, on_complete=conversation_manager.save_conversation)
                 yield response
             except Exception as e:
+                conversation.discard_message(user_message)
                 yield f"Error: {str(e)}"
         
-        return Response(generate(), mimetype='text/plain')
+        headers = {
+            "X-Conversation-Id": conversation.id,
+            "X-Semantic-Cache": ("hit" if cached else "miss") if cacheable else "bypass",
+            **limit.headers()
+        }
+        return Response(generate(), mimetype='text/plain', headers=headers)
         
     except Exception as e:
         logger.error(f"Error in chat endpoint: {e}")
@@ -191,6 +300,25 @@ def validate_key():
         logger.error(f"Error in validate-key endpoint: {e}")
         return jsonify({"error": str(e)}), 500
 
+# Metrics endpoint
+@app.route('/api/metrics', methods=['GET'])
+def metrics():
+    """Report internal performance metrics (operators only)"""
+    if not metrics_allowed():
+        return jsonify({"error": "Not found"}), 404
+    return jsonify({
+        "summarizer": conversation_summarizer.get_metrics(),
+        "embeddings": knowledge_retriever.pipeline.get_metrics(),
+        "semanticCache": semantic_cache.get_metrics(),
+        "tokenVerifier": token_verifier.get_metrics(),
+        "rateLimiter": rate_limiter.get_metrics(),
+        "keyValidation": user_api_service.key_cache.get_metrics(),
+        "userApiSessions": user_api_service.sessions.get_metrics(),
+        "providers": ai_service.get_metrics(),
+        "hfHedging": hf_hedger.get_metrics(),
+        "modelCatalog": model_catalog.get_metrics()
+    })
+
 # Error handlers
 @app.errorhandler(404)
 def not_found(e):
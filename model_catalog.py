@@ -0,0 +1,407 @@
+"""
+Model catalog served by /api/models.
+Merges each provider's static model list with the models its server reports,
+refreshes the live lists in the background, and annotates every model with
+the latency and availability observed on our own traffic. Requests are served
+from an in-memory snapshot with a content-hash ETag.
+"""
+
+import os
+import json
+import time
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+from typing import Dict, List, Any, Callable, Optional, Tuple
+
+from services import BackendStats
+
+logger = logging.getLogger(__name__)
+
+# Model catalog configuration
+# Providers listed in the catalog, in display order. /api/chat-with-key only calls the
+# Hugging Face Inference API, so other providers are listed only when configured here
+MODEL_CATALOG_PROVIDERS = [p.strip().lower() for p in os.getenv("MODEL_CATALOG_PROVIDERS", "huggingface").split(",") if p.strip()]
+# Seconds between fetches of the providers' live model lists
+MODEL_CATALOG_REFRESH_INTERVAL = float(os.getenv("MODEL_CATALOG_REFRESH_INTERVAL", "300"))
+# Seconds between snapshot rebuilds picking up new traffic statistics
+MODEL_CATALOG_STATS_INTERVAL = float(os.getenv("MODEL_CATALOG_STATS_INTERVAL", "15"))
+MODEL_CATALOG_FETCH_TIMEOUT = float(os.getenv("MODEL_CATALOG_FETCH_TIMEOUT", "10"))
+# max-age of the /api/models response; clients revalidate with the ETag afterwards
+MODEL_CATALOG_MAX_AGE = int(os.getenv("MODEL_CATALOG_MAX_AGE", "30"))
+# Models with at least this many recent requests and a higher error rate are reported unavailable
+MODEL_CATALOG_MIN_SAMPLES = int(os.getenv("MODEL_CATALOG_MIN_SAMPLES", "5"))
+MODEL_CATALOG_MAX_ERROR_RATE = float(os.getenv("MODEL_CATALOG_MAX_ERROR_RATE", "0.5"))
+# Bound on tracked (provider, model) pairs, since model names can come from requests
+MODEL_CATALOG_MAX_TRACKED = int(os.getenv("MODEL_CATALOG_MAX_TRACKED", "512"))
+
+
+def _digest(data: Any) -> str:
+    """Stable content hash of a catalog."""
+    return hashlib.sha1(json.dumps(data, sort_keys=True).encode("utf-8")).hexdigest()
+
+
+def _milliseconds(seconds: Optional[float]) -> Optional[int]:
+    return None if seconds is None else int(round(seconds * 1000))
+
+
+class ModelStats:
+    """
+    Rolling latency and error statistics per (provider, model) from live traffic.
+    
+    The least recently used pairs are dropped beyond max_models.
+    """
+    
+    def __init__(self, max_models: int = None, clock: Callable[[], float] = None):
+        """
+        Initialize the statistics.
+        
+        Args:
+            max_models: Maximum number of tracked (provider, model) pairs
+            clock: Time source, for tests
+        """
+        self.max_models = max_models or MODEL_CATALOG_MAX_TRACKED
+        self.clock = clock
+        self._stats: "OrderedDict[Tuple[str, str], BackendStats]" = OrderedDict()
+        self._lock = threading.Lock()
+    
+    def record(self, provider: str, model: str, latency: Optional[float]) -> None:
+        """
+        Record the outcome of a request.
+        
+        Args:
+            provider: Provider that served the request
+            model: Model ID
+            latency: Seconds to the response (or first chunk), or None if the request failed
+        """
+        if not model:
+            return
+        key = (provider, model)
+        with self._lock:
+            stats = self._stats.get(key)
+            if stats is None:
+                stats = self._stats[key] = BackendStats(clock=self.clock)
+                while len(self._stats) > self.max_models:
+                    self._stats.popitem(last=False)
+            else:
+                self._stats.move_to_end(key)
+        stats.record(latency)
+    
+    def get(self, provider: str, model: str) -> Optional[Dict[str, Any]]:
+        """
+        Get a model's statistics.
+        
+        Args:
+            provider: Provider name
+            model: Model ID
+        
+        Returns:
+            Sample count, error rate and p50/p95 latency, or None without traffic
+        """
+        with self._lock:
+            stats = self._stats.get((provider, model))
+        return stats.snapshot() if stats is not None else None
+
+
+# Shared statistics, recorded by the LLM clients
+model_stats = ModelStats()
+
+
+class ModelSource:
+    """A provider's models: a static list, optionally merged with a live listing."""
+    
+    def __init__(self, provider: str, static: List[Dict[str, Any]] = None, fetch: Callable[[], List[Any]] = None):
+        """
+        Initialize the source.
+        
+        Args:
+            provider: Provider name, as recorded in the model statistics
+            static: Known models as dicts with id and optional name and description
+            fetch: Returns the models the provider currently serves, as IDs or dicts with an id
+        """
+        self.provider = provider
+        self.static = [dict(model) for model in static or []]
+        self.fetch = fetch
+        # Last successful live listing by model ID; kept when a later fetch fails
+        self.live: Optional["OrderedDict[str, Dict[str, Any]]"] = None
+        self.fetched_at: Optional[float] = None
+        self.last_error: Optional[str] = None
+        self.fetches = 0
+        self.failures = 0
+    
+    def refresh(self) -> bool:
+        """
+        Fetch the live listing.
+        
+        Returns:
+            Whether the fetch succeeded (always True without a live listing)
+        """
+        if self.fetch is None:
+            return True
+        self.fetches += 1
+        try:
+            models = self.fetch()
+        except Exception as e:
+            self.failures += 1
+            self.last_error = str(e)
+            logger.warning(f"Error listing {self.provider} models: {e}")
+            return False
+        live = OrderedDict()
+        for model in models or []:
+            entry = {"id": model} if isinstance(model, str) else dict(model)
+            if entry.get("id"):
+                live[entry["id"]] = entry
+        self.live = live
+        self.fetched_at = time.time()
+        self.last_error = None
+        return True
+    
+    def models(self) -> List[Dict[str, Any]]:
+        """
+        Merge the static and live lists.
+        
+        Returns:
+            Models with id, name, description, provider, source and listed
+            (False for static models the provider does not report, or while a
+            live provider has never been reached)
+        """
+        merged: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+        for model in self.static:
+            merged[model["id"]] = {
+                "id": model["id"],
+                "name": model.get("name", model["id"]),
+                "description": model.get("description", ""),
+                "provider": self.provider,
+                "source": "static",
+                "listed": self.fetch is None or (self.live is not None and model["id"] in self.live)
+            }
+        for model_id, model in (self.live or {}).items():
+            if model_id in merged:
+                merged[model_id]["source"] = "static+live"
+                continue
+            merged[model_id] = {
+                "id": model_id,
+                "name": model.get("name", model_id),
+                "description": model.get("description", ""),
+                "provider": self.provider,
+                "source": "live",
+                "listed": True
+            }
+        return list(merged.values())
+    
+    def status(self) -> Dict[str, Any]:
+        """Fetch status of the source."""
+        return {
+            "live": self.fetch is not None,
+            "fetchedAt": self.fetched_at,
+            "fetches": self.fetches,
+            "failures": self.failures,
+            "lastError": self.last_error
+        }
+
+
+def default_sources(providers: List[str] = None) -> List[ModelSource]:
+    """
+    Create the catalog sources of the configured providers.
+    
+    Args:
+        providers: Provider names (MODEL_CATALOG_PROVIDERS by default)
+    
+    Returns:
+        The sources
+    """
+    # Imported here: the clients record their traffic into this module's statistics
+    from llm_client import LLMAPIClient
+    from openai_compatible import OpenAICompatibleClient
+    from user_api_service import POPULAR_MODELS
+    
+    sources = []
+    for provider in providers or MODEL_CATALOG_PROVIDERS:
+        if provider == "huggingface":
+            sources.append(ModelSource("huggingface", static=POPULAR_MODELS))
+        elif provider == "api":
+            client = LLMAPIClient(timeout=MODEL_CATALOG_FETCH_TIMEOUT)
+            sources.append(ModelSource("api", fetch=lambda client=client: client.list_models_sync()))
+        elif provider == "vicuna":
+            client = OpenAICompatibleClient()
+            sources.append(ModelSource(
+                "vicuna",
+                static=[{"id": client.model, "name": "Vicuna", "description": "Self-hosted Vicuna model"}],
+                fetch=lambda client=client: client.list_models(timeout=MODEL_CATALOG_FETCH_TIMEOUT)
+            ))
+        else:
+            logger.warning(f"Unknown model catalog provider: {provider}")
+    return sources
+
+
+class CatalogSnapshot:
+    """An immutable rendering of the catalog."""
+    
+    def __init__(self, models: List[Dict[str, Any]], etag: str, version: int):
+        self.models = models
+        self.etag = etag
+        self.version = version
+
+
+class ModelCatalog:
+    """
+    Cached model catalog with background refresh.
+    
+    Requests read the current snapshot from memory. A daemon thread, started
+    on first access, re-fetches the live listings every refresh interval and
+    rebuilds the snapshot with fresh traffic statistics every stats interval.
+    A failed fetch keeps the provider's last listing. The snapshot (and its
+    ETag) only changes when its content does.
+    """
+    
+    def __init__(
+        self,
+        sources: List[ModelSource] = None,
+        stats: ModelStats = None,
+        refresh_interval: float = None,
+        stats_interval: float = None,
+        min_samples: int = None,
+        max_error_rate: float = None
+    ):
+        """
+        Initialize the catalog.
+        
+        Args:
+            sources: Model sources (the configured providers' by default, created on first access)
+            stats: Traffic statistics (the shared model_stats by default)
+            refresh_interval: Seconds between live listing fetches
+            stats_interval: Seconds between snapshot rebuilds
+            min_samples: Requests needed before the error rate can mark a model unavailable
+            max_error_rate: Error rate above which a model is reported unavailable
+        """
+        self._sources = sources
+        self.stats = stats or model_stats
+        self.refresh_interval = MODEL_CATALOG_REFRESH_INTERVAL if refresh_interval is None else refresh_interval
+        self.stats_interval = MODEL_CATALOG_STATS_INTERVAL if stats_interval is None else stats_interval
+        self.min_samples = min_samples or MODEL_CATALOG_MIN_SAMPLES
+        self.max_error_rate = MODEL_CATALOG_MAX_ERROR_RATE if max_error_rate is None else max_error_rate
+        self._snapshot: Optional[CatalogSnapshot] = None
+        self._last_refresh = 0.0
+        self._lock = threading.RLock()
+        self._worker: Optional[threading.Thread] = None
+        self._stop_event = threading.Event()
+        self.refreshes = 0
+    
+    @property
+    def sources(self) -> List[ModelSource]:
+        with self._lock:
+            if self._sources is None:
+                self._sources = default_sources()
+            return self._sources
+    
+    def get(self) -> CatalogSnapshot:
+        """
+        Get the current catalog.
+        
+        The first call serves the static lists and starts the background
+        refresh, so it never waits on a provider.
+        
+        Returns:
+            The snapshot
+        """
+        snapshot = self._snapshot
+        if snapshot is None:
+            with self._lock:
+                if self._snapshot is None:
+                    self.rebuild()
+                snapshot = self._snapshot
+            self.start()
+        return snapshot
+    
+    def refresh(self) -> CatalogSnapshot:
+        """
+        Fetch the live listings and rebuild the snapshot.
+        
+        Returns:
+            The new snapshot
+        """
+        for source in self.sources:
+            source.refresh()
+        self._last_refresh = time.monotonic()
+        self.refreshes += 1
+        return self.rebuild()
+    
+    def rebuild(self) -> CatalogSnapshot:
+        """
+        Rebuild the snapshot from the sources and the current traffic statistics.
+        
+        Returns:
+            The snapshot, unchanged if its content is
+        """
+        models = []
+        for source in self.sources:
+            for model in source.models():
+                models.append(self._annotate(model, self.stats.get(source.provider, model["id"])))
+        etag = _digest(models)
+        with self._lock:
+            if self._snapshot is None or self._snapshot.etag != etag:
+                version = self._snapshot.version + 1 if self._snapshot else 1
+                self._snapshot = CatalogSnapshot(models, etag, version)
+            return self._snapshot
+    
+    def _annotate(self, model: Dict[str, Any], stats: Optional[Dict[str, Any]]) -> Dict[str, Any]:
+        """Add observed latency and availability to a catalog entry."""
+        listed = model.pop("listed")
+        samples = stats["samples"] if stats else 0
+        error_rate = round(stats["errorRate"], 3) if stats else None
+        failing = samples >= self.min_samples and error_rate > self.max_error_rate
+        model.update({
+            "available": listed and not failing,
+            "latencyMs": {"p50": _milliseconds(stats["p50"]), "p95": _milliseconds(stats["p95"])} if stats else None,
+            "samples": samples,
+            "errorRate": error_rate
+        })
+        return model
+    
+    def start(self) -> None:
+        """Start the background refresh thread."""
+        with self._lock:
+            if self._worker and self._worker.is_alive():
+                return
+            self._stop_event.clear()
+            self._worker = threading.Thread(target=self._run, name="model-catalog-refresh", daemon=True)
+            self._worker.start()
+    
+    def stop(self) -> None:
+        """Stop the background refresh thread, if running."""
+        self._stop_event.set()
+        if self._worker:
+            self._worker.join(timeout=MODEL_CATALOG_FETCH_TIMEOUT + 1)
+            self._worker = None
+    
+    def _run(self) -> None:
+        """Background refresh loop; fetches the live listings at once, then on the interval."""
+        while not self._stop_event.is_set():
+            try:
+                if self.refreshes == 0 or time.monotonic() - self._last_refresh >= self.refresh_interval:
+                    self.refresh()
+                else:
+                    self.rebuild()
+            except Exception as e:
+                logger.error(f"Error refreshing model catalog: {e}")
+            self._stop_event.wait(self.stats_interval)
+    
+    def get_metrics(self) -> Dict[str, Any]:
+        """
+        Get catalog metrics.
+        
+        Returns:
+            Snapshot version, model count and the fetch status of each provider
+        """
+        snapshot = self._snapshot
+        return {
+            "version": snapshot.version if snapshot else 0,
+            "models": len(snapshot.models) if snapshot else 0,
+            "refreshes": self.refreshes,
+            "providers": {source.provider: source.status() for source in self._sources or []}
+        }
+
+
+# Singleton catalog served by /api/models
+model_catalog = ModelCatalog()
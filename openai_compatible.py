@@ -0,0 +1,213 @@
+"""
+Streaming client for OpenAI-compatible chat completion servers.
+Serves the Vicuna provider from self-hosted model servers such as vLLM or
+llama.cpp, reusing pooled keep-alive connections.
+"""
+
+import os
+import json
+import time
+import logging
+from contextlib import aclosing
+from typing import Dict, List, Any, AsyncGenerator
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from sse_client import StreamMetrics, stream_sse
+
+logger = logging.getLogger(__name__)
+
+# Local model server configuration
+VICUNA_API_URL = os.getenv("VICUNA_API_URL", "http://localhost:8000/v1")
+VICUNA_MODEL = os.getenv("VICUNA_MODEL", "vicuna-13b")
+VICUNA_API_KEY = os.getenv("VICUNA_API_KEY")
+VICUNA_CONNECT_TIMEOUT = float(os.getenv("VICUNA_CONNECT_TIMEOUT", "5"))
+VICUNA_READ_TIMEOUT = float(os.getenv("VICUNA_READ_TIMEOUT", "60"))
+VICUNA_POOL_SIZE = int(os.getenv("VICUNA_POOL_SIZE", "16"))
+
+
+class OpenAICompatibleClient:
+    """Streams chat completions from an OpenAI-compatible /v1/chat/completions endpoint."""
+    
+    def __init__(
+        self,
+        base_url: str = None,
+        model: str = None,
+        api_key: str = None,
+        temperature: float = 0.7,
+        max_tokens: int = 1024,
+        max_buffered: int = None
+    ):
+        """
+        Initialize the client.
+        
+        Args:
+            base_url: API base URL including the version, e.g. http://localhost:8000/v1
+            model: Model name served by the server
+            api_key: Bearer token, if the server requires one
+            temperature: Sampling temperature
+            max_tokens: Maximum tokens per response
+            max_buffered: Chunks read ahead of the consumer before reading pauses
+        """
+        self.base_url = (base_url or VICUNA_API_URL).rstrip("/")
+        self.url = f"{self.base_url}/chat/completions"
+        self.model = model or VICUNA_MODEL
+        self.temperature = temperature
+        self.max_tokens = max_tokens
+        self.max_buffered = max_buffered
+        self.timeout = (VICUNA_CONNECT_TIMEOUT, VICUNA_READ_TIMEOUT)
+        
+        self.headers = {"Content-Type": "application/json"}
+        api_key = api_key or VICUNA_API_KEY
+        if api_key:
+            self.headers["Authorization"] = f"Bearer {api_key}"
+        
+        # Keep-alive connections to the model server are reused across requests
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=VICUNA_POOL_SIZE)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+        self.metrics = StreamMetrics()
+    
+    def build_request(self, system_instruction: str, message: str, history: List[Dict[str, str]] = None) -> Dict[str, Any]:
+        """
+        Build a streaming chat completion request body.
+        
+        Args:
+            system_instruction: System prompt or instruction
+            message: User message
+            history: Earlier conversation turns as role/content dicts, oldest first
+        
+        Returns:
+            Request body
+        """
+        messages = [{"role": "system", "content": system_instruction}] if system_instruction else []
+        messages.extend({"role": turn["role"], "content": turn["content"]} for turn in history or [])
+        messages.append({"role": "user", "content": message})
+        return self.messages_request(messages)
+    
+    def messages_request(self, messages: List[Dict[str, str]], model: str = None, temperature: float = None, max_tokens: int = None) -> Dict[str, Any]:
+        """
+        Build a streaming chat completion request body from chat messages.
+        
+        Args:
+            messages: Role/content messages, including any system message
+            model: Model name (the client's model by default)
+            temperature: Sampling temperature (the client's by default)
+            max_tokens: Maximum tokens (the client's by default)
+        
+        Returns:
+            Request body
+        """
+        return {
+            "model": model or self.model,
+            "messages": messages,
+            "temperature": self.temperature if temperature is None else temperature,
+            "max_tokens": max_tokens or self.max_tokens,
+            "stream": True
+        }
+    
+    async def stream(self, system_instruction: str, message: str, history: List[Dict[str, str]] = None) -> AsyncGenerator[str, None]:
+        """
+        Stream a chat completion.
+        
+        Args:
+            system_instruction: System prompt or instruction
+            message: User message
+            history: Earlier conversation turns as role/content dicts, oldest first
+        
+        Yields:
+            Content deltas as they are generated
+        
+        Raises:
+            RuntimeError: If the server reports an error
+        """
+        async with aclosing(self._stream(self.build_request(system_instruction, message, history))) as chunks:
+            async for chunk in chunks:
+                yield chunk
+    
+    async def stream_messages(self, messages: List[Dict[str, str]], **options: Any) -> AsyncGenerator[str, None]:
+        """
+        Stream a chat completion for a list of chat messages.
+        
+        Args:
+            messages: Role/content messages, including any system message
+            **options: model, temperature and max_tokens overrides
+        
+        Yields:
+            Content deltas as they are generated
+        """
+        async with aclosing(self._stream(self.messages_request(messages, **options))) as chunks:
+            async for chunk in chunks:
+                yield chunk
+    
+    async def _stream(self, body: Dict[str, Any]) -> AsyncGenerator[str, None]:
+        """Stream the content deltas of a request body."""
+        started = time.monotonic()
+        first_token = None
+        chunks = 0
+        failed = False
+        done = False
+        try:
+            async for event in stream_sse(self.session, self.url, json=body, headers=self.headers, timeout=self.timeout, max_buffered=self.max_buffered):
+                # Read on to the end of the body after [DONE] so the connection goes back to the pool
+                if done:
+                    continue
+                if event.data.strip() == "[DONE]":
+                    done = True
+                    continue
+                chunk = json.loads(event.data)
+                if "error" in chunk:
+                    error = chunk["error"]
+                    raise RuntimeError(f"Model server error: {error.get('message', error) if isinstance(error, dict) else error}")
+                
+                choices = chunk.get("choices") or [{}]
+                text = (choices[0].get("delta") or {}).get("content")
+                if not text:
+                    # Role announcements and the final finish_reason chunk carry no content
+                    continue
+                if first_token is None:
+                    first_token = time.monotonic() - started
+                    logger.debug(f"{body['model']} time to first token: {first_token * 1000:.0f} ms")
+                chunks += 1
+                yield text
+        except Exception:
+            failed = True
+            raise
+        finally:
+            self.metrics.record(time.monotonic() - started, first_token, chunks, failed)
+    
+    def list_models(self, timeout: float = None) -> List[Dict[str, Any]]:
+        """
+        List the models the server serves (GET /models).
+        
+        Args:
+            timeout: Read timeout in seconds (the client's by default)
+        
+        Returns:
+            Model descriptions with at least an id
+        
+        Raises:
+            requests.RequestException: On connection errors and error statuses
+        """
+        response = self.session.get(
+            f"{self.base_url}/models",
+            headers=self.headers,
+            timeout=(self.timeout[0], timeout or self.timeout[1])
+        )
+        response.raise_for_status()
+        return response.json().get("data", [])
+    
+    def get_metrics(self) -> Dict[str, Any]:
+        """
+        Get streaming metrics.
+        
+        Returns:
+            Counters and time-to-first-token percentiles in seconds
+        """
+        return self.metrics.get_metrics()
+    
+    def close(self) -> None:
+        """Close the pooled connections."""
+        self.session.close()
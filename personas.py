@@ -7,14 +7,16 @@ PERSONAS = {
         "name": "Synapse",
         "icon": "🧠",
         "tagline": "Your core AI assistant.",
-        "system_instruction": "You are Synapse, a helpful and versatile AI assistant. Be concise and informative."
+        "system_instruction": "You are Synapse, a helpful and versatile AI assistant. Be concise and informative.",
+        "semantic_cache": {"enabled": True, "threshold": 0.92, "ttl": 86400}
     },
     "tutor": {
         "id": "tutor",
         "name": "AI Tutor",
         "icon": "🧑‍🏫",
         "tagline": "Explains complex topics simply.",
-        "system_instruction": "You are an AI Tutor. Explain concepts clearly and patiently. Break down complex ideas into smaller, understandable parts. Encourage questions."
+        "system_instruction": "You are an AI Tutor. Explain concepts clearly and patiently. Break down complex ideas into smaller, understandable parts. Encourage questions.",
+        "semantic_cache": {"enabled": True, "threshold": 0.9, "ttl": 7 * 86400}
     },
     "content-creator": {
         "id": "content-creator",
@@ -30,7 +32,8 @@ PERSONAS = {
     #     "name": "Prompt Creator",
     #     "icon": "💡",
     #     "tagline": "Helps craft effective prompts.",
-    #     "system_instruction": "You are an AI Prompt Creator..."
+    #     "system_instruction": "You are an AI Prompt Creator...",
+    #     "semantic_cache": {"enabled": True, "threshold": 0.9, "ttl": 86400}  # optional opt-in
     # },
 }
 
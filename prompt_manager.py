@@ -2,17 +2,17 @@
 Prompt manager module for handling prompt enhancement through questionnaires.
 """
 
-import json
 import logging
 import os
 import re
 from typing import Dict, Any, List, Optional, Tuple
 
+from template_registry import TemplateRegistry
+
 logger = logging.getLogger(__name__)
 
 # Base directory for prompt templates
 TEMPLATES_DIR = os.path.join(os.path.dirname(os.path.dirname(__file__)), "data", "templates")
-os.makedirs(TEMPLATES_DIR, exist_ok=True)
 
 # Default questionnaire templates
 DEFAULT_TEMPLATES = {
@@ -282,38 +282,8 @@ class PromptManager:
             templates_dir: Directory for storing prompt templates
         """
         self.templates_dir = templates_dir or TEMPLATES_DIR
-        self._templates = {}
-        self._load_default_templates()
-        self._load_custom_templates()
-    
-    def _load_default_templates(self):
-        """Load the default templates."""
-        for template_id, template_data in DEFAULT_TEMPLATES.items():
-            self._templates[template_id] = template_data
-            
-            # Save default templates to disk if they don't exist
-            file_path = os.path.join(self.templates_dir, f"{template_id}.json")
-            if not os.path.exists(file_path):
-                os.makedirs(self.templates_dir, exist_ok=True)
-                with open(file_path, 'w') as f:
-                    json.dump(template_data, f, indent=2)
-    
-    def _load_custom_templates(self):
-        """Load custom templates from the templates directory."""
-        if not os.path.exists(self.templates_dir):
-            return
-        
-        for filename in os.listdir(self.templates_dir):
-            if filename.endswith('.json'):
-                template_id = os.path.splitext(filename)[0]
-                if template_id not in self._templates:  # Don't overwrite default templates
-                    file_path = os.path.join(self.templates_dir, filename)
-                    try:
-                        with open(file_path, 'r') as f:
-                            template_data = json.load(f)
-                            self._templates[template_id] = template_data
-                    except Exception as e:
-                        logger.error(f"Error loading template from {file_path}: {e}")
+        # Templates are loaded lazily and hot-reloaded from disk; built-ins stay in memory
+        self.registry = TemplateRegistry(self.templates_dir, DEFAULT_TEMPLATES)
     
     def select_template(self, message: str) -> str:
         """
@@ -334,7 +304,7 @@ class PromptManager:
         }
         
         # Count keyword matches for each template
-        template_scores = {template_id: 0 for template_id in self._templates.keys()}
+        template_scores = {template_id: 0 for template_id in self.registry.ids()}
         
         for template_id, keywords in template_keywords.items():
             for keyword in keywords:
@@ -360,7 +330,7 @@ class PromptManager:
         Returns:
             Template data or None if not found
         """
-        return self._templates.get(template_id)
+        return self.registry.get(template_id)
     
     def list_templates(self) -> List[Dict[str, Any]]:
         """
@@ -369,7 +339,7 @@ class PromptManager:
         Returns:
             List of templates with their IDs
         """
-        return [{"id": template_id, **template_data} for template_id, template_data in self._templates.items()]
+        return self.registry.list()
     
     def get_current_question(self, conversation: Any) -> str:
         """
@@ -420,6 +390,7 @@ class PromptManager:
         # Increment the current question index
         current_index = conversation.questionnaire.get("currentQuestionIndex", 0)
         conversation.questionnaire["currentQuestionIndex"] = current_index + 1
+        conversation.persist_metadata()
         
         return self.get_current_question(conversation)
     
@@ -494,6 +465,7 @@ class PromptManager:
             conversation.questionnaire["answers"] = {}
         
         conversation.questionnaire["answers"][question_id] = processed_answer
+        conversation.persist_metadata()
     
     def generate_prompt(self, conversation: Any) -> str:
         """
@@ -0,0 +1,394 @@
+"""
+Rate limiting and daily quotas for chat endpoints.
+Requests are admitted by a token bucket and a per-day counter keyed by user ID
+or hashed API key, so traffic that would exceed a limit is rejected before it
+reaches (and spends quota at) the upstream provider.
+"""
+
+import os
+import math
+import time
+import logging
+import threading
+from typing import Dict, Any, Callable, Optional
+
+from api_key_cache import key_fingerprint, API_KEY_HASH_SALT
+
+logger = logging.getLogger(__name__)
+
+# Try to import redis for the shared backend
+try:
+    import redis
+    REDIS_AVAILABLE = True
+except ImportError:
+    REDIS_AVAILABLE = False
+
+# Rate limit configuration
+RATE_LIMIT_ENABLED = os.getenv("RATE_LIMIT_ENABLED", "true").lower() in ("1", "true", "yes")
+RATE_LIMIT_BACKEND = os.getenv("RATE_LIMIT_BACKEND", "memory").lower()
+RATE_LIMIT_REDIS_URL = os.getenv("RATE_LIMIT_REDIS_URL", "redis://localhost:6379/0")
+RATE_LIMIT_PER_MINUTE = float(os.getenv("RATE_LIMIT_PER_MINUTE", "30"))
+RATE_LIMIT_BURST = int(os.getenv("RATE_LIMIT_BURST", "10"))
+# Requests per key per UTC day (0 disables the quota)
+RATE_LIMIT_DAILY_QUOTA = int(os.getenv("RATE_LIMIT_DAILY_QUOTA", "1000"))
+# Seconds a key is held back after the upstream provider answered 429
+RATE_LIMIT_UPSTREAM_COOLDOWN = float(os.getenv("RATE_LIMIT_UPSTREAM_COOLDOWN", "30"))
+
+# Idle in-memory entries are pruned every this many checks
+_PRUNE_INTERVAL = 10000
+
+
+def api_key_identity(api_key: str) -> str:
+    """
+    Rate limit key of an API key. The key itself is never stored.
+    
+    Args:
+        api_key: The provider API key
+    
+    Returns:
+        A namespaced salted HMAC of the key
+    """
+    return "key:" + key_fingerprint(api_key).hex()[:32]
+
+
+class RateLimitPolicy:
+    """
+    Limits applied to one key: a token bucket and an optional daily quota.
+    """
+    
+    def __init__(self, per_minute: float = None, burst: int = None, daily_quota: int = None):
+        """
+        Initialize a policy.
+        
+        Args:
+            per_minute: Sustained requests per minute (bucket refill rate)
+            burst: Bucket capacity
+            daily_quota: Requests per UTC day (0 for unlimited)
+        """
+        self.per_minute = per_minute or RATE_LIMIT_PER_MINUTE
+        self.burst = burst or RATE_LIMIT_BURST
+        self.daily_quota = RATE_LIMIT_DAILY_QUOTA if daily_quota is None else daily_quota
+    
+    @property
+    def rate(self) -> float:
+        """Refill rate in tokens per second."""
+        return self.per_minute / 60.0
+
+
+class RateLimitResult:
+    """
+    Outcome of a rate limit check.
+    """
+    
+    def __init__(
+        self,
+        allowed: bool,
+        policy: RateLimitPolicy,
+        tokens: float,
+        quota_used: int,
+        now: float,
+        reason: Optional[str] = None
+    ):
+        """
+        Initialize a result.
+        
+        Args:
+            allowed: Whether the request may proceed
+            policy: The policy that was applied
+            tokens: Tokens left in the bucket after the check
+            quota_used: Requests counted against today's quota
+            now: Time of the check (epoch seconds)
+            reason: "rate" or "quota" when rejected
+        """
+        self.allowed = allowed
+        self.policy = policy
+        self.tokens = tokens
+        self.quota_used = quota_used
+        self.now = now
+        self.reason = reason
+    
+    @property
+    def retry_after(self) -> int:
+        """Seconds until a request would be admitted (0 if allowed)."""
+        if self.allowed:
+            return 0
+        if self.reason == "quota":
+            return self.quota_reset
+        return max(1, math.ceil((1 - self.tokens) / self.policy.rate))
+    
+    @property
+    def quota_reset(self) -> int:
+        """Seconds until the daily quota resets (midnight UTC)."""
+        return max(1, math.ceil(86400 - self.now % 86400))
+    
+    def headers(self) -> Dict[str, str]:
+        """
+        Standard rate limit response headers.
+        
+        Returns:
+            X-RateLimit-* headers (Reset is seconds until the bucket is full),
+            X-Quota-* headers when a daily quota applies, and Retry-After when rejected
+        """
+        policy = self.policy
+        headers = {
+            "X-RateLimit-Limit": str(policy.burst),
+            "X-RateLimit-Remaining": str(max(0, int(self.tokens))),
+            "X-RateLimit-Reset": str(max(0, math.ceil((policy.burst - self.tokens) / policy.rate)))
+        }
+        if policy.daily_quota:
+            headers["X-Quota-Limit"] = str(policy.daily_quota)
+            headers["X-Quota-Remaining"] = str(max(0, policy.daily_quota - self.quota_used))
+            headers["X-Quota-Reset"] = str(self.quota_reset)
+        if not self.allowed:
+            headers["Retry-After"] = str(self.retry_after)
+        return headers
+
+
+class RateLimiter:
+    """
+    Interface for rate limiter backends.
+    """
+    
+    def __init__(self, enabled: bool = None, clock: Callable[[], float] = None):
+        """
+        Initialize the limiter.
+        
+        Args:
+            enabled: Global switch (defaults to RATE_LIMIT_ENABLED)
+            clock: Time source, for tests
+        """
+        self.enabled = RATE_LIMIT_ENABLED if enabled is None else enabled
+        self.clock = clock or time.time
+        self._metrics_lock = threading.Lock()
+        self._metrics = {"allowed": 0, "rejectedRate": 0, "rejectedQuota": 0, "penalties": 0, "backendErrors": 0}
+    
+    def check(self, key: str, policy: RateLimitPolicy, cost: int = 1) -> RateLimitResult:
+        """
+        Admit or reject a request, consuming tokens and quota if admitted.
+        
+        Args:
+            key: Rate limit key (e.g. "user:<uid>" or api_key_identity())
+            policy: Limits to apply
+            cost: Tokens and quota the request consumes
+        
+        Returns:
+            The result (always allowed when the limiter is disabled)
+        """
+        now = self.clock()
+        if not self.enabled:
+            return RateLimitResult(True, policy, policy.burst, 0, now)
+        try:
+            result = self._check(key, policy, cost, now)
+        except Exception as e:
+            # Fail open: an unavailable limiter store must not take the API down
+            self._count("backendErrors")
+            logger.error(f"Rate limiter error for {key}: {e}")
+            return RateLimitResult(True, policy, policy.burst, 0, now)
+        self._count("allowed" if result.allowed else ("rejectedQuota" if result.reason == "quota" else "rejectedRate"))
+        return result
+    
+    def penalize(self, key: str, policy: RateLimitPolicy, seconds: float = None) -> None:
+        """
+        Empty a key's bucket so it refills only after a delay (e.g. after an upstream 429).
+        
+        Args:
+            key: Rate limit key
+            policy: The key's policy
+            seconds: Delay before the next request is admitted
+        """
+        if not self.enabled:
+            return
+        seconds = RATE_LIMIT_UPSTREAM_COOLDOWN if seconds is None else seconds
+        try:
+            self._set_tokens(key, policy, 1 - seconds * policy.rate, self.clock())
+            self._count("penalties")
+        except Exception as e:
+            self._count("backendErrors")
+            logger.error(f"Rate limiter error for {key}: {e}")
+    
+    def _check(self, key: str, policy: RateLimitPolicy, cost: int, now: float) -> RateLimitResult:
+        raise NotImplementedError
+    
+    def _set_tokens(self, key: str, policy: RateLimitPolicy, tokens: float, now: float) -> None:
+        raise NotImplementedError
+    
+    def _count(self, name: str) -> None:
+        with self._metrics_lock:
+            self._metrics[name] += 1
+    
+    def get_metrics(self) -> Dict[str, Any]:
+        """
+        Get limiter metrics.
+        
+        Returns:
+            Admission counters and the backend name
+        """
+        with self._metrics_lock:
+            metrics = dict(self._metrics)
+        metrics["enabled"] = self.enabled
+        metrics["backend"] = type(self).__name__
+        return metrics
+
+
+class InMemoryRateLimiter(RateLimiter):
+    """
+    Process-local limiter. Limits are per process; use the Redis backend to
+    share them between workers.
+    """
+    
+    def __init__(self, enabled: bool = None, clock: Callable[[], float] = None):
+        super().__init__(enabled, clock)
+        # key -> [tokens, last update]
+        self._buckets: Dict[str, list] = {}
+        # key -> [UTC day number, requests that day]
+        self._quotas: Dict[str, list] = {}
+        self._lock = threading.Lock()
+        self._checks = 0
+    
+    def _check(self, key: str, policy: RateLimitPolicy, cost: int, now: float) -> RateLimitResult:
+        day = int(now // 86400)
+        with self._lock:
+            bucket = self._buckets.get(key)
+            if bucket is None:
+                bucket = self._buckets[key] = [float(policy.burst), now]
+            tokens = min(float(policy.burst), bucket[0] + max(0.0, now - bucket[1]) * policy.rate)
+            
+            quota = self._quotas.get(key)
+            if quota is None or quota[0] != day:
+                quota = self._quotas[key] = [day, 0]
+            
+            reason = None
+            if tokens < cost:
+                reason = "rate"
+            elif policy.daily_quota and quota[1] + cost > policy.daily_quota:
+                reason = "quota"
+            else:
+                tokens -= cost
+                quota[1] += cost
+            bucket[0], bucket[1] = tokens, now
+            
+            self._checks += 1
+            if self._checks % _PRUNE_INTERVAL == 0:
+                self._prune(policy, now)
+            return RateLimitResult(reason is None, policy, tokens, quota[1], now, reason)
+    
+    def _set_tokens(self, key: str, policy: RateLimitPolicy, tokens: float, now: float) -> None:
+        with self._lock:
+            self._buckets[key] = [tokens, now]
+    
+    def _prune(self, policy: RateLimitPolicy, now: float) -> None:
+        """Drop buckets that have refilled completely and quotas of past days (caller holds the lock)."""
+        day = int(now // 86400)
+        full = [key for key, bucket in self._buckets.items() if bucket[0] + (now - bucket[1]) * policy.rate >= policy.burst]
+        for key in full:
+            del self._buckets[key]
+        for key in [key for key, quota in self._quotas.items() if quota[0] != day]:
+            del self._quotas[key]
+
+
+class RedisRateLimiter(RateLimiter):
+    """
+    Limiter shared by all workers through Redis. Each check is a single
+    atomic script call using the Redis server clock.
+    """
+    
+    # KEYS: bucket hash, quota counter prefix. ARGV: rate, burst, cost, daily quota.
+    # The quota counter of the current UTC day is KEYS[2] .. ':' .. day, so the
+    # day boundary follows the server clock like the bucket does.
+    CHECK_SCRIPT = """
+        local now_parts = redis.call('TIME')
+        local now = tonumber(now_parts[1]) + tonumber(now_parts[2]) / 1000000
+        local rate, burst, cost, daily = tonumber(ARGV[1]), tonumber(ARGV[2]), tonumber(ARGV[3]), tonumber(ARGV[4])
+        local quota_key = KEYS[2] .. ':' .. math.floor(now / 86400)
+        local state = redis.call('HMGET', KEYS[1], 'tokens', 'ts')
+        local tokens = tonumber(state[1]) or burst
+        local ts = tonumber(state[2]) or now
+        tokens = math.min(burst, tokens + math.max(0, now - ts) * rate)
+        local used = tonumber(redis.call('GET', quota_key) or '0')
+        local reason = ''
+        if tokens < cost then
+            reason = 'rate'
+        elseif daily > 0 and used + cost > daily then
+            reason = 'quota'
+        else
+            tokens = tokens - cost
+            if daily > 0 then
+                used = redis.call('INCRBY', quota_key, cost)
+                redis.call('EXPIRE', quota_key, 90000)
+            end
+        end
+        redis.call('HSET', KEYS[1], 'tokens', tostring(tokens), 'ts', tostring(now))
+        redis.call('EXPIRE', KEYS[1], math.ceil((burst - tokens) / rate) + 60)
+        return {reason, tostring(tokens), used, tostring(now)}
+    """
+    
+    # KEYS: bucket hash. ARGV: rate, burst, tokens. Timestamped with the server clock.
+    SET_TOKENS_SCRIPT = """
+        local now_parts = redis.call('TIME')
+        local now = tonumber(now_parts[1]) + tonumber(now_parts[2]) / 1000000
+        local rate, burst, tokens = tonumber(ARGV[1]), tonumber(ARGV[2]), tonumber(ARGV[3])
+        redis.call('HSET', KEYS[1], 'tokens', tostring(tokens), 'ts', tostring(now))
+        redis.call('EXPIRE', KEYS[1], math.ceil((burst - tokens) / rate) + 60)
+        return tostring(now)
+    """
+    
+    def __init__(self, url: str = None, enabled: bool = None, prefix: str = "ratelimit"):
+        """
+        Initialize the Redis limiter.
+        
+        Args:
+            url: Redis URL (defaults to RATE_LIMIT_REDIS_URL)
+            enabled: Global switch (defaults to RATE_LIMIT_ENABLED)
+            prefix: Namespace of the Redis keys
+        """
+        super().__init__(enabled)
+        if not REDIS_AVAILABLE:
+            raise ImportError("redis package not installed. Install with: pip install redis")
+        self.client = redis.Redis.from_url(url or RATE_LIMIT_REDIS_URL, socket_timeout=0.25)
+        self.prefix = prefix
+        self._script = self.client.register_script(self.CHECK_SCRIPT)
+        self._set_tokens_script = self.client.register_script(self.SET_TOKENS_SCRIPT)
+        if not API_KEY_HASH_SALT:
+            logger.warning("API_KEY_HASH_SALT is not set; API key rate limits are not shared between workers")
+    
+    def _keys(self, key: str):
+        return [f"{self.prefix}:bucket:{key}", f"{self.prefix}:quota:{key}"]
+    
+    def _check(self, key: str, policy: RateLimitPolicy, cost: int, now: float) -> RateLimitResult:
+        # now (the client clock) is ignored: the script reads the server clock
+        reason, tokens, used, server_now = self._script(
+            keys=self._keys(key),
+            args=[policy.rate, policy.burst, cost, policy.daily_quota]
+        )
+        reason = reason.decode() if isinstance(reason, bytes) else reason
+        return RateLimitResult(not reason, policy, float(tokens), int(used), float(server_now), reason or None)
+    
+    def _set_tokens(self, key: str, policy: RateLimitPolicy, tokens: float, now: float) -> None:
+        self._set_tokens_script(keys=self._keys(key)[:1], args=[policy.rate, policy.burst, tokens])
+
+
+def create_rate_limiter(kind: str = None) -> RateLimiter:
+    """
+    Create the configured rate limiter.
+    
+    Args:
+        kind: Backend ('memory' or 'redis'), defaults to RATE_LIMIT_BACKEND
+    
+    Returns:
+        A rate limiter (in-memory if Redis is requested but unavailable)
+    """
+    kind = (kind or RATE_LIMIT_BACKEND).lower()
+    if kind == "redis":
+        try:
+            return RedisRateLimiter()
+        except Exception as e:
+            logger.warning(f"Redis rate limiter unavailable ({e}); using in-memory limits")
+            return InMemoryRateLimiter()
+    if kind == "memory":
+        return InMemoryRateLimiter()
+    raise ValueError(f"Unsupported RATE_LIMIT_BACKEND: {kind}. Choose 'memory' or 'redis'.")
+
+
+# Shared limiter and the policy applied to chat requests
+rate_limiter = create_rate_limiter()
+chat_rate_limit = RateLimitPolicy()
@@ -0,0 +1,331 @@
+"""
+Semantic response cache for chat.
+Serves a stored response when a new message is a close paraphrase of an
+earlier one the same user sent to the same persona, without calling the
+provider. Off by default; it needs a sentence embedding model, since lexical
+similarity cannot tell paraphrases from near-identical questions.
+"""
+
+import os
+import time
+import random
+import hashlib
+import logging
+import threading
+from typing import Dict, List, Any, Optional
+
+import numpy as np
+
+from embeddings import Embedder, get_embedder
+
+logger = logging.getLogger(__name__)
+
+# Semantic cache configuration (personas opt in individually, see personas.PERSONAS)
+SEMANTIC_CACHE_ENABLED = os.getenv("SEMANTIC_CACHE_ENABLED", "false").lower() in ("1", "true", "yes")
+SEMANTIC_CACHE_MODEL = os.getenv("SEMANTIC_CACHE_MODEL", "all-MiniLM-L6-v2")
+SEMANTIC_CACHE_THRESHOLD = float(os.getenv("SEMANTIC_CACHE_THRESHOLD", "0.9"))
+SEMANTIC_CACHE_TTL = float(os.getenv("SEMANTIC_CACHE_TTL", "86400"))
+SEMANTIC_CACHE_MAX_ENTRIES = int(os.getenv("SEMANTIC_CACHE_MAX_ENTRIES", "5000"))
+# Fraction of hits that still call the provider to measure cached answer quality
+SEMANTIC_CACHE_AUDIT_RATE = float(os.getenv("SEMANTIC_CACHE_AUDIT_RATE", "0.0"))
+# Misses scoring at least this fraction of the threshold count as near misses
+NEAR_MISS_RATIO = 0.9
+
+
+class CacheHit:
+    """
+    A cached response matched by similarity.
+    """
+    
+    def __init__(self, persona_id: str, slot: int, message: str, response: str, similarity: float, created_at: float):
+        """
+        Initialize a cache hit.
+        
+        Args:
+            persona_id: Persona the response was cached for
+            slot: Slot of the entry in the persona's partition
+            message: The cached message that matched
+            response: The cached response
+            similarity: Cosine similarity between the new and cached message
+            created_at: When the response was cached
+        """
+        self.persona_id = persona_id
+        self.slot = slot
+        self.message = message
+        self.response = response
+        self.similarity = similarity
+        self.created_at = created_at
+
+
+class _Partition:
+    """Cached entries of one persona: a fixed-capacity ring of vectors and responses."""
+    
+    def __init__(self, dim: int, capacity: int, prompt_digest: str):
+        self.vectors = np.zeros((capacity, dim), dtype=np.float32)
+        self.created = np.full(capacity, -np.inf)
+        # Who each entry was generated for; entries are only served within their scope
+        self.scopes = np.full(capacity, None, dtype=object)
+        self.messages: List[Optional[str]] = [None] * capacity
+        self.responses: List[Optional[str]] = [None] * capacity
+        self.prompt_digest = prompt_digest
+        self.next_slot = 0
+
+
+class SemanticCache:
+    """
+    Per-persona semantic cache of chat responses.
+    
+    Each persona has its own partition: a fixed-capacity float32 matrix of
+    message embeddings searched with one matrix-vector product, with the
+    oldest entry overwritten when full. Entries expire after the TTL, and
+    a partition is dropped when its persona's system prompt changes.
+    
+    Every entry belongs to a scope (the user it was generated for), so
+    answers that depend on personal details are never served to someone
+    else. The cache switches itself off if its embedder is not semantic.
+    """
+    
+    def __init__(
+        self,
+        embedder: Embedder = None,
+        enabled: bool = None,
+        threshold: float = None,
+        ttl: float = None,
+        max_entries: int = None,
+        audit_rate: float = None,
+        persona_settings: Dict[str, Dict[str, Any]] = None
+    ):
+        """
+        Initialize the semantic cache.
+        
+        Args:
+            embedder: Semantic embedder for messages (SEMANTIC_CACHE_MODEL by default)
+            enabled: Global switch (defaults to SEMANTIC_CACHE_ENABLED)
+            threshold: Default minimum similarity for a hit
+            ttl: Default lifetime of entries in seconds
+            max_entries: Maximum entries per persona
+            audit_rate: Fraction of hits re-generated upstream to measure quality
+            persona_settings: Per-persona settings ({"enabled", "threshold", "ttl"}) by persona ID;
+                personas without settings are not cached
+        """
+        self._embedder = embedder
+        self.enabled = SEMANTIC_CACHE_ENABLED if enabled is None else enabled
+        self.threshold = threshold or SEMANTIC_CACHE_THRESHOLD
+        self.ttl = ttl or SEMANTIC_CACHE_TTL
+        self.max_entries = max_entries or SEMANTIC_CACHE_MAX_ENTRIES
+        self.audit_rate = SEMANTIC_CACHE_AUDIT_RATE if audit_rate is None else audit_rate
+        self.persona_settings = persona_settings if persona_settings is not None else self._settings_from_personas()
+        self._partitions: Dict[str, _Partition] = {}
+        self._lock = threading.Lock()
+        self._metrics: Dict[str, Dict[str, float]] = {}
+    
+    @property
+    def embedder(self) -> Optional[Embedder]:
+        """
+        The message embedder, created on first use.
+        
+        The cache is disabled, with a warning, if no semantic embedder can be loaded.
+        """
+        if self._embedder is None and self.enabled:
+            try:
+                embedder = get_embedder(SEMANTIC_CACHE_MODEL)
+            except Exception as e:
+                logger.warning(f"Semantic cache disabled: could not load {SEMANTIC_CACHE_MODEL}: {e}")
+                self.enabled = False
+                return None
+            self._embedder = embedder
+        if self._embedder is not None and not self._embedder.semantic and self.enabled:
+            logger.warning(f"Semantic cache disabled: {self._embedder.name} is a lexical embedder, not a sentence embedding model")
+            self.enabled = False
+        return self._embedder
+    
+    @staticmethod
+    def _settings_from_personas() -> Dict[str, Dict[str, Any]]:
+        import personas
+        return {
+            persona_id: persona["semantic_cache"]
+            for persona_id, persona in personas.PERSONAS.items()
+            if persona.get("semantic_cache")
+        }
+    
+    def is_enabled_for(self, persona_id: str) -> bool:
+        """
+        Whether responses for a persona are cached.
+        
+        Args:
+            persona_id: ID of the persona
+        
+        Returns:
+            True if the cache is on, has a semantic embedder and the persona opted in
+        """
+        if not (self.enabled and self.persona_settings.get(persona_id, {}).get("enabled")):
+            return False
+        return self.embedder is not None and self.enabled
+    
+    def lookup(self, persona_id: str, system_instruction: str, message: str, scope: str) -> Optional[CacheHit]:
+        """
+        Find a cached response for a paraphrase of a message.
+        
+        Args:
+            persona_id: ID of the persona
+            system_instruction: The persona's current system prompt
+            message: The user's message
+            scope: Who is asking (e.g. the user ID); only their own entries can match
+        
+        Returns:
+            The best cached response above the persona's threshold, or None
+        """
+        if not scope or not self.is_enabled_for(persona_id):
+            return None
+        
+        settings = self.persona_settings[persona_id]
+        threshold = settings.get("threshold", self.threshold)
+        ttl = settings.get("ttl", self.ttl)
+        query = self.embedder.embed_query(message)
+        
+        with self._lock:
+            metrics = self._persona_metrics(persona_id)
+            metrics["lookups"] += 1
+            partition = self._partitions.get(persona_id)
+            if partition is None or partition.prompt_digest != self._digest(system_instruction):
+                metrics["misses"] += 1
+                return None
+            
+            scores = partition.vectors @ query
+            scores[(partition.created < time.time() - ttl) | (partition.scopes != scope)] = -np.inf
+            slot = int(np.argmax(scores))
+            similarity = float(scores[slot])
+            if similarity < threshold:
+                metrics["misses"] += 1
+                if similarity >= threshold * NEAR_MISS_RATIO:
+                    metrics["nearMisses"] += 1
+                return None
+            
+            metrics["hits"] += 1
+            metrics["hitSimilarity"] += similarity
+            return CacheHit(
+                persona_id, slot, partition.messages[slot], partition.responses[slot],
+                similarity, float(partition.created[slot])
+            )
+    
+    def store(self, persona_id: str, system_instruction: str, message: str, response: str, scope: str) -> None:
+        """
+        Cache a response.
+        
+        Args:
+            persona_id: ID of the persona
+            system_instruction: The persona's current system prompt
+            message: The user's message
+            response: The provider's response
+            scope: Who the response was generated for (e.g. the user ID)
+        """
+        if not scope or not self.is_enabled_for(persona_id):
+            return
+        
+        vector = self.embedder.embed_query(message)
+        digest = self._digest(system_instruction)
+        with self._lock:
+            partition = self._partitions.get(persona_id)
+            if partition is None or partition.prompt_digest != digest:
+                partition = _Partition(self.embedder.dim, self.max_entries, digest)
+                self._partitions[persona_id] = partition
+            
+            # Replace an existing entry for the same message instead of duplicating it
+            scores = partition.vectors @ vector
+            scores[partition.scopes != scope] = -np.inf
+            slot = int(np.argmax(scores))
+            if scores[slot] < 0.999 or partition.messages[slot] != message:
+                slot = partition.next_slot
+                partition.next_slot = (slot + 1) % self.max_entries
+            
+            partition.vectors[slot] = vector
+            partition.created[slot] = time.time()
+            partition.scopes[slot] = scope
+            partition.messages[slot] = message
+            partition.responses[slot] = response
+            self._persona_metrics(persona_id)["stores"] += 1
+    
+    def should_audit(self) -> bool:
+        """
+        Whether to re-generate a hit upstream to measure cache quality.
+        
+        Returns:
+            True for a random audit_rate fraction of calls
+        """
+        return self.audit_rate > 0 and random.random() < self.audit_rate
+    
+    def record_audit(self, hit: CacheHit, fresh_response: str) -> float:
+        """
+        Compare a cached response with a freshly generated one.
+        
+        Args:
+            hit: The cache hit that was audited
+            fresh_response: The provider's response to the new message
+        
+        Returns:
+            Cosine similarity between the cached and fresh responses
+        """
+        vectors = self.embedder.embed([hit.response, fresh_response])
+        agreement = float(vectors[0] @ vectors[1])
+        with self._lock:
+            metrics = self._persona_metrics(hit.persona_id)
+            metrics["audits"] += 1
+            metrics["auditAgreement"] += agreement
+        return agreement
+    
+    def invalidate(self, persona_id: str = None) -> None:
+        """
+        Drop cached responses.
+        
+        Args:
+            persona_id: Persona to clear (all personas if None)
+        """
+        with self._lock:
+            if persona_id is None:
+                self._partitions.clear()
+            else:
+                self._partitions.pop(persona_id, None)
+    
+    def get_metrics(self) -> Dict[str, Any]:
+        """
+        Get hit-rate and quality metrics.
+        
+        Returns:
+            Per-persona counters with hit rate, mean hit similarity and mean
+            audit agreement, plus totals
+        """
+        with self._lock:
+            personas = {persona_id: dict(counters) for persona_id, counters in self._metrics.items()}
+            entries = {
+                persona_id: int(np.isfinite(partition.created).sum())
+                for persona_id, partition in self._partitions.items()
+            }
+        
+        totals = {"lookups": 0, "hits": 0, "misses": 0, "nearMisses": 0, "stores": 0, "audits": 0}
+        for persona_id, counters in personas.items():
+            for key in totals:
+                totals[key] += counters[key]
+            counters["entries"] = entries.get(persona_id, 0)
+            counters["hitRate"] = counters["hits"] / counters["lookups"] if counters["lookups"] else 0.0
+            counters["meanHitSimilarity"] = counters.pop("hitSimilarity") / counters["hits"] if counters["hits"] else 0.0
+            agreement = counters.pop("auditAgreement")
+            counters["meanAuditAgreement"] = agreement / counters["audits"] if counters["audits"] else None
+        totals["hitRate"] = totals["hits"] / totals["lookups"] if totals["lookups"] else 0.0
+        return {"enabled": self.enabled, "personas": personas, "total": totals}
+    
+    def _persona_metrics(self, persona_id: str) -> Dict[str, float]:
+        metrics = self._metrics.get(persona_id)
+        if metrics is None:
+            metrics = self._metrics[persona_id] = {
+                "lookups": 0, "hits": 0, "misses": 0, "nearMisses": 0, "stores": 0,
+                "audits": 0, "hitSimilarity": 0.0, "auditAgreement": 0.0
+            }
+        return metrics
+    
+    @staticmethod
+    def _digest(system_instruction: str) -> str:
+        return hashlib.sha1((system_instruction or "").encode("utf-8")).hexdigest()
+
+
+# Shared semantic cache
+semantic_cache = SemanticCache()
@@ -1,20 +1,20 @@
 """
 Enhanced AI service with support for multiple LLM providers.
-Integrates Gemini, Hugging Face, and Vicuna (placeholder).
+Integrates Gemini, Hugging Face, and Vicuna (streamed from an OpenAI-compatible
+server at VICUNA_API_URL), routing each request to the fastest healthy provider
+with automatic fallback.
 """
 
 import os
+import time
 import logging
 import asyncio
-from typing import Dict, List, Any, AsyncGenerator, Optional
+import threading
+from collections import deque
+from typing import Dict, List, Any, AsyncGenerator, Callable, Deque, Optional, Tuple
 
-# Try to import Google Cloud AI Platform (optional)
-try:
-    import google.cloud.aiplatform as aiplatform
-    GOOGLE_AI_AVAILABLE = True
-except ImportError:
-    GOOGLE_AI_AVAILABLE = False
-    aiplatform = None
+from openai_compatible import OpenAICompatibleClient
+from vertex_gemini import GeminiStreamingClient
 
 logger = logging.getLogger(__name__)
 
@@ -25,103 +25,509 @@ GEMINI_MODEL_NAME = os.getenv("GEMINI_MODEL", "gemini-1.5-flash-001")
 LLM_PROVIDER = os.getenv("LLM_PROVIDER", "huggingface").lower()  # Default to huggingface
 HUGGING_FACE_API_KEY = os.getenv("HUGGING_FACE_API_KEY")
 VICUNA_API_URL = os.getenv("VICUNA_API_URL", "http://localhost:8000/v1")
+# Providers to route between, e.g. "gemini,huggingface"; defaults to LLM_PROVIDER alone
+LLM_PROVIDERS = [p.strip().lower() for p in os.getenv("LLM_PROVIDERS", LLM_PROVIDER).split(",") if p.strip()]
+# Routing preference per provider, e.g. "gemini=2,huggingface=1"
+LLM_PROVIDER_WEIGHTS = os.getenv("LLM_PROVIDER_WEIGHTS", "")
 
-class AIService:
-    """Handles interactions with the configured AI model provider."""
+# Router configuration
+ROUTER_WINDOW_SECONDS = float(os.getenv("ROUTER_WINDOW_SECONDS", "300"))
+ROUTER_WINDOW_SIZE = int(os.getenv("ROUTER_WINDOW_SIZE", "200"))
+ROUTER_MIN_SAMPLES = int(os.getenv("ROUTER_MIN_SAMPLES", "5"))
+ROUTER_MAX_ERROR_RATE = float(os.getenv("ROUTER_MAX_ERROR_RATE", "0.5"))
+ROUTER_HEDGING = os.getenv("ROUTER_HEDGING", "false").lower() == "true"
+# A hedge starts once the primary is slower than its p95 times this factor
+ROUTER_HEDGE_FACTOR = float(os.getenv("ROUTER_HEDGE_FACTOR", "1.0"))
+ROUTER_HEDGE_MIN_DELAY = float(os.getenv("ROUTER_HEDGE_MIN_DELAY", "0.05"))
+
+
+def parse_weights(spec: str) -> Dict[str, float]:
+    """
+    Parse a "name=weight,..." specification.
+    
+    Args:
+        spec: Comma-separated name=weight pairs
+    
+    Returns:
+        Weight per name
+    """
+    weights = {}
+    for item in spec.split(","):
+        name, _, weight = item.partition("=")
+        if name.strip() and weight.strip():
+            try:
+                weights[name.strip().lower()] = float(weight)
+            except ValueError:
+                logger.warning(f"Ignoring invalid provider weight: {item}")
+    return weights
+
+
+def _percentile(values: List[float], q: float) -> Optional[float]:
+    """Nearest-rank percentile of sorted values."""
+    return values[round(q * (len(values) - 1))] if values else None
+
+
+class BackendStats:
+    """Rolling latency and error statistics of a backend."""
+    
+    def __init__(self, window_seconds: float = None, window_size: int = None, clock: Callable[[], float] = None):
+        """
+        Initialize the statistics.
+        
+        Args:
+            window_seconds: Age after which samples are forgotten
+            window_size: Maximum number of samples kept
+            clock: Time source, for tests
+        """
+        self.window_seconds = window_seconds or ROUTER_WINDOW_SECONDS
+        self.clock = clock or time.monotonic
+        # (timestamp, seconds to first chunk or None on failure)
+        self._samples: Deque[Tuple[float, Optional[float]]] = deque(maxlen=window_size or ROUTER_WINDOW_SIZE)
+        self._lock = threading.Lock()
+        self.in_flight = 0
+        self.requests = 0
+        self.errors = 0
+    
+    def record(self, latency: Optional[float]) -> None:
+        """
+        Record the outcome of a request.
+        
+        Args:
+            latency: Seconds to the first chunk, or None if the request failed
+        """
+        with self._lock:
+            self._samples.append((self.clock(), latency))
+            self.requests += 1
+            if latency is None:
+                self.errors += 1
+    
+    def _window(self) -> List[Tuple[float, Optional[float]]]:
+        """Samples within the window (caller holds the lock)."""
+        horizon = self.clock() - self.window_seconds
+        while self._samples and self._samples[0][0] < horizon:
+            self._samples.popleft()
+        return list(self._samples)
+    
+    def percentile(self, q: float, min_samples: int = 1) -> Optional[float]:
+        """
+        Get a latency percentile of the successful requests in the window.
+        
+        Args:
+            q: Percentile as a fraction, e.g. 0.95
+            min_samples: Successful samples needed for an answer
+        
+        Returns:
+            Latency in seconds, or None with too few samples
+        """
+        with self._lock:
+            samples = self._window()
+        latencies = sorted(latency for _, latency in samples if latency is not None)
+        return _percentile(latencies, q) if len(latencies) >= max(min_samples, 1) else None
+    
+    def snapshot(self) -> Dict[str, Any]:
+        """
+        Get the current statistics.
+        
+        Returns:
+            Sample count, error rate and p50/p95 latency (None without successes)
+        """
+        with self._lock:
+            samples = self._window()
+        latencies = sorted(latency for _, latency in samples if latency is not None)
+        return {
+            "samples": len(samples),
+            "errorRate": (len(samples) - len(latencies)) / len(samples) if samples else 0.0,
+            "p50": _percentile(latencies, 0.5),
+            "p95": _percentile(latencies, 0.95)
+        }
+
+
+class Backend:
+    """An LLM provider or model that the router can send requests to."""
+    
+    def __init__(self, name: str, stream: Callable[[str, str], AsyncGenerator[str, None]] = None, weight: float = 1.0):
+        """
+        Initialize the backend.
+        
+        Args:
+            name: Backend name
+            stream: Function streaming a response for (system_instruction, message)
+            weight: Routing preference; latency is divided by the weight when ranking
+        """
+        self.name = name
+        self._stream = stream
+        self.weight = weight
+        self.stats = BackendStats()
+    
+    def stream(self, system_instruction: str, message: str) -> AsyncGenerator[str, None]:
+        """Stream a response; failures raise exceptions."""
+        return self._stream(system_instruction, message)
+
+
+class StubBackend(Backend):
+    """Local backend with configurable latency and failures, for tests and benchmarks."""
+    
+    def __init__(self, name: str, latency: float = 0.0, fail: bool = False, chunks: int = 1, weight: float = 1.0):
+        """
+        Initialize the stub.
+        
+        Args:
+            name: Backend name
+            latency: Seconds before the first chunk
+            fail: Whether requests fail
+            chunks: Number of chunks streamed
+            weight: Routing preference
+        """
+        super().__init__(name, weight=weight)
+        self.latency = latency
+        self.fail = fail
+        self.chunks = chunks
+        self.calls = 0
+    
+    async def stream(self, system_instruction: str, message: str) -> AsyncGenerator[str, None]:
+        self.calls += 1
+        await asyncio.sleep(self.latency)
+        if self.fail:
+            raise RuntimeError(f"{self.name} unavailable")
+        for i in range(self.chunks):
+            yield f"[{self.name}] {message}" if i == 0 else f" {i}"
+
+
+class _Attempt:
+    """A backend request racing for its first chunk."""
+    
+    def __init__(self, backend: Backend, system_instruction: str, message: str):
+        self.backend = backend
+        self.started = time.monotonic()
+        # Seconds to the first chunk, once it arrived
+        self.latency: Optional[float] = None
+        self.stream = backend.stream(system_instruction, message)
+        self.task = asyncio.ensure_future(self._next())
+        backend.stats.in_flight += 1
+    
+    async def _next(self) -> Tuple[bool, Optional[str]]:
+        try:
+            return True, await self.stream.__anext__()
+        except StopAsyncIteration:
+            return False, None
+    
+    async def cancel(self) -> None:
+        """Abandon a losing or unused request."""
+        self.task.cancel()
+        try:
+            await self.task
+        except BaseException:
+            pass
+        await self.finish()
+    
+    async def finish(self) -> None:
+        self.backend.stats.in_flight -= 1
+        await self.stream.aclose()
+
+
+class ProviderRouter:
+    """
+    Routes requests to the fastest healthy backend.
+    
+    Backends are ranked by rolling p50 time-to-first-chunk divided by their
+    weight; backends without enough recent samples rank first so they are
+    (re)measured, and backends above the error-rate threshold rank last.
+    A request that fails before streaming falls back to the next backend,
+    and with hedging enabled a second backend is started once the primary
+    is slower than its own p95.
+    """
+    
+    def __init__(
+        self,
+        backends: List[Backend],
+        min_samples: int = None,
+        max_error_rate: float = None,
+        hedging: bool = None,
+        hedge_factor: float = None,
+        hedge_min_delay: float = None
+    ):
+        """
+        Initialize the router.
+        
+        Args:
+            backends: Backends in order of preference for ties
+            min_samples: Samples needed before a backend's latency is trusted
+            max_error_rate: Error rate above which a backend is unhealthy
+            hedging: Whether to hedge slow requests
+            hedge_factor: Multiple of the primary's p95 after which to hedge
+            hedge_min_delay: Minimum seconds before hedging
+        """
+        self.backends = list(backends)
+        self.min_samples = ROUTER_MIN_SAMPLES if min_samples is None else min_samples
+        self.max_error_rate = ROUTER_MAX_ERROR_RATE if max_error_rate is None else max_error_rate
+        self.hedging = ROUTER_HEDGING if hedging is None else hedging
+        self.hedge_factor = hedge_factor or ROUTER_HEDGE_FACTOR
+        self.hedge_min_delay = ROUTER_HEDGE_MIN_DELAY if hedge_min_delay is None else hedge_min_delay
+        self._metrics = {"requests": 0, "failures": 0, "fallbacks": 0, "hedges": 0, "hedgeWins": 0}
     
-    def __init__(self):
-        self.provider = LLM_PROVIDER
-        self.gemini_model = None
+    def rank(self) -> List[Backend]:
+        """
+        Order backends by preference.
         
-        if self.provider == "gemini":
-            if not GOOGLE_AI_AVAILABLE:
-                raise RuntimeError("Google Cloud AI Platform not available. Install with: pip install google-cloud-aiplatform")
+        Returns:
+            Backends, best first
+        """
+        def score(item: Tuple[int, Backend]) -> Tuple[int, float, int]:
+            index, backend = item
+            stats = backend.stats.snapshot()
+            if stats["samples"] >= self.min_samples and stats["errorRate"] > self.max_error_rate:
+                return (2, 0.0, index)
+            if stats["samples"] < self.min_samples or stats["p50"] is None:
+                return (0, 0.0, index)
+            return (1, stats["p50"] / max(backend.weight, 1e-9), index)
+        
+        return [backend for _, backend in sorted(enumerate(self.backends), key=score)]
+    
+    def hedge_delay(self, backend: Backend) -> Optional[float]:
+        """
+        Seconds to wait for a backend's first chunk before hedging.
+        
+        Args:
+            backend: The primary backend
+        
+        Returns:
+            The delay, or None if hedging is off or the backend has too few samples
+        """
+        if not self.hedging:
+            return None
+        stats = backend.stats.snapshot()
+        if stats["samples"] < self.min_samples or stats["p95"] is None:
+            return None
+        return max(stats["p95"] * self.hedge_factor, self.hedge_min_delay)
+    
+    async def generate(self, system_instruction: str, message: str) -> AsyncGenerator[str, None]:
+        """
+        Stream a response from the best available backend.
+        
+        Args:
+            system_instruction: System prompt or instruction
+            message: User message
+        
+        Yields:
+            Response chunks
+        
+        Raises:
+            RuntimeError: If every backend failed
+        """
+        self._metrics["requests"] += 1
+        winner, first = await self._first_chunk(self.rank(), system_instruction, message)
+        latency = winner.latency
+        try:
+            if first is not None:
+                yield first
+                async for chunk in winner.stream:
+                    yield chunk
+        except Exception:
+            # Failed mid-stream; too late to fall back
+            latency = None
+            raise
+        finally:
+            # One sample per request: the time to the first chunk, or a failure
+            winner.backend.stats.record(latency)
+            await winner.finish()
+    
+    async def _first_chunk(self, ranked: List[Backend], system_instruction: str, message: str) -> Tuple[_Attempt, Optional[str]]:
+        """Race backends for the first chunk, hedging and falling back as needed."""
+        if not ranked:
+            raise RuntimeError("No LLM backends configured")
+        
+        queue = deque(ranked)
+        pending: List[_Attempt] = [_Attempt(queue.popleft(), system_instruction, message)]
+        hedged = False
+        errors = []
+        try:
+            while pending:
+                delay = None if hedged or not queue else self.hedge_delay(pending[0].backend)
+                if delay is not None:
+                    delay = max(0.0, pending[0].started + delay - time.monotonic())
+                done, _ = await asyncio.wait([attempt.task for attempt in pending], timeout=delay, return_when=asyncio.FIRST_COMPLETED)
+                if not done:
+                    hedged = True
+                    self._metrics["hedges"] += 1
+                    pending.append(_Attempt(queue.popleft(), system_instruction, message))
+                    continue
+                
+                for attempt in [attempt for attempt in pending if attempt.task in done]:
+                    try:
+                        _, first = attempt.task.result()
+                    except Exception as e:
+                        pending.remove(attempt)
+                        logger.warning(f"LLM backend {attempt.backend.name} failed: {e}")
+                        attempt.backend.stats.record(None)
+                        errors.append(f"{attempt.backend.name}: {e}")
+                        await attempt.finish()
+                        continue
             
+                    # Recorded by generate() once the stream ends, as a single sample
+                    attempt.latency = time.monotonic() - attempt.started
+                    if hedged and attempt.backend is not ranked[0]:
+                        self._metrics["hedgeWins"] += 1
+                    # The winner stays pending until the losers are gone, so a cancellation meanwhile releases it too
+                    for loser in [other for other in pending if other is not attempt]:
+                        pending.remove(loser)
+                        await loser.cancel()
+                    pending.remove(attempt)
+                    return attempt, first
+                
+                if not pending and queue:
+                    self._metrics["fallbacks"] += 1
+                    pending.append(_Attempt(queue.popleft(), system_instruction, message))
+        except BaseException:
+            # Cancelled or closed by the consumer: abandon every request still racing
+            while pending:
+                await pending.pop().cancel()
+            raise
+        
+        self._metrics["failures"] += 1
+        raise RuntimeError(f"All LLM backends failed: {'; '.join(errors)}")
+    
+    def get_metrics(self) -> Dict[str, Any]:
+        """
+        Get routing metrics.
+        
+        Returns:
+            Router counters and rolling statistics per backend
+        """
+        backends = {}
+        for backend in self.backends:
+            stats = backend.stats.snapshot()
+            stats.update({
+                "weight": backend.weight,
+                "inFlight": backend.stats.in_flight,
+                "requests": backend.stats.requests,
+                "errors": backend.stats.errors,
+                "healthy": stats["samples"] < self.min_samples or stats["errorRate"] <= self.max_error_rate
+            })
+            backends[backend.name] = stats
+        return {**self._metrics, "backends": backends}
+
+
+class AIService:
+    """Handles interactions with the configured AI model providers."""
+    
+    def __init__(self, providers: List[str] = None, weights: Dict[str, float] = None):
+        """
+        Initialize the configured providers.
+        
+        Args:
+            providers: Provider names to route between (LLM_PROVIDERS by default)
+            weights: Routing weight per provider (LLM_PROVIDER_WEIGHTS by default)
+        """
+        providers = providers or LLM_PROVIDERS
+        weights = parse_weights(LLM_PROVIDER_WEIGHTS) if weights is None else weights
+        self.provider = providers[0]
+        self.gemini_client = None
+        self.hf_service = None
+        self.vicuna_client = None
+        
+        backends = []
+        for provider in providers:
+            try:
+                self._init_provider(provider)
+            except Exception as e:
+                # With several providers a broken one is left out; a single provider must work
+                if len(providers) == 1:
+                    raise
+                logger.error(f"Skipping LLM provider {provider}: {e}")
+                continue
+            backends.append(Backend(provider, self._provider_stream(provider), weight=weights.get(provider, 1.0)))
+        if not backends:
+            raise RuntimeError(f"No usable LLM provider among: {', '.join(providers)}")
+        self.router = ProviderRouter(backends)
+    
+    def _init_provider(self, provider: str) -> None:
+        """Initialize one provider."""
+        if provider == "gemini":
             if not GCP_PROJECT_ID:
                 raise ValueError("GCP_PROJECT_ID must be set when using Gemini provider")
             try:
-                aiplatform.init(project=GCP_PROJECT_ID, location=GCP_LOCATION)
-                # NOTE: Using Vertex AI SDK for Gemini models
-                self.gemini_model = aiplatform.gapic.PredictionServiceClient()
-                # Construct the full model endpoint path for Vertex AI
-                self.model_endpoint = f"projects/{GCP_PROJECT_ID}/locations/{GCP_LOCATION}/publishers/google/models/{GEMINI_MODEL_NAME}"
+                # One long-lived client streams from the Vertex AI REST API
+                self.gemini_client = GeminiStreamingClient(GCP_PROJECT_ID, GCP_LOCATION, GEMINI_MODEL_NAME)
+                self.model_endpoint = self.gemini_client.model_path
                 logger.info(f"AIService initialized for Gemini provider using model endpoint: {self.model_endpoint}")
             except Exception as e:
-                logger.error(f"Failed to initialize Google Cloud AI Platform for Gemini: {e}")
+                logger.error(f"Failed to initialize Vertex AI client for Gemini: {e}")
                 raise RuntimeError(f"Gemini initialization failed: {e}")
-        elif self.provider == "huggingface":
+        elif provider == "huggingface":
             if not HUGGING_FACE_API_KEY:
                 logger.warning("HUGGING_FACE_API_KEY not set. Hugging Face service will not work.")
+            from huggingface_service import HuggingFaceService
+            self.hf_service = HuggingFaceService()
             logger.info("AIService initialized for Hugging Face provider.")
-        elif self.provider == "vicuna":
-            # Placeholder: No specific initialization needed for the Vicuna placeholder yet.
-            logger.info("AIService initialized for Vicuna provider (placeholder). Ensure local model server is running if applicable.")
+        elif provider == "vicuna":
+            # Served by an OpenAI-compatible local model server (vLLM, llama.cpp, ...)
+            self.vicuna_client = OpenAICompatibleClient(base_url=VICUNA_API_URL)
+            logger.info(f"AIService initialized for Vicuna provider at {self.vicuna_client.url}. Ensure the local model server is running.")
         else:
-            raise ValueError(f"Unsupported LLM_PROVIDER: {self.provider}. Choose 'gemini', 'huggingface' or 'vicuna'.")
+            raise ValueError(f"Unsupported LLM_PROVIDER: {provider}. Choose 'gemini', 'huggingface' or 'vicuna'.")
+    
+    def _provider_stream(self, provider: str) -> Callable[[str, str], AsyncGenerator[str, None]]:
+        """Streaming function of a provider."""
+        return {
+            "gemini": self._generate_gemini_streaming_response,
+            "huggingface": self._generate_huggingface_response,
+            "vicuna": self._generate_vicuna_streaming_response
+        }[provider]
 
     async def _generate_gemini_streaming_response(self, system_instruction: str, message: str):
-        """Generates streaming response using Gemini via Vertex AI SDK."""
-        if not self.gemini_model:
+        """Generates streaming response using Gemini via the Vertex AI streaming API."""
+        if not self.gemini_client:
              raise RuntimeError("Gemini model not initialized.")
         
         try:
-            # Construct the request payload for Vertex AI streaming prediction
-            # This is a simplified example; refer to Vertex AI documentation for exact payload structure.
-            instance = {
-                "prompt": f"{system_instruction}\n\nUser: {message}\nAI:"
-            }
-            parameters = {
-                "temperature": 0.7,
-                "maxOutputTokens": 1024,
-            }
-            
-            # --- Placeholder Response --- 
-            # Since implementing the actual Vertex AI streaming call is complex,
-            # we will yield a placeholder response for now.
-            logger.warning("Using placeholder response for Gemini streaming - Vertex AI stream_predict needs implementation.")
-            yield "I'm responding based on your message: " + message[:30] + "..."
-            yield " This is a placeholder response from the Gemini model."
-            yield " In production, this would be a real response from the Vertex AI API."
-            
+            async for chunk in self.gemini_client.stream(system_instruction, message):
+                yield chunk
         except Exception as e:
             logger.error(f"Error during Gemini streaming generation: {e}")
             raise RuntimeError(f"Gemini API call failed: {e}")
 
     async def _generate_huggingface_response(self, system_instruction: str, message: str):
         """Generates response using Hugging Face models."""
+        if not self.hf_service:
+            raise RuntimeError("Hugging Face service not initialized.")
+        
         try:
-            from huggingface_service import HuggingFaceService
-            hf_service = HuggingFaceService()
-            
-            response = hf_service.generate_response(system_instruction, message)
-            yield response
-            
+            # The Inference API call blocks, so it runs on a worker thread and
+            # the router can hedge or fall back while it is outstanding
+            loop = asyncio.get_running_loop()
+            response = await loop.run_in_executor(None, self.hf_service.generate_response, system_instruction, message)
         except Exception as e:
             logger.error(f"Error during Hugging Face generation: {e}")
-            yield f"Error generating response: {str(e)}"
+            raise RuntimeError(f"Hugging Face API call failed: {e}")
+        yield response
 
     async def _generate_vicuna_streaming_response(self, system_instruction: str, message: str):
-        """Placeholder for generating streaming response using Vicuna."""
-        logger.info("Generating response using Vicuna provider (placeholder)...")
-        # In a real implementation, this would interact with a local Vicuna server/API.
-        yield f"[Vicuna Model] Response to: \"{message[:30]}...\"\n"
-        yield "This is a placeholder response from the Vicuna model integration."
-        yield f"\nSystem instruction used: \"{system_instruction[:50]}...\""
-        # Simulate streaming delay
-        await asyncio.sleep(0.5)
+        """Generates streaming response using Vicuna on a local OpenAI-compatible server."""
+        if not self.vicuna_client:
+            raise RuntimeError("Vicuna client not initialized.")
+        
+        try:
+            async for chunk in self.vicuna_client.stream(system_instruction, message):
+                yield chunk
+        except Exception as e:
+            logger.error(f"Error during Vicuna streaming generation: {e}")
+            raise RuntimeError(f"Vicuna API call failed: {e}")
 
     async def generate_streaming_response(self, system_instruction: str, message: str):
-        """Generates a streaming response based on the configured provider."""
-        if self.provider == "gemini":
-            async for chunk in self._generate_gemini_streaming_response(system_instruction, message):
-                yield chunk
-        elif self.provider == "huggingface":
-            async for chunk in self._generate_huggingface_response(system_instruction, message):
-                yield chunk
-        elif self.provider == "vicuna":
-            async for chunk in self._generate_vicuna_streaming_response(system_instruction, message):
-                yield chunk
-        else:
-            # This case should ideally be caught in __init__, but as a safeguard:
-            logger.error(f"Attempted to generate response with unsupported provider: {self.provider}")
-            raise RuntimeError(f"Unsupported LLM provider configured: {self.provider}")
\ No newline at end of file
+        """Generates a streaming response from the fastest healthy provider."""
+        async for chunk in self.router.generate(system_instruction, message):
+            yield chunk
+    
+    def get_metrics(self) -> Dict[str, Any]:
+        """
+        Get provider routing metrics.
+        
+        Returns:
+            Router counters and statistics per provider
+        """
+        metrics = self.router.get_metrics()
+        if self.gemini_client:
+            metrics["gemini"] = self.gemini_client.get_metrics()
+        if self.vicuna_client:
+            metrics["vicuna"] = self.vicuna_client.get_metrics()
+        return metrics
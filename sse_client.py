@@ -0,0 +1,213 @@
+"""
+Server-sent events over a pooled requests session.
+The blocking HTTP read runs on a worker thread and events are handed to the
+event loop as they arrive, so async callers can stream tokens without
+buffering the whole response. A bounded buffer applies backpressure: when
+the consumer falls behind, the worker stops reading and the server is
+slowed down by TCP flow control.
+"""
+
+import os
+import asyncio
+import logging
+import threading
+from collections import deque
+from typing import Any, AsyncGenerator, Deque, Dict, Iterable, Iterator, Optional, Tuple, Union
+
+import requests
+
+logger = logging.getLogger(__name__)
+
+# Events read ahead of the consumer before the worker stops reading
+SSE_MAX_BUFFERED_EVENTS = int(os.getenv("SSE_MAX_BUFFERED_EVENTS", "64"))
+
+# Sentinel marking the end of a stream
+_DONE = object()
+
+
+class SSEEvent:
+    """One server-sent event."""
+    
+    def __init__(self, data: str, event: str = "message", event_id: str = None):
+        self.data = data
+        self.event = event
+        self.id = event_id
+    
+    def __repr__(self) -> str:
+        return f"SSEEvent(event={self.event!r}, data={self.data!r})"
+
+
+class StreamHTTPError(Exception):
+    """Raised when a streaming endpoint answers with an error status."""
+    
+    def __init__(self, status_code: int, body: str):
+        super().__init__(f"HTTP {status_code}: {body}")
+        self.status_code = status_code
+        self.body = body
+
+
+class StreamMetrics:
+    """Request counts and time-to-first-token percentiles of a streaming client."""
+    
+    def __init__(self, window: int = 200):
+        """
+        Initialize the metrics.
+        
+        Args:
+            window: Number of recent first-token times kept
+        """
+        self._ttft: Deque[float] = deque(maxlen=window)
+        self._metrics = {"requests": 0, "errors": 0, "chunks": 0, "streamSeconds": 0.0}
+        self._lock = threading.Lock()
+    
+    def record(self, seconds: float, first_token: Optional[float], chunks: int, failed: bool) -> None:
+        """
+        Record a finished stream.
+        
+        Args:
+            seconds: Duration of the stream
+            first_token: Seconds to the first token, or None if none arrived
+            chunks: Number of chunks yielded
+            failed: Whether the stream ended with an error
+        """
+        with self._lock:
+            self._metrics["requests"] += 1
+            self._metrics["chunks"] += chunks
+            self._metrics["streamSeconds"] += seconds
+            if first_token is not None:
+                self._ttft.append(first_token)
+            if failed:
+                self._metrics["errors"] += 1
+    
+    def get_metrics(self) -> Dict[str, Any]:
+        """
+        Get the metrics.
+        
+        Returns:
+            Counters and time-to-first-token percentiles in seconds
+        """
+        with self._lock:
+            metrics = dict(self._metrics)
+            ttft = sorted(self._ttft)
+        metrics["ttftP50"] = ttft[round(0.5 * (len(ttft) - 1))] if ttft else None
+        metrics["ttftP95"] = ttft[round(0.95 * (len(ttft) - 1))] if ttft else None
+        return metrics
+
+
+def iter_sse_events(lines: Iterable[Union[bytes, str]]) -> Iterator[SSEEvent]:
+    """
+    Parse server-sent events from response lines.
+    
+    Args:
+        lines: Response lines without line terminators
+    
+    Yields:
+        Events, dispatched at each blank line
+    """
+    data, event, event_id = [], "message", None
+    for line in lines:
+        if isinstance(line, bytes):
+            line = line.decode("utf-8")
+        if not line:
+            if data:
+                yield SSEEvent("\n".join(data), event, event_id)
+            data, event = [], "message"
+            continue
+        if line.startswith(":"):
+            continue
+        field, _, value = line.partition(":")
+        if value.startswith(" "):
+            value = value[1:]
+        if field == "data":
+            data.append(value)
+        elif field == "event":
+            event = value
+        elif field == "id":
+            event_id = value
+    # A stream may end without a trailing blank line
+    if data:
+        yield SSEEvent("\n".join(data), event, event_id)
+
+
+async def stream_sse(
+    session: requests.Session,
+    url: str,
+    json: Dict[str, Any] = None,
+    headers: Dict[str, str] = None,
+    timeout: Tuple[float, float] = (10, 60),
+    max_buffered: int = None
+) -> AsyncGenerator[SSEEvent, None]:
+    """
+    POST a request and stream the server-sent events of the response.
+    
+    Closing the generator early closes the connection, which stops the
+    worker thread.
+    
+    Args:
+        session: Long-lived session whose connection pool is reused
+        url: Endpoint URL
+        json: Request body
+        headers: Extra request headers
+        timeout: Connect and per-read timeouts in seconds
+        max_buffered: Events read ahead of the consumer (SSE_MAX_BUFFERED_EVENTS by default)
+    
+    Yields:
+        Events as they arrive
+    
+    Raises:
+        StreamHTTPError: If the endpoint answers with a non-200 status
+        requests.RequestException: On connection errors and timeouts
+    """
+    loop = asyncio.get_running_loop()
+    queue: "asyncio.Queue[Tuple[Any, Optional[BaseException]]]" = asyncio.Queue()
+    stop = threading.Event()
+    credits = threading.Semaphore(max_buffered or SSE_MAX_BUFFERED_EVENTS)
+    holder: Dict[str, requests.Response] = {}
+    
+    def put(item: Any, error: BaseException = None) -> None:
+        try:
+            loop.call_soon_threadsafe(queue.put_nowait, (item, error))
+        except RuntimeError:
+            # The event loop is gone; nobody is listening any more
+            stop.set()
+    
+    def pump() -> None:
+        try:
+            response = session.post(url, json=json, headers={"Accept": "text/event-stream", **(headers or {})}, stream=True, timeout=timeout)
+            holder["response"] = response
+            with response:
+                if stop.is_set():
+                    return
+                if response.status_code != 200:
+                    raise StreamHTTPError(response.status_code, response.text[:500])
+                # chunk_size=None hands over each transfer chunk as soon as it arrives
+                for event in iter_sse_events(response.iter_lines(chunk_size=None)):
+                    # Wait for the consumer to make room before reading on
+                    while not credits.acquire(timeout=0.1):
+                        if stop.is_set():
+                            return
+                    if stop.is_set():
+                        return
+                    put(event)
+            put(_DONE)
+        except BaseException as e:
+            if not stop.is_set():
+                put(None, e)
+    
+    worker = threading.Thread(target=pump, name="sse-stream", daemon=True)
+    worker.start()
+    try:
+        while True:
+            item, error = await queue.get()
+            if error is not None:
+                raise error
+            if item is _DONE:
+                return
+            credits.release()
+            yield item
+    finally:
+        stop.set()
+        response = holder.get("response")
+        if response is not None:
+            # Unblocks the worker's read
+            response.close()
@@ -0,0 +1,287 @@
+"""
+Template registry for questionnaire prompt templates.
+Loads templates lazily and hot-reloads changed files from the templates directory.
+"""
+
+import os
+import json
+import time
+import hashlib
+import logging
+import threading
+from typing import Dict, Any, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# How often (seconds) the templates directory is re-scanned for changes
+TEMPLATE_POLL_INTERVAL = float(os.getenv("TEMPLATE_POLL_INTERVAL", "2.0"))
+
+QUESTION_TYPES = {"text", "textarea", "select", "checkbox"}
+
+
+class TemplateValidationError(ValueError):
+    """Raised when a template file does not describe a usable questionnaire."""
+
+
+def validate_template(template_id: str, data: Any) -> Dict[str, Any]:
+    """
+    Validate a questionnaire template.
+    
+    Args:
+        template_id: ID the template will be registered under
+        data: Parsed template data
+    
+    Returns:
+        The validated template data
+    
+    Raises:
+        TemplateValidationError: If the template is malformed
+    """
+    if not isinstance(data, dict):
+        raise TemplateValidationError(f"Template {template_id} must be a JSON object")
+    
+    if not isinstance(data.get("name"), str) or not data["name"]:
+        raise TemplateValidationError(f"Template {template_id} is missing a name")
+    
+    questions = data.get("questions")
+    if not isinstance(questions, list) or not questions:
+        raise TemplateValidationError(f"Template {template_id} must define at least one question")
+    
+    seen_ids = set()
+    for index, question in enumerate(questions):
+        if not isinstance(question, dict) or not question.get("id"):
+            raise TemplateValidationError(f"Template {template_id} question {index} is missing an id")
+        if question["id"] in seen_ids:
+            raise TemplateValidationError(f"Template {template_id} has duplicate question id: {question['id']}")
+        seen_ids.add(question["id"])
+        
+        question_type = question.get("type")
+        if question_type not in QUESTION_TYPES:
+            raise TemplateValidationError(f"Template {template_id} question {question['id']} has unknown type: {question_type}")
+        if question_type == "select" and not isinstance(question.get("options"), list):
+            raise TemplateValidationError(f"Template {template_id} select question {question['id']} has no options")
+    
+    if "prompt_template" in data and not isinstance(data["prompt_template"], str):
+        raise TemplateValidationError(f"Template {template_id} prompt_template must be a string")
+    
+    return data
+
+
+def _digest(data: Dict[str, Any]) -> str:
+    """Stable content hash of a template."""
+    return hashlib.sha1(json.dumps(data, sort_keys=True).encode("utf-8")).hexdigest()
+
+
+class TemplateRegistry:
+    """
+    In-memory registry of questionnaire templates backed by a directory of JSON files.
+    
+    Built-in templates are served from memory and are never written to disk.
+    Custom templates are loaded on first access and the directory is re-scanned
+    (mtime polling, at most once per poll interval) so that added, edited or
+    removed files are picked up without a restart. Only files whose mtime or
+    size changed are re-read.
+    """
+    
+    def __init__(
+        self,
+        templates_dir: str,
+        default_templates: Dict[str, Dict[str, Any]] = None,
+        poll_interval: float = None
+    ):
+        """
+        Initialize the template registry.
+        
+        Args:
+            templates_dir: Directory containing custom template JSON files
+            default_templates: Built-in templates, which custom files cannot override
+            poll_interval: Minimum seconds between directory scans
+        """
+        self.templates_dir = templates_dir
+        self.poll_interval = TEMPLATE_POLL_INTERVAL if poll_interval is None else poll_interval
+        self._defaults = dict(default_templates or {})
+        self._custom: Dict[str, Dict[str, Any]] = {}
+        self._file_stats: Dict[str, Tuple[int, int]] = {}
+        self._digests: Dict[str, str] = {template_id: _digest(data) for template_id, data in self._defaults.items()}
+        self._lock = threading.RLock()
+        self._loaded = False
+        self._last_scan = 0.0
+        self._version = 0
+        self._etag = self._compute_etag()
+        self._watcher: Optional[threading.Thread] = None
+        self._stop_event = threading.Event()
+    
+    @property
+    def version(self) -> int:
+        """Monotonic counter incremented whenever the template set changes."""
+        self._maybe_refresh()
+        return self._version
+    
+    @property
+    def etag(self) -> str:
+        """Content hash of the current template set, suitable for an HTTP ETag."""
+        self._maybe_refresh()
+        return self._etag
+    
+    def get(self, template_id: str) -> Optional[Dict[str, Any]]:
+        """
+        Get a template by ID.
+        
+        Args:
+            template_id: ID of the template
+        
+        Returns:
+            Template data or None if not found
+        """
+        self._maybe_refresh()
+        return self._defaults.get(template_id) or self._custom.get(template_id)
+    
+    def ids(self) -> List[str]:
+        """
+        List the IDs of all registered templates.
+        
+        Returns:
+            Template IDs, built-in templates first
+        """
+        self._maybe_refresh()
+        with self._lock:
+            return list(self._defaults) + [template_id for template_id in self._custom if template_id not in self._defaults]
+    
+    def list(self) -> List[Dict[str, Any]]:
+        """
+        List all registered templates.
+        
+        Returns:
+            List of templates with their IDs
+        """
+        templates = []
+        for template_id in self.ids():
+            template = self.get(template_id)
+            # Skip templates removed by a reload since the IDs were listed
+            if template is not None:
+                templates.append({"id": template_id, **template})
+        return templates
+    
+    def refresh(self, force: bool = False) -> bool:
+        """
+        Re-scan the templates directory and reload changed files.
+        
+        Args:
+            force: Scan even if the poll interval has not elapsed
+        
+        Returns:
+            True if the template set changed, False otherwise
+        """
+        with self._lock:
+            now = time.monotonic()
+            if not force and self._loaded and now - self._last_scan < self.poll_interval:
+                return False
+            self._last_scan = now
+            self._loaded = True
+            
+            changed = False
+            seen = set()
+            
+            try:
+                entries = list(os.scandir(self.templates_dir))
+            except FileNotFoundError:
+                entries = []
+            except OSError as e:
+                logger.error(f"Error scanning templates directory {self.templates_dir}: {e}")
+                return False
+            
+            for entry in entries:
+                if not entry.name.endswith('.json') or not entry.is_file():
+                    continue
+                template_id = os.path.splitext(entry.name)[0]
+                seen.add(template_id)
+                
+                stat = entry.stat()
+                file_stat = (stat.st_mtime_ns, stat.st_size)
+                if self._file_stats.get(template_id) == file_stat:
+                    continue
+                self._file_stats[template_id] = file_stat
+                changed |= self._load_file(template_id, entry.path)
+            
+            for template_id in list(self._file_stats):
+                if template_id not in seen:
+                    del self._file_stats[template_id]
+                    if self._custom.pop(template_id, None) is not None:
+                        self._digests.pop(template_id, None)
+                        logger.info(f"Template removed: {template_id}")
+                        changed = True
+            
+            if changed:
+                self._version += 1
+                self._etag = self._compute_etag()
+            
+            return changed
+    
+    def start_watching(self) -> None:
+        """Start a daemon thread that polls the templates directory for changes."""
+        with self._lock:
+            if self._watcher and self._watcher.is_alive():
+                return
+            self._stop_event.clear()
+            self._watcher = threading.Thread(target=self._watch, name="template-registry-watcher", daemon=True)
+            self._watcher.start()
+    
+    def stop_watching(self) -> None:
+        """Stop the background watcher thread, if running."""
+        self._stop_event.set()
+        if self._watcher:
+            self._watcher.join(timeout=self.poll_interval + 1)
+            self._watcher = None
+    
+    def _watch(self) -> None:
+        """Background polling loop."""
+        while not self._stop_event.wait(self.poll_interval):
+            try:
+                self.refresh(force=True)
+            except Exception as e:
+                logger.error(f"Error refreshing templates: {e}")
+    
+    def _maybe_refresh(self) -> None:
+        """Load on first access, then re-scan at most once per poll interval."""
+        if not self._loaded or (self._watcher is None and time.monotonic() - self._last_scan >= self.poll_interval):
+            self.refresh()
+    
+    def _load_file(self, template_id: str, file_path: str) -> bool:
+        """
+        Load and validate a single template file.
+        
+        Args:
+            template_id: ID of the template
+            file_path: Path to the template JSON file
+        
+        Returns:
+            True if the registered template changed
+        """
+        if template_id in self._defaults:
+            # Built-in templates take precedence over files with the same name
+            return False
+        
+        try:
+            with open(file_path, 'r') as f:
+                data = validate_template(template_id, json.load(f))
+        except (OSError, ValueError) as e:
+            # Keep serving the last good version of the template
+            logger.error(f"Error loading template from {file_path}: {e}")
+            return False
+        
+        digest = _digest(data)
+        if self._digests.get(template_id) == digest:
+            return False
+        
+        self._custom[template_id] = data
+        self._digests[template_id] = digest
+        logger.info(f"Template loaded: {template_id}")
+        return True
+    
+    def _compute_etag(self) -> str:
+        """Combine per-template digests into a single ETag."""
+        combined = hashlib.sha1()
+        for template_id in sorted(self._digests):
+            combined.update(template_id.encode("utf-8"))
+            combined.update(self._digests[template_id].encode("ascii"))
+        return combined.hexdigest()
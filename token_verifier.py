@@ -0,0 +1,423 @@
+"""
+Local verification of Firebase ID tokens.
+Google's signing keys are cached according to their Cache-Control header and
+decoded tokens are cached until they expire, so the request path does not
+touch the network.
+"""
+
+import os
+import re
+import json
+import time
+import hmac
+import base64
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+from typing import Dict, Any, Callable, Optional, Tuple
+
+import requests
+
+logger = logging.getLogger(__name__)
+
+# Try to import cryptography for RSA verification; a pure-Python fallback is used without it
+try:
+    from cryptography.exceptions import InvalidSignature
+    from cryptography.hazmat.primitives import hashes
+    from cryptography.hazmat.primitives.asymmetric import padding, rsa
+    CRYPTOGRAPHY_AVAILABLE = True
+except ImportError:
+    CRYPTOGRAPHY_AVAILABLE = False
+
+# Token verification configuration
+FIREBASE_PROJECT_ID = os.getenv("FIREBASE_PROJECT_ID")
+FIREBASE_JWKS_URL = os.getenv(
+    "FIREBASE_JWKS_URL",
+    "https://www.googleapis.com/service_accounts/v1/jwk/securetoken@system.gserviceaccount.com"
+)
+TOKEN_CACHE_SIZE = int(os.getenv("TOKEN_CACHE_SIZE", "10000"))
+# Allowed clock difference (seconds) for the iat and auth_time claims
+TOKEN_CLOCK_SKEW = int(os.getenv("TOKEN_CLOCK_SKEW", "60"))
+# Key set lifetime when the response has no usable Cache-Control
+JWKS_DEFAULT_MAX_AGE = 3600
+# Keys are refreshed in the background once this fraction of their lifetime has passed
+JWKS_REFRESH_AHEAD = 0.9
+# Minimum seconds between key fetches, so unknown key IDs and outages do not cause a fetch per request
+JWKS_MIN_REFETCH_INTERVAL = 60.0
+
+# ASN.1 DigestInfo prefix of a SHA-256 hash in PKCS#1 v1.5 signatures
+_SHA256_DIGEST_INFO = bytes.fromhex("3031300d060960864801650304020105000420")
+_MAX_AGE_PATTERN = re.compile(r"max-age=(\d+)")
+
+
+class TokenVerificationError(Exception):
+    """Raised when an ID token is malformed, wrongly signed or has invalid claims."""
+
+
+class ExpiredTokenError(TokenVerificationError):
+    """Raised when an ID token has expired."""
+
+
+def _b64decode(segment: str) -> bytes:
+    return base64.urlsafe_b64decode(segment + "=" * (-len(segment) % 4))
+
+
+def _b64int(segment: str) -> int:
+    return int.from_bytes(_b64decode(segment), "big")
+
+
+def rsa_verify_sha256(n: int, e: int, signature: bytes, message: bytes) -> bool:
+    """
+    Verify an RSASSA-PKCS1-v1_5 SHA-256 signature (RS256) with plain integers.
+    
+    Args:
+        n: RSA modulus
+        e: RSA public exponent
+        signature: The signature
+        message: The signed bytes
+    
+    Returns:
+        True if the signature is valid
+    """
+    size = (n.bit_length() + 7) // 8
+    if len(signature) != size:
+        return False
+    value = int.from_bytes(signature, "big")
+    if value >= n:
+        return False
+    digest_info = _SHA256_DIGEST_INFO + hashlib.sha256(message).digest()
+    expected = b"\x00\x01" + b"\xff" * (size - 3 - len(digest_info)) + b"\x00" + digest_info
+    return hmac.compare_digest(pow(value, e, n).to_bytes(size, "big"), expected)
+
+
+class RSAPublicKey:
+    """
+    An RS256 verification key from a JWK.
+    """
+    
+    def __init__(self, n: int, e: int):
+        """
+        Initialize the key.
+        
+        Args:
+            n: RSA modulus
+            e: RSA public exponent
+        """
+        self.n = n
+        self.e = e
+        self._key = rsa.RSAPublicNumbers(e, n).public_key() if CRYPTOGRAPHY_AVAILABLE else None
+    
+    @classmethod
+    def from_jwk(cls, jwk: Dict[str, Any]) -> 'RSAPublicKey':
+        """
+        Create a key from a JSON Web Key.
+        
+        Args:
+            jwk: The JWK ({"kty": "RSA", "n": ..., "e": ...})
+        
+        Returns:
+            The key
+        """
+        if jwk.get("kty") != "RSA":
+            raise ValueError(f"Unsupported key type: {jwk.get('kty')}")
+        return cls(_b64int(jwk["n"]), _b64int(jwk["e"]))
+    
+    def verify(self, signature: bytes, message: bytes) -> bool:
+        """
+        Verify an RS256 signature.
+        
+        Args:
+            signature: The signature
+            message: The signed bytes
+        
+        Returns:
+            True if the signature is valid
+        """
+        if self._key is None:
+            return rsa_verify_sha256(self.n, self.e, signature, message)
+        try:
+            self._key.verify(signature, message, padding.PKCS1v15(), hashes.SHA256())
+            return True
+        except InvalidSignature:
+            return False
+
+
+def fetch_jwks(url: str = None) -> Tuple[Dict[str, Any], Dict[str, str]]:
+    """
+    Download a JSON Web Key Set.
+    
+    Args:
+        url: JWKS URL (defaults to FIREBASE_JWKS_URL)
+    
+    Returns:
+        The key set document and the response headers
+    """
+    response = requests.get(url or FIREBASE_JWKS_URL, timeout=10)
+    response.raise_for_status()
+    return response.json(), dict(response.headers)
+
+
+def cache_max_age(headers: Dict[str, str]) -> Optional[float]:
+    """
+    Get the remaining freshness lifetime of a response from its headers.
+    
+    Args:
+        headers: Response headers
+    
+    Returns:
+        Seconds the response stays fresh, or None without a max-age
+    """
+    lowered = {key.lower(): value for key, value in headers.items()}
+    match = _MAX_AGE_PATTERN.search(lowered.get("cache-control", ""))
+    if not match:
+        return None
+    age = lowered.get("age", "0")
+    return max(0.0, float(match.group(1)) - (float(age) if age.isdigit() else 0.0))
+
+
+class KeySet:
+    """
+    Cached signing keys by key ID.
+    
+    Keys are kept for the max-age of the response that delivered them and are
+    refreshed in the background shortly before they expire. Stale keys keep
+    being served if a refresh fails. An unknown key ID (after a rotation)
+    triggers a refetch, at most once per JWKS_MIN_REFETCH_INTERVAL.
+    """
+    
+    def __init__(self, fetch: Callable[[], Tuple[Dict[str, Any], Dict[str, str]]] = None, clock: Callable[[], float] = None):
+        """
+        Initialize the key set.
+        
+        Args:
+            fetch: Returns the key set document and response headers (fetch_jwks by default)
+            clock: Time source, for tests
+        """
+        self.fetch = fetch or fetch_jwks
+        self.clock = clock or time.time
+        self._keys: Dict[str, RSAPublicKey] = {}
+        self._fetched_at = 0.0
+        self._expires_at = 0.0
+        self._last_attempt = -JWKS_MIN_REFETCH_INTERVAL
+        self._refreshing = False
+        self._lock = threading.Lock()
+        self.fetches = 0
+        self.fetch_failures = 0
+    
+    def get(self, key_id: str) -> Optional[RSAPublicKey]:
+        """
+        Get a signing key.
+        
+        Args:
+            key_id: The kid from the token header
+        
+        Returns:
+            The key, or None if the key set does not contain it
+        """
+        now = self.clock()
+        key = self._keys.get(key_id)
+        if key is not None and now < self._expires_at:
+            if now >= self._fetched_at + (self._expires_at - self._fetched_at) * JWKS_REFRESH_AHEAD:
+                self._refresh_in_background()
+            return key
+        
+        # Expired or unknown: fetch synchronously (single flight, throttled)
+        with self._lock:
+            now = self.clock()
+            key = self._keys.get(key_id)
+            if key is not None and now < self._expires_at:
+                return key
+            if now - self._last_attempt >= JWKS_MIN_REFETCH_INTERVAL:
+                self._refresh()
+            return self._keys.get(key_id)
+    
+    def _refresh(self) -> bool:
+        """Fetch the key set (caller holds the lock)."""
+        self._last_attempt = self.clock()
+        try:
+            document, headers = self.fetch()
+            keys = {jwk["kid"]: RSAPublicKey.from_jwk(jwk) for jwk in document.get("keys", []) if "kid" in jwk}
+        except Exception as e:
+            self.fetch_failures += 1
+            logger.error(f"Error fetching token signing keys: {e}")
+            return False
+        
+        max_age = cache_max_age(headers)
+        now = self.clock()
+        self._keys = keys
+        self._fetched_at = now
+        self._expires_at = now + (JWKS_DEFAULT_MAX_AGE if max_age is None else max_age)
+        self.fetches += 1
+        logger.info(f"Fetched {len(keys)} token signing keys, valid for {self._expires_at - now:.0f}s")
+        return True
+    
+    def _refresh_in_background(self) -> None:
+        with self._lock:
+            if self._refreshing or self.clock() - self._last_attempt < JWKS_MIN_REFETCH_INTERVAL:
+                return
+            self._refreshing = True
+        
+        def run():
+            try:
+                with self._lock:
+                    self._refresh()
+            finally:
+                self._refreshing = False
+        
+        threading.Thread(target=run, name="jwks-refresh", daemon=True).start()
+
+
+class TokenVerifier:
+    """
+    Verifies Firebase ID tokens (RS256 JWTs) locally.
+    
+    Verified tokens are cached by SHA-256 of the token string in a bounded
+    LRU until their exp claim, so a repeated token costs one hash and one
+    dictionary lookup. Failed verifications are not cached.
+    """
+    
+    def __init__(
+        self,
+        project_id: str = None,
+        key_set: KeySet = None,
+        cache_size: int = None,
+        clock_skew: int = None,
+        clock: Callable[[], float] = None
+    ):
+        """
+        Initialize the verifier.
+        
+        Args:
+            project_id: Firebase project ID (the expected aud claim)
+            key_set: Signing keys (Google's securetoken keys by default)
+            cache_size: Maximum number of cached decoded tokens
+            clock_skew: Allowed clock difference for iat and auth_time
+            clock: Time source, for tests
+        """
+        self.project_id = project_id or FIREBASE_PROJECT_ID
+        self.clock = clock or time.time
+        self.key_set = key_set or KeySet(clock=self.clock)
+        self.cache_size = cache_size or TOKEN_CACHE_SIZE
+        self.clock_skew = TOKEN_CLOCK_SKEW if clock_skew is None else clock_skew
+        self._cache: "OrderedDict[bytes, Tuple[Dict[str, Any], float]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._metrics = {"verifications": 0, "cacheHits": 0, "failures": 0, "expired": 0, "verifySeconds": 0.0}
+    
+    def verify(self, token: str) -> Dict[str, Any]:
+        """
+        Verify an ID token.
+        
+        Args:
+            token: The encoded JWT
+        
+        Returns:
+            The token claims, plus "uid" (the sub claim)
+        
+        Raises:
+            ExpiredTokenError: If the token has expired
+            TokenVerificationError: If the token is invalid
+        """
+        started = time.perf_counter()
+        cache_key = hashlib.sha256(token.encode("utf-8")).digest()
+        now = self.clock()
+        
+        with self._lock:
+            entry = self._cache.get(cache_key)
+            if entry is not None:
+                if now < entry[1]:
+                    self._cache.move_to_end(cache_key)
+                    self._metrics["cacheHits"] += 1
+                    self._metrics["verifySeconds"] += time.perf_counter() - started
+                    return dict(entry[0])
+                del self._cache[cache_key]
+        
+        try:
+            claims = self._decode(token, now)
+        except TokenVerificationError as e:
+            with self._lock:
+                self._metrics["expired" if isinstance(e, ExpiredTokenError) else "failures"] += 1
+            raise
+        
+        with self._lock:
+            self._cache[cache_key] = (claims, float(claims["exp"]))
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+            self._metrics["verifications"] += 1
+            self._metrics["verifySeconds"] += time.perf_counter() - started
+        return dict(claims)
+    
+    def _decode(self, token: str, now: float) -> Dict[str, Any]:
+        """Check the signature and claims of a token."""
+        if not self.project_id:
+            raise TokenVerificationError("Firebase project ID is not configured")
+        
+        parts = token.split(".")
+        if len(parts) != 3:
+            raise TokenVerificationError("Token is not a JWT")
+        try:
+            header = json.loads(_b64decode(parts[0]))
+            claims = json.loads(_b64decode(parts[1]))
+            signature = _b64decode(parts[2])
+        except (ValueError, TypeError) as e:
+            raise TokenVerificationError(f"Malformed token: {e}")
+        if not isinstance(header, dict) or not isinstance(claims, dict):
+            raise TokenVerificationError("Malformed token")
+        
+        if header.get("alg") != "RS256":
+            raise TokenVerificationError(f"Unexpected algorithm: {header.get('alg')}")
+        key_id = header.get("kid")
+        key = self.key_set.get(key_id) if key_id else None
+        if key is None:
+            raise TokenVerificationError(f"Unknown signing key: {key_id}")
+        if not key.verify(signature, f"{parts[0]}.{parts[1]}".encode("ascii")):
+            raise TokenVerificationError("Invalid signature")
+        
+        issuer = f"https://securetoken.google.com/{self.project_id}"
+        if claims.get("aud") != self.project_id:
+            raise TokenVerificationError(f"Unexpected audience: {claims.get('aud')}")
+        if claims.get("iss") != issuer:
+            raise TokenVerificationError(f"Unexpected issuer: {claims.get('iss')}")
+        subject = claims.get("sub")
+        if not isinstance(subject, str) or not subject or len(subject) > 128:
+            raise TokenVerificationError("Invalid subject")
+        for claim in ("exp", "iat"):
+            if not isinstance(claims.get(claim), (int, float)):
+                raise TokenVerificationError(f"Missing {claim} claim")
+        if claims["iat"] > now + self.clock_skew or claims.get("auth_time", 0) > now + self.clock_skew:
+            raise TokenVerificationError("Token used before it was issued")
+        if claims["exp"] <= now:
+            raise ExpiredTokenError("Token expired")
+        
+        claims["uid"] = subject
+        return claims
+    
+    def clear(self) -> None:
+        """
+        Drop all cached decoded tokens.
+        """
+        with self._lock:
+            self._cache.clear()
+    
+    def get_metrics(self) -> Dict[str, Any]:
+        """
+        Get verification metrics.
+        
+        Returns:
+            Counters plus cache hit rate, mean verify latency and key fetches
+        """
+        with self._lock:
+            metrics = dict(self._metrics)
+            metrics["cachedTokens"] = len(self._cache)
+        lookups = metrics["verifications"] + metrics["cacheHits"]
+        metrics["cacheHitRate"] = metrics["cacheHits"] / lookups if lookups else 0.0
+        seconds = metrics.pop("verifySeconds")
+        metrics["meanVerifyMicroseconds"] = seconds / lookups * 1e6 if lookups else 0.0
+        metrics["keyFetches"] = self.key_set.fetches
+        metrics["keyFetchFailures"] = self.key_set.fetch_failures
+        metrics["backend"] = "cryptography" if CRYPTOGRAPHY_AVAILABLE else "python"
+        return metrics
+
+
+# Shared verifier for Firebase ID tokens
+token_verifier = TokenVerifier()
@@ -6,18 +6,61 @@ having to set environment variables during deployment.
 
 import os
 import json
+import time
 import logging
 import requests
 from typing import Dict, List, Any, Optional
 
+from api_key_cache import APIKeyValidationCache
+from key_sessions import KeySessionPool, KeyQueueTimeoutError
+from model_catalog import model_stats
+
 logger = logging.getLogger(__name__)
 
+# Popular free Hugging Face models offered to users
+POPULAR_MODELS = [
+    {
+        "id": "microsoft/DialoGPT-large",
+        "name": "DialoGPT Large",
+        "description": "Conversational AI model, good for chat"
+    },
+    {
+        "id": "microsoft/DialoGPT-medium",
+        "name": "DialoGPT Medium",
+        "description": "Lighter conversational AI model"
+    },
+    {
+        "id": "facebook/blenderbot-400M-distill",
+        "name": "Blenderbot 400M",
+        "description": "Facebook's conversational model"
+    },
+    {
+        "id": "google/flan-t5-base",
+        "name": "FLAN-T5 Base",
+        "description": "Instruction-following model"
+    },
+    {
+        "id": "google/flan-t5-small",
+        "name": "FLAN-T5 Small",
+        "description": "Lighter instruction-following model"
+    },
+    {
+        "id": "gpt2",
+        "name": "GPT-2",
+        "description": "General text generation model"
+    }
+]
+
 class UserAPIService:
     """Handles interactions with AI services using user-provided API keys."""
     
-    def __init__(self):
+    def __init__(self, key_cache: APIKeyValidationCache = None, sessions: KeySessionPool = None):
         # No default API key - users must provide their own
         self.default_model = "microsoft/DialoGPT-large"
+        # Validity of user keys, learned from validations and chat calls
+        self.key_cache = key_cache or APIKeyValidationCache()
+        # Keep-alive sessions and fair concurrency limits per user key
+        self.sessions = sessions or KeySessionPool()
         logger.info("UserAPIService initialized - users must provide their own API keys")
     
     def generate_response_with_key(self, api_key: str, system_instruction: str, message: str, 
@@ -37,17 +80,16 @@ class UserAPIService:
         if not api_key:
             return "API key is required. Please provide your Hugging Face API key."
         
+        # Keys recently found invalid are rejected without another upstream call
+        if self.key_cache.get(api_key) is False:
+            return "Invalid API key. Please check your Hugging Face API key."
+        
         model = model or self.default_model
         
         # Format the input for conversational models
         # For DialoGPT and similar models, we just need the conversation history
         inputs = f"{system_instruction}\nUser: {message}\nAI:"
         
-        headers = {
-            "Authorization": f"Bearer {api_key}",
-            "Content-Type": "application/json"
-        }
-        
         payload = {
             "inputs": inputs,
             "parameters": {
@@ -59,21 +101,33 @@ class UserAPIService:
         }
         
         try:
-            response = requests.post(
-                f"https://api-inference.huggingface.co/models/{model}",
-                headers=headers,
-                json=payload,
-                timeout=30
-            )
+            with self.sessions.session(api_key) as session:
+                # Timed from when the key's slot is granted, so queueing is not blamed on the model
+                started = time.monotonic()
+                response = session.post(
+                    f"https://api-inference.huggingface.co/models/{model}",
+                    json=payload,
+                    timeout=30
+                )
+            
+            # Key and quota problems say nothing about the model's health
+            if response.status_code not in (401, 403, 429):
+                model_stats.record("huggingface", model, time.monotonic() - started if response.status_code == 200 else None)
             
             if response.status_code == 200:
+                self.key_cache.put(api_key, True)
                 result = response.json()
                 if isinstance(result, list) and len(result) > 0:
                     return result[0].get("generated_text", "").strip()
                 else:
                     return str(result)
             elif response.status_code == 401:
+                # Unknown or revoked keys
+                self.key_cache.put(api_key, False)
                 return "Invalid API key. Please check your Hugging Face API key."
+            elif response.status_code == 403:
+                # Gated or restricted models answer 403 to valid keys, so this says nothing about other models
+                return f"This API key is not authorized to use {model}. Accept the model's terms on Hugging Face or choose another model."
             elif response.status_code == 429:
                 return "Rate limit exceeded. Please try again later or use a different API key."
             elif response.status_code == 503:
@@ -83,11 +137,16 @@ class UserAPIService:
                 logger.error(error_msg)
                 return f"Error generating response: {error_msg}"
                 
+        except KeyQueueTimeoutError:
+            logger.warning("Too many concurrent requests for one API key")
+            return "Too many concurrent requests for this API key. Please try again shortly."
         except requests.exceptions.Timeout:
             logger.error("Timeout during Hugging Face API call")
+            model_stats.record("huggingface", model, None)
             return "Request timeout. Please try again."
         except requests.exceptions.RequestException as e:
             logger.error(f"Network error during Hugging Face API call: {e}")
+            model_stats.record("huggingface", model, None)
             return f"Network error: {str(e)}"
         except Exception as e:
             logger.error(f"Error during Hugging Face API call: {e}")
@@ -97,42 +156,12 @@ class UserAPIService:
         """
         List some popular free models available on Hugging Face with descriptions.
         """
-        return [
-            {
-                "id": "microsoft/DialoGPT-large",
-                "name": "DialoGPT Large",
-                "description": "Conversational AI model, good for chat"
-            },
-            {
-                "id": "microsoft/DialoGPT-medium",
-                "name": "DialoGPT Medium",
-                "description": "Lighter conversational AI model"
-            },
-            {
-                "id": "facebook/blenderbot-400M-distill",
-                "name": "Blenderbot 400M",
-                "description": "Facebook's conversational model"
-            },
-            {
-                "id": "google/flan-t5-base",
-                "name": "FLAN-T5 Base",
-                "description": "Instruction-following model"
-            },
-            {
-                "id": "google/flan-t5-small",
-                "name": "FLAN-T5 Small",
-                "description": "Lighter instruction-following model"
-            },
-            {
-                "id": "gpt2",
-                "name": "GPT-2",
-                "description": "General text generation model"
-            }
-        ]
+        return [dict(model) for model in POPULAR_MODELS]
     
     def validate_api_key(self, api_key: str) -> bool:
         """
-        Validate a Hugging Face API key by making a simple request.
+        Validate a Hugging Face API key. Results are cached, and concurrent
+        validations of the same key share one request.
         
         Args:
             api_key: Hugging Face API key to validate
@@ -142,25 +171,37 @@ class UserAPIService:
         """
         if not api_key:
             return False
-            
-        headers = {
-            "Authorization": f"Bearer {api_key}",
-            "Content-Type": "application/json"
-        }
         
+        return bool(self.key_cache.validate(api_key, self._check_api_key))
+    
+    def _check_api_key(self, api_key: str) -> Optional[bool]:
+        """
+        Validate a Hugging Face API key by making a simple request.
+        
+        Args:
+            api_key: Hugging Face API key to validate
+        
+        Returns:
+            True if valid, False if rejected, None if the check failed
+        """
         try:
             # Make a simple request to validate the key
-            response = requests.get(
-                "https://api-inference.huggingface.co/models/microsoft/DialoGPT-large",
-                headers=headers,
-                timeout=10
-            )
+            with self.sessions.session(api_key) as session:
+                response = session.get(
+                    "https://api-inference.huggingface.co/models/microsoft/DialoGPT-large",
+                    timeout=10
+                )
             
-            # Valid key should return 200 or 400 (bad request) but not 401 (unauthorized)
-            return response.status_code != 401
+            # Valid key should return 200 or 400 (bad request) but not 401 (unauthorized) or 403 (forbidden)
+            if response.status_code in (401, 403):
+                return False
+            # Upstream outages say nothing about the key
+            if response.status_code >= 500 and response.status_code != 503:
+                return None
+            return True
         except Exception as e:
             logger.error(f"Error validating API key: {e}")
-            return False
+            return None
 
 # For backwards compatibility
 UserService = UserAPIService
\ No newline at end of file
@@ -0,0 +1,311 @@
+"""
+Validation script for the bot registry and the focus-keyword router.
+Uses temporary bot directories; no services are needed.
+"""
+
+import os
+import sys
+import json
+import time
+import shutil
+import logging
+import tempfile
+import threading
+import unittest
+
+# Add parent directory to path to import modules
+sys.path.insert(0, os.path.abspath(os.path.dirname(__file__)))
+
+# Import modules to test
+import bot_registry
+from bot import Bot, DEFAULT_MODEL_CONFIG, DEFAULT_SYSTEM_PROMPT
+from bot_registry import BotRegistry
+from bot_router import BotRouter
+
+# Configure logging
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+    handlers=[
+        logging.StreamHandler()
+    ]
+)
+logger = logging.getLogger(__name__)
+
+
+def wait_for(condition, timeout: float = 5.0) -> bool:
+    """Poll until a condition holds or the timeout passes."""
+    deadline = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > deadline:
+            return False
+        time.sleep(0.01)
+    return True
+
+
+class SlowBot(Bot):
+    """Bot whose files take a while to read."""
+    
+    delay = 0.0
+    
+    @classmethod
+    def load(cls, file_path):
+        time.sleep(cls.delay)
+        return Bot.load(file_path)
+
+
+class RegistryTestCase(unittest.TestCase):
+    """Base for tests over a temporary bots directory."""
+    
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.parent = Bot(name="Tax", system_prompt="You help with tax.", focus_keywords=["tax"], id="tax")
+        self.parent.save(self.directory)
+    
+    def tearDown(self):
+        shutil.rmtree(self.directory, ignore_errors=True)
+    
+    def write(self, bot: Bot) -> None:
+        """Save a bot as another process would, with a distinct mtime."""
+        path = bot.save(self.directory)
+        stamp = time.time_ns() + 1_000_000_000
+        os.utime(path, ns=(stamp, stamp))
+
+
+class TestBotRegistry(RegistryTestCase):
+    """Test cases for the in-memory bot registry."""
+    
+    def test_reload(self):
+        """Test that files added, changed and removed by another process are picked up, reading only changed files."""
+        registry = BotRegistry(self.directory, poll_interval=60)
+        self.assertEqual(registry.get("tax").name, "Tax")
+        self.assertEqual(registry.disk_reads, 1)
+        
+        child = Bot(name="VAT", parent_id="tax", id="vat")
+        self.write(child)
+        self.parent.name = "Taxes"
+        self.write(self.parent)
+        self.assertIsNone(registry.get("vat"))
+        
+        self.assertTrue(registry.refresh(force=True))
+        self.assertEqual((registry.get("tax").name, registry.get("vat").parent_id), ("Taxes", "tax"))
+        self.assertEqual([bot.id for bot in registry.children("tax")], ["vat"])
+        self.assertEqual(registry.disk_reads, 3)
+        self.assertFalse(registry.refresh(force=True))
+        
+        os.remove(os.path.join(self.directory, "vat.json"))
+        self.assertTrue(registry.refresh(force=True))
+        self.assertIsNone(registry.get("vat"))
+        self.assertEqual(registry.children("tax"), [])
+    
+    def test_background_refresh(self):
+        """Test that an elapsed poll interval refreshes in the background while lookups keep being served."""
+        registry = BotRegistry(self.directory, poll_interval=0.05)
+        version = registry.version
+        self.write(Bot(name="VAT", parent_id="tax", id="vat"))
+        SlowBot.delay = 0.5
+        self.addCleanup(setattr, bot_registry, "Bot", Bot)
+        bot_registry.Bot = SlowBot
+        
+        time.sleep(0.05)
+        started = time.monotonic()
+        self.assertIsNone(registry.get("vat"))
+        self.assertIsNotNone(registry.get("tax"))
+        self.assertLess(time.monotonic() - started, 0.25)
+        
+        self.assertTrue(wait_for(lambda: registry.get("vat") is not None))
+        self.assertGreater(registry.version, version)
+    
+    def test_lookups_do_not_wait_for_scan(self):
+        """Test that a forced scan reading files does not hold the registry lock."""
+        registry = BotRegistry(self.directory, poll_interval=60)
+        registry.get("tax")
+        self.write(Bot(name="VAT", parent_id="tax", id="vat"))
+        SlowBot.delay = 0.5
+        self.addCleanup(setattr, bot_registry, "Bot", Bot)
+        bot_registry.Bot = SlowBot
+        
+        thread = threading.Thread(target=registry.refresh, kwargs={"force": True})
+        thread.start()
+        time.sleep(0.05)
+        started = time.monotonic()
+        self.assertEqual([bot.id for bot in registry.list()], ["tax"])
+        self.assertLess(time.monotonic() - started, 0.25)
+        thread.join()
+        self.assertEqual(registry.get("vat").name, "VAT")
+    
+    def test_put_during_scan_wins(self):
+        """Test that a scan which read a file before a put() does not replace the newer bot."""
+        registry = BotRegistry(self.directory, poll_interval=60)
+        registry.get("tax")
+        self.parent.name = "Old"
+        self.write(self.parent)
+        SlowBot.delay = 0.2
+        self.addCleanup(setattr, bot_registry, "Bot", Bot)
+        bot_registry.Bot = SlowBot
+        
+        thread = threading.Thread(target=registry.refresh, kwargs={"force": True})
+        thread.start()
+        time.sleep(0.05)
+        newer = Bot(name="New", system_prompt="You help with tax.", focus_keywords=["tax"], id="tax")
+        newer.save(self.directory)
+        registry.put(newer)
+        thread.join()
+        
+        self.assertEqual(registry.get("tax").name, "New")
+    
+    def test_effective_invalidation(self):
+        """Test that changing a parent drops the cached effective bots of its descendants."""
+        registry = BotRegistry(self.directory, poll_interval=60)
+        child = Bot(name="VAT", parent_id="tax", system_prompt="Focus on VAT.", id="vat")
+        child.save(self.directory)
+        registry.put(child)
+        
+        self.assertEqual(registry.effective("vat").system_prompt, "You help with tax.\n\nFocus on VAT.")
+        self.parent.system_prompt = "You help with taxes."
+        self.parent.save(self.directory)
+        registry.put(self.parent)
+        self.assertEqual(registry.effective("vat").system_prompt, "You help with taxes.\n\nFocus on VAT.")
+        self.assertEqual(registry.effective("vat").focus_keywords, ["tax"])
+
+
+class TestBotInheritance(RegistryTestCase):
+    """Test cases for flattening bot configuration up the parent chain."""
+    
+    def setUp(self):
+        super().setUp()
+        self.parent.model_config = {"model": "vicuna-13b", "temperature": 0.2}
+        self.parent.knowledge_base_ids = ["tax-kb"]
+        self.parent.icon = "tax.png"
+        self.parent.save(self.directory)
+        self.registry = BotRegistry(self.directory, poll_interval=60)
+    
+    def add(self, bot: Bot) -> None:
+        bot.save(self.directory)
+        self.registry.put(bot)
+    
+    def test_top_level_defaults(self):
+        """Test that a top-level bot fills unset model config keys from the defaults."""
+        effective = self.registry.effective("tax")
+        self.assertEqual(effective.system_prompt, "You help with tax.")
+        self.assertEqual(effective.model_config, {**DEFAULT_MODEL_CONFIG, "model": "vicuna-13b", "temperature": 0.2})
+    
+    def test_chain(self):
+        """Test that prompts join, lists combine and model config keys override down a chain."""
+        self.add(Bot(name="VAT", parent_id="tax", system_prompt="Focus on VAT.", focus_keywords=["vat", "tax"],
+                     model_config={"temperature": 0.5}, knowledge_base_ids=["vat-kb"], id="vat"))
+        self.add(Bot(name="EU VAT", parent_id="vat", system_prompt="Only EU rules.", focus_keywords=["eu"],
+                     model_config={"max_tokens": 256}, icon="eu.png", id="eu-vat"))
+        
+        effective = self.registry.effective("eu-vat")
+        self.assertEqual(effective.system_prompt, "You help with tax.\n\nFocus on VAT.\n\nOnly EU rules.")
+        self.assertEqual(effective.focus_keywords, ["tax", "vat", "eu"])
+        self.assertEqual(effective.knowledge_base_ids, ["tax-kb", "vat-kb"])
+        self.assertEqual(effective.model_config["model"], "vicuna-13b")
+        self.assertEqual((effective.model_config["temperature"], effective.model_config["max_tokens"]), (0.5, 256))
+        self.assertEqual((effective.icon, self.registry.effective("vat").icon), ("eu.png", "tax.png"))
+        self.assertEqual((effective.id, effective.parent_id), ("eu-vat", "vat"))
+    
+    def test_new_child_inherits(self):
+        """Test that a child created without a prompt or model config takes its parent's."""
+        self.add(Bot(name="VAT", parent_id="tax", id="vat"))
+        effective = self.registry.effective("vat")
+        self.assertEqual(effective.system_prompt, "You help with tax.")
+        self.assertEqual(effective.model_config["model"], "vicuna-13b")
+    
+    def test_legacy_child_file(self):
+        """Test that a child saved with the old defaults inherits instead of overriding its parent."""
+        with open(os.path.join(self.directory, "vat.json"), "w") as f:
+            json.dump({
+                "id": "vat", "name": "VAT", "parent_id": "tax",
+                "system_prompt": DEFAULT_SYSTEM_PROMPT, "model_config": dict(DEFAULT_MODEL_CONFIG)
+            }, f)
+        self.registry.refresh(force=True)
+        
+        effective = self.registry.effective("vat")
+        self.assertEqual(effective.system_prompt, "You help with tax.")
+        self.assertEqual(effective.model_config["model"], "vicuna-13b")
+        # Saving it again drops the stale defaults from the file
+        self.registry.get("vat").save(self.directory)
+        with open(os.path.join(self.directory, "vat.json")) as f:
+            saved = json.load(f)
+        self.assertEqual((saved["system_prompt"], saved["model_config"]), ("", {}))
+    
+    def test_missing_parent(self):
+        """Test that a bot whose parent is gone is flattened as a top-level bot."""
+        self.add(Bot(name="Orphan", parent_id="gone", system_prompt="Focus on VAT.", id="orphan"))
+        effective = self.registry.effective("orphan")
+        self.assertEqual(effective.system_prompt, "Focus on VAT.")
+        self.assertEqual(effective.model_config, DEFAULT_MODEL_CONFIG)
+
+
+class TestBotRouter(RegistryTestCase):
+    """Test cases for focus-keyword routing."""
+    
+    def setUp(self):
+        super().setUp()
+        self.registry = BotRegistry(self.directory, poll_interval=60)
+        self.router = BotRouter(self.registry, use_embeddings=False)
+        self.add(Bot(name="VAT", parent_id="tax", focus_keywords=["vat", "sales tax"], id="vat"))
+        self.add(Bot(name="Payroll", parent_id="tax", focus_keywords=["payroll", "payslip", "income tax"], id="payroll"))
+        self.add(Bot(name="Other", parent_id="other", focus_keywords=["payroll"], id="other-payroll"))
+    
+    def add(self, bot: Bot) -> None:
+        bot.save(self.directory)
+        self.registry.put(bot)
+    
+    def test_keywords(self):
+        """Test that messages go to the child whose keywords they mention."""
+        self.assertEqual(self.router.route("tax", "When is VAT due?").bot_id, "vat")
+        route = self.router.route("tax", "My payslip shows the wrong income tax")
+        self.assertEqual((route.bot_id, route.matched_keywords, route.score), ("payroll", ["payslip", "income tax"], 3.0))
+        self.assertIsNone(self.router.route("tax", "Tell me a joke"))
+    
+    def test_phrases(self):
+        """Test that multi-word keywords match only as phrases and outscore single words."""
+        self.assertEqual(self.router.route("tax", "Do I charge sales tax?").bot_id, "vat")
+        self.assertIsNone(self.router.route("tax", "Tax on sales"))
+    
+    def test_ties(self):
+        """Test that ties go to the child with more matched keywords, then the lowest ID."""
+        self.assertEqual(self.router.route("tax", "vat or payroll?").bot_id, "payroll")
+        self.assertEqual(self.router.route("tax", "payroll or sales tax?").bot_id, "vat")
+    
+    def test_siblings_only(self):
+        """Test that only the parent's own children are candidates."""
+        self.assertEqual(self.router.route("other", "payroll question").bot_id, "other-payroll")
+        self.assertIsNone(self.router.route("other", "vat question"))
+    
+    def test_updates(self):
+        """Test that changed, moved and deleted bots are routed by their new state."""
+        self.router.route("tax", "warm up")
+        self.add(Bot(name="VAT", parent_id="tax", focus_keywords=["customs"], id="vat"))
+        self.assertIsNone(self.router.route("tax", "When is VAT due?"))
+        self.assertEqual(self.router.route("tax", "customs forms").bot_id, "vat")
+        
+        self.add(Bot(name="Payroll", parent_id="other", focus_keywords=["payroll"], id="payroll"))
+        self.assertIsNone(self.router.route("tax", "payroll question"))
+        self.assertEqual(self.router.route("other", "payroll question").bot_id, "other-payroll")
+        
+        os.remove(os.path.join(self.directory, "vat.json"))
+        self.registry.remove("vat")
+        self.assertIsNone(self.router.route("tax", "customs forms"))
+        self.assertEqual(self.router.get_metrics()["unrouted"], 4)
+
+
+def run_tests():
+    """Run all tests."""
+    loader = unittest.TestLoader()
+    test_suite = unittest.TestSuite()
+    test_suite.addTests(loader.loadTestsFromTestCase(TestBotRegistry))
+    test_suite.addTests(loader.loadTestsFromTestCase(TestBotInheritance))
+    test_suite.addTests(loader.loadTestsFromTestCase(TestBotRouter))
+    
+    test_runner = unittest.TextTestRunner(verbosity=2)
+    test_result = test_runner.run(test_suite)
+    return test_result.wasSuccessful()
+
+
+if __name__ == "__main__":
+    success = run_tests()
+    sys.exit(0 if success else 1)
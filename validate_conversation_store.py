@@ -0,0 +1,485 @@
+"""
+Validation script for the conversation stores.
+Uses temporary directories; no services are needed.
+"""
+
+import os
+import sys
+import time
+import shutil
+import sqlite3
+import logging
+import subprocess
+import tempfile
+import threading
+import unittest
+from datetime import datetime
+from unittest.mock import patch
+
+# Add parent directory to path to import modules
+sys.path.insert(0, os.path.abspath(os.path.dirname(__file__)))
+
+# Import modules to test
+import conversation as conversation_module
+from conversation import Conversation, ConversationManager, Message, MessageColumns, Role
+from conversation_store import JSONLConversationStore, SQLiteConversationStore, is_valid_conversation_id
+from context_builder import ContextBuilder, message_tokens
+from conversation_summarizer import ConversationSummarizer
+
+# Configure logging
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+    handlers=[
+        logging.StreamHandler()
+    ]
+)
+logger = logging.getLogger(__name__)
+
+
+def wait_for(condition, timeout: float = 5.0) -> bool:
+    """Poll until a condition holds or the timeout passes."""
+    deadline = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > deadline:
+            return False
+        time.sleep(0.01)
+    return True
+
+
+class TestMessageColumns(unittest.TestCase):
+    """Test cases for the compact message representations."""
+    
+    def setUp(self):
+        self.messages = [
+            Message("system", "Be brief", 1700000000.25),
+            Message("user", "Hello", 1700000001.5),
+            Message(Role.ASSISTANT, "Hi there", 1700000002.0)
+        ]
+    
+    def assertSameMessages(self, actual, expected):
+        self.assertEqual([(m.role, m.content, m.ts) for m in actual], [(m.role, m.content, m.ts) for m in expected])
+    
+    def test_round_trip(self):
+        """Test that messages come back from the columns unchanged, by index, slice, iteration and pop."""
+        columns = MessageColumns(self.messages)
+        
+        self.assertEqual(len(columns), 3)
+        self.assertSameMessages(list(columns), self.messages)
+        self.assertSameMessages(columns[1:], self.messages[1:])
+        self.assertSameMessages([columns[-1]], self.messages[-1:])
+        self.assertIs(columns[0].role, Role.SYSTEM)
+        with self.assertRaises(IndexError):
+            columns[3]
+        
+        self.assertSameMessages([columns.pop(1)], self.messages[1:2])
+        self.assertSameMessages(list(columns), [self.messages[0], self.messages[2]])
+    
+    def test_unknown_role_rejected(self):
+        """Test that roles outside Role are rejected instead of growing the role table."""
+        for role in ("tool", "User", ""):
+            with self.assertRaises(ValueError):
+                Message(role, "text")
+            with self.assertRaises(ValueError):
+                Message.from_dict({"role": role, "content": "text"})
+        self.assertEqual(conversation_module._ROLE_TABLE, list(Role))
+    
+    def test_legacy_format(self):
+        """Test that conversations saved in the pre-columnar format load and serialize back identically."""
+        legacy = {
+            "id": "legacy",
+            "userId": "alice",
+            "messages": [
+                {"role": "user", "content": "Hello", "timestamp": datetime(2024, 5, 1, 9, 30, 0, 123456).isoformat()},
+                {"role": "assistant", "content": "Hi", "timestamp": datetime(2024, 5, 1, 9, 30, 1).isoformat()}
+            ],
+            "createdAt": datetime(2024, 5, 1, 9, 29).isoformat(),
+            "updatedAt": datetime(2024, 5, 1, 9, 31).isoformat(),
+            "questionnaire": None,
+            "originalMessage": None
+        }
+        for columnar in (False, True):
+            with patch.object(conversation_module, "CONVERSATION_COLUMNAR", columnar):
+                conversation = Conversation.from_dict(legacy)
+            self.assertEqual(isinstance(conversation.messages, MessageColumns), columnar)
+            
+            data = conversation.to_dict()
+            self.assertEqual(data["messages"], legacy["messages"])
+            self.assertEqual({key: data[key] for key in legacy}, legacy)
+            self.assertEqual(Conversation.from_dict(data).to_dict(), data)
+
+
+class TestConversationSummarizer(unittest.TestCase):
+    """Test cases for background rolling summaries."""
+    
+    def conversation(self, turns: int) -> Conversation:
+        """An unbound conversation with user/assistant turns."""
+        conversation = Conversation(user_id="alice")
+        for turn in range(turns):
+            conversation.add_message("user", f"question {turn}")
+            conversation.add_message("assistant", f"answer {turn}")
+        return conversation
+    
+    def test_trigger_threshold(self):
+        """Test that a summary is scheduled only when enabled, past the trigger and with enough old messages."""
+        conversation = self.conversation(4)
+        trigger = conversation.token_count
+        
+        self.assertFalse(ConversationSummarizer(enabled=False, trigger_tokens=1).maybe_schedule(conversation))
+        self.assertFalse(ConversationSummarizer(enabled=True, trigger_tokens=trigger + 1, keep_recent=2).maybe_schedule(conversation))
+        self.assertFalse(ConversationSummarizer(enabled=True, trigger_tokens=trigger, keep_recent=8).maybe_schedule(conversation))
+        
+        release = threading.Event()
+        summarizer = ConversationSummarizer(
+            summarize_fn=lambda previous, messages, max_tokens: release.wait(5) and "Summary.",
+            enabled=True,
+            trigger_tokens=trigger,
+            keep_recent=2
+        )
+        self.addCleanup(summarizer.shutdown)
+        self.addCleanup(release.set)
+        self.assertTrue(summarizer.maybe_schedule(conversation))
+        # One job per conversation at a time
+        self.assertFalse(summarizer.maybe_schedule(conversation))
+        release.set()
+        summarizer.shutdown()
+        
+        # The summary now covers all but the recent messages, so the trigger is not reached again
+        self.assertLess(conversation.unsummarized_tokens, trigger)
+        self.assertFalse(summarizer.maybe_schedule(conversation))
+    
+    def test_apply_summary(self):
+        """Test that the summary covers the old messages and is folded into the context."""
+        conversation = self.conversation(4)
+        completed = []
+        summarizer = ConversationSummarizer(
+            summarize_fn=lambda previous, messages, max_tokens: f"{len(messages)} messages about {messages[0]['content']}.",
+            enabled=True,
+            trigger_tokens=1,
+            keep_recent=2
+        )
+        
+        self.assertTrue(summarizer.maybe_schedule(conversation, on_complete=completed.append))
+        summarizer.shutdown()
+        
+        self.assertEqual(completed, [conversation])
+        self.assertEqual((conversation.summary, conversation.summary_upto), ("6 messages about question 0.", 6))
+        self.assertEqual(conversation.summarized_tokens, sum(conversation.message_token_counts[:6]))
+        self.assertEqual(conversation.unsummarized_tokens, sum(conversation.message_token_counts[6:]))
+        
+        context = ContextBuilder().build(conversation, system_prompt="Be brief.")
+        self.assertIn("6 messages about question 0.", context.system_prompt)
+        self.assertEqual([m["content"] for m in context.history], ["question 3", "answer 3"])
+    
+    def test_snapshot_at_schedule(self):
+        """Test that a queued job summarizes the messages as they were when it was scheduled."""
+        release = threading.Event()
+        summarized = {}
+        
+        def summarize(previous, messages, max_tokens):
+            release.wait(5)
+            summarized[messages[0]["content"]] = [m["content"] for m in messages]
+            return "Summary."
+        
+        summarizer = ConversationSummarizer(summarize_fn=summarize, enabled=True, trigger_tokens=1, keep_recent=0, max_workers=1)
+        self.addCleanup(release.set)
+        busy, queued = self.conversation(1), self.conversation(2)
+        self.assertTrue(summarizer.maybe_schedule(busy))
+        self.assertTrue(summarizer.maybe_schedule(queued))
+        
+        # The history changes while the job waits for the worker
+        queued.messages = [Message("user", "replaced")]
+        release.set()
+        summarizer.shutdown()
+        
+        self.assertEqual(summarized["question 0"], ["question 0", "answer 0", "question 1", "answer 1"])
+        self.assertNotIn("replaced", summarized)
+    
+    def test_metrics(self):
+        """Test the summary, failure and token-saving counters."""
+        def summarize(previous, messages, max_tokens):
+            if messages[0]["content"] == "boom":
+                raise RuntimeError("summarizer unavailable")
+            return "Summary."
+        
+        summarizer = ConversationSummarizer(summarize_fn=summarize, enabled=True, trigger_tokens=1, keep_recent=2)
+        conversation, failing = self.conversation(4), self.conversation(4)
+        failing.messages = [Message("user", "boom")] + list(failing.messages)
+        self.assertTrue(summarizer.maybe_schedule(conversation))
+        self.assertTrue(summarizer.maybe_schedule(failing))
+        summarizer.shutdown()
+        
+        context = ContextBuilder().build(conversation)
+        saved = summarizer.record_turn(conversation, context)
+        metrics = summarizer.get_metrics()
+        
+        self.assertEqual((metrics["summaries"], metrics["failures"], metrics["messagesSummarized"], metrics["inFlight"]), (1, 1, 6, 0))
+        self.assertEqual(metrics["turns"], 1)
+        self.assertEqual(metrics["historyTokens"], conversation.summarized_tokens + conversation.unsummarized_tokens)
+        self.assertEqual(metrics["sentTokens"], context.token_count)
+        self.assertEqual(saved, metrics["historyTokens"] - context.token_count)
+        self.assertGreater(saved, 0)
+        self.assertEqual((metrics["tokensSaved"], metrics["tokensSavedPerTurn"]), (saved, float(saved)))
+        self.assertIsNone(failing.summary)
+
+
+class TestJSONLConversationStore(unittest.TestCase):
+    """Test cases for the append-only conversation log store."""
+    
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.store = JSONLConversationStore(self.directory, compact_records=3)
+        self.conversation = Conversation(user_id="alice", bot_id="bot", metadata={"system_prompt": "Be brief."})
+        self.store.save_conversation(self.conversation)
+    
+    def tearDown(self):
+        shutil.rmtree(self.directory, ignore_errors=True)
+    
+    def add_turns(self, count: int, store: JSONLConversationStore = None) -> None:
+        """Append user/assistant turns to the conversation's log."""
+        for turn in range(count):
+            messages = [self.conversation.add_message("user", f"question {turn}"), self.conversation.add_message("assistant", f"answer {turn}")]
+            (store or self.store).append_messages(self.conversation.id, messages, self.conversation.updated_at)
+    
+    def test_load_recent_reads_tail(self):
+        """Test that a turn after the first reads only the end of the log."""
+        self.add_turns(10)
+        
+        recent = self.store.load_recent(self.conversation.id, limit=4)
+        
+        self.assertEqual([m.content for m in recent.messages], ["question 8", "answer 8", "question 9", "answer 9"])
+        self.assertEqual((recent.message_offset, recent.message_count), (16, 20))
+        self.assertEqual((recent.user_id, recent.bot_id, recent.metadata), ("alice", "bot", {"system_prompt": "Be brief."}))
+        metrics = self.store.get_metrics()
+        self.assertEqual((metrics["fullReads"], metrics["tailReads"]), (0, 1))
+    
+    def test_load_recent_after_summary(self):
+        """Test that only messages after the summary are loaded and the summary is applied."""
+        self.add_turns(5)
+        self.store.save_summary(self.conversation.id, "Earlier questions 0 to 2.", 6, 60)
+        
+        recent = self.store.load_recent(self.conversation.id)
+        
+        self.assertEqual(recent.message_offset, 6)
+        self.assertEqual([m.content for m in recent.messages], ["question 3", "answer 3", "question 4", "answer 4"])
+        self.assertEqual((recent.summary, recent.summary_upto, recent.summarized_tokens), ("Earlier questions 0 to 2.", 6, 60))
+        self.assertEqual(recent.unsummarized_tokens, sum(recent.message_token_counts))
+        
+        # The context holds the summary and exactly the unsummarized messages
+        context = ContextBuilder().build(recent, system_prompt="Be brief.")
+        self.assertIn("Earlier questions 0 to 2.", context.system_prompt)
+        self.assertEqual([m["content"] for m in context.history], ["question 3", "answer 3", "question 4", "answer 4"])
+        self.assertEqual((context.dropped, context.summarized), (0, 6))
+    
+    def test_summarize_tail(self):
+        """Test that a conversation loaded from its tail is summarized from the right messages."""
+        self.add_turns(6)
+        self.store.save_summary(self.conversation.id, "Questions 0 and 1.", 4, 40)
+        recent = self.store.load_recent(self.conversation.id)
+        
+        summarized = []
+        summarizer = ConversationSummarizer(
+            summarize_fn=lambda previous, messages, max_tokens: summarized.extend(messages) or f"{previous} More.",
+            enabled=True,
+            trigger_tokens=1,
+            keep_recent=2
+        )
+        self.assertTrue(summarizer.maybe_schedule(recent))
+        summarizer.shutdown()
+        
+        self.assertEqual([m["content"] for m in summarized], ["question 2", "answer 2", "question 3", "answer 3", "question 4", "answer 4"])
+        self.assertEqual(recent.summary_upto, 10)
+        self.assertEqual(recent.summarized_tokens, 40 + sum(recent.message_token_counts[:6]))
+    
+    def test_write_by_another_process(self):
+        """Test that a log appended to by another store instance is replayed again."""
+        self.add_turns(2)
+        self.store.load_recent(self.conversation.id)
+        
+        self.add_turns(1, store=JSONLConversationStore(self.directory))
+        recent = self.store.load_recent(self.conversation.id)
+        
+        self.assertEqual(recent.message_count, 6)
+        self.assertEqual(recent.messages[-1].content, "answer 0")
+        # The header cached when the log was created was stale, so the log was replayed once
+        self.assertEqual(self.store.get_metrics()["fullReads"], 1)
+    
+    def test_background_compaction(self):
+        """Test that superseded records are compacted off the request path without losing messages."""
+        self.add_turns(3)
+        for _ in range(3):
+            self.store.save_conversation(self.conversation)
+        
+        self.assertTrue(wait_for(lambda: self.store.get_metrics()["compactions"] == 1))
+        with open(os.path.join(self.directory, f"{self.conversation.id}.jsonl"), encoding="utf-8") as f:
+            kinds = [line.split('"type": "')[1].split('"')[0] for line in f]
+        self.assertEqual(kinds.count("meta"), 1)
+        self.assertEqual(len(self.store.load_conversation(self.conversation.id).messages), 6)
+    
+    def test_compaction_keeps_concurrent_appends(self):
+        """Test that records appended while a log is replayed for compaction are kept."""
+        self.add_turns(2)
+        replay = self.store._replay
+        
+        def replay_then_append(path, end=None):
+            result = replay(path, end)
+            self.add_turns(1)
+            return result
+        
+        self.store._replay = replay_then_append
+        self.assertTrue(self.store.compact(self.conversation.id))
+        self.store._replay = replay
+        
+        loaded = self.store.load_conversation(self.conversation.id)
+        self.assertEqual([m.content for m in loaded.messages][-2:], ["question 0", "answer 0"])
+        self.assertEqual(len(loaded.messages), 6)
+        self.assertEqual(self.store.load_recent(self.conversation.id).message_count, 6)
+
+    def test_unsafe_ids(self):
+        """Test that IDs which are not plain file names never reach the file system."""
+        store = JSONLConversationStore(os.path.join(self.directory, "store"))
+        Conversation(id="victim").save(self.directory)
+        
+        for conversation_id in ("../victim", "..", "a/b", "", "x" * 65, None):
+            self.assertFalse(is_valid_conversation_id(conversation_id))
+            with self.assertRaises(ValueError):
+                store.load_recent(conversation_id)
+        self.assertTrue(is_valid_conversation_id(self.conversation.id))
+        self.assertTrue(os.path.exists(os.path.join(self.directory, "victim.json")))
+    
+    def test_legacy_conversion(self):
+        """Test that a legacy JSON file is converted under the ID it was requested by."""
+        legacy = Conversation(id="internal", user_id="bob")
+        legacy.add_message("user", "hello")
+        os.rename(legacy.save(self.directory), os.path.join(self.directory, "requested.json"))
+        
+        loaded = self.store.load_recent("requested")
+        self.assertEqual((loaded.id, loaded.user_id, [m.content for m in loaded.messages]), ("requested", "bob", ["hello"]))
+        self.assertEqual(self.store.load_conversation("requested").id, "requested")
+        self.assertFalse(os.path.exists(os.path.join(self.directory, "requested.json")))
+        self.assertFalse(os.path.exists(os.path.join(self.directory, "internal.jsonl")))
+    
+    def test_symlink_outside_directory(self):
+        """Test that a legacy file linking outside the directory is neither converted nor deleted."""
+        store = JSONLConversationStore(os.path.join(self.directory, "store"))
+        victim = Conversation(id="victim").save(self.directory)
+        os.symlink(victim, os.path.join(self.directory, "store", "link.json"))
+        
+        self.assertIsNone(store.load_conversation("link"))
+        self.assertFalse(store.delete_conversation("link"))
+        self.assertTrue(os.path.exists(victim))
+
+
+class TestSQLiteConversationStore(unittest.TestCase):
+    """Test cases for the SQLite conversation store."""
+    
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.db_path = os.path.join(self.directory, "conversations.db")
+    
+    def tearDown(self):
+        shutil.rmtree(self.directory, ignore_errors=True)
+    
+    def test_round_trip(self):
+        """Test that every saved conversation field and message is loaded back."""
+        store = SQLiteConversationStore(self.db_path)
+        conversation = Conversation(user_id="alice", bot_id="bot", metadata={"system_prompt": "Be brief.", "tags": ["vat"]})
+        conversation.questionnaire = {"templateId": "tax", "answers": {}}
+        conversation.original_message = "Help with VAT"
+        store.save_conversation(conversation)
+        messages = [conversation.add_message("user", "question"), conversation.add_message("assistant", "answer")]
+        store.append_messages(conversation.id, messages, conversation.updated_at)
+        conversation.apply_summary("Asked about VAT.", 1)
+        store.save_conversation(conversation)
+        store.close()
+        
+        store = SQLiteConversationStore(self.db_path)
+        loaded = store.load_conversation(conversation.id)
+        
+        self.assertEqual(loaded.to_dict(include_messages=False), conversation.to_dict(include_messages=False))
+        self.assertEqual([(str(m.role), m.content) for m in store.load_messages(conversation.id)], [("user", "question"), ("assistant", "answer")])
+        self.assertEqual(store.list_conversation_ids("alice"), [conversation.id])
+        store.close()
+    
+    def test_migration(self):
+        """Test that a database created before the bot_id and metadata columns is upgraded in place."""
+        connection = sqlite3.connect(self.db_path)
+        connection.executescript("""
+            CREATE TABLE conversations (
+                id TEXT PRIMARY KEY, user_id TEXT, created_at REAL NOT NULL, updated_at REAL NOT NULL,
+                questionnaire TEXT, original_message TEXT
+            );
+            INSERT INTO conversations VALUES ('old', 'alice', 0, 0, NULL, NULL);
+        """)
+        connection.close()
+        
+        store = SQLiteConversationStore(self.db_path)
+        old = store.load_conversation("old")
+        self.assertEqual((old.user_id, old.bot_id, old.metadata, old.summary), ("alice", None, {}, None))
+        
+        old.bot_id = "bot"
+        old.metadata = {"system_prompt": "Be brief."}
+        store.save_conversation(old)
+        self.assertEqual(store.load_conversation("old").metadata, {"system_prompt": "Be brief."})
+        store.close()
+
+
+class TestConversationManager(unittest.TestCase):
+    """Test cases for the conversation manager over a store."""
+    
+    def test_import_order(self):
+        """Test that conversation_store can be imported before conversation."""
+        result = subprocess.run(
+            [sys.executable, "-c", "import conversation_store; import conversation; print(conversation.conversation_manager._store)"],
+            cwd=os.path.dirname(os.path.abspath(__file__)), capture_output=True, text=True
+        )
+        self.assertEqual(result.returncode, 0, result.stderr)
+        # The default store is only created on first use
+        self.assertEqual(result.stdout.strip(), "None")
+
+    def test_metadata_write_through(self):
+        """Test that questionnaire state survives a restart without an explicit save."""
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory, ignore_errors=True)
+        conversation = ConversationManager(store=JSONLConversationStore(directory)).get_or_create_conversation(user_id="alice")
+        conversation.start_questionnaire("general", "Help me write")
+        conversation.questionnaire["answers"]["topic"] = "tax"
+        conversation.complete_questionnaire()
+        
+        restarted = ConversationManager(store=JSONLConversationStore(directory)).get_conversation(conversation.id)
+        self.assertEqual(restarted.original_message, "Help me write")
+        self.assertEqual(restarted.questionnaire["answers"], {"topic": "tax"})
+        self.assertTrue(restarted.questionnaire["complete"])
+    
+    def test_discard_unpersisted_message(self):
+        """Test that a message added without persisting can be dropped again, in both history layouts."""
+        for columnar in (False, True):
+            conversation = Conversation(columnar=columnar)
+            conversation.add_message("user", "kept")
+            pending = conversation.add_message("user", "dropped", persist=False)
+            conversation.add_message("assistant", "concurrent")
+            
+            conversation.discard_message(pending)
+            self.assertEqual([m.content for m in conversation.messages], ["kept", "concurrent"])
+            self.assertEqual(list(conversation.message_token_counts), [message_tokens("kept"), message_tokens("concurrent")])
+            self.assertEqual(conversation.token_count, sum(conversation.message_token_counts))
+
+
+def run_tests():
+    """Run all tests."""
+    loader = unittest.TestLoader()
+    test_suite = unittest.TestSuite()
+    test_suite.addTests(loader.loadTestsFromTestCase(TestMessageColumns))
+    test_suite.addTests(loader.loadTestsFromTestCase(TestConversationSummarizer))
+    test_suite.addTests(loader.loadTestsFromTestCase(TestJSONLConversationStore))
+    test_suite.addTests(loader.loadTestsFromTestCase(TestSQLiteConversationStore))
+    test_suite.addTests(loader.loadTestsFromTestCase(TestConversationManager))
+    
+    test_runner = unittest.TextTestRunner(verbosity=2)
+    test_result = test_runner.run(test_suite)
+    return test_result.wasSuccessful()
+
+
+if __name__ == "__main__":
+    success = run_tests()
+    sys.exit(0 if success else 1)
@@ -0,0 +1,336 @@
+"""
+Validation script for knowledge base ingestion and retrieval.
+Uses the hashing embedder and temporary directories; no model download is needed.
+"""
+
+import os
+import sys
+import time
+import shutil
+import logging
+import tempfile
+import unittest
+
+import numpy as np
+
+# Add parent directory to path to import modules
+sys.path.insert(0, os.path.abspath(os.path.dirname(__file__)))
+
+# Import modules to test
+from ann_index import IVFIndex, evaluate_recall, exact_search
+from bot_service import BotService
+from embedding_cache import EmbeddingCache, EmbeddingPipeline
+from embeddings import HashingEmbedder
+from knowledge_base import KnowledgeBase
+from knowledge_retrieval import IngestionManifest, KnowledgeRetriever
+
+# Configure logging
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+    handlers=[
+        logging.StreamHandler()
+    ]
+)
+logger = logging.getLogger(__name__)
+
+
+VAT = """# VAT
+
+## Filing
+File your VAT return online every quarter through the tax portal.
+
+## Late payment
+A late VAT payment is charged interest from the due date."""
+
+PAYROLL = """# Payroll
+
+## Payslips
+Employers give every employee a payslip on or before payday."""
+
+
+def clustered_vectors(count: int, dim: int = 32, clusters: int = 20, seed: int = 0) -> np.ndarray:
+    """Normalized vectors scattered around random cluster centers."""
+    rng = np.random.default_rng(seed)
+    centers = rng.normal(size=(clusters, dim))
+    vectors = centers[rng.integers(clusters, size=count)] + 0.3 * rng.normal(size=(count, dim))
+    vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+    return vectors.astype(np.float32)
+
+
+def text_source(source_id: str, text: str) -> dict:
+    """A knowledge base source holding its text inline."""
+    return {"id": source_id, "type": "text", "path": "", "metadata": {"text": text}}
+
+
+class CountingEmbedder(HashingEmbedder):
+    """Hashing embedder that records the texts it embeds."""
+    
+    def __init__(self, dim: int = 64, name: str = None):
+        super().__init__(dim)
+        self.name = name or self.name
+        self.embedded = []
+    
+    def embed(self, texts):
+        self.embedded.extend(texts)
+        return super().embed(texts)
+
+
+class TestIVFIndex(unittest.TestCase):
+    """Test cases for the approximate vector index."""
+    
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.matrix = clustered_vectors(4000)
+        self.queries = clustered_vectors(50, seed=1)
+        self.index = IVFIndex(self.directory, nprobe=8)
+        self.index.build(self.matrix, nlist=32)
+    
+    def tearDown(self):
+        shutil.rmtree(self.directory, ignore_errors=True)
+    
+    def test_recall(self):
+        """Test recall@10 against brute-force search, and exact results when every list is probed."""
+        results = evaluate_recall(self.index, self.matrix, self.queries, k=10, nprobes=[8, 32])
+        
+        self.assertGreaterEqual(results[0]["recall"], 0.9)
+        self.assertEqual(results[1]["recall"], 1.0)
+    
+    def test_insert_and_exclude(self):
+        """Test that inserted rows are found and excluded rows are not."""
+        extra = clustered_vectors(100, seed=2)
+        matrix = np.vstack([self.matrix, extra])
+        self.index.insert(np.arange(len(self.matrix), len(matrix)), extra)
+        
+        query = extra[0]
+        self.assertEqual(self.index.search(matrix, query, 1)[0][0], len(self.matrix))
+        
+        exclude = np.zeros(len(matrix), dtype=bool)
+        exclude[len(self.matrix)] = True
+        rows = [row for row, _ in self.index.search(matrix, query, 10, nprobe=32, exclude=exclude)]
+        self.assertNotIn(len(self.matrix), rows)
+        self.assertEqual(rows, [row for row, _ in exact_search(matrix, query, 10, exclude=exclude)])
+    
+    def test_reload(self):
+        """Test that a reloaded index answers like the one that was built."""
+        self.index.insert(np.arange(len(self.matrix), len(self.matrix) + 1), self.matrix[:1])
+        matrix = np.vstack([self.matrix, self.matrix[:1]])
+        reloaded = IVFIndex(self.directory, nprobe=8)
+        
+        self.assertTrue(reloaded.load())
+        for query in self.queries[:5]:
+            self.assertEqual(reloaded.search(matrix, query, 10), self.index.search(matrix, query, 10))
+
+
+class KnowledgeBaseTestCase(unittest.TestCase):
+    """Base for tests that ingest a knowledge base into a temporary directory."""
+    
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.cache = EmbeddingCache(os.path.join(self.directory, "embeddings.db"))
+        self.pipeline = EmbeddingPipeline(cache=self.cache, max_workers=2, use_cache=True)
+        self.retriever = KnowledgeRetriever(chunk_size=80, pipeline=self.pipeline, compaction_threshold=0.99)
+        self.knowledge_base = KnowledgeBase(
+            name="Tax",
+            description="Tax help",
+            sources=[text_source("vat", VAT), text_source("payroll", PAYROLL)],
+            embedding_model="hashing-64",
+            vector_db_path=os.path.join(self.directory, "vector_db")
+        )
+        self.retriever.ingest(self.knowledge_base)
+    
+    def tearDown(self):
+        self.pipeline.shutdown()
+        self.cache.close()
+        shutil.rmtree(self.directory, ignore_errors=True)
+    
+    def texts(self, results) -> list:
+        return [result["text"] for result in results]
+
+
+class TestRanking(KnowledgeBaseTestCase):
+    """Test cases for vector, BM25 and hybrid ranking."""
+    
+    def test_lexical(self):
+        """Test that BM25 ranks the chunk with the rare query term first and skips chunks without query terms."""
+        results = self.retriever.query(self.knowledge_base, "payslip payday", mode="lexical")
+        
+        self.assertEqual(len(results), 1)
+        self.assertIn("payslip", results[0]["text"])
+        self.assertGreater(results[0]["lexical_score"], 0)
+    
+    def test_hybrid(self):
+        """Test that hybrid scores blend the normalized BM25 score and the cosine similarity."""
+        results = self.retriever.query(self.knowledge_base, "late VAT payment interest", mode="hybrid", alpha=0.5)
+        
+        best = results[0]
+        self.assertIn("late VAT payment", best["text"])
+        self.assertAlmostEqual(best["score"], 0.5 * max(best["vector_score"], 0.0) + 0.5, places=5)
+        self.assertEqual([result["score"] for result in results], sorted((result["score"] for result in results), reverse=True))
+        
+        # Lexical-only ranking with alpha 0 puts the same chunk first
+        self.assertEqual(self.retriever.query(self.knowledge_base, "late VAT payment interest", alpha=0.0)[0]["text"], best["text"])
+    
+    def test_chunk_index(self):
+        """Test that results report the chunk's position within its source and its store row separately."""
+        results = {result["text"]: result for result in self.retriever.query(self.knowledge_base, "payslip payday VAT", k=10, min_score=-1)}
+        payslip = next(result for text, result in results.items() if "payslip" in text)
+        
+        self.assertEqual(payslip["source_id"], "payroll")
+        self.assertEqual(payslip["chunk_index"], 0)
+        self.assertEqual(payslip["row"], 2)
+        self.assertEqual(self.retriever.search(self.knowledge_base, payslip["text"], k=1)[0]["chunk_index"], 0)
+
+
+class TestIncrementalIngestion(KnowledgeBaseTestCase):
+    """Test cases for tombstones and compaction."""
+    
+    def test_changed_and_removed_sources(self):
+        """Test that changed and removed sources are tombstoned and no longer returned."""
+        self.knowledge_base.sources = [text_source("vat", VAT.replace("every quarter", "every month"))]
+        stats = self.retriever.ingest(self.knowledge_base)
+        
+        self.assertEqual((stats["updated"], stats["removed"], stats["chunks"]), (1, 1, 2))
+        store = self.retriever.get_store(self.knowledge_base)
+        self.assertEqual((store.count, store.deleted_count), (5, 3))
+        texts = self.texts(self.retriever.query(self.knowledge_base, "VAT return every quarter month payslip", k=10, min_score=-1))
+        self.assertTrue(any("every month" in text for text in texts))
+        self.assertFalse(any("every quarter" in text or "payslip" in text for text in texts))
+    
+    def test_unchanged_sources_are_skipped(self):
+        """Test that a second ingestion of the same sources embeds nothing."""
+        stats = self.retriever.ingest(self.knowledge_base)
+        self.assertEqual((stats["unchanged"], stats["chunks_indexed"]), (2, 0))
+    
+    def test_compaction(self):
+        """Test that compaction drops tombstones and remaps the manifest rows."""
+        self.knowledge_base.sources = [text_source("payroll", PAYROLL), text_source("vat", VAT + "\n\nKeep records for six years.")]
+        self.retriever.ingest(self.knowledge_base)
+        
+        self.assertEqual(self.retriever.compact(self.knowledge_base)["removed"], 2)
+        store = self.retriever.get_store(self.knowledge_base)
+        self.assertEqual((store.count, store.deleted_count), (4, 0))
+        manifest = IngestionManifest(self.knowledge_base.vector_db_path)
+        manifest.load()
+        self.assertEqual((manifest.sources["payroll"]["start"], manifest.sources["payroll"]["end"]), (0, 1))
+        self.assertEqual((manifest.sources["vat"]["start"], manifest.sources["vat"]["end"]), (1, 4))
+        self.assertEqual([chunk["source_id"] for chunk in store.chunks], ["payroll", "vat", "vat", "vat"])
+        
+        result = self.retriever.query(self.knowledge_base, "records six years", mode="lexical")[0]
+        self.assertEqual((result["source_id"], result["row"]), ("vat", 3))
+        # Still incremental after compaction
+        self.assertEqual(self.retriever.ingest(self.knowledge_base)["chunks_indexed"], 0)
+    
+    def test_background_compaction(self):
+        """Test that crossing the tombstone threshold compacts the store in the background."""
+        self.retriever.compaction_threshold = 0.2
+        self.knowledge_base.sources = [text_source("payroll", PAYROLL)]
+        self.retriever.ingest(self.knowledge_base)
+        
+        store = self.retriever.get_store(self.knowledge_base)
+        deadline = time.monotonic() + 5
+        while store.deleted_count:
+            self.assertLess(time.monotonic(), deadline)
+            time.sleep(0.01)
+        self.assertEqual(store.count, 1)
+
+
+class TestKnowledgeBaseLookup(unittest.TestCase):
+    """Test cases for the bot service's in-memory knowledge bases."""
+    
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.service = BotService(data_dir=self.directory, llm_client=object())
+        self.knowledge_base = KnowledgeBase(name="Tax", description="Tax help", sources=[text_source("vat", VAT)])
+        self.knowledge_base.save(self.service.knowledge_bases_dir)
+        self.loads = 0
+        load = KnowledgeBase.load.__func__
+        
+        def counting_load(cls, file_path):
+            self.loads += 1
+            return load(cls, file_path)
+        
+        KnowledgeBase.load = classmethod(counting_load)
+        self.addCleanup(setattr, KnowledgeBase, "load", classmethod(load))
+    
+    def tearDown(self):
+        shutil.rmtree(self.directory, ignore_errors=True)
+    
+    def test_kept_in_memory(self):
+        """Test that a knowledge base is parsed once and read again only after its file changes."""
+        first = self.service.get_knowledge_base(self.knowledge_base.id)
+        self.assertIs(self.service.get_knowledge_base(self.knowledge_base.id), first)
+        self.assertEqual(self.loads, 1)
+        
+        self.knowledge_base.add_source("text", "", {"text": PAYROLL})
+        path = self.knowledge_base.save(self.service.knowledge_bases_dir)
+        os.utime(path, ns=(time.time_ns(), time.time_ns() + 1_000_000_000))
+        self.assertEqual(len(self.service.get_knowledge_base(self.knowledge_base.id).sources), 2)
+        self.assertEqual(self.loads, 2)
+        
+        os.remove(path)
+        self.assertIsNone(self.service.get_knowledge_base(self.knowledge_base.id))
+
+
+class TestEmbeddingPipeline(unittest.TestCase):
+    """Test cases for the cached embedding pipeline."""
+    
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.cache = EmbeddingCache(os.path.join(self.directory, "embeddings.db"))
+        self.pipeline = EmbeddingPipeline(cache=self.cache, batch_size=2, max_workers=2, use_cache=True)
+    
+    def tearDown(self):
+        self.pipeline.shutdown()
+        self.cache.close()
+        shutil.rmtree(self.directory, ignore_errors=True)
+    
+    def test_hit(self):
+        """Test that cached texts are not embedded again and duplicates are embedded once."""
+        embedder = CountingEmbedder()
+        first = self.pipeline.embed(embedder, ["a b", "c d", "a b"])
+        self.assertEqual(embedder.embedded, ["a b", "c d"])
+        
+        stats = {}
+        second = self.pipeline.embed(embedder, ["c d", "a b"], stats)
+        self.assertEqual(len(embedder.embedded), 2)
+        self.assertEqual(stats["cache_hits"], 2)
+        np.testing.assert_array_equal(second, first[[1, 0]])
+        self.assertEqual(self.pipeline.get_metrics()["duplicates"], 1)
+    
+    def test_invalidate(self):
+        """Test that changed text or another model misses the cache."""
+        embedder = CountingEmbedder()
+        self.pipeline.embed(embedder, ["a b"])
+        
+        self.pipeline.embed(embedder, ["a b", "a c"])
+        self.assertEqual(embedder.embedded, ["a b", "a c"])
+        
+        other = CountingEmbedder(name="other-model")
+        self.pipeline.embed(other, ["a b"])
+        self.assertEqual(other.embedded, ["a b"])
+        
+        # Entries of another dimension are ignored
+        wider = CountingEmbedder(dim=128, name="other-model")
+        self.assertEqual(self.pipeline.embed(wider, ["a b"]).shape, (1, 128))
+        self.assertEqual(wider.embedded, ["a b"])
+
+
+def run_tests():
+    """Run all tests."""
+    loader = unittest.TestLoader()
+    test_suite = unittest.TestSuite()
+    test_suite.addTests(loader.loadTestsFromTestCase(TestIVFIndex))
+    test_suite.addTests(loader.loadTestsFromTestCase(TestRanking))
+    test_suite.addTests(loader.loadTestsFromTestCase(TestIncrementalIngestion))
+    test_suite.addTests(loader.loadTestsFromTestCase(TestKnowledgeBaseLookup))
+    test_suite.addTests(loader.loadTestsFromTestCase(TestEmbeddingPipeline))
+    
+    test_runner = unittest.TextTestRunner(verbosity=2)
+    test_result = test_runner.run(test_suite)
+    return test_result.wasSuccessful()
+
+
+if __name__ == "__main__":
+    success = run_tests()
+    sys.exit(0 if success else 1)
@@ -0,0 +1,421 @@
+"""
+Validation script for the async LLM clients.
+Exercises timeouts, cancellation and the concurrency limit with in-process
+backends, and the HTTP clients against local stubs; no network access or
+credentials are needed.
+"""
+
+import os
+import sys
+import json
+import time
+import asyncio
+import logging
+import tempfile
+import threading
+import unittest
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Add parent directory to path to import modules
+sys.path.insert(0, os.path.abspath(os.path.dirname(__file__)))
+
+# Import modules to test
+import bot_service
+from bot_service import BotService
+from llm_client import Completion, LegacyLLMClient, LLMClient, LLMClientError, LLMTimeoutError, VicunaLLMClient, run_sync
+from llm_service import LLMService
+from openai_compatible import OpenAICompatibleClient
+from validate_streaming import StubStreamingServer, openai_event
+
+# Configure logging
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+    handlers=[
+        logging.StreamHandler()
+    ]
+)
+logger = logging.getLogger(__name__)
+
+
+class SlowLLMClient(LLMClient):
+    """Backend that answers after a delay and records its peak concurrency."""
+    
+    name = "slow"
+    
+    def __init__(self, delay: float = 0.0, fail: bool = False, **kwargs):
+        super().__init__(**kwargs)
+        self.delay = delay
+        self.fail = fail
+        self.active = 0
+        self.peak = 0
+        self.calls = []
+    
+    async def _complete(self, messages, model, temperature, max_tokens, **options):
+        self.calls.append(messages)
+        self.active += 1
+        self.peak = max(self.peak, self.active)
+        try:
+            await asyncio.sleep(self.delay)
+            if self.fail:
+                raise LLMClientError("backend down", "stub failure")
+            return Completion(f"echo: {messages[-1]['content']}", model)
+        finally:
+            self.active -= 1
+
+
+class BlockingService:
+    """LLMService stand-in whose calls block their thread."""
+    
+    def __init__(self, delay: float):
+        self.delay = delay
+        self.finished = threading.Event()
+    
+    def chat_completion(self, messages, model, temperature, max_tokens):
+        time.sleep(self.delay)
+        self.finished.set()
+        return {"content": f"echo: {messages[-1]['content']}"}
+    
+    def extract_assistant_message(self, raw):
+        return raw["content"]
+
+
+class StubAPIHandler(BaseHTTPRequestHandler):
+    """Answers /chat and /models like the LLM API server."""
+    
+    protocol_version = "HTTP/1.1"
+    
+    def log_message(self, format, *args):
+        pass
+    
+    def reply(self, status: int, payload: dict):
+        data = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        try:
+            self.wfile.write(data)
+        except (BrokenPipeError, ConnectionResetError):
+            # The client gave up waiting
+            pass
+    
+    def do_POST(self):
+        body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))))
+        self.server.requests.append(body)
+        time.sleep(self.server.delay)
+        if self.server.status != 200:
+            self.reply(self.server.status, {"error": "stub error"})
+            return
+        content = body["messages"][-1]["content"]
+        self.reply(200, {"model": body["options"]["model"], "choices": [{"index": 0, "message": {"role": "assistant", "content": f"echo: {content}"}}]})
+    
+    def do_GET(self):
+        self.reply(200, {"data": [{"id": "vicuna-13b"}, {"id": "gpt-4"}]})
+
+
+class StubAPIServer(ThreadingHTTPServer):
+    """Local LLM API server with configurable delay and status."""
+    
+    daemon_threads = True
+    
+    def __init__(self):
+        super().__init__(("127.0.0.1", 0), StubAPIHandler)
+        self.delay = 0.0
+        self.status = 200
+        self.requests = []
+        self.thread = threading.Thread(target=self.serve_forever, daemon=True)
+        self.thread.start()
+    
+    @property
+    def url(self) -> str:
+        return f"http://127.0.0.1:{self.server_address[1]}/api"
+    
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+
+MESSAGES = [{"role": "system", "content": "Be brief."}, {"role": "user", "content": "hi"}]
+
+
+class TestLLMClient(unittest.TestCase):
+    """Test cases for the client base class."""
+    
+    def test_complete(self):
+        """Test a completion and its response format."""
+        client = SlowLLMClient()
+        completion = asyncio.run(client.complete(MESSAGES, model="m"))
+        
+        self.assertEqual(completion.text, "echo: hi")
+        self.assertEqual(completion.to_response()["choices"][0]["message"]["content"], "echo: hi")
+        self.assertEqual(client.get_metrics()["requests"], 1)
+    
+    def test_concurrency_limit(self):
+        """Test that concurrent calls beyond the limit wait for a slot."""
+        client = SlowLLMClient(delay=0.05, max_concurrency=3)
+        
+        async def go():
+            return await asyncio.gather(*(client.complete([{"role": "user", "content": str(i)}]) for i in range(12)))
+        
+        completions = asyncio.run(go())
+        self.assertEqual([c.text for c in completions], [f"echo: {i}" for i in range(12)])
+        self.assertEqual(client.peak, 3)
+        metrics = client.get_metrics()
+        self.assertEqual((metrics["requests"], metrics["inFlight"], metrics["waiting"]), (12, 0, 0))
+    
+    def test_timeout(self):
+        """Test that slow calls time out and free their slot."""
+        client = SlowLLMClient(delay=5, max_concurrency=1)
+        
+        async def go():
+            started = time.monotonic()
+            with self.assertRaises(LLMTimeoutError):
+                await client.complete(MESSAGES, timeout=0.1)
+            self.assertLess(time.monotonic() - started, 1)
+            # The slot was released, so a fast call goes through
+            client.delay = 0
+            return await client.complete(MESSAGES, timeout=0.5)
+        
+        self.assertEqual(asyncio.run(go()).text, "echo: hi")
+        metrics = client.get_metrics()
+        self.assertEqual((metrics["timeouts"], metrics["errors"], metrics["inFlight"]), (1, 0, 0))
+    
+    def test_cancellation(self):
+        """Test that cancelling a call stops it and is counted."""
+        client = SlowLLMClient(delay=5)
+        
+        async def go():
+            task = asyncio.create_task(client.complete(MESSAGES))
+            await asyncio.sleep(0.05)
+            task.cancel()
+            with self.assertRaises(asyncio.CancelledError):
+                await task
+        
+        asyncio.run(go())
+        metrics = client.get_metrics()
+        self.assertEqual((metrics["cancelled"], metrics["inFlight"], client.active), (1, 0, 0))
+    
+    def test_blocking_timeout_keeps_slot(self):
+        """Test that a timed out blocking call keeps its slot until its thread finishes."""
+        service = BlockingService(delay=0.4)
+        client = LegacyLLMClient(service, max_concurrency=1)
+        
+        async def go():
+            with self.assertRaises(LLMTimeoutError):
+                await client.complete(MESSAGES, timeout=0.05)
+            # The thread is still running, so no second request can start
+            self.assertFalse(service.finished.is_set())
+            self.assertEqual(client.get_metrics()["inFlight"], 1)
+            with self.assertRaises(LLMTimeoutError):
+                await client.complete(MESSAGES, timeout=0.05)
+            self.assertEqual(client.get_metrics()["requests"], 1)
+            
+            # Once it finishes the slot is free again
+            await asyncio.get_running_loop().run_in_executor(None, service.finished.wait)
+            service.delay = 0
+            return await client.complete(MESSAGES, timeout=1)
+        
+        self.assertEqual(asyncio.run(go()).text, "echo: hi")
+        self.assertEqual(client.get_metrics()["inFlight"], 0)
+    
+    def test_errors(self):
+        """Test that backend errors propagate and are counted."""
+        client = SlowLLMClient(fail=True)
+        with self.assertRaisesRegex(LLMClientError, "backend down"):
+            asyncio.run(client.complete(MESSAGES))
+        self.assertEqual(client.get_metrics()["errors"], 1)
+    
+    def test_stream_without_backend_streaming(self):
+        """Test that backends without streaming yield one chunk."""
+        client = SlowLLMClient()
+        
+        async def go():
+            return [chunk async for chunk in client.stream(MESSAGES)]
+        
+        self.assertEqual(asyncio.run(go()), ["echo: hi"])
+    
+    def test_sync_shim(self):
+        """Test blocking calls and their guard against use on the client's own loop."""
+        client = SlowLLMClient(delay=0.01)
+        self.assertEqual(client.complete_sync(MESSAGES).text, "echo: hi")
+        
+        async def nested():
+            return run_sync(client.complete(MESSAGES))
+        
+        with self.assertRaises(RuntimeError):
+            run_sync(nested())
+
+
+class TestLLMService(unittest.TestCase):
+    """Test cases for the synchronous LLMService shim against a local stub."""
+    
+    @classmethod
+    def setUpClass(cls):
+        cls.server = StubAPIServer()
+    
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.stop()
+    
+    def setUp(self):
+        self.server.delay = 0.0
+        self.server.status = 200
+        self.server.requests.clear()
+        self.service = LLMService(api_url=self.server.url, api_key="key")
+    
+    def test_chat_completion(self):
+        """Test the request format and response of a chat completion."""
+        response = self.service.chat_completion(MESSAGES, model="gpt-4", max_tokens=50, force_cloud=True)
+        
+        self.assertEqual(self.service.extract_assistant_message(response), "echo: hi")
+        self.assertEqual(self.server.requests[0]["options"], {"model": "gpt-4", "temperature": 0.7, "maxTokens": 50, "forceCloud": True})
+    
+    def test_errors(self):
+        """Test that API errors and timeouts become error responses."""
+        self.server.status = 500
+        response = self.service.chat_completion(MESSAGES)
+        self.assertEqual(response["error"], "API error: 500")
+        
+        self.server.status = 200
+        self.server.delay = 1
+        self.service.client.timeout = 0.2
+        started = time.monotonic()
+        response = self.service.chat_completion(MESSAGES)
+        self.assertIn("timed out", response["error"])
+        self.assertLess(time.monotonic() - started, 0.9)
+    
+    def test_models(self):
+        """Test listing models."""
+        self.assertEqual([m["id"] for m in self.service.get_available_models()], ["vicuna-13b", "gpt-4"])
+
+
+class TestVicunaLLMClient(unittest.TestCase):
+    """Test cases for the Vicuna client against the local streaming stub."""
+    
+    @classmethod
+    def setUpClass(cls):
+        cls.server = StubStreamingServer()
+    
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.stop()
+    
+    def setUp(self):
+        self.server.events = [openai_event(role="assistant"), openai_event("Hello"), openai_event(" there"), openai_event(finish_reason="stop"), "data: [DONE]\r\n\r\n"]
+        self.server.delay = 0.0
+        self.client = VicunaLLMClient(OpenAICompatibleClient(base_url=f"{self.server.url}/v1", model="vicuna-7b"))
+    
+    def tearDown(self):
+        self.client.client.close()
+    
+    def test_stream_and_complete(self):
+        """Test streaming and whole completions."""
+        async def go():
+            chunks = [chunk async for chunk in self.client.stream(MESSAGES, temperature=0.2)]
+            completion = await self.client.complete(MESSAGES)
+            return chunks, completion
+        
+        chunks, completion = asyncio.run(go())
+        self.assertEqual(chunks, ["Hello", " there"])
+        self.assertEqual((completion.text, completion.model), ("Hello there", "vicuna-7b"))
+        self.assertEqual(self.server.requests[-2]["body"]["temperature"], 0.2)
+    
+    def test_stream_timeout(self):
+        """Test that a stalled stream times out."""
+        self.server.delay = 0.5
+        
+        async def go():
+            return [chunk async for chunk in self.client.stream(MESSAGES, timeout=0.2)]
+        
+        with self.assertRaises(LLMTimeoutError):
+            asyncio.run(go())
+        self.assertEqual(self.client.get_metrics()["timeouts"], 1)
+
+
+class TestConcurrentConversations(unittest.TestCase):
+    """Test cases for serving many conversations on one event loop."""
+    
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.client = SlowLLMClient(delay=0.2, max_concurrency=32)
+        self.service = BotService(data_dir=self.tmp.name, llm_client=self.client)
+        self.bot = self.service.create_bot({"name": "helper", "system_prompt": "Be brief."})
+    
+    def tearDown(self):
+        self.tmp.cleanup()
+    
+    def test_concurrent_send_message(self):
+        """Test that conversations overlap instead of queueing behind each other."""
+        async def go():
+            return await asyncio.gather(*(
+                self.service.send_message_async(f"conversation-{i}", self.bot.id, f"question {i}")
+                for i in range(20)
+            ))
+        
+        started = time.monotonic()
+        responses = asyncio.run(go())
+        self.assertLess(time.monotonic() - started, 2)
+        self.assertEqual(sorted(r["message"] for r in responses), sorted(f"echo: question {i}" for i in range(20)))
+        self.assertGreater(self.client.peak, 10)
+        
+        conversation = self.service.get_conversation(responses[0]["conversation_id"], self.bot.id)
+        self.assertEqual([m.role for m in conversation.messages], ["user", "assistant"])
+    
+    def test_sync_send_message_and_errors(self):
+        """Test the blocking send_message and LLM failures."""
+        response = self.service.send_message("conversation", self.bot.id, "hello")
+        self.assertEqual(response["message"], "echo: hello")
+        
+        self.client.fail = True
+        response = self.service.send_message(response["conversation_id"], self.bot.id, "again")
+        self.assertEqual(response["error"], "Failed to get response from LLM")
+        
+        self.client.fail = False
+        self.client.delay = 1
+        response = asyncio.run(self.service.send_message_async("other", self.bot.id, "hello", timeout=0.1))
+        self.assertEqual(response["error"], "LLM request timed out")
+        self.assertEqual(self.service.send_message("x", "missing", "hello"), {"error": "Bot not found: missing"})
+
+    def test_untrusted_ids(self):
+        """Test that unsafe conversation IDs and unknown bots never touch the file system."""
+        response = self.service.send_message("../../escape", self.bot.id, "hello")
+        self.assertEqual(response["message"], "echo: hello")
+        self.assertNotEqual(response["conversation_id"], "../../escape")
+        self.assertIsNone(self.service.get_conversation("../../escape", self.bot.id))
+        self.assertEqual(self.service.get_recent_messages("../../escape", self.bot.id), [])
+        
+        self.assertEqual(self.service.list_conversations("../missing"), [])
+        with self.assertRaises(ValueError):
+            self.service.conversation_store("../missing")
+        self.assertEqual(os.listdir(self.service.conversations_dir), [self.bot.id])
+        self.assertEqual(sorted(os.listdir(self.tmp.name)), ["bots", "conversations"])
+    
+    def test_store_cache_bound(self):
+        """Test that at most BOT_CONVERSATION_STORES conversation stores are kept."""
+        self.addCleanup(setattr, bot_service, "BOT_CONVERSATION_STORES", bot_service.BOT_CONVERSATION_STORES)
+        bot_service.BOT_CONVERSATION_STORES = 2
+        for name in ("a", "b", "c"):
+            bot = self.service.create_bot({"name": name, "system_prompt": "Be brief."})
+            self.service.send_message("conversation", bot.id, "hello")
+        
+        self.assertEqual(len(self.service._conversation_stores), 2)
+
+
+def run_tests():
+    """Run all tests."""
+    loader = unittest.TestLoader()
+    test_suite = unittest.TestSuite()
+    test_suite.addTests(loader.loadTestsFromTestCase(TestLLMClient))
+    test_suite.addTests(loader.loadTestsFromTestCase(TestLLMService))
+    test_suite.addTests(loader.loadTestsFromTestCase(TestVicunaLLMClient))
+    test_suite.addTests(loader.loadTestsFromTestCase(TestConcurrentConversations))
+    
+    test_runner = unittest.TextTestRunner(verbosity=2)
+    test_result = test_runner.run(test_suite)
+    return test_result.wasSuccessful()
+
+
+if __name__ == "__main__":
+    success = run_tests()
+    sys.exit(0 if success else 1)
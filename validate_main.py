@@ -0,0 +1,188 @@
+"""
+Validation script for the Flask endpoints in main.py.
+Uses Flask's test client; no services are needed.
+"""
+
+import os
+import sys
+import shutil
+import logging
+import tempfile
+import unittest
+
+# Add parent directory to path to import modules
+sys.path.insert(0, os.path.abspath(os.path.dirname(__file__)))
+
+# Import modules to test
+import main
+from conversation import ConversationManager
+from conversation_store import JSONLConversationStore
+from huggingface_service import HuggingFaceService, DEFAULT_MODEL, HF_MAX_NEW_TOKENS
+from context_builder import ContextBuilder, CHARS_PER_TOKEN
+
+# Configure logging
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+    handlers=[
+        logging.StreamHandler()
+    ]
+)
+logger = logging.getLogger(__name__)
+
+
+class TestMetricsEndpoint(unittest.TestCase):
+    """Test cases for access to /api/metrics."""
+    
+    def setUp(self):
+        self.client = main.app.test_client()
+        self.token, self.admins = main.METRICS_TOKEN, main.METRICS_ADMIN_UIDS
+        main.METRICS_TOKEN, main.METRICS_ADMIN_UIDS = "", set()
+    
+    def tearDown(self):
+        main.METRICS_TOKEN, main.METRICS_ADMIN_UIDS = self.token, self.admins
+    
+    def test_off_by_default(self):
+        """Test that metrics are not served unless an operator token or admin is configured."""
+        self.assertEqual(self.client.get("/api/metrics").status_code, 404)
+        self.assertEqual(self.client.get("/api/metrics", headers={"X-Metrics-Token": ""}).status_code, 404)
+    
+    def test_token(self):
+        """Test that only the configured token is accepted."""
+        main.METRICS_TOKEN = "operator-secret"
+        self.assertEqual(self.client.get("/api/metrics", headers={"X-Metrics-Token": "wrong"}).status_code, 404)
+        
+        response = self.client.get("/api/metrics", headers={"X-Metrics-Token": "operator-secret"})
+        self.assertEqual(response.status_code, 200)
+        self.assertIn("userApiSessions", response.get_json())
+        self.assertNotIn("perKey", response.get_json()["userApiSessions"])
+    
+    def test_admin_user(self):
+        """Test that listed admins are let in by their verified user ID."""
+        main.METRICS_ADMIN_UIDS = {"admin-uid"}
+        verified_user_id = main.verified_user_id
+        self.addCleanup(setattr, main, "verified_user_id", verified_user_id)
+        
+        main.verified_user_id = lambda: "someone-else"
+        self.assertEqual(self.client.get("/api/metrics").status_code, 404)
+        main.verified_user_id = lambda: "admin-uid"
+        self.assertEqual(self.client.get("/api/metrics").status_code, 200)
+
+
+class TestChatEndpoint(unittest.TestCase):
+    """Test cases for what /api/chat sends to the model."""
+    
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory, ignore_errors=True)
+        self.addCleanup(setattr, main, "conversation_manager", main.conversation_manager)
+        main.conversation_manager = ConversationManager(store=JSONLConversationStore(self.directory))
+        
+        self.calls = []
+        generate_response = HuggingFaceService.generate_response
+        self.addCleanup(setattr, HuggingFaceService, "generate_response", generate_response)
+        HuggingFaceService.generate_response = lambda service, system, message, history=None: self.calls.append((message, history)) or "reply"
+    
+    def chat(self, message: str, conversation_id: str = None, remote_addr: str = "10.0.0.1", status: int = 200):
+        # The agent blueprint also routes /api/chat, so call the view directly
+        with main.app.test_request_context(
+            "/api/chat", method="POST", json={"message": message, "conversationId": conversation_id},
+            environ_base={"REMOTE_ADDR": remote_addr}
+        ):
+            response = main.app.make_response(main.chat())
+        self.assertEqual(response.status_code, status)
+        if status != 200:
+            return response.get_json()
+        self.assertEqual(response.get_data(as_text=True), "reply")
+        return response.headers["X-Conversation-Id"]
+    
+    def test_over_budget_message_is_truncated(self):
+        """Test that an over-budget message is sent as the context builder cut it."""
+        self.chat("x" * 10000)
+        
+        message, history = self.calls[0]
+        self.assertEqual(history, [])
+        self.assertLess(len(message), 10000)
+        budget = ContextBuilder().budget_for(DEFAULT_MODEL, HF_MAX_NEW_TOKENS)
+        self.assertLessEqual(len(message), budget * CHARS_PER_TOKEN)
+    
+    def test_history_excludes_latest(self):
+        """Test that earlier turns go in the history and the latest only as the message."""
+        conversation_id = self.chat("first")
+        self.chat("second", conversation_id)
+        
+        message, history = self.calls[1]
+        self.assertEqual(message, "second")
+        self.assertEqual([turn["content"] for turn in history], ["first", "reply"])
+
+    def test_other_callers_conversation(self):
+        """Test that a conversation ID from another caller is neither read nor appended to."""
+        conversation_id = self.chat("private", remote_addr="10.0.0.1")
+        self.assertEqual(main.conversation_manager.get_conversation(conversation_id).user_id, "ip:10.0.0.1")
+        
+        error = self.chat("let me in", conversation_id, remote_addr="10.0.0.2", status=404)
+        self.assertEqual(error, {"error": "Conversation not found"})
+        self.assertEqual(len(self.calls), 1)
+        messages = main.conversation_manager.get_conversation(conversation_id).messages
+        self.assertEqual([m.content for m in messages], ["private", "reply"])
+    
+    def test_failed_generation_is_not_recorded(self):
+        """Test that a user turn whose reply fails is neither kept nor persisted."""
+        conversation_id = self.chat("first")
+        
+        def fail(service, system, message, history=None):
+            raise RuntimeError("upstream down")
+        HuggingFaceService.generate_response = fail
+        with main.app.test_request_context(
+            "/api/chat", method="POST", json={"message": "lost", "conversationId": conversation_id},
+            environ_base={"REMOTE_ADDR": "10.0.0.1"}
+        ):
+            response = main.app.make_response(main.chat())
+        self.assertEqual(response.get_data(as_text=True), "Error: upstream down")
+        
+        conversation = main.conversation_manager.get_conversation(conversation_id)
+        self.assertEqual([m.content for m in conversation.messages], ["first", "reply"])
+        stored = main.conversation_manager.store.load_conversation(conversation_id)
+        self.assertEqual([m.content for m in stored.messages], ["first", "reply"])
+    
+    def test_invalid_conversation_id(self):
+        """Test that a conversation ID which is not a plain identifier is rejected."""
+        error = self.chat("hello", "../../package", status=400)
+        self.assertEqual(error, {"error": "Invalid conversation ID"})
+        self.assertEqual(self.calls, [])
+    
+    def test_verified_owner(self):
+        """Test that a verified user's conversation follows the user, not the address."""
+        self.addCleanup(setattr, main, "verified_user_id", main.verified_user_id)
+        main.verified_user_id = lambda: "alice"
+        conversation_id = self.chat("hello", remote_addr="10.0.0.1")
+        self.chat("again", conversation_id, remote_addr="10.0.0.2")
+        self.assertEqual(main.conversation_manager.get_conversation(conversation_id).user_id, "user:alice")
+        
+        main.verified_user_id = lambda: None
+        self.chat("guess", conversation_id, remote_addr="10.0.0.1", status=404)
+
+    def test_token_verified_once(self):
+        """Test that a chat request verifies the caller's ID token only once."""
+        self.addCleanup(setattr, main, "verified_user_id", main.verified_user_id)
+        verifications = []
+        main.verified_user_id = lambda: verifications.append(1) or "alice"
+        self.chat("hello")
+        self.assertEqual(len(verifications), 1)
+
+
+def run_tests():
+    """Run all tests."""
+    loader = unittest.TestLoader()
+    test_suite = unittest.TestSuite()
+    test_suite.addTests(loader.loadTestsFromTestCase(TestMetricsEndpoint))
+    test_suite.addTests(loader.loadTestsFromTestCase(TestChatEndpoint))
+    
+    test_runner = unittest.TextTestRunner(verbosity=2)
+    test_result = test_runner.run(test_suite)
+    return test_result.wasSuccessful()
+
+
+if __name__ == "__main__":
+    success = run_tests()
+    sys.exit(0 if success else 1)
@@ -0,0 +1,226 @@
+"""
+Validation script for the model catalog.
+Uses in-process model sources and traffic statistics; no network access is needed.
+"""
+
+import os
+import sys
+import time
+import logging
+import threading
+import unittest
+
+# Add parent directory to path to import modules
+sys.path.insert(0, os.path.abspath(os.path.dirname(__file__)))
+
+# Import modules to test
+from model_catalog import ModelCatalog, ModelSource, ModelStats
+
+# Configure logging
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+    handlers=[
+        logging.StreamHandler()
+    ]
+)
+logger = logging.getLogger(__name__)
+
+
+STATIC = [
+    {"id": "vicuna-13b", "name": "Vicuna 13B", "description": "Chat model"},
+    {"id": "vicuna-7b", "name": "Vicuna 7B", "description": "Smaller chat model"}
+]
+
+
+class FakeListing:
+    """Live listing that can be changed, slowed down or made to fail."""
+    
+    def __init__(self, models):
+        self.models = models
+        self.fail = False
+        self.delay = 0.0
+        self.calls = 0
+    
+    def __call__(self):
+        self.calls += 1
+        time.sleep(self.delay)
+        if self.fail:
+            raise RuntimeError("connection refused")
+        return self.models
+
+
+class TestModelSource(unittest.TestCase):
+    """Test cases for merging static and live model lists."""
+    
+    def test_merge(self):
+        """Test that live models extend and confirm the static list."""
+        listing = FakeListing([{"id": "vicuna-13b", "object": "model"}, "llama-3-8b"])
+        source = ModelSource("vicuna", static=STATIC, fetch=listing)
+        
+        # Nothing is confirmed before the first successful fetch
+        self.assertFalse(any(model["listed"] for model in source.models()))
+        
+        self.assertTrue(source.refresh())
+        models = {model["id"]: model for model in source.models()}
+        self.assertEqual(list(models), ["vicuna-13b", "vicuna-7b", "llama-3-8b"])
+        self.assertEqual((models["vicuna-13b"]["source"], models["vicuna-13b"]["name"]), ("static+live", "Vicuna 13B"))
+        self.assertFalse(models["vicuna-7b"]["listed"])
+        self.assertEqual((models["llama-3-8b"]["source"], models["llama-3-8b"]["name"]), ("live", "llama-3-8b"))
+    
+    def test_failed_fetch_keeps_listing(self):
+        """Test that a failed fetch keeps the last successful listing."""
+        listing = FakeListing(["vicuna-13b", "llama-3-8b"])
+        source = ModelSource("vicuna", static=STATIC, fetch=listing)
+        source.refresh()
+        
+        listing.fail = True
+        self.assertFalse(source.refresh())
+        self.assertEqual([model["id"] for model in source.models()], ["vicuna-13b", "vicuna-7b", "llama-3-8b"])
+        self.assertEqual(source.status()["failures"], 1)
+        self.assertIn("connection refused", source.status()["lastError"])
+    
+    def test_unreachable_provider(self):
+        """Test that a live provider which was never reached lists nothing as available."""
+        listing = FakeListing(["vicuna-13b"])
+        listing.fail = True
+        catalog = ModelCatalog(sources=[ModelSource("vicuna", static=STATIC, fetch=listing)], stats=ModelStats())
+        
+        models = catalog.refresh().models
+        self.assertEqual([model["id"] for model in models], ["vicuna-13b", "vicuna-7b"])
+        self.assertFalse(any(model["available"] for model in models))
+        self.assertEqual(catalog.get_metrics()["providers"]["vicuna"]["failures"], 1)
+    
+    def test_static_only_provider(self):
+        """Test that a provider without a live listing reports its static models as available."""
+        catalog = ModelCatalog(sources=[ModelSource("huggingface", static=[{"id": "gpt2"}])], stats=ModelStats())
+        self.assertTrue(catalog.refresh().models[0]["available"])
+
+
+class TestModelStats(unittest.TestCase):
+    """Test cases for per-model traffic statistics."""
+    
+    def test_record(self):
+        """Test latency percentiles and error rates per provider and model."""
+        stats = ModelStats()
+        for latency in (0.1, 0.2, 0.3, None):
+            stats.record("api", "vicuna-13b", latency)
+        stats.record("vicuna", "vicuna-13b", 1.0)
+        
+        snapshot = stats.get("api", "vicuna-13b")
+        self.assertEqual((snapshot["samples"], snapshot["errorRate"], snapshot["p50"]), (4, 0.25, 0.2))
+        self.assertEqual(stats.get("vicuna", "vicuna-13b")["p50"], 1.0)
+        self.assertIsNone(stats.get("api", "unknown"))
+    
+    def test_bounded(self):
+        """Test that the least recently used models are dropped."""
+        stats = ModelStats(max_models=2)
+        stats.record("api", "a", 0.1)
+        stats.record("api", "b", 0.1)
+        stats.record("api", "a", 0.1)
+        stats.record("api", "c", 0.1)
+        
+        self.assertIsNotNone(stats.get("api", "a"))
+        self.assertIsNone(stats.get("api", "b"))
+
+
+class TestModelCatalog(unittest.TestCase):
+    """Test cases for the cached catalog."""
+    
+    def setUp(self):
+        self.listing = FakeListing(["vicuna-13b"])
+        self.stats = ModelStats()
+        self.catalog = ModelCatalog(
+            sources=[ModelSource("huggingface", static=[{"id": "gpt2", "name": "GPT-2"}]), ModelSource("vicuna", static=STATIC, fetch=self.listing)],
+            stats=self.stats,
+            refresh_interval=60,
+            stats_interval=0.05,
+            min_samples=3,
+            max_error_rate=0.5
+        )
+    
+    def tearDown(self):
+        self.catalog.stop()
+    
+    def test_annotations(self):
+        """Test observed latency and availability."""
+        for latency in (0.12, 0.2, 0.3):
+            self.stats.record("vicuna", "vicuna-13b", latency)
+        for _ in range(3):
+            self.stats.record("huggingface", "gpt2", None)
+        
+        models = {model["id"]: model for model in self.catalog.refresh().models}
+        self.assertEqual(models["vicuna-13b"]["latencyMs"], {"p50": 200, "p95": 300})
+        self.assertTrue(models["vicuna-13b"]["available"])
+        # Failing on our own traffic
+        self.assertFalse(models["gpt2"]["available"])
+        self.assertEqual(models["gpt2"]["errorRate"], 1.0)
+        # No longer reported by the provider
+        self.assertFalse(models["vicuna-7b"]["available"])
+        self.assertIsNone(models["vicuna-7b"]["latencyMs"])
+        self.assertNotIn("listed", models["vicuna-7b"])
+    
+    def test_etag(self):
+        """Test that the snapshot changes only when its content does."""
+        first = self.catalog.rebuild()
+        self.assertIs(self.catalog.rebuild(), first)
+        
+        self.stats.record("vicuna", "vicuna-13b", 0.1)
+        second = self.catalog.rebuild()
+        self.assertNotEqual(second.etag, first.etag)
+        self.assertEqual(second.version, first.version + 1)
+    
+    def test_background_refresh(self):
+        """Test that the first request is served at once and live listings arrive in the background."""
+        self.listing.delay = 0.3
+        self.listing.models = ["vicuna-13b", "llama-3-8b"]
+        
+        started = time.monotonic()
+        snapshot = self.catalog.get()
+        self.assertLess(time.monotonic() - started, 0.2)
+        self.assertNotIn("llama-3-8b", [model["id"] for model in snapshot.models])
+        
+        deadline = time.monotonic() + 3
+        while "llama-3-8b" not in [model["id"] for model in self.catalog.get().models]:
+            self.assertLess(time.monotonic(), deadline)
+            time.sleep(0.05)
+        
+        # Traffic shows up at the next stats rebuild without another fetch
+        self.stats.record("vicuna", "llama-3-8b", 0.05)
+        deadline = time.monotonic() + 3
+        while next(m for m in self.catalog.get().models if m["id"] == "llama-3-8b")["samples"] == 0:
+            self.assertLess(time.monotonic(), deadline)
+            time.sleep(0.05)
+        self.assertEqual(self.listing.calls, 1)
+        self.assertEqual(self.catalog.get_metrics()["providers"]["vicuna"]["fetches"], 1)
+    
+    def test_concurrent_get(self):
+        """Test that concurrent first requests share one snapshot."""
+        # Keep the background fetch from publishing a newer snapshot meanwhile
+        self.listing.delay = 0.5
+        snapshots = []
+        threads = [threading.Thread(target=lambda: snapshots.append(self.catalog.get())) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        
+        self.assertEqual(len({id(snapshot) for snapshot in snapshots}), 1)
+
+
+def run_tests():
+    """Run all tests."""
+    loader = unittest.TestLoader()
+    test_suite = unittest.TestSuite()
+    test_suite.addTests(loader.loadTestsFromTestCase(TestModelSource))
+    test_suite.addTests(loader.loadTestsFromTestCase(TestModelStats))
+    test_suite.addTests(loader.loadTestsFromTestCase(TestModelCatalog))
+    
+    test_runner = unittest.TextTestRunner(verbosity=2)
+    test_result = test_runner.run(test_suite)
+    return test_result.wasSuccessful()
+
+
+if __name__ == "__main__":
+    success = run_tests()
+    sys.exit(0 if success else 1)
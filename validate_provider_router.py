@@ -0,0 +1,352 @@
+"""
+Validation script for latency-aware provider routing and hedged requests.
+Uses local stub backends with configurable latency; no network access is needed.
+"""
+
+import os
+import sys
+import time
+import asyncio
+import logging
+import threading
+import unittest
+
+# Add parent directory to path to import modules
+sys.path.insert(0, os.path.abspath(os.path.dirname(__file__)))
+
+# Import modules to test
+from services import AIService, Backend, BackendStats, ProviderRouter, StubBackend, parse_weights
+from huggingface_service import HuggingFaceError, RequestHedger
+
+# Configure logging
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+    handlers=[
+        logging.StreamHandler()
+    ]
+)
+logger = logging.getLogger(__name__)
+
+
+class FakeClock:
+    """Manually advanced time source."""
+    
+    def __init__(self, now: float = 1000.0):
+        self.now = now
+    
+    def __call__(self) -> float:
+        return self.now
+
+
+async def collect(router: ProviderRouter, message: str = "hello") -> str:
+    """Run one request through the router and join its chunks."""
+    return "".join([chunk async for chunk in router.generate("system", message)])
+
+
+def run(router: ProviderRouter, requests: int = 1) -> list:
+    """Run requests sequentially and return the responses."""
+    async def go():
+        return [await collect(router) for _ in range(requests)]
+    return asyncio.run(go())
+
+
+class TestBackendStats(unittest.TestCase):
+    """Test cases for rolling backend statistics."""
+    
+    def test_percentiles_and_errors(self):
+        """Test p50/p95 and error rate over the window."""
+        stats = BackendStats(window_seconds=60, window_size=100, clock=FakeClock())
+        for latency in range(1, 21):
+            stats.record(latency / 100)
+        stats.record(None)
+        
+        snapshot = stats.snapshot()
+        self.assertEqual(snapshot["samples"], 21)
+        self.assertAlmostEqual(snapshot["p50"], 0.11)
+        self.assertAlmostEqual(snapshot["p95"], 0.19)
+        self.assertAlmostEqual(snapshot["errorRate"], 1 / 21)
+    
+    def test_window_expiry(self):
+        """Test that old samples are forgotten."""
+        clock = FakeClock()
+        stats = BackendStats(window_seconds=60, window_size=100, clock=clock)
+        stats.record(None)
+        clock.now += 61
+        stats.record(0.1)
+        
+        snapshot = stats.snapshot()
+        self.assertEqual(snapshot["samples"], 1)
+        self.assertEqual(snapshot["errorRate"], 0.0)
+        self.assertEqual(stats.errors, 1)
+
+
+class TestProviderRouter(unittest.TestCase):
+    """Test cases for routing, fallback and hedging."""
+    
+    def test_routes_to_fastest(self):
+        """Test that traffic settles on the fastest backend once measured."""
+        slow = StubBackend("slow", latency=0.03)
+        fast = StubBackend("fast", latency=0.001)
+        router = ProviderRouter([slow, fast], min_samples=3, hedging=False)
+        
+        responses = run(router, requests=10)
+        
+        # Both are measured first, then the fast backend takes the rest
+        self.assertEqual(slow.calls, 3)
+        self.assertEqual(fast.calls, 7)
+        self.assertEqual(responses[-1], "[fast] hello")
+        self.assertEqual([b.name for b in router.rank()], ["fast", "slow"])
+    
+    def test_weights(self):
+        """Test that weights scale a backend's latency when ranking."""
+        preferred = StubBackend("preferred", latency=0.01, weight=4.0)
+        other = StubBackend("other", latency=0.005)
+        router = ProviderRouter([other, preferred], min_samples=2, hedging=False)
+        
+        run(router, requests=4)
+        self.assertEqual(router.rank()[0].name, "preferred")
+    
+    def test_fallback(self):
+        """Test that a failing backend falls back and is then demoted."""
+        broken = StubBackend("broken", fail=True)
+        healthy = StubBackend("healthy", latency=0.001)
+        router = ProviderRouter([broken, healthy], min_samples=2, max_error_rate=0.5, hedging=False)
+        
+        responses = run(router, requests=5)
+        
+        self.assertEqual(responses, ["[healthy] hello"] * 5)
+        self.assertEqual(broken.calls, 2)
+        metrics = router.get_metrics()
+        self.assertEqual(metrics["fallbacks"], 2)
+        self.assertFalse(metrics["backends"]["broken"]["healthy"])
+        self.assertEqual(metrics["backends"]["healthy"]["inFlight"], 0)
+    
+    def test_all_backends_fail(self):
+        """Test that a request fails once every backend has failed."""
+        router = ProviderRouter([StubBackend("a", fail=True), StubBackend("b", fail=True)], hedging=False)
+        
+        with self.assertRaises(RuntimeError):
+            run(router)
+        self.assertEqual(router.get_metrics()["failures"], 1)
+    
+    def test_hedging(self):
+        """Test that a request slower than the primary's p95 is hedged."""
+        primary = StubBackend("primary", latency=0.01)
+        secondary = StubBackend("secondary", latency=0.02)
+        router = ProviderRouter([primary, secondary], min_samples=3, hedging=True, hedge_min_delay=0.0)
+        
+        # Measure both backends, then make the primary stall
+        run(router, requests=6)
+        primary.latency = 1.0
+        
+        response = asyncio.run(asyncio.wait_for(collect(router), timeout=0.5))
+        
+        self.assertEqual(response, "[secondary] hello")
+        metrics = router.get_metrics()
+        self.assertEqual(metrics["hedges"], 1)
+        self.assertEqual(metrics["hedgeWins"], 1)
+        self.assertEqual(metrics["backends"]["primary"]["inFlight"], 0)
+    
+    def test_streams_all_chunks(self):
+        """Test that every chunk of the winning backend is streamed."""
+        router = ProviderRouter([StubBackend("stub", chunks=3)], hedging=False)
+        self.assertEqual(run(router), ["[stub] hello 1 2"])
+
+    def test_cancelled_while_racing(self):
+        """Test that cancelling a request during a hedge releases every racing backend."""
+        primary = StubBackend("primary", latency=0.01)
+        secondary = StubBackend("secondary", latency=0.01)
+        router = ProviderRouter([primary, secondary], min_samples=3, hedging=True, hedge_min_delay=0.0)
+        run(router, requests=6)
+        primary.latency = secondary.latency = 1.0
+        
+        async def go():
+            request = asyncio.ensure_future(collect(router))
+            await asyncio.sleep(0.2)
+            self.assertEqual((primary.stats.in_flight, secondary.stats.in_flight), (1, 1))
+            request.cancel()
+            with self.assertRaises(asyncio.CancelledError):
+                await request
+        
+        asyncio.run(asyncio.wait_for(go(), timeout=0.5))
+        self.assertEqual((primary.stats.in_flight, secondary.stats.in_flight), (0, 0))
+        self.assertEqual(router.get_metrics()["hedges"], 1)
+    
+    def test_mid_stream_failure_is_one_sample(self):
+        """Test that a stream failing after its first chunk is recorded once, as a failure."""
+        async def stream(system_instruction, message):
+            yield "partial"
+            raise RuntimeError("connection reset")
+        
+        backend = Backend("flaky", stream=stream)
+        router = ProviderRouter([backend], hedging=False)
+        with self.assertRaises(RuntimeError):
+            run(router)
+        
+        snapshot = backend.stats.snapshot()
+        self.assertEqual((snapshot["samples"], snapshot["errorRate"]), (1, 1.0))
+        self.assertEqual(backend.stats.in_flight, 0)
+
+
+class SlowHuggingFace:
+    """Blocking stand-in for HuggingFaceService."""
+    
+    def __init__(self, latency: float, fail: bool = False):
+        self.latency = latency
+        self.fail = fail
+        self.calls = 0
+    
+    def generate_response(self, system_instruction: str, message: str) -> str:
+        self.calls += 1
+        time.sleep(self.latency if self.calls > 1 else 0.0)
+        if self.fail:
+            raise HuggingFaceError("Error generating response: 503")
+        return "slow hf"
+
+
+def stub_call(result, latency: float):
+    """Blocking call returning a result (or raising it, if it is an exception) after a delay."""
+    def call():
+        time.sleep(latency)
+        if isinstance(result, Exception):
+            raise result
+        return result
+    return call
+
+
+class TestRequestHedger(unittest.TestCase):
+    """Test cases for hedged blocking calls."""
+    
+    def setUp(self):
+        """Set up a hedger that has seen fast primaries."""
+        # The minimum delay keeps scheduling jitter in the warm-up calls from triggering hedges
+        self.hedger = RequestHedger(enabled=True, percentile=0.9, min_delay=0.03, min_samples=5, budget=0.25, burst=1, max_workers=4)
+        for _ in range(20):
+            self.hedger.run(stub_call("primary", 0.005), stub_call("secondary", 0.0))
+    
+    def test_no_hedge_when_fast(self):
+        """Test that fast primaries are never hedged."""
+        self.assertEqual(self.hedger.run(stub_call("primary", 0.0), stub_call("secondary", 0.0)), "primary")
+        metrics = self.hedger.get_metrics()
+        self.assertEqual(metrics["hedged"], 0)
+        self.assertIsNotNone(metrics["hedgeDelay"])
+    
+    def test_hedge_wins(self):
+        """Test that a stalled primary is beaten by the hedge."""
+        started = time.monotonic()
+        response = self.hedger.run(stub_call("primary", 1.0), stub_call("secondary", 0.01))
+        
+        self.assertEqual(response, "secondary")
+        self.assertLess(time.monotonic() - started, 0.5)
+        metrics = self.hedger.get_metrics()
+        self.assertEqual(metrics["hedged"], 1)
+        self.assertEqual(metrics["winRate"], 1.0)
+    
+    def test_failed_hedge_waits_for_primary(self):
+        """Test that a failing hedge does not replace a slow but successful primary."""
+        response = self.hedger.run(stub_call("primary", 0.1), stub_call(HuggingFaceError("Error generating response: 500"), 0.0))
+        self.assertEqual(response, "primary")
+        self.assertEqual(self.hedger.get_metrics()["hedgeWins"], 0)
+    
+    def test_both_fail(self):
+        """Test that the primary's error is raised when neither call succeeds."""
+        with self.assertRaisesRegex(HuggingFaceError, "primary"):
+            self.hedger.run(stub_call(HuggingFaceError("primary"), 0.1), stub_call(HuggingFaceError("secondary"), 0.0))
+        self.assertEqual(self.hedger.stats.errors, 1)
+    
+    def test_budget(self):
+        """Test that hedges stop once the budget is spent."""
+        for _ in range(3):
+            self.hedger.run(stub_call("primary", 0.1), stub_call("secondary", 0.0))
+        metrics = self.hedger.get_metrics()
+        self.assertEqual(metrics["hedged"], 1)
+        self.assertEqual(metrics["budgetExhausted"], 2)
+    
+    def test_disabled(self):
+        """Test that a disabled hedger only runs the primary."""
+        self.hedger.enabled = False
+        self.assertEqual(self.hedger.run(stub_call("primary", 0.05), stub_call("secondary", 0.0)), "primary")
+        self.assertEqual(self.hedger.get_metrics()["hedged"], 0)
+
+    def test_saturated_pool(self):
+        """Test that time queued in a saturated pool neither counts as latency nor triggers a hedge."""
+        release = threading.Event()
+        blockers = [self.hedger._executor.submit(release.wait, 5) for _ in range(4)]
+        threading.Timer(0.2, release.set).start()
+        
+        self.assertEqual(self.hedger.run(stub_call("primary", 0.005), stub_call("secondary", 0.0)), "primary")
+        for blocker in blockers:
+            blocker.result()
+        
+        metrics = self.hedger.get_metrics()
+        self.assertEqual((metrics["hedged"], metrics["saturated"]), (0, 1))
+        # The slowest recorded primary is the call itself, not the 0.2s it spent queued
+        self.assertLess(self.hedger.stats.percentile(1.0), 0.1)
+
+
+class TestAIService(unittest.TestCase):
+    """Test cases for the provider configuration of AIService."""
+    
+    def test_weights_parsing(self):
+        """Test parsing provider weights."""
+        self.assertEqual(parse_weights("gemini=2, huggingface=0.5,bad,vicuna=x"), {"gemini": 2.0, "huggingface": 0.5})
+    
+    def test_skips_unusable_providers(self):
+        """Test that unusable providers are left out when several are configured."""
+        service = AIService(providers=["unknown", "vicuna"], weights={"vicuna": 2.0})
+        self.assertEqual([b.name for b in service.router.backends], ["vicuna"])
+        self.assertEqual(service.router.backends[0].weight, 2.0)
+        
+        with self.assertRaises(ValueError):
+            AIService(providers=["unknown"])
+
+    def test_huggingface_runs_off_the_loop(self):
+        """Test that a slow Hugging Face call does not block the event loop, so it can be hedged."""
+        service = AIService(providers=["huggingface"])
+        service.hf_service = SlowHuggingFace(latency=0.5)
+        huggingface = Backend("huggingface", service._generate_huggingface_response)
+        fast = StubBackend("fast", latency=0.01)
+        router = ProviderRouter([huggingface, fast], min_samples=1, hedging=True, hedge_min_delay=0.05)
+        
+        # Measure both backends, then let the hedge beat the slow call
+        run(router, requests=2)
+        
+        async def timed():
+            # Timed inside the loop: asyncio.run() also waits for the abandoned call's thread
+            started = time.monotonic()
+            response = await collect(router)
+            return response, time.monotonic() - started
+        
+        response, elapsed = asyncio.run(timed())
+        self.assertEqual(response, "[fast] hello")
+        self.assertLess(elapsed, 0.4)
+        self.assertEqual(router.get_metrics()["hedges"], 1)
+    
+    def test_huggingface_failure_falls_back(self):
+        """Test that a Hugging Face error is raised to the router rather than returned as text."""
+        service = AIService(providers=["huggingface"])
+        service.hf_service = SlowHuggingFace(latency=0.0, fail=True)
+        router = ProviderRouter([Backend("huggingface", service._generate_huggingface_response), StubBackend("fast")], hedging=False)
+        
+        self.assertEqual(run(router), ["[fast] hello"])
+        self.assertEqual(router.get_metrics()["fallbacks"], 1)
+
+
+def run_tests():
+    """Run all tests."""
+    loader = unittest.TestLoader()
+    test_suite = unittest.TestSuite()
+    test_suite.addTests(loader.loadTestsFromTestCase(TestBackendStats))
+    test_suite.addTests(loader.loadTestsFromTestCase(TestProviderRouter))
+    test_suite.addTests(loader.loadTestsFromTestCase(TestRequestHedger))
+    test_suite.addTests(loader.loadTestsFromTestCase(TestAIService))
+    
+    test_runner = unittest.TextTestRunner(verbosity=2)
+    test_result = test_runner.run(test_suite)
+    return test_result.wasSuccessful()
+
+
+if __name__ == "__main__":
+    success = run_tests()
+    sys.exit(0 if success else 1)
@@ -0,0 +1,165 @@
+"""
+Validation script for rate limiting and daily quotas.
+Uses the in-memory limiter with a fake clock; no Redis server is needed.
+"""
+
+import os
+import sys
+import hashlib
+import logging
+import unittest
+
+# Add parent directory to path to import modules
+sys.path.insert(0, os.path.abspath(os.path.dirname(__file__)))
+
+# Import modules to test
+from rate_limiter import InMemoryRateLimiter, RateLimitPolicy, api_key_identity
+
+# Configure logging
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+    handlers=[
+        logging.StreamHandler()
+    ]
+)
+logger = logging.getLogger(__name__)
+
+
+# Shortly before midnight UTC
+START = 19000 * 86400 + 86400 - 120
+
+
+class FakeClock:
+    """Clock that only moves when told to."""
+    
+    def __init__(self, now: float = START):
+        self.now = now
+    
+    def __call__(self) -> float:
+        return self.now
+    
+    def advance(self, seconds: float) -> None:
+        self.now += seconds
+
+
+class TestTokenBucket(unittest.TestCase):
+    """Test cases for the token bucket."""
+    
+    def setUp(self):
+        self.clock = FakeClock()
+        self.limiter = InMemoryRateLimiter(enabled=True, clock=self.clock)
+        # One token every 2 seconds, bursts of 3
+        self.policy = RateLimitPolicy(per_minute=30, burst=3, daily_quota=0)
+    
+    def test_burst_then_reject(self):
+        """Test that a burst is admitted and the next request is rejected with Retry-After."""
+        results = [self.limiter.check("user:a", self.policy) for _ in range(4)]
+        
+        self.assertEqual([result.allowed for result in results], [True, True, True, False])
+        self.assertEqual(results[3].reason, "rate")
+        self.assertEqual(results[3].headers()["Retry-After"], "2")
+        self.assertEqual(results[2].headers()["X-RateLimit-Remaining"], "0")
+    
+    def test_refill(self):
+        """Test that tokens come back at the policy rate, up to the burst size."""
+        for _ in range(3):
+            self.limiter.check("user:a", self.policy)
+        
+        self.clock.advance(1.9)
+        self.assertFalse(self.limiter.check("user:a", self.policy).allowed)
+        self.clock.advance(0.1)
+        self.assertTrue(self.limiter.check("user:a", self.policy).allowed)
+        
+        # A long pause refills no more than the burst
+        self.clock.advance(3600)
+        results = [self.limiter.check("user:a", self.policy) for _ in range(4)]
+        self.assertEqual([result.allowed for result in results], [True, True, True, False])
+    
+    def test_keys_are_independent(self):
+        """Test that one key's traffic does not use another key's tokens."""
+        for _ in range(4):
+            self.limiter.check("user:a", self.policy)
+        self.assertTrue(self.limiter.check("user:b", self.policy).allowed)
+    
+    def test_penalize(self):
+        """Test that an upstream 429 holds the key back for the cooldown."""
+        self.limiter.penalize("user:a", self.policy, seconds=10)
+        
+        self.clock.advance(9)
+        self.assertFalse(self.limiter.check("user:a", self.policy).allowed)
+        self.clock.advance(1)
+        self.assertTrue(self.limiter.check("user:a", self.policy).allowed)
+    
+    def test_disabled(self):
+        """Test that a disabled limiter admits everything."""
+        limiter = InMemoryRateLimiter(enabled=False, clock=self.clock)
+        self.assertTrue(all(limiter.check("user:a", self.policy).allowed for _ in range(10)))
+
+
+class TestDailyQuota(unittest.TestCase):
+    """Test cases for the daily quota."""
+    
+    def setUp(self):
+        self.clock = FakeClock()
+        self.limiter = InMemoryRateLimiter(enabled=True, clock=self.clock)
+        self.policy = RateLimitPolicy(per_minute=6000, burst=100, daily_quota=3)
+    
+    def test_quota(self):
+        """Test that requests beyond the quota are rejected until midnight UTC."""
+        results = [self.limiter.check("user:a", self.policy) for _ in range(4)]
+        
+        self.assertEqual([result.allowed for result in results], [True, True, True, False])
+        rejected = results[3]
+        self.assertEqual(rejected.reason, "quota")
+        self.assertEqual(rejected.retry_after, 120)
+        self.assertEqual(rejected.headers()["X-Quota-Remaining"], "0")
+        self.assertEqual(self.limiter.get_metrics()["rejectedQuota"], 1)
+        
+        # A rejected request does not use quota
+        self.assertEqual(rejected.quota_used, 3)
+        
+        self.clock.advance(120)
+        result = self.limiter.check("user:a", self.policy)
+        self.assertTrue(result.allowed)
+        self.assertEqual(result.quota_used, 1)
+    
+    def test_rate_rejection_keeps_quota(self):
+        """Test that a request rejected by the bucket is not counted against the quota."""
+        policy = RateLimitPolicy(per_minute=60, burst=1, daily_quota=3)
+        self.limiter.check("user:a", policy)
+        self.assertEqual(self.limiter.check("user:a", policy).reason, "rate")
+        
+        self.clock.advance(1)
+        self.assertEqual(self.limiter.check("user:a", policy).quota_used, 2)
+
+
+class TestAPIKeyIdentity(unittest.TestCase):
+    """Test cases for API key rate limit keys."""
+    
+    def test_salted(self):
+        """Test that the identity is stable, distinct per key and not a plain hash of the key."""
+        identity = api_key_identity("sk-test")
+        
+        self.assertEqual(identity, api_key_identity("sk-test"))
+        self.assertNotEqual(identity, api_key_identity("sk-other"))
+        self.assertNotIn("sk-test", identity)
+        self.assertNotEqual(identity, "key:" + hashlib.sha256(b"sk-test").hexdigest()[:32])
+
+
+def run_tests():
+    """Run all tests."""
+    loader = unittest.TestLoader()
+    test_suite = unittest.TestSuite()
+    test_suite.addTests(loader.loadTestsFromTestCase(TestTokenBucket))
+    test_suite.addTests(loader.loadTestsFromTestCase(TestDailyQuota))
+    test_suite.addTests(loader.loadTestsFromTestCase(TestAPIKeyIdentity))
+    
+    test_runner = unittest.TextTestRunner(verbosity=2)
+    test_result = test_runner.run(test_suite)
+    return test_result.wasSuccessful()
+
+
+if __name__ == "__main__":
+    success = run_tests()
+    sys.exit(0 if success else 1)
@@ -0,0 +1,138 @@
+"""
+Validation script for the semantic response cache.
+Uses a stub sentence embedder with fixed similarities, so no model download
+is needed.
+"""
+
+import os
+import sys
+import logging
+import unittest
+
+import numpy as np
+
+# Add parent directory to path to import modules
+sys.path.insert(0, os.path.abspath(os.path.dirname(__file__)))
+
+# Import modules to test
+from embeddings import Embedder, HashingEmbedder
+from semantic_cache import SemanticCache
+
+# Configure logging
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+    handlers=[
+        logging.StreamHandler()
+    ]
+)
+logger = logging.getLogger(__name__)
+
+
+SYSTEM = "You are Synapse."
+QUESTION = "How do I file VAT?"
+
+
+def unit(angle: float) -> np.ndarray:
+    """A unit vector at a given angle from the first axis; cosines follow from the angles."""
+    vector = np.zeros(8, dtype=np.float32)
+    vector[0], vector[1] = np.cos(angle), np.sin(angle)
+    return vector
+
+
+class StubSentenceEmbedder(Embedder):
+    """Semantic embedder with fixed vectors per text."""
+    
+    name = "stub-sentence"
+    dim = 8
+    semantic = True
+    
+    def __init__(self):
+        self.vectors = {
+            QUESTION: unit(0.0),
+            # Paraphrase: cosine 0.95 with the question
+            "How to file my VAT return": unit(np.arccos(0.95)),
+            # Near miss: cosine 0.85, below the 0.9 threshold but within the near-miss band
+            "How do I pay VAT late?": unit(np.arccos(0.85)),
+            # Unrelated: cosine 0
+            "Write me a poem": unit(np.pi / 2)
+        }
+    
+    def embed(self, texts):
+        return np.stack([self.vectors[text] for text in texts])
+
+
+class TestSemanticCache(unittest.TestCase):
+    """Test cases for the semantic cache."""
+    
+    def setUp(self):
+        self.cache = SemanticCache(
+            embedder=StubSentenceEmbedder(),
+            enabled=True,
+            threshold=0.9,
+            max_entries=16,
+            persona_settings={"synapse": {"enabled": True}}
+        )
+        self.cache.store("synapse", SYSTEM, QUESTION, "Use the online portal.", "alice")
+    
+    def test_paraphrase_hit(self):
+        """Test that a paraphrase from the same user is served from the cache."""
+        hit = self.cache.lookup("synapse", SYSTEM, "How to file my VAT return", "alice")
+        
+        self.assertIsNotNone(hit)
+        self.assertEqual((hit.message, hit.response), (QUESTION, "Use the online portal."))
+        self.assertAlmostEqual(hit.similarity, 0.95, places=4)
+    
+    def test_near_miss(self):
+        """Test that a similar but different question misses and is counted as a near miss."""
+        self.assertIsNone(self.cache.lookup("synapse", SYSTEM, "How do I pay VAT late?", "alice"))
+        self.assertIsNone(self.cache.lookup("synapse", SYSTEM, "Write me a poem", "alice"))
+        
+        totals = self.cache.get_metrics()["total"]
+        self.assertEqual((totals["misses"], totals["nearMisses"]), (2, 1))
+    
+    def test_scoped_by_user(self):
+        """Test that one user's cached answer is never served to another."""
+        self.assertIsNone(self.cache.lookup("synapse", SYSTEM, QUESTION, "bob"))
+        self.assertIsNone(self.cache.lookup("synapse", SYSTEM, QUESTION, None))
+        
+        # Bob's own answer to the same message is kept next to Alice's
+        self.cache.store("synapse", SYSTEM, QUESTION, "Bob's answer", "bob")
+        self.assertEqual(self.cache.lookup("synapse", SYSTEM, QUESTION, "bob").response, "Bob's answer")
+        self.assertEqual(self.cache.lookup("synapse", SYSTEM, QUESTION, "alice").response, "Use the online portal.")
+    
+    def test_prompt_change_and_opt_in(self):
+        """Test that a changed system prompt drops entries and other personas are not cached."""
+        self.assertIsNone(self.cache.lookup("synapse", "You are someone else.", QUESTION, "alice"))
+        self.assertFalse(self.cache.is_enabled_for("tutor"))
+    
+    def test_lexical_embedder_disables_cache(self):
+        """Test that the cache turns itself off without a sentence embedding model."""
+        cache = SemanticCache(embedder=HashingEmbedder(), enabled=True, persona_settings={"synapse": {"enabled": True}})
+        
+        self.assertFalse(cache.is_enabled_for("synapse"))
+        cache.store("synapse", SYSTEM, QUESTION, "answer", "alice")
+        self.assertIsNone(cache.lookup("synapse", SYSTEM, QUESTION, "alice"))
+        self.assertFalse(cache.get_metrics()["enabled"])
+    
+    @unittest.skipIf("SEMANTIC_CACHE_ENABLED" in os.environ, "SEMANTIC_CACHE_ENABLED is set")
+    def test_disabled_by_default(self):
+        """Test that the cache is off unless SEMANTIC_CACHE_ENABLED is set."""
+        cache = SemanticCache(persona_settings={"synapse": {"enabled": True}})
+        self.assertFalse(cache.is_enabled_for("synapse"))
+
+
+def run_tests():
+    """Run all tests."""
+    loader = unittest.TestLoader()
+    test_suite = unittest.TestSuite()
+    test_suite.addTests(loader.loadTestsFromTestCase(TestSemanticCache))
+    
+    test_runner = unittest.TextTestRunner(verbosity=2)
+    test_result = test_runner.run(test_suite)
+    return test_result.wasSuccessful()
+
+
+if __name__ == "__main__":
+    success = run_tests()
+    sys.exit(0 if success else 1)
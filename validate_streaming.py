@@ -0,0 +1,389 @@
+"""
+Validation script for streaming LLM providers.
+Streams from a local HTTP stub that speaks server-sent events with chunked
+transfer encoding; no network access or credentials are needed.
+"""
+
+import os
+import sys
+import json
+import time
+import asyncio
+import logging
+import threading
+import unittest
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Add parent directory to path to import modules
+sys.path.insert(0, os.path.abspath(os.path.dirname(__file__)))
+
+# Import modules to test
+from openai_compatible import OpenAICompatibleClient
+from sse_client import StreamHTTPError, iter_sse_events, stream_sse
+from vertex_gemini import GeminiStreamingClient
+
+# Configure logging
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+    handlers=[
+        logging.StreamHandler()
+    ]
+)
+logger = logging.getLogger(__name__)
+
+
+def gemini_event(text: str) -> dict:
+    """A streamGenerateContent response chunk."""
+    return {"candidates": [{"content": {"role": "model", "parts": [{"text": text}]}}]}
+
+
+def openai_event(content: str = None, role: str = None, finish_reason: str = None) -> dict:
+    """A chat.completion.chunk."""
+    delta = {}
+    if role:
+        delta["role"] = role
+    if content is not None:
+        delta["content"] = content
+    return {"object": "chat.completion.chunk", "model": "vicuna-test", "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}]}
+
+
+class FakeStreamingResponse:
+    """Streaming response that counts the lines read from it."""
+    
+    status_code = 200
+    
+    def __init__(self, events: int):
+        self.events = events
+        self.read = 0
+        self.closed = False
+    
+    def iter_lines(self, chunk_size=None):
+        for i in range(self.events):
+            if self.closed:
+                return
+            self.read += 1
+            yield f"data: {i}".encode()
+            yield b""
+    
+    def close(self):
+        self.closed = True
+    
+    def __enter__(self):
+        return self
+    
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+class FakeSession:
+    """Session returning a fixed response."""
+    
+    def __init__(self, response):
+        self.response = response
+    
+    def post(self, url, **kwargs):
+        return self.response
+
+
+class StubStreamingHandler(BaseHTTPRequestHandler):
+    """Streams the server's configured events, one chunk per event."""
+    
+    protocol_version = "HTTP/1.1"
+    
+    def log_message(self, format, *args):
+        pass
+    
+    def do_POST(self):
+        server = self.server
+        body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))))
+        server.requests.append({"path": self.path, "headers": dict(self.headers), "body": body})
+        server.connections.add(self.client_address)
+        
+        if server.status != 200:
+            payload = json.dumps({"error": {"code": server.status, "message": "stub error"}}).encode()
+            self.send_response(server.status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(payload)))
+            self.end_headers()
+            self.wfile.write(payload)
+            return
+        
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        try:
+            for event in server.events:
+                time.sleep(server.delay)
+                data = (event if isinstance(event, str) else f"data: {json.dumps(event)}\r\n\r\n").encode()
+                self.wfile.write(f"{len(data):x}\r\n".encode() + data + b"\r\n")
+                self.wfile.flush()
+            self.wfile.write(b"0\r\n\r\n")
+            self.wfile.flush()
+        except (BrokenPipeError, ConnectionResetError):
+            server.disconnected.set()
+
+
+class StubStreamingServer(ThreadingHTTPServer):
+    """Local streaming endpoint with configurable events, delay and status."""
+    
+    daemon_threads = True
+    
+    def __init__(self):
+        super().__init__(("127.0.0.1", 0), StubStreamingHandler)
+        self.events = []
+        self.delay = 0.0
+        self.status = 200
+        self.requests = []
+        self.connections = set()
+        self.disconnected = threading.Event()
+        self.thread = threading.Thread(target=self.serve_forever, daemon=True)
+        self.thread.start()
+    
+    @property
+    def url(self) -> str:
+        return f"http://127.0.0.1:{self.server_address[1]}"
+    
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+
+class TestSSEParsing(unittest.TestCase):
+    """Test cases for server-sent event parsing."""
+    
+    def test_events(self):
+        """Test multi-line data, event types, comments and an unterminated last event."""
+        lines = [b": keep-alive", b"data: first", b"data: line", b"", b"event: done", b"id: 7", b"data:{}", b"", b"data: tail"]
+        events = list(iter_sse_events(lines))
+        
+        self.assertEqual([e.data for e in events], ["first\nline", "{}", "tail"])
+        self.assertEqual(events[1].event, "done")
+        self.assertEqual(events[1].id, "7")
+        self.assertEqual(events[2].event, "message")
+
+    def test_backpressure(self):
+        """Test that reading pauses while the consumer is behind and stops when it leaves."""
+        response = FakeStreamingResponse(events=1000)
+        
+        async def slow_consumer():
+            stream = stream_sse(FakeSession(response), "http://stub", max_buffered=4)
+            received = [await stream.__anext__() for _ in range(2)]
+            await asyncio.sleep(0.2)
+            read_while_paused = response.read
+            await stream.aclose()
+            return received, read_while_paused
+        
+        received, read_while_paused = asyncio.run(slow_consumer())
+        self.assertEqual([event.data for event in received], ["0", "1"])
+        self.assertLessEqual(read_while_paused, 2 + 4 + 1)
+        self.assertTrue(response.closed)
+
+
+class TestGeminiStreaming(unittest.TestCase):
+    """Test cases for Vertex AI Gemini streaming against the local stub."""
+    
+    @classmethod
+    def setUpClass(cls):
+        cls.server = StubStreamingServer()
+    
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.stop()
+    
+    def setUp(self):
+        """Reset the stub and create a client pointed at it."""
+        self.server.events = [gemini_event("Hello"), gemini_event(", "), gemini_event("world")]
+        self.server.delay = 0.0
+        self.server.status = 200
+        self.server.requests.clear()
+        self.server.connections.clear()
+        self.server.disconnected.clear()
+        self.client = GeminiStreamingClient("test-project", "us-central1", "gemini-test", endpoint=self.server.url, access_token="test-token")
+    
+    def tearDown(self):
+        self.client.close()
+    
+    def collect(self, **kwargs) -> list:
+        """Stream a response, returning (seconds since start, chunk) pairs."""
+        async def go():
+            started = time.monotonic()
+            return [(time.monotonic() - started, chunk) async for chunk in self.client.stream("Be brief.", "Hi", **kwargs)]
+        return asyncio.run(go())
+    
+    def test_request(self):
+        """Test the endpoint path, authorization and request body."""
+        chunks = self.collect(history=[{"role": "user", "content": "Earlier"}, {"role": "assistant", "content": "Reply"}])
+        
+        self.assertEqual("".join(chunk for _, chunk in chunks), "Hello, world")
+        request = self.server.requests[0]
+        self.assertEqual(request["path"], "/v1/projects/test-project/locations/us-central1/publishers/google/models/gemini-test:streamGenerateContent?alt=sse")
+        self.assertEqual(request["headers"]["Authorization"], "Bearer test-token")
+        self.assertEqual(request["body"]["systemInstruction"], {"parts": [{"text": "Be brief."}]})
+        self.assertEqual([c["role"] for c in request["body"]["contents"]], ["user", "model", "user"])
+        self.assertEqual(request["body"]["contents"][-1]["parts"][0]["text"], "Hi")
+    
+    def test_incremental_delivery(self):
+        """Test that tokens are yielded as they arrive and time to first token is tracked."""
+        self.server.delay = 0.1
+        chunks = self.collect()
+        
+        self.assertEqual(len(chunks), 3)
+        self.assertLess(chunks[0][0], 0.2)
+        self.assertGreater(chunks[-1][0], 0.25)
+        metrics = self.client.get_metrics()
+        self.assertEqual(metrics["chunks"], 3)
+        self.assertLess(metrics["ttftP50"], 0.2)
+    
+    def test_connection_reuse(self):
+        """Test that the long-lived client reuses its connection."""
+        self.collect()
+        self.collect()
+        self.assertEqual(len(self.server.requests), 2)
+        self.assertEqual(len(self.server.connections), 1)
+    
+    def test_errors(self):
+        """Test error events and error statuses."""
+        self.server.events = [gemini_event("Partial"), {"error": {"code": 500, "message": "internal"}}]
+        with self.assertRaisesRegex(RuntimeError, "internal"):
+            self.collect()
+        
+        self.server.events = [{"promptFeedback": {"blockReason": "SAFETY"}}]
+        with self.assertRaisesRegex(RuntimeError, "SAFETY"):
+            self.collect()
+        
+        self.server.status = 403
+        with self.assertRaises(StreamHTTPError) as context:
+            self.collect()
+        self.assertEqual(context.exception.status_code, 403)
+        self.assertEqual(self.client.get_metrics()["errors"], 3)
+    
+    def test_cancellation(self):
+        """Test that abandoning a stream closes the connection."""
+        self.server.events = [gemini_event(f"token {i} ") for i in range(50)]
+        self.server.delay = 0.02
+        
+        async def first_chunk():
+            stream = self.client.stream("Be brief.", "Hi")
+            chunk = await stream.__anext__()
+            await stream.aclose()
+            return chunk
+        
+        self.assertEqual(asyncio.run(first_chunk()), "token 0 ")
+        self.assertTrue(self.server.disconnected.wait(2))
+
+
+class TestOpenAICompatibleStreaming(unittest.TestCase):
+    """Test cases for OpenAI-compatible chat completion streaming against the local stub."""
+    
+    @classmethod
+    def setUpClass(cls):
+        cls.server = StubStreamingServer()
+    
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.stop()
+    
+    def setUp(self):
+        """Reset the stub and create a client pointed at it."""
+        self.server.events = [
+            openai_event(role="assistant"),
+            openai_event("Hello"),
+            openai_event(" there"),
+            openai_event(finish_reason="stop"),
+            "data: [DONE]\r\n\r\n"
+        ]
+        self.server.delay = 0.0
+        self.server.status = 200
+        self.server.requests.clear()
+        self.server.connections.clear()
+        self.server.disconnected.clear()
+        self.client = OpenAICompatibleClient(base_url=f"{self.server.url}/v1", model="vicuna-test", api_key="local-key")
+    
+    def tearDown(self):
+        self.client.close()
+    
+    def collect(self, **kwargs) -> list:
+        """Stream a response, returning (seconds since start, chunk) pairs."""
+        async def go():
+            started = time.monotonic()
+            return [(time.monotonic() - started, chunk) async for chunk in self.client.stream("Be brief.", "Hi", **kwargs)]
+        return asyncio.run(go())
+    
+    def test_request(self):
+        """Test the endpoint path, authorization and request body."""
+        chunks = self.collect(history=[{"role": "user", "content": "Earlier"}, {"role": "assistant", "content": "Reply"}])
+        
+        self.assertEqual([chunk for _, chunk in chunks], ["Hello", " there"])
+        request = self.server.requests[0]
+        self.assertEqual(request["path"], "/v1/chat/completions")
+        self.assertEqual(request["headers"]["Authorization"], "Bearer local-key")
+        self.assertEqual(request["headers"]["Accept"], "text/event-stream")
+        self.assertEqual(request["body"]["model"], "vicuna-test")
+        self.assertTrue(request["body"]["stream"])
+        self.assertEqual([m["role"] for m in request["body"]["messages"]], ["system", "user", "assistant", "user"])
+    
+    def test_incremental_delivery(self):
+        """Test that deltas are yielded as they arrive."""
+        self.server.delay = 0.1
+        chunks = self.collect()
+        
+        self.assertLess(chunks[0][0], 0.3)
+        self.assertGreater(chunks[-1][0], 0.25)
+        self.assertIsNotNone(self.client.get_metrics()["ttftP50"])
+    
+    def test_done_ends_stream(self):
+        """Test that events after [DONE] are ignored."""
+        self.server.events.append(openai_event("ignored"))
+        self.assertEqual("".join(chunk for _, chunk in self.collect()), "Hello there")
+    
+    def test_connection_reuse(self):
+        """Test that keep-alive connections to the model server are reused."""
+        for _ in range(3):
+            self.collect()
+        self.assertEqual(len(self.server.connections), 1)
+    
+    def test_errors(self):
+        """Test error chunks and error statuses."""
+        self.server.events = [openai_event("Partial"), {"error": {"message": "out of memory"}}]
+        with self.assertRaisesRegex(RuntimeError, "out of memory"):
+            self.collect()
+        
+        self.server.status = 503
+        with self.assertRaises(StreamHTTPError):
+            self.collect()
+        self.assertEqual(self.client.get_metrics()["errors"], 2)
+    
+    def test_cancellation(self):
+        """Test that abandoning a stream closes the connection without counting an error."""
+        self.server.events = [openai_event(f"token {i} ") for i in range(50)]
+        self.server.delay = 0.02
+        
+        async def first_chunk():
+            stream = self.client.stream("Be brief.", "Hi")
+            chunk = await stream.__anext__()
+            await stream.aclose()
+            return chunk
+        
+        self.assertEqual(asyncio.run(first_chunk()), "token 0 ")
+        self.assertTrue(self.server.disconnected.wait(2))
+        self.assertEqual(self.client.get_metrics()["errors"], 0)
+
+
+def run_tests():
+    """Run all tests."""
+    loader = unittest.TestLoader()
+    test_suite = unittest.TestSuite()
+    test_suite.addTests(loader.loadTestsFromTestCase(TestSSEParsing))
+    test_suite.addTests(loader.loadTestsFromTestCase(TestGeminiStreaming))
+    test_suite.addTests(loader.loadTestsFromTestCase(TestOpenAICompatibleStreaming))
+    
+    test_runner = unittest.TextTestRunner(verbosity=2)
+    test_result = test_runner.run(test_suite)
+    return test_result.wasSuccessful()
+
+
+if __name__ == "__main__":
+    success = run_tests()
+    sys.exit(0 if success else 1)
@@ -0,0 +1,173 @@
+"""
+Validation script for the questionnaire template registry.
+Uses temporary template directories; no services are needed.
+"""
+
+import os
+import sys
+import json
+import time
+import shutil
+import logging
+import tempfile
+import unittest
+
+# Add parent directory to path to import modules
+sys.path.insert(0, os.path.abspath(os.path.dirname(__file__)))
+
+# Import modules to test
+from template_registry import TemplateRegistry, TemplateValidationError, validate_template
+
+# Configure logging
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+    handlers=[
+        logging.StreamHandler()
+    ]
+)
+logger = logging.getLogger(__name__)
+
+
+def template(name: str, question: str = "topic") -> dict:
+    """A minimal valid template."""
+    return {"name": name, "questions": [{"id": question, "type": "text", "label": question.title()}]}
+
+
+def wait_for(condition, timeout: float = 5.0) -> bool:
+    """Poll until a condition holds or the timeout passes."""
+    deadline = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > deadline:
+            return False
+        time.sleep(0.01)
+    return True
+
+
+class TestValidateTemplate(unittest.TestCase):
+    """Test cases for template validation."""
+    
+    def test_valid(self):
+        """Test that a well-formed template is returned unchanged."""
+        data = template("General")
+        self.assertIs(validate_template("general", data), data)
+    
+    def test_invalid(self):
+        """Test that malformed templates are rejected."""
+        select = {"name": "X", "questions": [{"id": "a", "type": "select"}]}
+        duplicate = {"name": "X", "questions": [{"id": "a", "type": "text"}, {"id": "a", "type": "text"}]}
+        for data in ([], {"questions": []}, {"name": "X", "questions": []}, select, duplicate,
+                     {"name": "X", "questions": [{"id": "a", "type": "slider"}]}):
+            with self.assertRaises(TemplateValidationError):
+                validate_template("bad", data)
+
+
+class TestTemplateRegistry(unittest.TestCase):
+    """Test cases for loading and hot-reloading templates."""
+    
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.registry = TemplateRegistry(self.directory, {"general": template("General")}, poll_interval=60)
+    
+    def tearDown(self):
+        self.registry.stop_watching()
+        shutil.rmtree(self.directory, ignore_errors=True)
+    
+    def write(self, template_id: str, data, offset: int = 1) -> None:
+        """Write a template file with a distinct mtime, as an edit in another process would."""
+        path = os.path.join(self.directory, f"{template_id}.json")
+        with open(path, "w") as f:
+            f.write(data if isinstance(data, str) else json.dumps(data))
+        stamp = time.time_ns() + offset * 1_000_000_000
+        os.utime(path, ns=(stamp, stamp))
+    
+    def test_load(self):
+        """Test that built-in and custom templates are served, built-ins first and never overridden."""
+        self.write("legal", template("Legal"))
+        self.write("general", template("Overridden"))
+        self.write("broken", "{not json")
+        
+        self.assertEqual(self.registry.ids(), ["general", "legal"])
+        self.assertEqual(self.registry.get("general")["name"], "General")
+        self.assertEqual([t["id"] for t in self.registry.list()], ["general", "legal"])
+        self.assertIsNone(self.registry.get("broken"))
+    
+    def test_reload_on_change(self):
+        """Test that added, edited and removed files are picked up on a forced scan."""
+        self.write("legal", template("Legal"))
+        self.assertEqual(self.registry.get("legal")["name"], "Legal")
+        
+        self.write("legal", template("Law"), offset=2)
+        self.write("tax", template("Tax"))
+        self.assertTrue(self.registry.refresh(force=True))
+        self.assertEqual((self.registry.get("legal")["name"], self.registry.get("tax")["name"]), ("Law", "Tax"))
+        
+        os.remove(os.path.join(self.directory, "tax.json"))
+        self.assertTrue(self.registry.refresh(force=True))
+        self.assertIsNone(self.registry.get("tax"))
+        self.assertFalse(self.registry.refresh(force=True))
+    
+    def test_invalid_edit_keeps_last_good(self):
+        """Test that a broken edit keeps serving the last valid version."""
+        self.write("legal", template("Legal"))
+        self.registry.get("legal")
+        self.write("legal", {"name": "Legal"}, offset=2)
+        
+        self.assertFalse(self.registry.refresh(force=True))
+        self.assertEqual(self.registry.get("legal")["name"], "Legal")
+    
+    def test_etag_and_version(self):
+        """Test that the ETag and version change with the content only."""
+        etag, version = self.registry.etag, self.registry.version
+        
+        self.write("legal", template("Legal"))
+        self.registry.refresh(force=True)
+        changed_etag, changed_version = self.registry.etag, self.registry.version
+        self.assertNotEqual(changed_etag, etag)
+        self.assertEqual(changed_version, version + 1)
+        
+        # Rewriting identical content changes the mtime but not the template set
+        self.write("legal", template("Legal"), offset=2)
+        self.assertFalse(self.registry.refresh(force=True))
+        self.assertEqual((self.registry.etag, self.registry.version), (changed_etag, changed_version))
+        
+        self.write("legal", template("Legal", question="jurisdiction"), offset=3)
+        self.registry.refresh(force=True)
+        self.assertNotEqual(self.registry.etag, changed_etag)
+        self.assertEqual(self.registry.version, version + 2)
+    
+    def test_list_skips_removed(self):
+        """Test that a template removed between listing IDs and reading it is left out."""
+        self.write("legal", template("Legal"))
+        self.registry.ids()
+        ids = self.registry.ids
+        self.registry.ids = lambda: ids() + ["gone"]
+        
+        self.assertEqual([t["id"] for t in self.registry.list()], ["general", "legal"])
+    
+    def test_watcher(self):
+        """Test that the watcher picks up changes without requests scanning the directory."""
+        self.registry.poll_interval = 0.05
+        self.registry.ids()
+        self.registry.start_watching()
+        
+        self.write("legal", template("Legal"))
+        self.assertTrue(wait_for(lambda: self.registry._custom.get("legal") is not None))
+        self.assertEqual(self.registry.get("legal")["name"], "Legal")
+
+
+def run_tests():
+    """Run all tests."""
+    loader = unittest.TestLoader()
+    test_suite = unittest.TestSuite()
+    test_suite.addTests(loader.loadTestsFromTestCase(TestValidateTemplate))
+    test_suite.addTests(loader.loadTestsFromTestCase(TestTemplateRegistry))
+    
+    test_runner = unittest.TextTestRunner(verbosity=2)
+    test_result = test_runner.run(test_suite)
+    return test_result.wasSuccessful()
+
+
+if __name__ == "__main__":
+    success = run_tests()
+    sys.exit(0 if success else 1)
@@ -0,0 +1,297 @@
+"""
+Validation script for local Firebase ID token verification.
+Uses locally generated RSA keys and tokens; no network access is needed.
+"""
+
+import os
+import sys
+import json
+import base64
+import random
+import hashlib
+import logging
+import unittest
+
+# Add parent directory to path to import modules
+sys.path.insert(0, os.path.abspath(os.path.dirname(__file__)))
+
+# Import modules to test
+from token_verifier import (
+    KeySet, TokenVerifier, TokenVerificationError, ExpiredTokenError,
+    cache_max_age, _SHA256_DIGEST_INFO
+)
+
+# Configure logging
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+    handlers=[
+        logging.StreamHandler()
+    ]
+)
+logger = logging.getLogger(__name__)
+
+PROJECT_ID = "synapse-test"
+
+
+def _is_probable_prime(n: int, rng: random.Random, rounds: int = 32) -> bool:
+    """Miller-Rabin primality test."""
+    if n < 4:
+        return n in (2, 3)
+    for small in (2, 3, 5, 7, 11, 13, 17, 19, 23, 29, 31, 37):
+        if n % small == 0:
+            return n == small
+    d, r = n - 1, 0
+    while d % 2 == 0:
+        d //= 2
+        r += 1
+    for _ in range(rounds):
+        x = pow(rng.randrange(2, n - 1), d, n)
+        if x in (1, n - 1):
+            continue
+        for _ in range(r - 1):
+            x = pow(x, 2, n)
+            if x == n - 1:
+                break
+        else:
+            return False
+    return True
+
+
+def generate_rsa_key(bits: int = 2048, seed: int = 0) -> dict:
+    """Generate an RSA key pair as integers (test use only)."""
+    rng = random.Random(seed)
+    e = 65537
+    while True:
+        primes = []
+        while len(primes) < 2:
+            candidate = rng.getrandbits(bits // 2) | (1 << (bits // 2 - 1)) | (1 << (bits // 2 - 2)) | 1
+            if _is_probable_prime(candidate, rng):
+                primes.append(candidate)
+        p, q = primes
+        phi = (p - 1) * (q - 1)
+        if p != q and phi % e:
+            return {"n": p * q, "e": e, "d": pow(e, -1, phi)}
+
+
+def _b64(data: bytes) -> str:
+    return base64.urlsafe_b64encode(data).rstrip(b"=").decode("ascii")
+
+
+def _b64int(value: int) -> str:
+    return _b64(value.to_bytes((value.bit_length() + 7) // 8, "big"))
+
+
+def sign_token(key: dict, kid: str, claims: dict, alg: str = "RS256") -> str:
+    """Create an RS256 JWT signed with a test key."""
+    signing_input = f"{_b64(json.dumps({'alg': alg, 'kid': kid, 'typ': 'JWT'}).encode())}.{_b64(json.dumps(claims).encode())}"
+    size = (key["n"].bit_length() + 7) // 8
+    digest_info = _SHA256_DIGEST_INFO + hashlib.sha256(signing_input.encode("ascii")).digest()
+    encoded = b"\x00\x01" + b"\xff" * (size - 3 - len(digest_info)) + b"\x00" + digest_info
+    signature = pow(int.from_bytes(encoded, "big"), key["d"], key["n"]).to_bytes(size, "big")
+    return f"{signing_input}.{_b64(signature)}"
+
+
+def jwk(key: dict, kid: str) -> dict:
+    """Public JWK of a test key."""
+    return {"kty": "RSA", "alg": "RS256", "use": "sig", "kid": kid, "n": _b64int(key["n"]), "e": _b64int(key["e"])}
+
+
+class FakeClock:
+    """Manually advanced time source."""
+    
+    def __init__(self, now: float = 1700000000.0):
+        self.now = now
+    
+    def __call__(self) -> float:
+        return self.now
+
+
+class FakeJWKSEndpoint:
+    """Serves a key set with a Cache-Control header and counts fetches."""
+    
+    def __init__(self, keys: list, max_age: int = 3600):
+        self.keys = keys
+        self.max_age = max_age
+        self.fetches = 0
+        self.fail = False
+    
+    def __call__(self):
+        self.fetches += 1
+        if self.fail:
+            raise ConnectionError("key endpoint unavailable")
+        return {"keys": list(self.keys)}, {"Cache-Control": f"public, max-age={self.max_age}, must-revalidate"}
+
+
+class TestTokenVerifier(unittest.TestCase):
+    """Test cases for token signature and claim verification."""
+    
+    @classmethod
+    def setUpClass(cls):
+        """Generate the signing keys once."""
+        cls.key = generate_rsa_key(seed=1)
+        cls.other_key = generate_rsa_key(bits=1024, seed=2)
+    
+    def setUp(self):
+        """Set up a verifier with a local key endpoint."""
+        self.clock = FakeClock()
+        self.endpoint = FakeJWKSEndpoint([jwk(self.key, "key-1")])
+        self.verifier = TokenVerifier(
+            project_id=PROJECT_ID,
+            key_set=KeySet(fetch=self.endpoint, clock=self.clock),
+            cache_size=3,
+            clock=self.clock
+        )
+    
+    def claims(self, **overrides) -> dict:
+        """Valid Firebase ID token claims."""
+        now = int(self.clock())
+        claims = {
+            "iss": f"https://securetoken.google.com/{PROJECT_ID}",
+            "aud": PROJECT_ID,
+            "auth_time": now - 10,
+            "sub": "user-123",
+            "iat": now - 10,
+            "exp": now + 3600,
+            "email": "user@example.com"
+        }
+        claims.update(overrides)
+        return claims
+    
+    def test_valid_token(self):
+        """Test verifying a valid token and serving it from the cache."""
+        token = sign_token(self.key, "key-1", self.claims())
+        
+        decoded = self.verifier.verify(token)
+        self.assertEqual(decoded["uid"], "user-123")
+        self.assertEqual(decoded["email"], "user@example.com")
+        
+        # The second verification is a cache hit and returns an independent copy
+        decoded["uid"] = "tampered"
+        self.assertEqual(self.verifier.verify(token)["uid"], "user-123")
+        metrics = self.verifier.get_metrics()
+        self.assertEqual(metrics["verifications"], 1)
+        self.assertEqual(metrics["cacheHits"], 1)
+        self.assertEqual(metrics["cacheHitRate"], 0.5)
+        self.assertEqual(metrics["keyFetches"], 1)
+    
+    def test_invalid_signature(self):
+        """Test rejecting tampered tokens and tokens signed by another key."""
+        token = sign_token(self.key, "key-1", self.claims())
+        header, payload, signature = token.split(".")
+        forged_payload = base64.urlsafe_b64encode(json.dumps(self.claims(sub="admin")).encode()).rstrip(b"=").decode()
+        
+        with self.assertRaises(TokenVerificationError):
+            self.verifier.verify(f"{header}.{forged_payload}.{signature}")
+        with self.assertRaises(TokenVerificationError):
+            self.verifier.verify(sign_token(self.other_key, "key-1", self.claims()))
+        self.assertEqual(self.verifier.get_metrics()["failures"], 2)
+    
+    def test_invalid_claims(self):
+        """Test rejecting tokens for another project, issuer or algorithm."""
+        invalid_tokens = [
+            sign_token(self.key, "key-1", self.claims(aud="other-project")),
+            sign_token(self.key, "key-1", self.claims(iss="https://securetoken.google.com/other-project")),
+            sign_token(self.key, "key-1", self.claims(sub="")),
+            sign_token(self.key, "key-1", self.claims(iat=int(self.clock()) + 600)),
+            sign_token(self.key, "key-1", self.claims(), alg="HS256"),
+            sign_token(self.key, "unknown-key", self.claims()),
+            "not-a-token"
+        ]
+        for token in invalid_tokens:
+            with self.assertRaises(TokenVerificationError):
+                self.verifier.verify(token)
+    
+    def test_expiry(self):
+        """Test that expired tokens are rejected, including cached ones."""
+        with self.assertRaises(ExpiredTokenError):
+            self.verifier.verify(sign_token(self.key, "key-1", self.claims(exp=int(self.clock()) - 1)))
+        
+        token = sign_token(self.key, "key-1", self.claims(exp=int(self.clock()) + 60))
+        self.verifier.verify(token)
+        self.clock.now += 61
+        with self.assertRaises(ExpiredTokenError):
+            self.verifier.verify(token)
+        self.assertEqual(self.verifier.get_metrics()["expired"], 2)
+    
+    def test_cache_is_bounded(self):
+        """Test that the decoded token cache evicts the least recently used token."""
+        tokens = [sign_token(self.key, "key-1", self.claims(sub=f"user-{i}")) for i in range(5)]
+        for token in tokens:
+            self.verifier.verify(token)
+        self.assertEqual(self.verifier.get_metrics()["cachedTokens"], 3)
+        
+        self.verifier.verify(tokens[0])
+        self.assertEqual(self.verifier.get_metrics()["verifications"], 6)
+
+
+class TestKeySet(unittest.TestCase):
+    """Test cases for signing key caching."""
+    
+    @classmethod
+    def setUpClass(cls):
+        """Generate the signing keys once."""
+        cls.key = generate_rsa_key(bits=1024, seed=3)
+        cls.rotated_key = generate_rsa_key(bits=1024, seed=4)
+    
+    def setUp(self):
+        """Set up a key set with a local key endpoint."""
+        self.clock = FakeClock()
+        self.endpoint = FakeJWKSEndpoint([jwk(self.key, "key-1")], max_age=600)
+        self.key_set = KeySet(fetch=self.endpoint, clock=self.clock)
+    
+    def test_cache_control(self):
+        """Test that keys are cached for the Cache-Control max-age."""
+        self.assertEqual(cache_max_age({"cache-control": "public, max-age=19204, must-revalidate", "Age": "4"}), 19200)
+        self.assertIsNone(cache_max_age({"Cache-Control": "no-cache"}))
+        
+        self.assertIsNotNone(self.key_set.get("key-1"))
+        self.clock.now += 500
+        self.assertIsNotNone(self.key_set.get("key-1"))
+        self.assertEqual(self.endpoint.fetches, 1)
+        
+        self.clock.now += 101
+        self.assertIsNotNone(self.key_set.get("key-1"))
+        self.assertEqual(self.endpoint.fetches, 2)
+    
+    def test_key_rotation(self):
+        """Test that an unknown key ID triggers a throttled refetch."""
+        self.assertIsNotNone(self.key_set.get("key-1"))
+        self.endpoint.keys.append(jwk(self.rotated_key, "key-2"))
+        
+        # Within the refetch interval of the first fetch, unknown keys are not fetched
+        self.assertIsNone(self.key_set.get("key-2"))
+        self.assertEqual(self.endpoint.fetches, 1)
+        
+        self.clock.now += 61
+        self.assertIsNotNone(self.key_set.get("key-2"))
+        self.assertIsNone(self.key_set.get("key-3"))
+        self.assertEqual(self.endpoint.fetches, 2)
+    
+    def test_stale_keys_on_failure(self):
+        """Test that stale keys keep being served while the endpoint is down."""
+        self.assertIsNotNone(self.key_set.get("key-1"))
+        self.endpoint.fail = True
+        self.clock.now += 601
+        
+        self.assertIsNotNone(self.key_set.get("key-1"))
+        self.assertIsNotNone(self.key_set.get("key-1"))
+        self.assertEqual(self.endpoint.fetches, 2)
+        self.assertEqual(self.key_set.fetch_failures, 1)
+
+
+def run_tests():
+    """Run all tests."""
+    loader = unittest.TestLoader()
+    test_suite = unittest.TestSuite()
+    test_suite.addTests(loader.loadTestsFromTestCase(TestTokenVerifier))
+    test_suite.addTests(loader.loadTestsFromTestCase(TestKeySet))
+    
+    test_runner = unittest.TextTestRunner(verbosity=2)
+    test_result = test_runner.run(test_suite)
+    return test_result.wasSuccessful()
+
+
+if __name__ == "__main__":
+    success = run_tests()
+    sys.exit(0 if success else 1)
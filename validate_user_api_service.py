@@ -0,0 +1,321 @@
+"""
+Validation script for user API keys: validation caching and the user API service.
+Uses stub HTTP sessions and a fake clock; no network access is needed.
+"""
+
+import os
+import sys
+import time
+import logging
+import threading
+import unittest
+
+# Add parent directory to path to import modules
+sys.path.insert(0, os.path.abspath(os.path.dirname(__file__)))
+
+# Import modules to test
+from api_key_cache import APIKeyValidationCache, key_fingerprint
+from key_sessions import KeySessionPool, KeyQueueTimeoutError
+from rate_limiter import api_key_identity
+from user_api_service import UserAPIService
+
+# Configure logging
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+    handlers=[
+        logging.StreamHandler()
+    ]
+)
+logger = logging.getLogger(__name__)
+
+
+class FakeClock:
+    """Clock that only moves when told to."""
+
+    def __init__(self, now: float = 1000.0):
+        self.now = now
+
+    def __call__(self) -> float:
+        return self.now
+
+    def advance(self, seconds: float) -> None:
+        self.now += seconds
+
+
+class StubResponse:
+    """Response with a status code and a JSON body."""
+
+    def __init__(self, status_code: int, body=None):
+        self.status_code = status_code
+        self.body = body
+        self.text = str(body)
+
+    def json(self):
+        return self.body
+
+
+class StubSession:
+    """Session answering every request with a fixed status, recording the calls."""
+
+    def __init__(self, status_code: int, delay: float = 0.0):
+        self.status_code = status_code
+        self.delay = delay
+        self.calls = 0
+
+    def request(self, *args, **kwargs):
+        self.calls += 1
+        time.sleep(self.delay)
+        return StubResponse(self.status_code, [{"generated_text": " hello "}])
+
+    get = post = request
+
+    def close(self):
+        pass
+
+
+class TestAPIKeyValidationCache(unittest.TestCase):
+    """Test cases for the key validation cache."""
+
+    def setUp(self):
+        self.clock = FakeClock()
+        self.cache = APIKeyValidationCache(ttl=100, negative_ttl=10, max_entries=2, salt=b"salt", clock=self.clock)
+
+    def test_fingerprint(self):
+        """Test that keys are stored as salted HMACs, never in the clear."""
+        self.cache.put("hf_secret", True)
+
+        self.assertEqual(list(self.cache._entries), [key_fingerprint("hf_secret", b"salt")])
+        self.assertNotEqual(key_fingerprint("hf_secret", b"salt"), key_fingerprint("hf_secret", b"other"))
+        self.assertNotIn(b"hf_secret", b"".join(self.cache._entries))
+
+    def test_ttl(self):
+        """Test that valid keys are trusted for the TTL and invalid ones for the shorter negative TTL."""
+        self.cache.put("good", True)
+        self.cache.put("bad", False)
+
+        self.clock.advance(9)
+        self.assertEqual((self.cache.get("good"), self.cache.get("bad")), (True, False))
+        self.clock.advance(1)
+        self.assertEqual((self.cache.get("good"), self.cache.get("bad")), (True, None))
+        self.clock.advance(90)
+        self.assertIsNone(self.cache.get("good"))
+
+    def test_negative_caching(self):
+        """Test that an invalid key is checked upstream once per negative TTL."""
+        calls = []
+        check = lambda key: calls.append(key) or False
+
+        self.assertFalse(self.cache.validate("bad", check))
+        self.assertFalse(self.cache.validate("bad", check))
+        self.assertEqual(len(calls), 1)
+        self.clock.advance(10)
+        self.assertFalse(self.cache.validate("bad", check))
+        self.assertEqual(len(calls), 2)
+
+    def test_inconclusive_not_cached(self):
+        """Test that a check without a verdict is retried next time."""
+        results = [None, True]
+        self.assertIsNone(self.cache.validate("key", lambda key: results.pop(0)))
+        self.assertTrue(self.cache.validate("key", lambda key: results.pop(0)))
+        self.assertEqual(self.cache.get_metrics()["inconclusive"], 1)
+
+    def test_lru_bound(self):
+        """Test that the least recently used keys are dropped beyond the size limit."""
+        self.cache.put("a", True)
+        self.cache.put("b", True)
+        self.cache.get("a")
+        self.cache.put("c", True)
+
+        self.assertEqual((self.cache.get("a"), self.cache.get("b"), self.cache.get("c")), (True, None, True))
+
+    def test_single_flight(self):
+        """Test that concurrent validations of one key share a single upstream check."""
+        release = threading.Event()
+        calls = []
+
+        def check(key):
+            calls.append(key)
+            release.wait(5)
+            return True
+
+        results = []
+        threads = [threading.Thread(target=lambda: results.append(self.cache.validate("key", check))) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        time.sleep(0.1)
+        release.set()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual((len(calls), results), (1, [True] * 8))
+        metrics = self.cache.get_metrics()
+        self.assertEqual((metrics["validations"], metrics["coalesced"]), (1, 7))
+        self.assertTrue(self.cache.validate("key", check))
+        self.assertEqual(len(calls), 1)
+
+
+class TestKeySessionPool(unittest.TestCase):
+    """Test cases for per-key sessions and fair concurrency limits."""
+    
+    def pool(self, **kwargs) -> KeySessionPool:
+        """A pool of stub sessions."""
+        return KeySessionPool(session_factory=lambda key: StubSession(200), **kwargs)
+    
+    def run_requests(self, pool: KeySessionPool, keys, hold: float = 0.05):
+        """Run one request per key on its own thread; returns the keys in the order they got a slot."""
+        order = []
+        active = {"now": 0, "peak": 0}
+        lock = threading.Lock()
+        
+        def request(key):
+            with pool.session(key):
+                with lock:
+                    order.append(key)
+                    active["now"] += 1
+                    active["peak"] = max(active["peak"], active["now"])
+                time.sleep(hold)
+                with lock:
+                    active["now"] -= 1
+        
+        threads = []
+        for key in keys:
+            threads.append(threading.Thread(target=request, args=(key,)))
+            threads[-1].start()
+            # Queue in a known order
+            time.sleep(0.01)
+        return threads, order, active
+    
+    def test_round_robin(self):
+        """Test that queued requests are admitted alternately across keys, not first come first served."""
+        pool = self.pool(max_in_flight=1, per_key_limit=4)
+        with pool.session("hf_holder"):
+            threads, order, _ = self.run_requests(pool, ["hf_a"] * 4 + ["hf_b"] * 2, hold=0.01)
+            self.assertEqual(pool.get_metrics()["waiting"], 6)
+        for thread in threads:
+            thread.join()
+        
+        self.assertEqual(order, ["hf_a", "hf_b", "hf_a", "hf_b", "hf_a", "hf_a"])
+    
+    def test_per_key_limit(self):
+        """Test that one key cannot hold more than its share while another key still gets through."""
+        pool = self.pool(max_in_flight=8, per_key_limit=2)
+        threads, order, active = self.run_requests(pool, ["hf_a"] * 5 + ["hf_b"], hold=0.1)
+        for thread in threads:
+            thread.join()
+        
+        self.assertEqual(active["peak"], 3)
+        self.assertLess(order.index("hf_b"), 3)
+    
+    def test_global_limit(self):
+        """Test that requests across all keys never exceed the global limit."""
+        pool = self.pool(max_in_flight=3, per_key_limit=4)
+        threads, _, active = self.run_requests(pool, [f"hf_{i}" for i in range(8)])
+        for thread in threads:
+            thread.join()
+        
+        self.assertEqual(active["peak"], 3)
+        metrics = pool.get_metrics()
+        self.assertEqual((metrics["requests"], metrics["inFlight"], metrics["waiting"]), (8, 0, 0))
+    
+    def test_queue_timeout(self):
+        """Test that a request waiting past the queue timeout fails and leaves the queue."""
+        pool = self.pool(max_in_flight=1, queue_timeout=0.05)
+        with pool.session("hf_a"):
+            with self.assertRaises(KeyQueueTimeoutError):
+                with pool.session("hf_b"):
+                    pass
+        
+        metrics = pool.get_metrics()
+        self.assertEqual((metrics["timeouts"], metrics["waiting"]), (1, 0))
+        with pool.session("hf_b"):
+            pass
+    
+    def test_eviction(self):
+        """Test that idle sessions beyond the limit are closed, but busy ones are kept."""
+        pool = self.pool(max_keys=1)
+        with pool.session("hf_a") as busy:
+            with pool.session("hf_b"):
+                pass
+            with pool.session("hf_c"):
+                pass
+            with pool.session("hf_a") as again:
+                self.assertIs(again, busy)
+        
+        self.assertEqual(pool.get_metrics()["keys"], 1)
+        self.assertEqual(pool.get_metrics()["evictions"], 2)
+    
+    def test_metrics_do_not_identify_keys(self):
+        """Test that metrics hold no per-key identifiers."""
+        pool = self.pool()
+        with pool.session("hf_secret"):
+            metrics = pool.get_metrics()
+        
+        self.assertEqual(metrics["busyKeys"], 1)
+        self.assertNotIn("perKey", metrics)
+        self.assertNotIn(api_key_identity("hf_secret"), str(metrics))
+
+
+class TestUserAPIService(unittest.TestCase):
+    """Test cases for key handling in the user API service."""
+
+    def service(self, status_code: int) -> UserAPIService:
+        """A service whose key sessions all answer with a status code."""
+        self.session = StubSession(status_code)
+        return UserAPIService(sessions=KeySessionPool(session_factory=lambda key: self.session))
+
+    def test_valid_key(self):
+        """Test that a successful call answers and marks the key valid."""
+        service = self.service(200)
+        self.assertEqual(service.generate_response_with_key("hf_good", "Be brief.", "hi"), "hello")
+        self.assertTrue(service.key_cache.get("hf_good"))
+
+    def test_rejected_keys(self):
+        """Test that a 401 marks the key invalid, and later calls skip the upstream request."""
+        service = self.service(401)
+        self.assertIn("Invalid API key", service.generate_response_with_key("hf_bad", "Be brief.", "hi"))
+        self.assertIs(service.key_cache.get("hf_bad"), False)
+        self.assertIn("Invalid API key", service.generate_response_with_key("hf_bad", "Be brief.", "hi"))
+        self.assertEqual(self.session.calls, 1)
+        
+        # The key check itself rejects the key with either status
+        for status_code in (401, 403):
+            service = self.service(status_code)
+            self.assertFalse(service.validate_api_key("hf_bad"))
+            self.assertFalse(service.validate_api_key("hf_bad"))
+            self.assertEqual(self.session.calls, 1)
+
+    def test_gated_model(self):
+        """Test that a 403 for one model does not lock the key out of other models."""
+        service = self.service(403)
+        response = service.generate_response_with_key("hf_good", "Be brief.", "hi", model="meta-llama/Llama-2-7b-chat-hf")
+        self.assertIn("not authorized to use meta-llama/Llama-2-7b-chat-hf", response)
+        self.assertIsNone(service.key_cache.get("hf_good"))
+        
+        self.session.status_code = 200
+        self.assertEqual(service.generate_response_with_key("hf_good", "Be brief.", "hi", model="gpt2"), "hello")
+        self.assertEqual(self.session.calls, 2)
+    
+    def test_outage_is_not_a_verdict(self):
+        """Test that an upstream outage during validation is not cached as invalid."""
+        service = self.service(500)
+        self.assertFalse(service.validate_api_key("hf_key"))
+        self.assertIsNone(service.key_cache.get("hf_key"))
+
+
+def run_tests():
+    """Run all tests."""
+    loader = unittest.TestLoader()
+    test_suite = unittest.TestSuite()
+    test_suite.addTests(loader.loadTestsFromTestCase(TestAPIKeyValidationCache))
+    test_suite.addTests(loader.loadTestsFromTestCase(TestKeySessionPool))
+    test_suite.addTests(loader.loadTestsFromTestCase(TestUserAPIService))
+
+    test_runner = unittest.TextTestRunner(verbosity=2)
+    test_result = test_runner.run(test_suite)
+    return test_result.wasSuccessful()
+
+
+if __name__ == "__main__":
+    success = run_tests()
+    sys.exit(0 if success else 1)
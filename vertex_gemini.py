@@ -0,0 +1,191 @@
+"""
+Streaming Gemini client for the Vertex AI REST API.
+Uses streamGenerateContent with server-sent events over one long-lived,
+pooled session, and tracks time to first token.
+"""
+
+import os
+import json
+import time
+import asyncio
+import logging
+import threading
+from typing import Dict, List, Any, AsyncGenerator
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from sse_client import StreamMetrics, stream_sse
+
+# Try to import Google auth (optional; installed with google-cloud-aiplatform)
+try:
+    import google.auth
+    from google.auth.transport.requests import Request as GoogleAuthRequest
+    GOOGLE_AUTH_AVAILABLE = True
+except ImportError:
+    GOOGLE_AUTH_AVAILABLE = False
+    google = None
+    GoogleAuthRequest = None
+
+logger = logging.getLogger(__name__)
+
+# Vertex AI configuration
+# Base URL of the API; defaults to the regional endpoint
+VERTEX_API_ENDPOINT = os.getenv("VERTEX_API_ENDPOINT")
+# Static access token, e.g. for local development; Application Default Credentials otherwise
+VERTEX_ACCESS_TOKEN = os.getenv("VERTEX_ACCESS_TOKEN")
+VERTEX_CONNECT_TIMEOUT = float(os.getenv("VERTEX_CONNECT_TIMEOUT", "10"))
+VERTEX_READ_TIMEOUT = float(os.getenv("VERTEX_READ_TIMEOUT", "60"))
+VERTEX_POOL_SIZE = int(os.getenv("VERTEX_POOL_SIZE", "16"))
+
+CLOUD_PLATFORM_SCOPE = "https://www.googleapis.com/auth/cloud-platform"
+
+
+class GeminiStreamingClient:
+    """Streams Gemini responses from Vertex AI."""
+    
+    def __init__(
+        self,
+        project_id: str,
+        location: str,
+        model: str,
+        endpoint: str = None,
+        access_token: str = None,
+        temperature: float = 0.7,
+        max_output_tokens: int = 1024
+    ):
+        """
+        Initialize the client.
+        
+        Args:
+            project_id: Google Cloud project ID
+            location: Vertex AI region
+            model: Gemini model name
+            endpoint: API base URL (VERTEX_API_ENDPOINT or the regional endpoint by default)
+            access_token: Static access token (VERTEX_ACCESS_TOKEN or default credentials by default)
+            temperature: Sampling temperature
+            max_output_tokens: Maximum tokens per response
+        
+        Raises:
+            RuntimeError: If no credentials are available
+        """
+        self.model_path = f"projects/{project_id}/locations/{location}/publishers/google/models/{model}"
+        self.endpoint = (endpoint or VERTEX_API_ENDPOINT or f"https://{location}-aiplatform.googleapis.com").rstrip("/")
+        self.url = f"{self.endpoint}/v1/{self.model_path}:streamGenerateContent?alt=sse"
+        self.temperature = temperature
+        self.max_output_tokens = max_output_tokens
+        self.timeout = (VERTEX_CONNECT_TIMEOUT, VERTEX_READ_TIMEOUT)
+        
+        self._access_token = access_token or VERTEX_ACCESS_TOKEN
+        self._credentials = None
+        if not self._access_token:
+            if not GOOGLE_AUTH_AVAILABLE:
+                raise RuntimeError("Google auth not available. Install with: pip install google-auth, or set VERTEX_ACCESS_TOKEN")
+            self._credentials, _ = google.auth.default(scopes=[CLOUD_PLATFORM_SCOPE])
+        self._credentials_lock = threading.Lock()
+        
+        # One session for the life of the service keeps TLS connections warm
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=VERTEX_POOL_SIZE)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+        
+        self.metrics = StreamMetrics()
+    
+    def _auth_headers(self) -> Dict[str, str]:
+        """Authorization header, refreshing default credentials when they expire."""
+        if self._access_token:
+            return {"Authorization": f"Bearer {self._access_token}"}
+        with self._credentials_lock:
+            if not self._credentials.valid:
+                self._credentials.refresh(GoogleAuthRequest())
+            return {"Authorization": f"Bearer {self._credentials.token}"}
+    
+    def build_request(self, system_instruction: str, message: str, history: List[Dict[str, str]] = None) -> Dict[str, Any]:
+        """
+        Build a generateContent request body.
+        
+        Args:
+            system_instruction: System prompt or instruction
+            message: User message
+            history: Earlier conversation turns as role/content dicts, oldest first
+        
+        Returns:
+            Request body
+        """
+        contents = [
+            {"role": "model" if turn["role"] == "assistant" else "user", "parts": [{"text": turn["content"]}]}
+            for turn in history or []
+        ]
+        contents.append({"role": "user", "parts": [{"text": message}]})
+        body = {
+            "contents": contents,
+            "generationConfig": {
+                "temperature": self.temperature,
+                "maxOutputTokens": self.max_output_tokens
+            }
+        }
+        if system_instruction:
+            body["systemInstruction"] = {"parts": [{"text": system_instruction}]}
+        return body
+    
+    async def stream(self, system_instruction: str, message: str, history: List[Dict[str, str]] = None) -> AsyncGenerator[str, None]:
+        """
+        Stream a response.
+        
+        Args:
+            system_instruction: System prompt or instruction
+            message: User message
+            history: Earlier conversation turns as role/content dicts, oldest first
+        
+        Yields:
+            Text as it is generated
+        
+        Raises:
+            RuntimeError: If the API reports an error or blocks the prompt
+        """
+        started = time.monotonic()
+        first_token = None
+        chunks = 0
+        failed = False
+        try:
+            headers = await asyncio.get_running_loop().run_in_executor(None, self._auth_headers)
+            body = self.build_request(system_instruction, message, history)
+            async for event in stream_sse(self.session, self.url, json=body, headers=headers, timeout=self.timeout):
+                response = json.loads(event.data)
+                if "error" in response:
+                    raise RuntimeError(f"Vertex AI error: {response['error'].get('message', response['error'])}")
+                block_reason = response.get("promptFeedback", {}).get("blockReason")
+                if block_reason:
+                    raise RuntimeError(f"Prompt blocked by Vertex AI: {block_reason}")
+                
+                text = "".join(
+                    part.get("text", "")
+                    for candidate in response.get("candidates", [])[:1]
+                    for part in candidate.get("content", {}).get("parts", [])
+                )
+                if not text:
+                    continue
+                if first_token is None:
+                    first_token = time.monotonic() - started
+                    logger.debug(f"Gemini time to first token: {first_token * 1000:.0f} ms")
+                chunks += 1
+                yield text
+        except Exception:
+            failed = True
+            raise
+        finally:
+            self.metrics.record(time.monotonic() - started, first_token, chunks, failed)
+    
+    def get_metrics(self) -> Dict[str, Any]:
+        """
+        Get streaming metrics.
+        
+        Returns:
+            Counters and time-to-first-token percentiles in seconds
+        """
+        return self.metrics.get_metrics()
+    
+    def close(self) -> None:
+        """Close the pooled connections."""
+        self.session.close()